@@ -0,0 +1 @@
+"""Нагрузочное тестирование и бенчмарки HTTP API сервисов UBI.136"""
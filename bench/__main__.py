@@ -0,0 +1,192 @@
+"""
+Запуск:
+    python -m bench run --scenarios writes,health --concurrency 32 --rate 200 --duration 30 --out results.json
+    python -m bench monitoring --members 3,7,15,50 --replica-sets 100 --iterations 2000 --out monitoring.json
+    python -m bench audit --entries 20000 --doc-bytes 1024 --out audit.json
+    python -m bench responses --iterations 200 --out responses.json
+    python -m bench startup --runs 5 --target 2 --out startup.json
+    python -m bench compare results.json --baseline bench/baseline.json --tolerance 0.15
+"""
+import argparse
+import asyncio
+import os
+import sys
+
+from . import report
+from .audit import run_audit
+from .loadgen import run_scenario
+from .monitoring import MONITORING_FUNCTIONS, run_monitoring
+from .responses import ENCODERS, run_responses
+from .scenarios import GROUPS, SCENARIOS, resolve
+from .startup import SERVICES, run_startup
+
+
+def cmd_run(args) -> int:
+    scenarios = resolve(args.scenarios)
+    results = []
+    for scenario in scenarios:
+        print(f"▶️  {scenario.name}: {scenario.method} {scenario.url(args.base_url)}", flush=True)
+        result = asyncio.run(run_scenario(
+            scenario, args.base_url, args.concurrency, args.rate, args.duration, args.timeout
+        ))
+        summary = result.to_dict()
+        latency = summary["latency"]
+        print(f"   {summary['throughput_rps']} rps, p50 {latency.get('p50_ms')} ms, "
+              f"p99 {latency.get('p99_ms')} ms, коды {summary['status_codes']}, ошибки {summary['errors']}")
+        results.append(result)
+
+    data = report.build_report(results, {
+        "base_url": args.base_url,
+        "concurrency": args.concurrency,
+        "rate": args.rate,
+        "duration_seconds": args.duration
+    })
+    return _finish(data, args)
+
+
+def _finish(data, args) -> int:
+    report.save(data, args.out)
+    print(f"💾 Результаты сохранены в {args.out}")
+    if args.save_baseline:
+        report.save(data, args.save_baseline)
+        print(f"📌 Базовый прогон обновлен: {args.save_baseline}")
+    if args.baseline:
+        return _compare(data, args.baseline, args.tolerance)
+    return 0
+
+
+def cmd_monitoring(args) -> int:
+    members = [int(m) for m in args.members.split(",") if m.strip()]
+    services = [s.strip() for s in args.services.split(",") if s.strip()] if args.services else None
+    results, settings = run_monitoring(members, args.replica_sets, args.iterations, args.snapshots, services)
+    return _finish(report.build_report(results, settings), args)
+
+
+def cmd_audit(args) -> int:
+    storages = [s.strip() for s in args.storages.split(",") if s.strip()]
+    blob = None if args.blob_min_bytes == "none" else int(args.blob_min_bytes)
+    print(f"🧪 {args.entries} записей по ~{args.doc_bytes} байт за {args.span_hours} ч, режимы: {', '.join(storages)}")
+    results, settings = run_audit(args.mongo_uri, args.entries, args.doc_bytes, args.span_hours,
+                                  args.timeline_hours, args.iterations, args.granularity, storages, blob)
+    return _finish(report.build_report(results, settings), args)
+
+
+def cmd_responses(args) -> int:
+    encoders = [e.strip() for e in args.encoders.split(",") if e.strip()] if args.encoders else None
+    results, settings = run_responses(args.iterations, args.scale, encoders)
+    return _finish(report.build_report(results, settings), args)
+
+
+def cmd_startup(args) -> int:
+    services = [s.strip() for s in args.services.split(",") if s.strip()] if args.services else list(SERVICES)
+    results, settings = run_startup(services, args.runs, args.target, args.backend, args.mongo_uri,
+                                    args.timeout, args.ready_timeout)
+    code = _finish(report.build_report(results, settings), args)
+    missed = [r.service for r in results if not r.to_dict()["within_target"]]
+    if missed:
+        print(f"🔴 Цель холодного старта {args.target}s не выполнена: {', '.join(missed)}")
+        return 1
+    return code
+
+
+def cmd_compare(args) -> int:
+    return _compare(report.load(args.results), args.baseline, args.tolerance)
+
+
+def _compare(current, baseline_path: str, tolerance: float) -> int:
+    rows = report.compare(current, report.load(baseline_path), tolerance)
+    print(report.format_table(rows))
+    regressions = [r for r in rows if r["regression"]]
+    if regressions:
+        print(f"🔴 Регрессий: {len(regressions)} (допуск {tolerance * 100:.0f}%)")
+        return 1
+    print("✅ Регрессий нет")
+    return 0
+
+
+def main(argv=None) -> int:
+    parser = argparse.ArgumentParser(prog="bench", description="Бенчмарк HTTP API сервисов UBI.136")
+    sub = parser.add_subparsers(dest="command", required=True)
+
+    run = sub.add_parser("run", help="Нагрузить эндпоинты и записать результаты в JSON")
+    run.add_argument("--scenarios", default="all",
+                     help=f"Сценарии или группы через запятую. Группы: {', '.join(GROUPS)}; "
+                          f"сценарии: {', '.join(SCENARIOS)}")
+    run.add_argument("--base-url", default="http://localhost")
+    run.add_argument("--concurrency", type=int, default=16)
+    run.add_argument("--rate", type=float, default=0, help="Запросов в секунду; 0 - без ограничения")
+    run.add_argument("--duration", type=float, default=10, help="Секунд на сценарий")
+    run.add_argument("--timeout", type=float, default=30)
+    run.add_argument("--out", default="bench_results.json")
+    run.add_argument("--baseline", help="Сравнить с базовым прогоном после завершения")
+    run.add_argument("--save-baseline", help="Сохранить этот прогон как базовый")
+    run.add_argument("--tolerance", type=float, default=0.15)
+    run.set_defaults(func=cmd_run)
+
+    mon = sub.add_parser("monitoring", help="Замерить CPU функций мониторинга на синтетических топологиях")
+    mon.add_argument("--members", default="3,7,15,50", help="Размеры Replica Set через запятую (до 50)")
+    mon.add_argument("--replica-sets", type=int, default=20, help="Сколько разных Replica Set моделировать")
+    mon.add_argument("--snapshots", type=int, default=32, help="Снимков эволюции optime на каждый Replica Set")
+    mon.add_argument("--iterations", type=int, default=2000, help="Оценок на функцию и размер")
+    mon.add_argument("--services", help=f"Сервисы через запятую: {', '.join(MONITORING_FUNCTIONS)}")
+    mon.add_argument("--out", default="bench_monitoring.json")
+    mon.add_argument("--baseline", help="Сравнить с базовым прогоном после завершения")
+    mon.add_argument("--save-baseline", help="Сохранить этот прогон как базовый")
+    mon.add_argument("--tolerance", type=float, default=0.15)
+    mon.set_defaults(func=cmd_monitoring)
+
+    audit = sub.add_parser("audit", help="Сравнить режимы хранения журнала аудита: объем и чтение timeline")
+    audit.add_argument("--mongo-uri", default=os.getenv("MONGO_URI", "mongodb://localhost:27017/?replicaSet=rs0"),
+                       help="Кластер MongoDB 5.0+ (прогон использует базу audit_bench и удаляет ее коллекции)")
+    audit.add_argument("--storages", default="collection,timeseries", help="Режимы AUDIT_STORAGE через запятую")
+    audit.add_argument("--entries", type=int, default=20000)
+    audit.add_argument("--doc-bytes", type=int, default=1024, help="Примерный размер записанного документа")
+    audit.add_argument("--span-hours", type=float, default=72, help="За сколько часов распределены записи")
+    audit.add_argument("--timeline-hours", type=float, default=24, help="Период запроса /audit/timeline")
+    audit.add_argument("--iterations", type=int, default=50, help="Чтений timeline на режим")
+    audit.add_argument("--granularity", default="day", help="AUDIT_PARTITIONING: day, month или none")
+    audit.add_argument("--blob-min-bytes", default="0", help="AUDIT_PAYLOAD_BLOB_BYTES для режима timeseries")
+    audit.add_argument("--out", default="bench_audit.json")
+    audit.add_argument("--baseline", help="Сравнить с базовым прогоном после завершения")
+    audit.add_argument("--save-baseline", help="Сохранить этот прогон как базовый")
+    audit.add_argument("--tolerance", type=float, default=0.15)
+    audit.set_defaults(func=cmd_audit)
+
+    resp = sub.add_parser("responses", help="Замерить сериализацию и сжатие типичных ответов сервисов")
+    resp.add_argument("--iterations", type=int, default=200, help="Сериализаций на ответ и кодировщик")
+    resp.add_argument("--scale", type=float, default=1.0, help="Множитель числа строк в ответах")
+    resp.add_argument("--encoders", help=f"Кодировщики через запятую: {', '.join(ENCODERS)}")
+    resp.add_argument("--out", default="bench_responses.json")
+    resp.add_argument("--baseline", help="Сравнить с базовым прогоном после завершения")
+    resp.add_argument("--save-baseline", help="Сохранить этот прогон как базовый")
+    resp.add_argument("--tolerance", type=float, default=0.15)
+    resp.set_defaults(func=cmd_responses)
+
+    start = sub.add_parser("startup", help="Замерить холодный старт сервисов до /livez и /readyz")
+    start.add_argument("--services", help=f"Сервисы через запятую: {', '.join(SERVICES)}")
+    start.add_argument("--runs", type=int, default=5, help="Запусков процесса на сервис")
+    start.add_argument("--target", type=float, default=2.0,
+                       help="Цель по p99 времени до /livez, секунд (код выхода 1 при превышении)")
+    start.add_argument("--backend", default="fake", help="MONGO_BACKEND сервисов: fake или mongodb")
+    start.add_argument("--mongo-uri", default=os.getenv("MONGO_URI", "mongodb://localhost:27017/?replicaSet=rs0"))
+    start.add_argument("--timeout", type=float, default=30, help="Предел ожидания /livez, секунд")
+    start.add_argument("--ready-timeout", type=float, default=10,
+                       help="Сколько ждать /readyz после /livez, секунд")
+    start.add_argument("--out", default="bench_startup.json")
+    start.add_argument("--baseline", help="Сравнить с базовым прогоном после завершения")
+    start.add_argument("--save-baseline", help="Сохранить этот прогон как базовый")
+    start.add_argument("--tolerance", type=float, default=0.15)
+    start.set_defaults(func=cmd_startup)
+
+    cmp = sub.add_parser("compare", help="Сравнить сохраненный прогон с базовым")
+    cmp.add_argument("results")
+    cmp.add_argument("--baseline", required=True)
+    cmp.add_argument("--tolerance", type=float, default=0.15)
+    cmp.set_defaults(func=cmd_compare)
+
+    args = parser.parse_args(argv)
+    return args.func(args)
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,176 @@
+import importlib.util
+import os
+import random
+import sys
+import time
+from datetime import datetime, timedelta
+from typing import Any, Callable, Dict, List, Optional, Tuple
+
+from common.backend import create_client
+from common.hdr import HdrHistogram
+
+from .monitoring import REPO_ROOT
+
+# Отдельная база, чтобы прогон не смешивался с журналом protected_db
+AUDIT_BENCH_DB = "audit_bench"
+
+
+def load_partitions():
+    service_dir = os.path.join(REPO_ROOT, "transaction_log")
+    # partitions импортирует соседние модули сервиса по короткому имени, как в контейнере
+    if service_dir not in sys.path:
+        sys.path.insert(0, service_dir)
+    path = os.path.join(service_dir, "partitions.py")
+    spec = importlib.util.spec_from_file_location("bench_audit_partitions", path)
+    module = importlib.util.module_from_spec(spec)
+    spec.loader.exec_module(module)
+    return module
+
+
+def synthetic_entries(count: int, doc_bytes: int, span_hours: float, seed: int = 136) -> List[Dict[str, Any]]:
+    """Записи журнала в форме /log/write, равномерно за span_hours до текущего момента"""
+    rng = random.Random(seed)
+    now = datetime.now()
+    step = timedelta(hours=span_hours) / count
+    collections = ["orders", "payments", "users", "inventory"]
+    operations = ["insert", "update", "delete"]
+    words = ["ubi136", "replica", "primary", "secondary", "majority", "journal", "oplog", "quorum"]
+    entries = []
+    for i in range(count):
+        document = {
+            "order_id": i,
+            "customer": f"user{rng.randrange(500)}",
+            "amount": round(rng.uniform(1, 1000), 2),
+            "items": [{"sku": f"SKU-{rng.randrange(10000)}", "qty": rng.randrange(1, 5)} for _ in range(3)],
+        }
+        # Текст добивает документ до doc_bytes и сжимается так же, как реальные данные с повторами
+        document["note"] = " ".join(rng.choice(words) for _ in range(max(doc_bytes - 160, 0) // 8))
+        entries.append({
+            "timestamp": now - step * (count - i),
+            "operation_type": rng.choice(operations),
+            "target_collection": rng.choice(collections),
+            "document": document,
+            "write_concern": "majority",
+            "result": "success" if rng.random() > 0.02 else "failed",
+            "metadata": {"client": "bench"},
+            "replica_set_status": {"primary": "mongo1:27017", "healthy_nodes": 3, "total_nodes": 3}
+        })
+    return entries
+
+
+class AuditLayoutResult:
+    def __init__(self, name: str, storage: str):
+        self.name = name
+        self.storage = storage
+        self.latency = HdrHistogram()
+        self.errors = 0
+        self.cpu_seconds = 0.0
+        self.elapsed = 0.0
+        self.insert_seconds = 0.0
+        self.entries = 0
+        self.rows_per_scan = 0
+        self.collections: Dict[str, Dict[str, int]] = {}
+
+    @property
+    def scans(self) -> int:
+        return self.latency.total
+
+    def to_dict(self) -> Dict[str, Any]:
+        ok = self.scans - self.errors
+        storage_bytes = sum(c["storage_bytes"] + c["index_bytes"] for c in self.collections.values())
+        return {
+            "endpoint": "/audit/timeline",
+            "storage": self.storage,
+            "entries": self.entries,
+            "inserts_per_second": round(self.entries / self.insert_seconds, 1) if self.insert_seconds else None,
+            "storage_bytes": storage_bytes,
+            "bytes_per_entry": round(storage_bytes / self.entries, 1) if self.entries else None,
+            "collections": self.collections,
+            "rows_per_scan": self.rows_per_scan,
+            "scans": self.scans,
+            "errors": self.errors,
+            "elapsed_seconds": round(self.elapsed, 3),
+            "cpu_ms_per_scan": round(self.cpu_seconds / self.scans * 1000, 3) if self.scans else None,
+            "success_rps": round(ok / self.elapsed, 1) if self.elapsed else 0,
+            "latency": self.latency.to_dict()
+        }
+
+
+def _collection_sizes(db, names: List[str]) -> Dict[str, Dict[str, int]]:
+    sizes = {}
+    for name in names:
+        stats = db.command("collStats", name)
+        sizes[name] = {
+            "count": stats.get("count", 0),
+            "data_bytes": stats.get("size", 0),
+            "storage_bytes": stats.get("storageSize", 0),
+            "index_bytes": stats.get("totalIndexSize", 0)
+        }
+    return sizes
+
+
+def _drop_audit_collections(db, parse_name: Callable[[str], Optional[Tuple[bool, str]]]):
+    for name in db.list_collection_names():
+        if parse_name(name) is not None:
+            db.drop_collection(name)
+
+
+def run_audit(uri: str, entries: int, doc_bytes: int, span_hours: float, timeline_hours: float,
+              iterations: int, granularity: str, storages: List[str], blob_min_bytes: Optional[int],
+              progress: Callable[[str], None] = print) -> Tuple[List[AuditLayoutResult], Dict[str, Any]]:
+    """
+    Один и тот же журнал в каждом режиме хранения: объем на диске по collStats
+    и время чтения /audit/timeline за timeline_hours
+    """
+    partitions = load_partitions()
+    client = create_client(uri)
+    db = client[AUDIT_BENCH_DB]
+    data = synthetic_entries(entries, doc_bytes, span_hours)
+    results = []
+    try:
+        for storage in storages:
+            _drop_audit_collections(db, partitions.parse_audit_name)
+            audit = partitions.AuditPartitions(db, granularity, 365, storage, blob_min_bytes)
+            result = AuditLayoutResult(f"audit.timeline@{storage}", storage)
+            result.entries = entries
+
+            started = time.perf_counter()
+            for entry in data:
+                audit.insert(dict(entry))
+            result.insert_seconds = time.perf_counter() - started
+            # Сжатие WiredTiger выполняется при сбросе на диск, до него storageSize занижен
+            db.command("fsync")
+            result.collections = _collection_sizes(db, audit.partitions())
+
+            cutoff = datetime.now() - timedelta(hours=timeline_hours)
+            cpu_started = time.process_time()
+            started = time.perf_counter()
+            for _ in range(iterations):
+                call_started = time.perf_counter()
+                try:
+                    result.rows_per_scan = len(audit.find_range({}, cutoff, fields=partitions.SUMMARY_FIELDS))
+                except Exception:
+                    result.errors += 1
+                result.latency.record((time.perf_counter() - call_started) * 1_000_000)
+            result.elapsed = time.perf_counter() - started
+            result.cpu_seconds = time.process_time() - cpu_started
+
+            summary = result.to_dict()
+            progress(f"   {storage}: {summary['storage_bytes']} байт ({summary['bytes_per_entry']} на запись), "
+                     f"timeline {summary['rows_per_scan']} записей p50 {summary['latency'].get('p50_ms')} ms, "
+                     f"p99 {summary['latency'].get('p99_ms')} ms")
+            results.append(result)
+        _drop_audit_collections(db, partitions.parse_audit_name)
+    finally:
+        client.close()
+    settings = {
+        "mode": "audit",
+        "entries": entries,
+        "doc_bytes": doc_bytes,
+        "span_hours": span_hours,
+        "timeline_hours": timeline_hours,
+        "iterations": iterations,
+        "granularity": granularity,
+        "blob_min_bytes": blob_min_bytes
+    }
+    return results, settings
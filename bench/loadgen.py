@@ -0,0 +1,87 @@
+import asyncio
+import time
+from typing import Any, Dict
+
+import httpx
+
+from common.hdr import HdrHistogram
+
+from .scenarios import Scenario
+
+
+class ScenarioResult:
+    def __init__(self, scenario: Scenario):
+        self.scenario = scenario
+        self.latency = HdrHistogram()
+        self.status_codes: Dict[str, int] = {}
+        self.errors = 0
+        self.elapsed = 0.0
+
+    @property
+    def name(self) -> str:
+        return self.scenario.name
+
+    @property
+    def requests(self) -> int:
+        return self.latency.total
+
+    def to_dict(self) -> Dict[str, Any]:
+        ok = sum(c for code, c in self.status_codes.items() if code.startswith('2'))
+        return {
+            "endpoint": f"{self.scenario.method} {self.scenario.path}",
+            "service": self.scenario.service,
+            "requests": self.requests,
+            "successful": ok,
+            "errors": self.errors,
+            "status_codes": self.status_codes,
+            "elapsed_seconds": round(self.elapsed, 3),
+            "throughput_rps": round(self.requests / self.elapsed, 1) if self.elapsed else 0,
+            "success_rps": round(ok / self.elapsed, 1) if self.elapsed else 0,
+            "latency": self.latency.to_dict()
+        }
+
+
+async def run_scenario(scenario: Scenario, base_url: str, concurrency: int, rate: float,
+                       duration: float, timeout: float = 30.0) -> ScenarioResult:
+    """
+    Нагрузить один эндпоинт
+
+    rate > 0 - открытая модель: запросы назначаются с шагом 1/rate, и задержка
+    считается от назначенного момента, а не от фактической отправки, чтобы
+    не прятать очередь (coordinated omission). rate = 0 - закрытая модель:
+    concurrency воркеров шлют запросы без пауз.
+    """
+    result = ScenarioResult(scenario)
+    url = scenario.url(base_url)
+    counter = iter(range(10 ** 12))
+    limits = httpx.Limits(max_connections=concurrency, max_keepalive_connections=concurrency)
+
+    async with httpx.AsyncClient(timeout=timeout, limits=limits) as client:
+        started = time.perf_counter()
+        stop_at = started + duration
+
+        async def worker():
+            while True:
+                seq = next(counter)
+                if rate > 0:
+                    intended = started + seq / rate
+                    if intended >= stop_at:
+                        return
+                    delay = intended - time.perf_counter()
+                    if delay > 0:
+                        await asyncio.sleep(delay)
+                else:
+                    intended = time.perf_counter()
+                    if intended >= stop_at:
+                        return
+                try:
+                    response = await client.request(scenario.method, url, **scenario.request_kwargs(seq))
+                    code = str(response.status_code)
+                    result.status_codes[code] = result.status_codes.get(code, 0) + 1
+                except httpx.HTTPError:
+                    result.errors += 1
+                result.latency.record((time.perf_counter() - intended) * 1_000_000)
+
+        await asyncio.gather(*(worker() for _ in range(concurrency)))
+        result.elapsed = time.perf_counter() - started
+    return result
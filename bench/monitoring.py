@@ -0,0 +1,172 @@
+import importlib.util
+import inspect
+import logging
+import os
+import sys
+import time
+from contextlib import contextmanager
+from typing import Any, Callable, Dict, List, Tuple
+
+from common.cluster_view import ClusterView
+from common.hdr import HdrHistogram
+
+from .topology_sim import SimulatedClient, TopologySimulator
+
+REPO_ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+
+# Функции мониторинга, которые разбирают replSetGetStatus: сервис -> имена обработчиков
+MONITORING_FUNCTIONS: Dict[str, List[str]] = {
+    "consensus_service": ["health_check", "get_cluster_status", "get_alerts"],
+    "replication_monitoring": ["get_replication_status", "get_replication_lag", "evaluate_alerts",
+                               "get_monitoring_alerts"],
+    "health_check": ["check_all_nodes", "check_primary", "check_secondaries",
+                     "check_network_connectivity", "get_health_summary"],
+    "recovery_service": ["get_recovery_status", "check_sync_status", "get_recovery_recommendations"],
+}
+
+
+@contextmanager
+def _service_import_context(service_dir: str):
+    # Сервисы импортируют соседние модули по короткому имени (latency, topology, ...),
+    # поэтому каждый main.py грузится со своей папкой в начале sys.path и из нее как cwd
+    before = set(sys.modules)
+    cwd = os.getcwd()
+    sys.path.insert(0, service_dir)
+    if REPO_ROOT not in sys.path:
+        sys.path.insert(1, REPO_ROOT)
+    os.chdir(service_dir)
+    try:
+        yield
+    finally:
+        os.chdir(cwd)
+        sys.path.remove(service_dir)
+        for name in set(sys.modules) - before:
+            module_file = getattr(sys.modules[name], "__file__", None) or ""
+            if module_file.startswith(service_dir + os.sep):
+                # Выгрузить короткие имена, чтобы следующий сервис получил свои модули
+                del sys.modules[name]
+
+
+def load_service(service: str):
+    service_dir = os.path.join(REPO_ROOT, service)
+    spec = importlib.util.spec_from_file_location(f"bench_{service}_main", os.path.join(service_dir, "main.py"))
+    module = importlib.util.module_from_spec(spec)
+    with _service_import_context(service_dir):
+        spec.loader.exec_module(module)
+    return module
+
+
+def call_sync(handler: Callable, *args) -> Any:
+    """
+    Выполнить async-обработчик без event loop
+
+    Обработчики мониторинга не ждут ничего асинхронного, поэтому корутина
+    завершается на первом send(); цикл событий только добавил бы шум к замеру.
+    Синхронные функции (оценка правил алертов) просто возвращают результат.
+    """
+    coroutine = handler(*args)
+    if not inspect.iscoroutine(coroutine):
+        return coroutine
+    try:
+        coroutine.send(None)
+    except StopIteration as done:
+        return done.value
+    coroutine.close()
+    raise RuntimeError(f"{handler.__name__} ожидает асинхронную операцию")
+
+
+class EvaluationResult:
+    def __init__(self, name: str, service: str, members: int):
+        self.name = name
+        self.service = service
+        self.members = members
+        self.latency = HdrHistogram()
+        self.errors = 0
+        self.cpu_seconds = 0.0
+        self.elapsed = 0.0
+
+    @property
+    def evaluations(self) -> int:
+        return self.latency.total
+
+    def to_dict(self) -> Dict[str, Any]:
+        ok = self.evaluations - self.errors
+        return {
+            "endpoint": self.name.split("@")[0],
+            "service": self.service,
+            "members": self.members,
+            "evaluations": self.evaluations,
+            "errors": self.errors,
+            "elapsed_seconds": round(self.elapsed, 3),
+            "cpu_us_per_eval": round(self.cpu_seconds / self.evaluations * 1_000_000, 2) if self.evaluations else None,
+            # Оценок в секунду процессорного времени - сопоставимо с success_rps HTTP-прогонов
+            "success_rps": round(ok / self.cpu_seconds, 1) if self.cpu_seconds else 0,
+            "latency": self.latency.to_dict()
+        }
+
+
+def evaluate(handler: Callable, result: EvaluationResult, iterations: int) -> EvaluationResult:
+    latency = result.latency
+    perf_counter = time.perf_counter
+    cpu_started = time.process_time()
+    started = perf_counter()
+    for _ in range(iterations):
+        call_started = perf_counter()
+        try:
+            call_sync(handler)
+        except Exception:
+            result.errors += 1
+        latency.record((perf_counter() - call_started) * 1_000_000)
+    result.elapsed = perf_counter() - started
+    result.cpu_seconds = time.process_time() - cpu_started
+    return result
+
+
+def run_monitoring(member_counts: List[int], replica_sets: int, iterations: int, snapshots_per_set: int,
+                   services: List[str] = None, progress: Callable[[str], None] = print
+                   ) -> Tuple[List[EvaluationResult], Dict[str, Any]]:
+    services = services or list(MONITORING_FUNCTIONS)
+    # Логи обработчиков на каждой оценке измеряли бы скорость консоли, а не разбор топологии
+    logging.disable(logging.WARNING)
+    try:
+        modules = {service: load_service(service) for service in services}
+        results = []
+        for members in member_counts:
+            started = time.perf_counter()
+            simulator = TopologySimulator(replica_sets, members, snapshots_per_set)
+            progress(f"🧪 {replica_sets} Replica Set x {members} узлов: "
+                     f"{len(simulator.snapshots)} снимков за {time.perf_counter() - started:.1f}s")
+            simulated = SimulatedClient(simulator)
+
+            async def build_cluster_view():
+                return ClusterView.fetch(simulated)
+
+            # Стоимость разбора снимка; эндпоинты между обновлениями снимка ее не платят
+            result = EvaluationResult(f"common.cluster_view@{members}", "common", members)
+            results.append(evaluate(build_cluster_view, result, iterations))
+            progress(f"   {result.name}: {result.to_dict()['cpu_us_per_eval']} µs CPU")
+            for service, module in modules.items():
+                module.client = simulated
+                # Кэши снимка от предыдущего размера Replica Set не должны попасть в замер
+                if hasattr(module, "cluster_views"):
+                    module.cluster_views.invalidate()
+                if hasattr(module, "topology_cache"):
+                    module.topology_cache.refresh(simulated)
+                for function in MONITORING_FUNCTIONS[service]:
+                    result = EvaluationResult(f"{service}.{function}@{members}", service, members)
+                    evaluate(getattr(module, function), result, iterations)
+                    results.append(result)
+                    summary = result.to_dict()
+                    progress(f"   {result.name}: {summary['cpu_us_per_eval']} µs CPU, "
+                             f"p99 {summary['latency'].get('p99_ms')} ms, ошибки {result.errors}")
+                module.client = None
+    finally:
+        logging.disable(logging.NOTSET)
+    settings = {
+        "mode": "monitoring",
+        "members": member_counts,
+        "replica_sets": replica_sets,
+        "iterations": iterations,
+        "snapshots_per_set": snapshots_per_set
+    }
+    return results, settings
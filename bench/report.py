@@ -0,0 +1,68 @@
+import json
+import subprocess
+from datetime import datetime
+from typing import Any, Dict, List
+
+
+def build_report(results, settings: Dict[str, Any]) -> Dict[str, Any]:
+    try:
+        commit = subprocess.run(['git', 'rev-parse', '--short', 'HEAD'],
+                                capture_output=True, text=True, timeout=5).stdout.strip() or None
+    except (OSError, subprocess.SubprocessError):
+        commit = None
+    return {
+        "timestamp": str(datetime.now()),
+        "git_commit": commit,
+        "settings": settings,
+        "scenarios": {r.name: r.to_dict() for r in results}
+    }
+
+
+def save(report: Dict[str, Any], path: str):
+    with open(path, 'w', encoding='utf-8') as f:
+        json.dump(report, f, ensure_ascii=False, indent=2)
+
+
+def load(path: str) -> Dict[str, Any]:
+    with open(path, encoding='utf-8') as f:
+        return json.load(f)
+
+
+def compare(current: Dict[str, Any], baseline: Dict[str, Any], tolerance: float) -> List[Dict[str, Any]]:
+    """
+    Сравнить прогон с базовым: регрессия - падение пропускной способности
+    или рост p50/p99 больше чем на tolerance (доля, 0.1 = 10%)
+    """
+    rows = []
+    for name, now in current["scenarios"].items():
+        base = baseline["scenarios"].get(name)
+        if base is None:
+            continue
+        checks = {
+            "throughput_rps": (base["success_rps"], now["success_rps"], False),
+            "p50_ms": (base["latency"].get("p50_ms"), now["latency"].get("p50_ms"), True),
+            "p99_ms": (base["latency"].get("p99_ms"), now["latency"].get("p99_ms"), True),
+        }
+        for metric, (before, after, lower_is_better) in checks.items():
+            if not before or after is None:
+                continue
+            change = (after - before) / before
+            regressed = change > tolerance if lower_is_better else change < -tolerance
+            rows.append({
+                "scenario": name,
+                "metric": metric,
+                "baseline": before,
+                "current": after,
+                "change_percent": round(change * 100, 1),
+                "regression": regressed
+            })
+    return rows
+
+
+def format_table(rows: List[Dict[str, Any]]) -> str:
+    lines = [f"{'scenario':<52}{'metric':<16}{'baseline':>12}{'current':>12}{'change':>10}"]
+    for row in rows:
+        mark = "  🔴" if row["regression"] else ""
+        lines.append(f"{row['scenario']:<52}{row['metric']:<16}{row['baseline']:>12}{row['current']:>12}"
+                     f"{row['change_percent']:>9}%{mark}")
+    return "\n".join(lines)
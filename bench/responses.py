@@ -0,0 +1,195 @@
+import random
+import time
+from datetime import datetime, timedelta
+from typing import Any, Callable, Dict, List, Tuple
+
+from bson import ObjectId
+from fastapi.encoders import jsonable_encoder
+from starlette.responses import JSONResponse
+
+from common import responses
+from common.hdr import HdrHistogram
+
+
+def _timeline(rows: int, rng: random.Random) -> Dict[str, Any]:
+    now = datetime.now()
+    return {
+        "period_hours": 24,
+        "operations_count": rows,
+        "timeline": [{
+            "timestamp": str(now - timedelta(seconds=i * 3)),
+            "operation": rng.choice(["insert", "update", "delete"]),
+            "collection": rng.choice(["orders", "payments", "users"]),
+            "write_concern": "majority",
+            "result": "success",
+            "cluster_state": {"primary": "mongo-primary:27017", "healthy_members": 3, "total_members": 3}
+        } for i in range(rows)]
+    }
+
+
+def _logs_recent(rows: int, rng: random.Random) -> Dict[str, Any]:
+    now = datetime.now()
+    return {
+        "count": rows,
+        "logs": [{
+            "_id": str(ObjectId()),
+            "seq": i,
+            "timestamp": now - timedelta(seconds=i),
+            "operation_type": "insert",
+            "target_collection": "orders",
+            "document": {
+                "order_id": i,
+                "customer": f"user{rng.randrange(500)}",
+                "amount": round(rng.uniform(1, 1000), 2),
+                "items": [{"sku": f"SKU-{rng.randrange(10000)}", "qty": rng.randrange(1, 5)} for _ in range(5)],
+                "created_at": now
+            },
+            "write_concern": "majority",
+            "result": "success",
+            "replica_set_status": {"primary": "mongo-primary:27017", "healthy_members": 3, "total_members": 3}
+        } for i in range(rows)]
+    }
+
+
+def _oplog_tail(rows: int, rng: random.Random) -> Dict[str, Any]:
+    now = datetime.now()
+    return {
+        "count": rows,
+        "entries": [{
+            "timestamp": str(now - timedelta(seconds=i)),
+            "operation": rng.choice(["i", "u", "d"]),
+            "namespace": "protected_db.orders",
+            "details": "{'_id': ObjectId('" + str(ObjectId()) + "'), 'order_id': " + str(i) + ", 'amount': 1"
+        } for i in range(rows)],
+        "description": "Последние операции из oplog MongoDB"
+    }
+
+
+def _health_all(rows: int, rng: random.Random) -> Dict[str, Any]:
+    now = datetime.now()
+    return {
+        "timestamp": str(now),
+        "cluster_status": "HEALTHY",
+        "total_nodes": rows,
+        "nodes": [{
+            "name": f"mongo-{i}:27017",
+            "state": "PRIMARY" if i == 0 else "SECONDARY",
+            "health": "healthy",
+            "uptime_seconds": rng.randrange(100000),
+            "ping_ms": rng.randrange(1, 40),
+            "optime": now - timedelta(seconds=rng.random()),
+            "checks": {"reachable": True, "replicating": True, "lag_seconds": round(rng.random(), 3)}
+        } for i in range(rows)]
+    }
+
+
+# Ответ -> (построитель, число строк в ответе); формы повторяют ответы эндпоинтов
+PAYLOADS: Dict[str, Tuple[Callable[[int, random.Random], Dict[str, Any]], int]] = {
+    "/audit/timeline": (_timeline, 5000),
+    "/logs/recent": (_logs_recent, 100),
+    "/oplog/tail": (_oplog_tail, 100),
+    "/health/all": (_health_all, 7),
+}
+
+
+def _fastapi_default(content: Any) -> bytes:
+    # Путь FastAPI без response_class: jsonable_encoder, затем json.dumps в JSONResponse
+    return JSONResponse(jsonable_encoder(content)).body
+
+
+ENCODERS: Dict[str, Callable[[Any], bytes]] = {
+    "fastapi": _fastapi_default,
+    "orjson": responses.dumps_json,
+}
+if responses.msgpack is not None:
+    ENCODERS["msgpack"] = responses.dumps_msgpack
+
+
+class EncodingResult:
+    def __init__(self, name: str, endpoint: str, encoder: str, rows: int):
+        self.name = name
+        self.endpoint = endpoint
+        self.encoder = encoder
+        self.rows = rows
+        self.latency = HdrHistogram()
+        self.cpu_seconds = 0.0
+        self.elapsed = 0.0
+        self.body_bytes = 0
+        self.wire_bytes: Dict[str, int] = {}
+        self.compress_us: Dict[str, float] = {}
+
+    @property
+    def renders(self) -> int:
+        return self.latency.total
+
+    def to_dict(self) -> Dict[str, Any]:
+        return {
+            "endpoint": self.endpoint,
+            "encoder": self.encoder,
+            "rows": self.rows,
+            "renders": self.renders,
+            "body_bytes": self.body_bytes,
+            # Байты в сети для каждого Content-Encoding и время сжатия одного тела
+            "wire_bytes": self.wire_bytes,
+            "compress_us": self.compress_us,
+            "elapsed_seconds": round(self.elapsed, 3),
+            "cpu_us_per_render": round(self.cpu_seconds / self.renders * 1_000_000, 2) if self.renders else None,
+            "success_rps": round(self.renders / self.cpu_seconds, 1) if self.cpu_seconds else 0,
+            "latency": self.latency.to_dict()
+        }
+
+
+def _compression(body: bytes, result: EncodingResult, repeats: int = 5):
+    result.wire_bytes["identity"] = len(body)
+    encodings = ["gzip"] + (["br"] if responses.brotli is not None else [])
+    for encoding in encodings:
+        started = time.perf_counter()
+        for _ in range(repeats):
+            compressed = responses.compress(body, encoding)
+        result.compress_us[encoding] = round((time.perf_counter() - started) / repeats * 1_000_000, 1)
+        result.wire_bytes[encoding] = len(compressed)
+
+
+def run_responses(iterations: int, scale: float, encoders: List[str] = None,
+                  progress: Callable[[str], None] = print) -> Tuple[List[EncodingResult], Dict[str, Any]]:
+    """
+    Сериализация типичных ответов сервисов: путь FastAPI по умолчанию против orjson
+    (и msgpack, если установлен) - время на ответ и байты в сети с gzip/brotli
+    """
+    encoders = encoders or list(ENCODERS)
+    rng = random.Random(136)
+    results = []
+    for endpoint, (build, rows) in PAYLOADS.items():
+        rows = max(1, int(rows * scale))
+        content = build(rows, rng)
+        for encoder in encoders:
+            encode = ENCODERS[encoder]
+            result = EncodingResult(f"responses{endpoint}@{encoder}", endpoint, encoder, rows)
+            latency = result.latency
+            perf_counter = time.perf_counter
+            cpu_started = time.process_time()
+            started = perf_counter()
+            for _ in range(iterations):
+                call_started = perf_counter()
+                body = encode(content)
+                latency.record((perf_counter() - call_started) * 1_000_000)
+            result.elapsed = perf_counter() - started
+            result.cpu_seconds = time.process_time() - cpu_started
+            result.body_bytes = len(body)
+            _compression(body, result)
+
+            summary = result.to_dict()
+            progress(f"   {endpoint} {encoder}: {summary['cpu_us_per_render']} мкс, "
+                     f"{result.body_bytes} байт, в сети {result.wire_bytes}")
+            results.append(result)
+    settings = {
+        "mode": "responses",
+        "iterations": iterations,
+        "scale": scale,
+        "encoders": encoders,
+        "compress_min_bytes": responses.RESPONSE_COMPRESS_MIN_BYTES,
+        "gzip_level": responses.RESPONSE_GZIP_LEVEL,
+        "brotli_quality": responses.RESPONSE_BROTLI_QUALITY if responses.brotli is not None else None
+    }
+    return results, settings
+
@@ -0,0 +1,79 @@
+import itertools
+from typing import Any, Callable, Dict, List, Optional
+
+SERVICE_PORTS = {
+    "consensus": 8001,
+    "replication": 8002,
+    "health": 8003,
+    "transaction_log": 8004,
+    "recovery": 8005
+}
+
+
+class Scenario:
+    """Один эндпоинт под нагрузкой: метод, путь и генератор тела/параметров запроса"""
+
+    def __init__(self, name: str, service: str, method: str, path: str,
+                 params: Optional[Dict[str, Any]] = None,
+                 body: Optional[Callable[[int], Any]] = None):
+        self.name = name
+        self.service = service
+        self.method = method
+        self.path = path
+        self.params = params or {}
+        self.body = body
+
+    def url(self, base_url: str) -> str:
+        return f"{base_url}:{SERVICE_PORTS[self.service]}{self.path}"
+
+    def request_kwargs(self, seq: int) -> Dict[str, Any]:
+        kwargs: Dict[str, Any] = {"params": self.params}
+        if self.body is not None:
+            kwargs["json"] = self.body(seq)
+        return kwargs
+
+
+def _bench_document(seq: int) -> Dict[str, Any]:
+    return {"bench": True, "seq": seq, "payload": "x" * 256}
+
+
+SCENARIOS: Dict[str, Scenario] = {s.name: s for s in [
+    Scenario("write_safe", "consensus", "POST", "/write/safe",
+             body=lambda seq: {"collection": "bench_data", "document": _bench_document(seq), "write_concern": "majority"}),
+    Scenario("cluster_status", "consensus", "GET", "/cluster/status"),
+    Scenario("log_write", "transaction_log", "POST", "/log/write",
+             params={"operation_type": "insert", "collection": "bench_data", "write_concern": "majority", "result": "success"},
+             body=lambda seq: {"document": _bench_document(seq), "metadata": {"source": "bench"}}),
+    Scenario("logs_recent", "transaction_log", "GET", "/logs/recent", params={"limit": 20}),
+    Scenario("logs_by_collection", "transaction_log", "GET", "/logs/by-collection",
+             params={"collection": "bench_data", "limit": 20}),
+    Scenario("logs_stats", "transaction_log", "GET", "/logs/stats"),
+    Scenario("replication_status", "replication", "GET", "/replication/status"),
+    Scenario("replication_lag", "replication", "GET", "/replication/lag"),
+    Scenario("replication_oplog_info", "replication", "GET", "/replication/oplog/info"),
+    Scenario("health_all", "health", "GET", "/health/all"),
+    Scenario("health_primary", "health", "GET", "/health/primary"),
+    Scenario("health_secondaries", "health", "GET", "/health/secondaries"),
+    Scenario("health_network", "health", "GET", "/health/network"),
+    Scenario("health_summary", "health", "GET", "/health/summary"),
+]}
+
+GROUPS: Dict[str, List[str]] = {
+    "writes": ["write_safe", "log_write"],
+    "logs": ["log_write", "logs_recent", "logs_by_collection", "logs_stats"],
+    "replication": ["replication_status", "replication_lag", "replication_oplog_info"],
+    "health": ["health_all", "health_primary", "health_secondaries", "health_network", "health_summary"],
+}
+GROUPS["all"] = list(SCENARIOS)
+
+
+def resolve(names: str) -> List[Scenario]:
+    """'writes,health_all' -> список сценариев без повторов, в исходном порядке"""
+    selected = itertools.chain.from_iterable(GROUPS.get(n, [n]) for n in names.split(',') if n)
+    result = []
+    for name in selected:
+        if name not in SCENARIOS:
+            raise ValueError(f"Неизвестный сценарий: {name} (доступны: {', '.join(list(SCENARIOS) + list(GROUPS))})")
+        if SCENARIOS[name] not in result:
+            result.append(SCENARIOS[name])
+    return result
@@ -0,0 +1,129 @@
+import os
+import subprocess
+import sys
+import tempfile
+import time
+import urllib.error
+import urllib.request
+from typing import Any, Callable, Dict, List, Optional, Tuple
+
+from common.hdr import HdrHistogram
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+
+SERVICES: Dict[str, int] = {
+    "consensus_service": 8001,
+    "replication_monitoring": 8002,
+    "health_check": 8003,
+    "transaction_log": 8004,
+    "recovery_service": 8005,
+}
+
+
+class StartupResult:
+    def __init__(self, service: str, target_seconds: float):
+        self.name = f"startup/{service}"
+        self.service = service
+        self.target_seconds = target_seconds
+        # Время от запуска процесса до первого 200 от /livez и от /readyz
+        self.latency = HdrHistogram()
+        self.ready = HdrHistogram()
+        self.not_ready = 0
+        self.failures = 0
+
+    def to_dict(self) -> Dict[str, Any]:
+        p99_ms = self.latency.to_dict().get("p99_ms")
+        return {
+            "runs": self.latency.total + self.failures,
+            "failures": self.failures,
+            "not_ready_runs": self.not_ready,
+            "target_seconds": self.target_seconds,
+            "within_target": p99_ms is not None and p99_ms / 1000 <= self.target_seconds,
+            # Поля сравнения с базовым прогоном: задержка - время до /livez
+            "success_rps": 0,
+            "latency": self.latency.to_dict(),
+            "ready_latency": self.ready.to_dict()
+        }
+
+
+def _status(url: str) -> Optional[int]:
+    try:
+        with urllib.request.urlopen(url, timeout=1) as response:
+            return response.status
+    except urllib.error.HTTPError as e:
+        return e.code
+    except (urllib.error.URLError, OSError):
+        return None
+
+
+def _launch(service: str, port: int, env: Dict[str, str], timeout: float,
+            ready_timeout: float) -> Tuple[Optional[float], Optional[float]]:
+    """Запустить uvicorn с сервисом; (секунд до /livez, секунд до /readyz) или None"""
+    base = f"http://127.0.0.1:{port}"
+    started = time.perf_counter()
+    process = subprocess.Popen(
+        [sys.executable, "-m", "uvicorn", "main:app", "--host", "127.0.0.1", "--port", str(port),
+         "--log-level", "warning"],
+        cwd=os.path.join(ROOT, service), env=env, stdout=subprocess.DEVNULL, stderr=subprocess.DEVNULL
+    )
+    live = ready = None
+    try:
+        while time.perf_counter() - started < timeout and process.poll() is None:
+            if live is None and _status(f"{base}/livez") == 200:
+                live = time.perf_counter() - started
+            if live is not None:
+                if _status(f"{base}/readyz") == 200:
+                    ready = time.perf_counter() - started
+                    break
+                if time.perf_counter() - started - live > ready_timeout:
+                    break
+            time.sleep(0.01)
+    finally:
+        process.terminate()
+        try:
+            process.wait(timeout=10)
+        except subprocess.TimeoutExpired:
+            process.kill()
+    return live, ready
+
+
+def run_startup(services: List[str], runs: int, target_seconds: float, backend: str, mongo_uri: str,
+                timeout: float, ready_timeout: float,
+                progress: Callable[[str], None] = print) -> Tuple[List[StartupResult], Dict[str, Any]]:
+    """
+    Холодный старт сервисов: отдельный процесс uvicorn на каждый прогон, время до
+    первого ответа /livez (сервис принимает трафик) и до /readyz (MongoDB ответила)
+    """
+    env = dict(os.environ)
+    env["PYTHONPATH"] = ROOT + (os.pathsep + env["PYTHONPATH"] if env.get("PYTHONPATH") else "")
+    env["MONGO_BACKEND"] = backend
+    env["MONGO_URI"] = mongo_uri
+    env.setdefault("ALERT_HISTORY_DIR", tempfile.mkdtemp(prefix="bench_startup_"))
+    results = []
+    for service in services:
+        result = StartupResult(service, target_seconds)
+        for _ in range(runs):
+            live, ready = _launch(service, SERVICES[service], env, timeout, ready_timeout)
+            if live is None:
+                result.failures += 1
+                continue
+            result.latency.record(int(live * 1_000_000))
+            if ready is None:
+                result.not_ready += 1
+            else:
+                result.ready.record(int(ready * 1_000_000))
+        summary = result.to_dict()
+        progress(f"   {service}: /livez p50 {summary['latency'].get('p50_ms')} ms, "
+                 f"/readyz p50 {summary['ready_latency'].get('p50_ms')} ms, "
+                 f"без готовности {result.not_ready}, сбоев {result.failures}, "
+                 f"{'✅' if summary['within_target'] else '🔴'} цель {target_seconds}s")
+        results.append(result)
+    settings = {
+        "mode": "startup",
+        "runs": runs,
+        "backend": backend,
+        "mongo_uri": mongo_uri,
+        "target_seconds": target_seconds,
+        "ready_timeout_seconds": ready_timeout
+    }
+    return results, settings
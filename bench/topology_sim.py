@@ -0,0 +1,97 @@
+import random
+from typing import Any, Dict, List
+
+from common.fake_mongo import FakeReplicaSet
+
+# В Replica Set до 50 участников, но голосующих не больше 7
+MAX_MEMBERS = 50
+MAX_VOTING_MEMBERS = 7
+
+
+class ManualClock:
+    def __init__(self, start: float = 1_700_000_000.0):
+        self.now = start
+
+    def __call__(self) -> float:
+        return self.now
+
+
+class TopologySimulator:
+    """
+    Генератор реалистичных документов replSetGetStatus для многих Replica Set
+
+    Каждый набор живет по своим часам: optime растут, lag Secondary блуждает
+    случайно с редкими всплесками, узлы иногда падают и поднимаются, Primary
+    иногда переизбирается. Снимки генерируются заранее, чтобы замер стоимости
+    мониторинга не включал стоимость генерации.
+    """
+
+    def __init__(self, replica_sets: int, members: int, snapshots_per_set: int = 32, seed: int = 136):
+        if not 1 <= members <= MAX_MEMBERS:
+            raise ValueError(f"В Replica Set от 1 до {MAX_MEMBERS} участников")
+        self.random = random.Random(seed)
+        self.snapshots: List[Dict[str, Any]] = []
+        for set_index in range(replica_sets):
+            self.snapshots.extend(self._evolve(f"rs{set_index}", members, snapshots_per_set))
+        self.random.shuffle(self.snapshots)
+        self.position = 0
+
+    def _evolve(self, name: str, members: int, steps: int) -> List[Dict[str, Any]]:
+        clock = ManualClock(1_700_000_000.0 + self.random.uniform(0, 86400))
+        hosts = [f"{name}-node{i}.db.internal:27017" for i in range(members)]
+        replica_set = FakeReplicaSet(hosts, name=name, clock=clock, election_timeout=3)
+        majority = min(members, MAX_VOTING_MEMBERS) // 2 + 1
+        snapshots = []
+        for _ in range(steps):
+            clock.now += self.random.uniform(1, 3)
+            for member in replica_set.members:
+                if not member.up:
+                    if self.random.random() < 0.3:
+                        replica_set.start(member.name)
+                    continue
+                if self.random.random() < 0.01:
+                    replica_set.stop(member.name)
+                    continue
+                member.ping_ms = max(0, int(self.random.gauss(5, 3)))
+                if member.state == "PRIMARY":
+                    continue
+                if self.random.random() < 0.05:
+                    member.lag_seconds = self.random.uniform(20, 120)
+                else:
+                    member.lag_seconds = max(0.0, member.lag_seconds * 0.6 + self.random.expovariate(1.0))
+            if self.random.random() < 0.02:
+                replica_set.step_down()
+            status = replica_set.status()
+            status["majorityVoteCount"] = majority
+            status["writeMajorityCount"] = majority
+            snapshots.append(status)
+        return snapshots
+
+    def next_status(self) -> Dict[str, Any]:
+        status = self.snapshots[self.position]
+        self.position = (self.position + 1) % len(self.snapshots)
+        return status
+
+
+class SimulatedAdmin:
+    def __init__(self, simulator: TopologySimulator):
+        self.simulator = simulator
+
+    def command(self, name, *args, **kwargs):
+        if name == "replSetGetStatus":
+            return self.simulator.next_status()
+        if name == "ping":
+            return {"ok": 1.0}
+        if name == "hello":
+            return {"isWritablePrimary": True, "setName": self.simulator.snapshots[0].get("set"), "ok": 1.0}
+        raise NotImplementedError(f"Симулятор не поддерживает команду {name}")
+
+
+class SimulatedClient:
+    """Минимальный клиент для функций мониторинга: только admin.command"""
+
+    def __init__(self, simulator: TopologySimulator):
+        self.admin = SimulatedAdmin(simulator)
+
+    def close(self):
+        pass
@@ -0,0 +1 @@
+"""Общий код сервисов UBI.136"""
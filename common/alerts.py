@@ -0,0 +1,431 @@
+import hashlib
+import json
+import logging
+import os
+import queue
+import threading
+import urllib.request
+from collections import deque
+from datetime import datetime
+from typing import Any, Deque, Dict, List, Optional
+
+from fastapi import APIRouter, HTTPException
+
+from common.responses import FastRoute
+
+logger = logging.getLogger(__name__)
+
+# Куда доставлять уведомления: "stdout,file:/var/log/alerts.jsonl,webhook:https://hooks.example/alerts"
+ALERT_SINKS = os.getenv("ALERT_SINKS", "stdout")
+ALERT_HISTORY_DIR = os.getenv("ALERT_HISTORY_DIR", "/tmp/alert_history")
+ALERT_HISTORY_MAX_EVENTS = int(os.getenv("ALERT_HISTORY_MAX_EVENTS", "10000"))
+ALERT_BATCH_SIZE = int(os.getenv("ALERT_BATCH_SIZE", "50"))
+ALERT_FLUSH_SECONDS = float(os.getenv("ALERT_FLUSH_SECONDS", "2"))
+ALERT_MAX_RETRIES = int(os.getenv("ALERT_MAX_RETRIES", "5"))
+ALERT_QUEUE_SIZE = int(os.getenv("ALERT_QUEUE_SIZE", "10000"))
+ALERT_WEBHOOK_TIMEOUT_SECONDS = float(os.getenv("ALERT_WEBHOOK_TIMEOUT_SECONDS", "5"))
+# Пауза между повторами доставки растет вдвое, но не больше минуты
+MAX_RETRY_DELAY_SECONDS = 60
+
+FIRING = "firing"
+ACKNOWLEDGED = "acknowledged"
+RESOLVED = "resolved"
+LEVEL_ORDER = {"CRITICAL": 0, "WARNING": 1, "INFO": 2}
+# Поля алерта, которые определяют его идентичность; message и значения метрик меняются между оценками
+FINGERPRINT_LABELS = ("type", "shard", "node")
+
+
+def fingerprint(source: str, alert: Dict[str, Any]) -> str:
+    labels = "|".join(str(alert.get(label) or "") for label in FINGERPRINT_LABELS)
+    return hashlib.sha1(f"{source}|{labels}".encode()).hexdigest()[:16]
+
+
+class AlertRecord:
+    __slots__ = ('fingerprint', 'alert', 'state', 'started_at', 'last_seen_at', 'acknowledged_at',
+                 'acknowledged_by', 'evaluations')
+
+    def __init__(self, fingerprint: str, alert: Dict[str, Any], started_at: str):
+        self.fingerprint = fingerprint
+        self.alert = alert
+        self.state = FIRING
+        self.started_at = started_at
+        self.last_seen_at = started_at
+        self.acknowledged_at: Optional[str] = None
+        self.acknowledged_by: Optional[str] = None
+        self.evaluations = 1
+
+    def to_dict(self) -> Dict[str, Any]:
+        return {
+            **self.alert,
+            "fingerprint": self.fingerprint,
+            "state": self.state,
+            "started_at": self.started_at,
+            "last_seen_at": self.last_seen_at,
+            "acknowledged_at": self.acknowledged_at,
+            "acknowledged_by": self.acknowledged_by
+        }
+
+    def event(self, source: str, state: str, at: str) -> Dict[str, Any]:
+        """Запись перехода для истории и уведомлений"""
+        return {
+            "at": at,
+            "source": source,
+            "fingerprint": self.fingerprint,
+            "state": state,
+            "started_at": self.started_at,
+            "acknowledged_by": self.acknowledged_by,
+            "alert": self.alert
+        }
+
+
+class AlertHistory:
+    """
+    Журнал переходов алертов в JSONL-файле
+
+    Хранится локально, а не в MongoDB: история должна писаться и тогда, когда
+    кластер, о котором алерт, недоступен. В памяти держатся последние max_events
+    событий; файл переписывается, когда вырастает вдвое, и в конец добавляется
+    снимок активных алертов, чтобы после перезапуска они не сработали повторно.
+    """
+
+    def __init__(self, path: str, max_events: int = ALERT_HISTORY_MAX_EVENTS):
+        self.path = path
+        self.max_events = max_events
+        self.events: Deque[Dict[str, Any]] = deque(maxlen=max_events)
+        self.lines = 0
+
+    def load(self) -> Dict[str, Dict[str, Any]]:
+        """Прочитать журнал; вернуть последнее событие каждого неразрешенного алерта"""
+        active: Dict[str, Dict[str, Any]] = {}
+        if not os.path.exists(self.path):
+            return active
+        with open(self.path, encoding='utf-8') as f:
+            for line in f:
+                try:
+                    event = json.loads(line)
+                except ValueError:
+                    # Оборванная последняя строка после аварийной остановки
+                    continue
+                self.lines += 1
+                if not event.pop("snapshot", False):
+                    self.events.append(event)
+                if event["state"] == RESOLVED:
+                    active.pop(event["fingerprint"], None)
+                else:
+                    active[event["fingerprint"]] = event
+        return active
+
+    def append(self, events: List[Dict[str, Any]], active: List[Dict[str, Any]]):
+        self.events.extend(events)
+        if self.lines + len(events) > 2 * self.max_events:
+            self._compact(active)
+            return
+        with open(self.path, 'a', encoding='utf-8') as f:
+            for event in events:
+                f.write(json.dumps(event, ensure_ascii=False, default=str) + "\n")
+        self.lines += len(events)
+
+    def _compact(self, active: List[Dict[str, Any]]):
+        tmp_path = self.path + ".tmp"
+        with open(tmp_path, 'w', encoding='utf-8') as f:
+            for event in self.events:
+                f.write(json.dumps(event, ensure_ascii=False, default=str) + "\n")
+            for event in active:
+                f.write(json.dumps({**event, "snapshot": True}, ensure_ascii=False, default=str) + "\n")
+        os.replace(tmp_path, self.path)
+        self.lines = len(self.events) + len(active)
+
+    def recent(self, limit: int, fingerprint: Optional[str] = None) -> List[Dict[str, Any]]:
+        events = [e for e in self.events if fingerprint is None or e["fingerprint"] == fingerprint]
+        return events[-limit:][::-1]
+
+
+class StdoutSink:
+    name = "stdout"
+
+    def send(self, batch: List[Dict[str, Any]]):
+        for notification in batch:
+            print(json.dumps(notification, ensure_ascii=False, default=str), flush=True)
+
+
+class FileSink:
+    def __init__(self, path: str):
+        self.path = path
+        self.name = f"file:{path}"
+
+    def send(self, batch: List[Dict[str, Any]]):
+        with open(self.path, 'a', encoding='utf-8') as f:
+            for notification in batch:
+                f.write(json.dumps(notification, ensure_ascii=False, default=str) + "\n")
+
+
+class WebhookSink:
+    def __init__(self, url: str, timeout: float = ALERT_WEBHOOK_TIMEOUT_SECONDS):
+        self.url = url
+        self.timeout = timeout
+        self.name = f"webhook:{url}"
+
+    def send(self, batch: List[Dict[str, Any]]):
+        body = json.dumps({"alerts": batch}, ensure_ascii=False, default=str).encode('utf-8')
+        request = urllib.request.Request(self.url, data=body, headers={"Content-Type": "application/json"})
+        # Ответ не 2xx urllib поднимает как HTTPError - пакет уйдет на повтор
+        with urllib.request.urlopen(request, timeout=self.timeout):
+            pass
+
+
+def sinks_from_spec(spec: str) -> List[Any]:
+    sinks = []
+    for item in filter(None, (part.strip() for part in spec.split(','))):
+        kind, _, target = item.partition(':')
+        if kind == "stdout":
+            sinks.append(StdoutSink())
+        elif kind == "file" and target:
+            sinks.append(FileSink(target))
+        elif kind == "webhook" and target:
+            sinks.append(WebhookSink(target))
+        else:
+            raise ValueError(f"Неизвестный получатель алертов в ALERT_SINKS: {item}")
+    return sinks
+
+
+class SinkWorker:
+    """
+    Доставка уведомлений одному получателю из своей очереди
+
+    У каждого получателя свой поток, поэтому недоступный webhook с повторами
+    не задерживает запись в файл и не блокирует оценку правил.
+    """
+
+    def __init__(self, sink, batch_size: int = ALERT_BATCH_SIZE, flush_seconds: float = ALERT_FLUSH_SECONDS,
+                 max_retries: int = ALERT_MAX_RETRIES, queue_size: int = ALERT_QUEUE_SIZE):
+        self.sink = sink
+        self.batch_size = batch_size
+        self.flush_seconds = flush_seconds
+        self.max_retries = max_retries
+        self.queue: "queue.Queue[Dict[str, Any]]" = queue.Queue(maxsize=queue_size)
+        self.delivered = 0
+        self.failed = 0
+        self.dropped = 0
+        self.last_error: Optional[str] = None
+        self._stop = threading.Event()
+        self._thread: Optional[threading.Thread] = None
+
+    def submit(self, notification: Dict[str, Any]):
+        try:
+            self.queue.put_nowait(notification)
+        except queue.Full:
+            self.dropped += 1
+            if self.dropped == 1 or self.dropped % 1000 == 0:
+                logger.warning(f"⚠️ Очередь уведомлений {self.sink.name} переполнена, отброшено {self.dropped}")
+
+    def start(self):
+        self._stop.clear()
+        self._thread = threading.Thread(target=self._run, name=f"alerts-{self.sink.name}", daemon=True)
+        self._thread.start()
+
+    def stop(self, timeout: float = 5.0):
+        self._stop.set()
+        if self._thread:
+            self._thread.join(timeout)
+
+    def _next_batch(self) -> List[Dict[str, Any]]:
+        try:
+            batch = [self.queue.get(timeout=self.flush_seconds)]
+        except queue.Empty:
+            return []
+        # Собрать пакет: все, что успело прийти, но не больше batch_size
+        while len(batch) < self.batch_size:
+            try:
+                batch.append(self.queue.get_nowait())
+            except queue.Empty:
+                break
+        return batch
+
+    def _run(self):
+        while not self._stop.is_set() or not self.queue.empty():
+            batch = self._next_batch()
+            if batch:
+                self._deliver(batch)
+
+    def _deliver(self, batch: List[Dict[str, Any]]):
+        delay = 1.0
+        for attempt in range(1, self.max_retries + 1):
+            try:
+                self.sink.send(batch)
+                self.delivered += len(batch)
+                self.last_error = None
+                return
+            except Exception as e:
+                self.last_error = str(e)
+                if attempt == self.max_retries or self._stop.is_set():
+                    break
+                logger.warning(f"⚠️ {self.sink.name}: попытка {attempt} не удалась ({e}), повтор через {delay:.0f}s")
+                self._stop.wait(delay)
+                delay = min(delay * 2, MAX_RETRY_DELAY_SECONDS)
+        self.failed += len(batch)
+        logger.error(f"❌ {self.sink.name}: {len(batch)} уведомлений не доставлено: {self.last_error}")
+
+    def stats(self) -> Dict[str, Any]:
+        return {
+            "sink": self.sink.name,
+            "queued": self.queue.qsize(),
+            "delivered": self.delivered,
+            "failed": self.failed,
+            "dropped": self.dropped,
+            "last_error": self.last_error
+        }
+
+
+class AlertEngine:
+    """
+    Состояние алертов между оценками правил
+
+    Каждая оценка передает полный список текущих алертов. Алерт узнается по
+    fingerprint (source + type/shard/node): новый становится firing, исчезнувший -
+    resolved, acknowledged сохраняется, пока алерт не разрешится. Уведомляются
+    только переходы; история переживает перезапуск сервиса.
+    """
+
+    def __init__(self, source: str, history: Optional[AlertHistory] = None, sinks: Optional[List[Any]] = None):
+        self.source = source
+        self.history = history
+        self.workers = [SinkWorker(sink) for sink in sinks or []]
+        self.active: Dict[str, AlertRecord] = {}
+        self.evaluated_at: Optional[str] = None
+        self.evaluations = 0
+        self._lock = threading.Lock()
+        if history is not None:
+            self._restore(history.load())
+
+    @classmethod
+    def from_env(cls, source: str) -> "AlertEngine":
+        os.makedirs(ALERT_HISTORY_DIR, exist_ok=True)
+        history = AlertHistory(os.path.join(ALERT_HISTORY_DIR, f"{source}.jsonl"))
+        return cls(source, history, sinks_from_spec(ALERT_SINKS))
+
+    def _restore(self, events: Dict[str, Dict[str, Any]]):
+        for fp, event in events.items():
+            record = AlertRecord(fp, event["alert"], event["started_at"])
+            record.state = event["state"]
+            record.last_seen_at = event["at"]
+            if record.state == ACKNOWLEDGED:
+                record.acknowledged_at = event["at"]
+                record.acknowledged_by = event.get("acknowledged_by")
+            self.active[fp] = record
+        if self.active:
+            logger.info(f"🔔 Восстановлено активных алертов из истории: {len(self.active)}")
+
+    def start(self):
+        for worker in self.workers:
+            worker.start()
+
+    def stop(self):
+        for worker in self.workers:
+            worker.stop()
+
+    def evaluate(self, alerts: List[Dict[str, Any]]) -> List[Dict[str, Any]]:
+        """Применить результат оценки правил; вернуть активные алерты"""
+        now = str(datetime.now())
+        transitions = []
+        with self._lock:
+            seen = set()
+            for alert in alerts:
+                fp = fingerprint(self.source, alert)
+                seen.add(fp)
+                record = self.active.get(fp)
+                if record is None:
+                    record = AlertRecord(fp, alert, now)
+                    self.active[fp] = record
+                    transitions.append(record.event(self.source, FIRING, now))
+                else:
+                    record.alert = alert
+                    record.last_seen_at = now
+                    record.evaluations += 1
+            for fp in [fp for fp in self.active if fp not in seen]:
+                record = self.active.pop(fp)
+                transitions.append(record.event(self.source, RESOLVED, now))
+            self.evaluated_at = now
+            self.evaluations += 1
+            if transitions:
+                self._record(transitions)
+            active = self._sorted()
+        self._notify(transitions)
+        return active
+
+    def acknowledge(self, fp: str, by: str) -> Dict[str, Any]:
+        now = str(datetime.now())
+        with self._lock:
+            record = self.active.get(fp)
+            if record is None:
+                raise KeyError(fp)
+            if record.state == ACKNOWLEDGED:
+                return record.to_dict()
+            record.state = ACKNOWLEDGED
+            record.acknowledged_at = now
+            record.acknowledged_by = by
+            transition = record.event(self.source, ACKNOWLEDGED, now)
+            self._record([transition])
+            result = record.to_dict()
+        self._notify([transition])
+        return result
+
+    def _record(self, transitions: List[Dict[str, Any]]):
+        if self.history is None:
+            return
+        try:
+            now = str(datetime.now())
+            self.history.append(transitions, [r.event(self.source, r.state, now) for r in self.active.values()])
+        except OSError as e:
+            logger.error(f"❌ Не удалось записать историю алертов: {e}")
+
+    def _notify(self, transitions: List[Dict[str, Any]]):
+        for transition in transitions:
+            notification = {**transition["alert"], **transition}
+            del notification["alert"]
+            for worker in self.workers:
+                worker.submit(notification)
+
+    def _sorted(self) -> List[Dict[str, Any]]:
+        records = sorted(self.active.values(), key=lambda r: (LEVEL_ORDER.get(r.alert.get("level"), 3), r.started_at))
+        return [record.to_dict() for record in records]
+
+    def current(self) -> List[Dict[str, Any]]:
+        with self._lock:
+            return self._sorted()
+
+    def stats(self) -> Dict[str, Any]:
+        return {
+            "source": self.source,
+            "active": len(self.active),
+            "evaluations": self.evaluations,
+            "evaluated_at": self.evaluated_at,
+            "sinks": [worker.stats() for worker in self.workers]
+        }
+
+
+def alerts_router(engine: AlertEngine, prefix: str) -> APIRouter:
+    """История, подтверждение и статистика доставки рядом с эндпоинтом алертов сервиса"""
+    router = APIRouter(route_class=FastRoute)
+
+    @router.get(f"{prefix}/history")
+    async def get_alert_history(limit: int = 100, fingerprint: Optional[str] = None):
+        """Переходы алертов (firing / acknowledged / resolved), новые первыми"""
+        if engine.history is None:
+            return {"events": []}
+        events = engine.history.recent(max(1, min(limit, engine.history.max_events)), fingerprint)
+        return {"count": len(events), "events": events}
+
+    @router.get(f"{prefix}/engine")
+    async def get_alert_engine_stats():
+        """Состояние движка алертов и очередей доставки"""
+        return engine.stats()
+
+    @router.post(f"{prefix}/{{fingerprint}}/acknowledge")
+    async def acknowledge_alert(fingerprint: str, by: str = "operator"):
+        """Подтвердить алерт: он остается в списке активных, пока не разрешится"""
+        try:
+            return engine.acknowledge(fingerprint, by)
+        except KeyError:
+            raise HTTPException(status_code=404, detail=f"Активный алерт {fingerprint} не найден")
+
+    return router
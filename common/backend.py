@@ -0,0 +1,23 @@
+import os
+import logging
+
+from pymongo import MongoClient
+
+logger = logging.getLogger(__name__)
+
+# mongodb - реальный кластер из MONGO_URI, fake - встроенная замена для офлайн тестов и бенчмарков
+MONGO_BACKEND = os.getenv("MONGO_BACKEND", "mongodb")
+
+
+def create_client(uri: str, **kwargs):
+    """Создать клиент MongoDB для выбранного бэкенда"""
+    if MONGO_BACKEND == "fake":
+        try:
+            from common.fake_mongo import FakeMongoClient, default_replica_set
+        except ImportError as e:
+            raise RuntimeError(f"MONGO_BACKEND=fake требует пакет mongomock: {e}")
+        logger.warning("🧪 Используется встроенная замена MongoDB (MONGO_BACKEND=fake)")
+        return FakeMongoClient(default_replica_set())
+    if MONGO_BACKEND != "mongodb":
+        raise RuntimeError(f"Неизвестный MONGO_BACKEND: {MONGO_BACKEND}")
+    return MongoClient(uri, **kwargs)
@@ -0,0 +1,216 @@
+import hashlib
+import threading
+import time
+from datetime import datetime
+from typing import Any, Callable, Dict, List, Optional, Tuple
+
+RECOVERY_STATES = ('RECOVERING', 'STARTUP', 'STARTUP2', 'ROLLBACK')
+
+
+class MemberView:
+    __slots__ = ('doc', 'name', 'state', 'healthy', 'optime', 'lag_seconds', 'ping_ms', 'uptime')
+
+    def __init__(self, doc: Dict[str, Any]):
+        self.doc = doc
+        self.name: str = doc['name']
+        self.state: str = doc['stateStr']
+        self.healthy: bool = doc['health'] == 1
+        self.optime: Optional[datetime] = doc.get('optimeDate')
+        # Отставание от Primary; None - если Primary нет или у кого-то нет optime
+        self.lag_seconds: Optional[float] = None
+        self.ping_ms = doc.get('pingMs')
+        self.uptime = doc.get('uptime', 0)
+
+    def get(self, key: str, default=None):
+        return self.doc.get(key, default)
+
+
+class ClusterView:
+    """
+    Разбор replSetGetStatus за один проход
+
+    Строится один раз на снимок: индексы узлов по состоянию и имени, счетчики
+    и lag относительно Primary посчитаны заранее, поэтому эндпоинты берут
+    готовые значения вместо повторных проходов по members.
+    """
+
+    __slots__ = ('status', 'set_name', 'term', 'date', 'members', 'by_name', 'by_state',
+                 'primary', 'primary_count', 'secondaries', 'healthy_count', 'unhealthy',
+                 'total', 'majority', 'voting_members', 'secondary_lags', 'max_lag_seconds', 'majority_lag_seconds',
+                 'commit_lag_seconds', 'version')
+
+    def __init__(self, rs_status: Dict[str, Any]):
+        self.status = rs_status
+        self.set_name = rs_status.get('set')
+        self.term = rs_status.get('term')
+        self.date = rs_status.get('date')
+        self.by_name: Dict[str, MemberView] = {}
+        self.by_state: Dict[str, List[MemberView]] = {}
+        self.unhealthy: List[MemberView] = []
+        self.healthy_count = 0
+
+        members = []
+        for doc in rs_status['members']:
+            member = MemberView(doc)
+            members.append(member)
+            self.by_name[member.name] = member
+            self.by_state.setdefault(member.state, []).append(member)
+            if member.healthy:
+                self.healthy_count += 1
+            else:
+                self.unhealthy.append(member)
+        self.members: Tuple[MemberView, ...] = tuple(members)
+        self.total = len(members)
+        self.majority = rs_status.get('majorityVoteCount') or self.total // 2 + 1
+        # Узлы, способные подтвердить запись (без арбитров): это w для writeConcern "all"
+        self.voting_members = rs_status.get('writableVotingMembersCount') or self.total
+
+        primaries = self.by_state.get('PRIMARY', ())
+        self.primary_count = len(primaries)
+        self.primary: Optional[MemberView] = primaries[0] if primaries else None
+        self.secondaries: List[MemberView] = self.by_state.get('SECONDARY', [])
+
+        self.secondary_lags: Dict[str, float] = {}
+        primary_optime = self.primary.optime if self.primary else None
+        if primary_optime:
+            self.primary.lag_seconds = 0.0
+            for member in members:
+                if member.state != 'PRIMARY' and member.optime:
+                    member.lag_seconds = (primary_optime - member.optime).total_seconds()
+                    if member.state == 'SECONDARY':
+                        self.secondary_lags[member.name] = max(0.0, member.lag_seconds)
+
+        lags = sorted(self.secondary_lags.values())
+        self.max_lag_seconds = lags[-1] if lags else 0.0
+        # Для w:majority нужны (majority - 1) самых свежих Secondary помимо Primary
+        needed = self.majority - 1
+        if needed <= 0:
+            self.majority_lag_seconds = 0.0
+        elif len(lags) >= needed:
+            self.majority_lag_seconds = lags[needed - 1]
+        else:
+            self.majority_lag_seconds = float('inf')
+
+        # Насколько точка majority-коммита отстает от Primary: столько записей откатится при его потере
+        committed = (rs_status.get('optimes') or {}).get('lastCommittedWallTime')
+        if primary_optime and committed:
+            self.commit_lag_seconds = max(0.0, (primary_optime - committed).total_seconds())
+        else:
+            self.commit_lag_seconds = self.majority_lag_seconds
+
+        # Версия топологии для условных GET: меняется с term, состоянием, optime или источником синхронизации узла
+        self.version = _digest((self.set_name, self.term, tuple(
+            (member.name, member.state, member.healthy, member.optime, member.get('syncSourceHost'))
+            for member in members
+        )))
+
+    @classmethod
+    def fetch(cls, client) -> "ClusterView":
+        return cls(client.admin.command('replSetGetStatus'))
+
+    @property
+    def secondary_count(self) -> int:
+        return len(self.secondaries)
+
+    @property
+    def primaries(self) -> List[MemberView]:
+        return self.by_state.get('PRIMARY', [])
+
+    def member(self, name: str) -> Optional[MemberView]:
+        return self.by_name.get(name)
+
+
+def _digest(parts: Any) -> str:
+    return hashlib.blake2b(repr(parts).encode(), digest_size=8).hexdigest()
+
+
+def topology_version(views: Dict[str, ClusterView], errors: Dict[str, str]) -> str:
+    """Версия шардированного кластера: версии всех шардов и список недоступных"""
+    return _digest((tuple(sorted((shard, view.version) for shard, view in views.items())), tuple(sorted(errors))))
+
+
+def sharded_response(results: Dict[str, Dict[str, Any]], errors: Dict[str, str],
+                     roles: Dict[str, str]) -> Dict[str, Any]:
+    """Ответ эндпоинта за mongos: отчеты по шардам и ошибки недоступных шардов"""
+    return {
+        "topology": "sharded",
+        "timestamp": str(datetime.now()),
+        "shards": {shard: {"role": roles.get(shard), **result} for shard, result in results.items()},
+        "unreachable_shards": errors
+    }
+
+
+class ClusterViewCache:
+    """
+    Один ClusterView на снимок для всех запросов сервиса
+
+    Снимок переиспользуется max_age_seconds; при 0 каждый вызов идет в MongoDB.
+    Ошибки не кэшируются - следующий запрос повторит replSetGetStatus.
+    """
+
+    def __init__(self, max_age_seconds: float = 1.0, uri: Optional[str] = None):
+        self.max_age_seconds = max_age_seconds
+        self.view: Optional[ClusterView] = None
+        self.fetched_at = float('-inf')
+        self._lock = threading.Lock()
+        # Если uri указывает на mongos, снимки собираются со всех шардов
+        self.shards = None
+        if uri is not None:
+            from common.sharding import ShardFanout
+            self.shards = ShardFanout(uri)
+        self.shard_views: Tuple[Dict[str, ClusterView], Dict[str, str]] = ({}, {})
+        self.shards_fetched_at = float('-inf')
+
+    def current(self, client) -> ClusterView:
+        view = self.view
+        if view is not None and time.monotonic() - self.fetched_at < self.max_age_seconds:
+            return view
+        with self._lock:
+            # Пока ждали блокировку, снимок мог обновить другой поток
+            if self.view is not None and time.monotonic() - self.fetched_at < self.max_age_seconds:
+                return self.view
+            view = ClusterView.fetch(client)
+            self.view = view
+            self.fetched_at = time.monotonic()
+            return view
+
+    def version(self, client) -> str:
+        """Версия текущего снимка (за mongos - всех шардов); совпадает, пока топология не изменилась"""
+        if not self.is_sharded(client):
+            return self.current(client).version
+        return topology_version(*self.current_shards(client))
+
+    def invalidate(self):
+        self.view = None
+        self.shards_fetched_at = float('-inf')
+
+    def is_sharded(self, client) -> bool:
+        return self.shards is not None and self.shards.is_sharded(client)
+
+    def current_shards(self, client) -> Tuple[Dict[str, ClusterView], Dict[str, str]]:
+        """Снимки всех шардов и config-серверов: (виды по shard id, ошибки недоступных)"""
+        if time.monotonic() - self.shards_fetched_at < self.max_age_seconds:
+            return self.shard_views
+        with self._lock:
+            if time.monotonic() - self.shards_fetched_at >= self.max_age_seconds:
+                self.shard_views = self.shards.views(client)
+                self.shards_fetched_at = time.monotonic()
+            return self.shard_views
+
+    def dispatch(self, client, report: Callable[[ClusterView], Dict[str, Any]]) -> Dict[str, Any]:
+        """report(view) для Replica Set или для каждого шарда, если сервис подключен к mongos"""
+        if not self.is_sharded(client):
+            return report(self.current(client))
+        views, errors = self.current_shards(client)
+        return sharded_response({shard: report(view) for shard, view in views.items()}, errors, self.shards.roles())
+
+    def dispatch_clients(self, client, fn: Callable[[Any], Dict[str, Any]]) -> Dict[str, Any]:
+        """fn(client) для Replica Set или параллельно fn(клиент шарда) для каждого шарда"""
+        if not self.is_sharded(client):
+            return fn(client)
+        results, errors = self.shards.fan_out(client, fn)
+        return sharded_response(results, errors, self.shards.roles())
+
+    def close(self):
+        if self.shards is not None:
+            self.shards.close()
@@ -0,0 +1,560 @@
+"""
+Встроенная замена MongoDB Replica Set для офлайн тестов и бенчмарков
+
+Данные хранятся в mongomock, поверх него эмулируются replSetGetStatus, local.oplog.rs,
+collStats, causal-сессии и change streams. Топология управляется скриптом:
+остановка узлов, выборы, задержка репликации, сетевые задержки и Split-Brain.
+"""
+import json
+import os
+import queue
+import threading
+import time
+from datetime import datetime
+from typing import Any, Callable, Dict, List, Optional
+
+import bson
+import mongomock
+from bson.raw_bson import RawBSONDocument
+from bson.timestamp import Timestamp
+from pymongo.errors import NotPrimaryError, OperationFailure, ServerSelectionTimeoutError
+
+DEFAULT_MEMBERS = "mongo-primary:27017,mongo-secondary1:27017,mongo-secondary2:27017"
+OPLOG_MAX_SIZE = 990 * 1024 * 1024
+EPOCH = datetime(1970, 1, 1)
+
+STATE_CODES = {
+    "PRIMARY": 1,
+    "SECONDARY": 2,
+    "RECOVERING": 3,
+    "STARTUP2": 5,
+    "ROLLBACK": 9,
+    "(not reachable/healthy)": 8
+}
+
+WRITE_METHODS = {
+    "insert_one": "i", "insert_many": "i",
+    "update_one": "u", "update_many": "u", "replace_one": "u", "find_one_and_update": "u",
+    "delete_one": "d", "delete_many": "d", "find_one_and_delete": "d"
+}
+
+
+class FakeMember:
+    def __init__(self, member_id: int, name: str, priority: float, now: float):
+        self.id = member_id
+        self.name = name
+        self.priority = priority
+        self.up = True
+        self.state = "SECONDARY"
+        self.lag_seconds = 0.0
+        self.ping_ms = 1
+        self.started_at = now
+        self.stopped_at: Optional[float] = None
+        self.election_date: Optional[float] = None
+
+
+class FakeReplicaSet:
+    """
+    Сценарная модель Replica Set
+
+    clock можно подменить управляемыми часами - тогда выборы и сценарий
+    продвигаются детерминированно, без реального ожидания.
+    """
+
+    def __init__(self, members: List[str], name: str = "rs0", clock: Callable[[], float] = time.time,
+                 election_timeout: float = 5.0):
+        self.name = name
+        self.clock = clock
+        self.election_timeout = election_timeout
+        self.storage = mongomock.MongoClient()
+        now = clock()
+        self.created_at = now
+        self.members = [
+            FakeMember(i, member, 2 if i == 0 else 1, now) for i, member in enumerate(members)
+        ]
+        self.members[0].state = "PRIMARY"
+        self.members[0].election_date = now
+        self.term = 1
+        self.election_due_at: Optional[float] = None
+        self.script: List[Dict[str, Any]] = []
+        self.last_optime = Timestamp(int(now), 0)
+        # Точка majority-коммита не откатывается назад, даже если majority узлов недоступно
+        self.committed_at = now
+        self.streams: List["FakeChangeStream"] = []
+        self._lock = threading.RLock()
+
+    # ---------- Управление топологией ----------
+
+    def member(self, name: str) -> FakeMember:
+        for member in self.members:
+            if member.name == name or member.name.split(':')[0] == name:
+                return member
+        raise KeyError(f"Нет узла {name}")
+
+    def stop(self, name: str):
+        with self._lock:
+            member = self.member(name)
+            was_primary = member.state == "PRIMARY"
+            member.up = False
+            member.state = "(not reachable/healthy)"
+            member.stopped_at = self.clock()
+            if was_primary and not self.primaries():
+                self.election_due_at = self.clock() + self.election_timeout
+
+    def start(self, name: str):
+        with self._lock:
+            member = self.member(name)
+            if member.up:
+                return
+            member.up = True
+            member.state = "SECONDARY"
+            member.started_at = self.clock()
+            member.stopped_at = None
+            if not self.primaries() and self.election_due_at is None:
+                self.election_due_at = self.clock() + self.election_timeout
+
+    def set_lag(self, name: str, seconds: float):
+        with self._lock:
+            self.member(name).lag_seconds = seconds
+
+    def set_ping(self, name: str, ping_ms: int):
+        with self._lock:
+            self.member(name).ping_ms = ping_ms
+
+    def set_state(self, name: str, state: str):
+        with self._lock:
+            self.member(name).state = state
+
+    def step_down(self):
+        with self._lock:
+            for member in self.primaries():
+                member.state = "SECONDARY"
+            self.election_due_at = self.clock() + self.election_timeout
+
+    def elect(self, name: Optional[str] = None):
+        """Немедленно завершить выборы (указанный узел или лучший кандидат)"""
+        with self._lock:
+            candidates = [m for m in self.members if m.up and m.state == "SECONDARY"]
+            if name:
+                candidates = [self.member(name)]
+            if not candidates or sum(1 for m in self.members if m.up) < self.majority:
+                return
+            winner = min(candidates, key=lambda m: (-m.priority, m.lag_seconds))
+            for member in self.primaries():
+                member.state = "SECONDARY"
+            winner.state = "PRIMARY"
+            winner.lag_seconds = 0.0
+            winner.election_date = self.clock()
+            self.term += 1
+            self.election_due_at = None
+
+    def split_brain(self, name: str):
+        """Второй Primary в изолированном сегменте"""
+        with self._lock:
+            member = self.member(name)
+            member.up = True
+            member.state = "PRIMARY"
+            member.election_date = self.clock()
+
+    def heal(self):
+        """Снять все сбои: узлы подняты, lag сброшен, Primary один"""
+        with self._lock:
+            for member in self.members:
+                member.up = True
+                member.lag_seconds = 0.0
+                member.ping_ms = 1
+                if member.state != "PRIMARY":
+                    member.state = "SECONDARY"
+            primaries = self.primaries()
+            for extra in sorted(primaries, key=lambda m: m.election_date or 0)[:-1]:
+                extra.state = "SECONDARY"
+            if not self.primaries():
+                self.elect()
+
+    def load_script(self, steps: List[Dict[str, Any]]):
+        """Шаги вида {"at": 5, "action": "stop", "member": "mongo-primary"} относительно старта"""
+        with self._lock:
+            self.script = sorted(steps, key=lambda s: s["at"])
+
+    def _advance(self):
+        now = self.clock()
+        while self.script and self.script[0]["at"] <= now - self.created_at:
+            step = self.script.pop(0)
+            action = step["action"]
+            if action == "lag":
+                self.set_lag(step["member"], step["seconds"])
+            elif action == "ping":
+                self.set_ping(step["member"], step["ms"])
+            elif action == "state":
+                self.set_state(step["member"], step["state"])
+            elif action in ("stop", "start", "split_brain", "elect"):
+                getattr(self, action)(step.get("member"))
+            else:
+                getattr(self, action)()
+        if self.election_due_at is not None and now >= self.election_due_at:
+            self.elect()
+            if self.election_due_at is not None:
+                # Кворума нет - следующая попытка через election_timeout
+                self.election_due_at = now + self.election_timeout
+
+    # ---------- Состояние ----------
+
+    @property
+    def majority(self) -> int:
+        return len(self.members) // 2 + 1
+
+    def primaries(self) -> List[FakeMember]:
+        return [m for m in self.members if m.up and m.state == "PRIMARY"]
+
+    @property
+    def writable(self) -> bool:
+        with self._lock:
+            self._advance()
+            return bool(self.primaries())
+
+    @property
+    def reachable(self) -> bool:
+        with self._lock:
+            self._advance()
+            return any(m.up for m in self.members)
+
+    def next_optime(self) -> Timestamp:
+        with self._lock:
+            seconds = int(self.clock())
+            inc = self.last_optime.inc + 1 if self.last_optime.time == seconds else 1
+            self.last_optime = Timestamp(seconds, inc)
+            return self.last_optime
+
+    def status(self) -> Dict[str, Any]:
+        with self._lock:
+            self._advance()
+            now = self.clock()
+            primaries = self.primaries()
+            # Отвечает первый доступный узел - он и помечается как self
+            responder = next((m for m in self.members if m.up), self.members[0])
+            members = []
+            for member in self.members:
+                optime_at = now - member.lag_seconds if member.up else (member.stopped_at or now)
+                optime_date = datetime.utcfromtimestamp(int(optime_at))
+                doc = {
+                    "_id": member.id,
+                    "name": member.name,
+                    "health": 1 if member.up else 0,
+                    "state": STATE_CODES.get(member.state, 0),
+                    "stateStr": member.state,
+                    "uptime": int(now - member.started_at) if member.up else 0,
+                    "optime": {"ts": Timestamp(int(optime_at), 1), "t": self.term} if member.up else {"ts": Timestamp(0, 0), "t": -1},
+                    "optimeDate": optime_date if member.up else EPOCH,
+                    "syncSourceHost": primaries[0].name if member.up and member.state == "SECONDARY" and primaries else "",
+                    "configVersion": 1,
+                    "configTerm": self.term
+                }
+                if member is responder:
+                    doc["self"] = True
+                else:
+                    doc["lastHeartbeat"] = datetime.utcfromtimestamp(now - 0.5 if member.up else member.stopped_at or now)
+                    doc["lastHeartbeatRecv"] = datetime.utcfromtimestamp(now - 0.7 if member.up else member.stopped_at or now)
+                    if member.up:
+                        doc["pingMs"] = member.ping_ms
+                if member.state == "PRIMARY" and member.election_date:
+                    doc["electionDate"] = datetime.utcfromtimestamp(int(member.election_date))
+                members.append(doc)
+            applied = sorted(
+                (now - m.lag_seconds for m in self.members if m.up and m.state in ("PRIMARY", "SECONDARY")),
+                reverse=True
+            )
+            if primaries and len(applied) >= self.majority:
+                self.committed_at = max(self.committed_at, applied[self.majority - 1])
+            applied_at = now - responder.lag_seconds if responder.up else self.committed_at
+            return {
+                "set": self.name,
+                "date": datetime.utcfromtimestamp(now),
+                "myState": STATE_CODES.get(responder.state, 0),
+                "term": self.term,
+                "majorityVoteCount": self.majority,
+                "writeMajorityCount": self.majority,
+                "optimes": {
+                    "lastCommittedOpTime": {"ts": Timestamp(int(self.committed_at), 1), "t": self.term},
+                    "lastCommittedWallTime": datetime.utcfromtimestamp(self.committed_at),
+                    "lastAppliedWallTime": datetime.utcfromtimestamp(applied_at)
+                },
+                "members": members,
+                "ok": 1.0
+            }
+
+    # ---------- Oplog и change streams ----------
+
+    def record(self, op: str, namespace: str, document: Dict[str, Any], key: Optional[Dict[str, Any]] = None):
+        ts = self.next_optime()
+        entry = {"ts": ts, "t": self.term, "op": op, "ns": namespace, "o": document,
+                 "wall": datetime.utcfromtimestamp(self.clock())}
+        if key is not None:
+            entry["o2"] = key
+        self.storage["local"]["oplog.rs"].insert_one(entry)
+        database, _, collection = namespace.partition('.')
+        event = {
+            "_id": {"_data": f"{ts.time:08x}{ts.inc:08x}"},
+            "operationType": {"i": "insert", "u": "update", "d": "delete"}[op],
+            "clusterTime": ts,
+            "ns": {"db": database, "coll": collection},
+            "documentKey": key or {"_id": document.get("_id")}
+        }
+        for stream in list(self.streams):
+            if stream.database in (None, database):
+                stream.events.put(event)
+
+
+class FakeChangeStream:
+    def __init__(self, replica_set: FakeReplicaSet, database: Optional[str], max_await_time_ms: Optional[int]):
+        self.replica_set = replica_set
+        self.database = database
+        self.max_await = (max_await_time_ms or 1000) / 1000
+        self.events: "queue.Queue[Dict[str, Any]]" = queue.Queue()
+        self.alive = True
+        replica_set.streams.append(self)
+
+    def try_next(self):
+        try:
+            return self.events.get(timeout=self.max_await)
+        except queue.Empty:
+            return None
+
+    def close(self):
+        self.alive = False
+        if self in self.replica_set.streams:
+            self.replica_set.streams.remove(self)
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        self.close()
+
+    def __iter__(self):
+        while self.alive:
+            event = self.try_next()
+            if event is not None:
+                yield event
+
+
+class FakeSession:
+    def __init__(self, replica_set: FakeReplicaSet):
+        self.replica_set = replica_set
+        self._operation_time: Optional[Timestamp] = None
+
+    @property
+    def operation_time(self) -> Timestamp:
+        return self.replica_set.last_optime
+
+    def advance_operation_time(self, operation_time: Timestamp):
+        self._operation_time = operation_time
+
+    def advance_cluster_time(self, cluster_time):
+        pass
+
+    def end_session(self):
+        pass
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        pass
+
+
+class FakeRawCursor:
+    """Курсор mongomock, отдающий документы байтами BSON, как при document_class=RawBSONDocument"""
+
+    def __init__(self, cursor):
+        self._cursor = cursor
+
+    def __getattr__(self, name):
+        attr = getattr(self._cursor, name)
+        if not callable(attr):
+            return attr
+
+        def chain(*args, **kwargs):
+            result = attr(*args, **kwargs)
+            return self if result is self._cursor else result
+        return chain
+
+    def __iter__(self):
+        return self
+
+    def __next__(self):
+        return RawBSONDocument(bson.encode(next(self._cursor)))
+
+
+class FakeCollection:
+    def __init__(self, replica_set: FakeReplicaSet, collection, raw: bool = False):
+        self._rs = replica_set
+        self._collection = collection
+        # mongomock не поддерживает свой document_class: сырые документы собираются здесь
+        self._raw = raw
+
+    @property
+    def name(self):
+        return self._collection.name
+
+    @property
+    def full_name(self):
+        return self._collection.full_name
+
+    def with_options(self, **kwargs):
+        codec_options = kwargs.get("codec_options")
+        raw = self._raw
+        if codec_options is not None and codec_options.document_class is RawBSONDocument:
+            raw = True
+            kwargs.pop("codec_options")
+        return FakeCollection(self._rs, self._collection.with_options(
+            **{k: v for k, v in kwargs.items() if k in ("write_concern", "codec_options")}
+        ), raw)
+
+    def __getattr__(self, name):
+        attr = getattr(self._collection, name)
+        if not callable(attr):
+            return attr
+
+        def call(*args, **kwargs):
+            kwargs.pop("session", None)
+            if not self._rs.reachable:
+                raise ServerSelectionTimeoutError("Fake replica set: нет доступных узлов")
+            if name in WRITE_METHODS:
+                return self._write(name, attr, *args, **kwargs)
+            result = attr(*args, **kwargs)
+            if self._raw and name == "find":
+                return FakeRawCursor(result)
+            if self._raw and name == "find_one" and result is not None:
+                return RawBSONDocument(bson.encode(result))
+            return result
+        return call
+
+    def _write(self, name, method, *args, **kwargs):
+        if not self._rs.writable:
+            raise NotPrimaryError("not primary")
+        op = WRITE_METHODS[name]
+        namespace = self._collection.full_name
+        if op == "d" or op == "u":
+            # Для oplog нужны _id затронутых документов до изменения
+            filter_ = args[0] if args else kwargs.get("filter", {})
+            multi = name.endswith("_many")
+            cursor = self._collection.find(filter_, {"_id": 1})
+            affected = [d["_id"] for d in (cursor if multi else cursor.limit(1))]
+        result = method(*args, **kwargs)
+        if name == "insert_one":
+            self._rs.record("i", namespace, args[0] if args else kwargs["document"])
+        elif name == "insert_many":
+            for document in (args[0] if args else kwargs["documents"]):
+                self._rs.record("i", namespace, document)
+        else:
+            for _id in affected:
+                self._rs.record(op, namespace, {"_id": _id}, key={"_id": _id} if op == "u" else None)
+        return result
+
+
+class FakeDatabase:
+    def __init__(self, replica_set: FakeReplicaSet, database):
+        self._rs = replica_set
+        self._database = database
+
+    @property
+    def name(self):
+        return self._database.name
+
+    def __getitem__(self, name: str) -> FakeCollection:
+        return FakeCollection(self._rs, self._database[name])
+
+    def __getattr__(self, name):
+        if name.startswith('_'):
+            raise AttributeError(name)
+        return getattr(self._database, name)
+
+    def get_collection(self, name: str, **kwargs) -> FakeCollection:
+        return self[name].with_options(**kwargs)
+
+    def command(self, command, value=None, **kwargs):
+        name = next(iter(command)) if isinstance(command, dict) else command
+        if name in ("ping", "hello", "isMaster", "ismaster"):
+            if not self._rs.reachable:
+                raise ServerSelectionTimeoutError("Fake replica set: нет доступных узлов")
+            return {"ok": 1.0, "isWritablePrimary": self._rs.writable, "setName": self._rs.name}
+        if name == "replSetGetStatus":
+            if not self._rs.reachable:
+                raise ServerSelectionTimeoutError("Fake replica set: нет доступных узлов")
+            return self._rs.status()
+        if name == "collStats":
+            collection = value if value is not None else command[name]
+            documents = list(self._database[collection].find())
+            size = sum(len(bson.encode(d)) for d in documents)
+            stats = {"ns": f"{self._database.name}.{collection}", "count": len(documents), "size": size,
+                     "avgObjSize": size // len(documents) if documents else 0, "storageSize": size, "ok": 1.0}
+            if self._database.name == "local" and collection == "oplog.rs":
+                stats.update(capped=True, maxSize=OPLOG_MAX_SIZE)
+            return stats
+        if isinstance(command, str):
+            command = {command: value if value is not None else 1}
+        try:
+            return self._database.command(command)
+        except NotImplementedError as e:
+            raise OperationFailure(f"Fake replica set: команда {name} не поддерживается ({e})")
+
+    def watch(self, pipeline=None, **kwargs):
+        return FakeChangeStream(self._rs, self._database.name, kwargs.get("max_await_time_ms"))
+
+
+class FakeMongoClient:
+    """Подмена MongoClient: тот же интерфейс, что используют сервисы"""
+
+    def __init__(self, replica_set: FakeReplicaSet, *args, **kwargs):
+        self._rs = replica_set
+
+    @property
+    def replica_set(self) -> FakeReplicaSet:
+        return self._rs
+
+    def __getitem__(self, name: str) -> FakeDatabase:
+        return FakeDatabase(self._rs, self._rs.storage[name])
+
+    def get_database(self, name: str, **kwargs) -> FakeDatabase:
+        return self[name]
+
+    @property
+    def admin(self) -> FakeDatabase:
+        return self["admin"]
+
+    def start_session(self, **kwargs) -> FakeSession:
+        return FakeSession(self._rs)
+
+    def watch(self, pipeline=None, **kwargs):
+        return FakeChangeStream(self._rs, None, kwargs.get("max_await_time_ms"))
+
+    def list_database_names(self):
+        return self._rs.storage.list_database_names()
+
+    def close(self):
+        pass
+
+
+_default_replica_set: Optional[FakeReplicaSet] = None
+_default_lock = threading.Lock()
+
+
+def default_replica_set() -> FakeReplicaSet:
+    """
+    Общий для процесса Replica Set; состав из FAKE_MONGO_MEMBERS,
+    сценарий - JSON-файл из FAKE_MONGO_SCENARIO
+    """
+    global _default_replica_set
+    with _default_lock:
+        if _default_replica_set is None:
+            members = os.getenv("FAKE_MONGO_MEMBERS", DEFAULT_MEMBERS).split(',')
+            replica_set = FakeReplicaSet(
+                members,
+                election_timeout=float(os.getenv("FAKE_MONGO_ELECTION_TIMEOUT", "5"))
+            )
+            scenario = os.getenv("FAKE_MONGO_SCENARIO")
+            if scenario:
+                with open(scenario, encoding='utf-8') as f:
+                    replica_set.load_script(json.load(f))
+            _default_replica_set = replica_set
+        return _default_replica_set
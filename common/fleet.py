@@ -0,0 +1,336 @@
+import heapq
+import json
+import logging
+import os
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+from datetime import datetime
+from typing import Any, Callable, Dict, List, Optional
+
+from fastapi import APIRouter, HTTPException
+
+from common.backend import create_client
+from common.cluster_view import ClusterView
+from common.responses import FastRoute
+from common.thresholds import thresholds
+
+logger = logging.getLogger(__name__)
+
+# JSON-реестр кластеров; без него флот состоит из одного кластера MONGO_URI
+FLEET_CONFIG = os.getenv("FLEET_CONFIG")
+FLEET_CLUSTER_NAME = os.getenv("FLEET_CLUSTER_NAME", "rs0")
+FLEET_WORKERS = int(os.getenv("FLEET_WORKERS", "16"))
+FLEET_POLL_INTERVAL_SECONDS = float(os.getenv("FLEET_POLL_INTERVAL_SECONDS", "10"))
+FLEET_TIMEOUT_MS = int(os.getenv("FLEET_TIMEOUT_MS", "5000"))
+# Недоступный кластер опрашивается реже: интервал растет до x8
+MAX_BACKOFF_MULTIPLIER = 8
+
+
+class ClusterConfig:
+    __slots__ = ('name', 'uri', 'interval_seconds', 'tags')
+
+    def __init__(self, name: str, uri: str, interval_seconds: float, tags: Optional[Dict[str, str]] = None):
+        self.name = name
+        self.uri = uri
+        self.interval_seconds = interval_seconds
+        self.tags = tags or {}
+
+
+class ClusterState:
+    __slots__ = ('config', 'view', 'digest', 'error', 'polled_at', 'checked_at', 'duration_ms',
+                 'failures', 'polls')
+
+    def __init__(self, config: ClusterConfig):
+        self.config = config
+        self.view: Optional[ClusterView] = None
+        self.digest: Optional[Dict[str, Any]] = None
+        self.error: Optional[str] = None
+        self.polled_at: Optional[str] = None
+        self.checked_at = float('-inf')
+        self.duration_ms: Optional[float] = None
+        self.failures = 0
+        self.polls = 0
+
+    @property
+    def backoff_multiplier(self) -> int:
+        return min(2 ** self.failures, MAX_BACKOFF_MULTIPLIER)
+
+    @property
+    def stale(self) -> bool:
+        # Три пропущенных опроса подряд - данные уже не отражают кластер
+        return time.monotonic() - self.checked_at > 3 * self.config.interval_seconds * self.backoff_multiplier
+
+    def to_dict(self) -> Dict[str, Any]:
+        status = "UNREACHABLE" if self.error else self.digest["status"] if self.digest else "PENDING"
+        # Сводка последнего успешного опроса недоступного кластера - отдельно, чтобы не выдать ее за текущую
+        digest = {"last_digest": self.digest} if self.error else self.digest or {}
+        return {
+            "cluster": self.config.name,
+            "tags": self.config.tags,
+            **digest,
+            "status": status,
+            "polled_at": self.polled_at,
+            "poll_duration_ms": self.duration_ms,
+            "consecutive_failures": self.failures,
+            "stale": self.stale if self.polls else False,
+            "error": self.error
+        }
+
+
+def load_registry(default_uri: str) -> List[ClusterConfig]:
+    """
+    Реестр из FLEET_CONFIG:
+    {"defaults": {"interval_seconds": 10}, "clusters": [{"name": "rs0", "uri": "mongodb://...", "tags": {...}}]}
+    """
+    if not FLEET_CONFIG:
+        return [ClusterConfig(FLEET_CLUSTER_NAME, default_uri, FLEET_POLL_INTERVAL_SECONDS)]
+    with open(FLEET_CONFIG, encoding='utf-8') as f:
+        data = json.load(f)
+    default_interval = data.get("defaults", {}).get("interval_seconds", FLEET_POLL_INTERVAL_SECONDS)
+    clusters = []
+    for entry in data["clusters"]:
+        clusters.append(ClusterConfig(
+            entry["name"], entry["uri"], float(entry.get("interval_seconds", default_interval)), entry.get("tags")
+        ))
+    names = [c.name for c in clusters]
+    if len(set(names)) != len(names):
+        raise ValueError("Имена кластеров в FLEET_CONFIG должны быть уникальны")
+    return clusters
+
+
+def cluster_digest(view: ClusterView) -> Dict[str, Any]:
+    """Короткая сводка одного кластера для сводки флота"""
+    rules = thresholds.current()
+    if view.primary_count == 1 and view.secondary_count >= 1 and view.healthy_count == view.total:
+        status = "EXCELLENT"
+    elif view.primary_count == 1 and view.healthy_count >= view.majority:
+        status = "GOOD"
+    elif view.primary_count == 1:
+        status = "DEGRADED"
+    else:
+        status = "CRITICAL"
+    return {
+        "replica_set": view.set_name,
+        "status": status,
+        "primary": view.primary.name if view.primary else None,
+        "primary_nodes": view.primary_count,
+        "secondary_nodes": view.secondary_count,
+        "healthy_nodes": view.healthy_count,
+        "total_nodes": view.total,
+        "max_lag_seconds": round(view.max_lag_seconds, 2),
+        "unhealthy": [m.name for m in view.unhealthy],
+        "lagging": [name for name, lag in view.secondary_lags.items() if rules.exceeds("fleet_lagging", lag)]
+    }
+
+
+class FleetMonitor:
+    """
+    Опрос многих Replica Set из одного процесса
+
+    У каждого кластера свое расписание; планировщик держит кучу сроков и
+    отдает созревшие опросы в пул из workers потоков. Кластер, чей прошлый
+    опрос еще идет, пропускает очередной срок, а не ставит второй в очередь.
+    """
+
+    def __init__(self, clusters: List[ClusterConfig], workers: int = FLEET_WORKERS,
+                 timeout_ms: int = FLEET_TIMEOUT_MS, client_factory: Callable = create_client):
+        self.clusters = {c.name: c for c in clusters}
+        self.states = {c.name: ClusterState(c) for c in clusters}
+        self.workers = workers
+        self.timeout_ms = timeout_ms
+        self.client_factory = client_factory
+        self.clients: Dict[str, Any] = {}
+        self.shared_clients: set = set()
+        self.in_flight: set = set()
+        self.skipped = 0
+        self._lock = threading.Lock()
+        self._stop = threading.Event()
+        self._wakeup = threading.Event()
+        self._pool: Optional[ThreadPoolExecutor] = None
+        self._thread: Optional[threading.Thread] = None
+
+    @classmethod
+    def from_env(cls, default_uri: str) -> "FleetMonitor":
+        return cls(load_registry(default_uri))
+
+    def start(self, default_client=None, default_uri: Optional[str] = None):
+        """default_client сервиса переиспользуется для кластера с тем же URI"""
+        for config in self.clusters.values():
+            if default_client is not None and config.uri == default_uri:
+                self.clients[config.name] = default_client
+                self.shared_clients.add(config.name)
+        self._pool = ThreadPoolExecutor(max_workers=self.workers, thread_name_prefix="fleet")
+        self._thread = threading.Thread(target=self._schedule, name="fleet-scheduler", daemon=True)
+        self._thread.start()
+        logger.info(f"🛰️ Мониторинг флота: {len(self.clusters)} кластеров, {self.workers} потоков")
+
+    def stop(self):
+        self._stop.set()
+        self._wakeup.set()
+        if self._pool:
+            self._pool.shutdown(wait=False, cancel_futures=True)
+        for name, client in self.clients.items():
+            if name in self.shared_clients:
+                continue
+            try:
+                client.close()
+            except Exception:
+                pass
+
+    def _client(self, config: ClusterConfig):
+        client = self.clients.get(config.name)
+        if client is None:
+            client = self.client_factory(
+                config.uri, serverSelectionTimeoutMS=self.timeout_ms, connectTimeoutMS=self.timeout_ms
+            )
+            self.clients[config.name] = client
+        return client
+
+    def _schedule(self):
+        # Первые опросы размазаны по интервалу, чтобы сотни кластеров не стартовали разом
+        now = time.monotonic()
+        count = max(1, len(self.clusters))
+        due = [(now + c.interval_seconds * i / count, i, c.name) for i, c in enumerate(self.clusters.values())]
+        heapq.heapify(due)
+        sequence = len(due)
+        while not self._stop.is_set():
+            if not due:
+                self._stop.wait(1)
+                continue
+            at, _, name = due[0]
+            delay = at - time.monotonic()
+            if delay > 0:
+                self._wakeup.wait(delay)
+                self._wakeup.clear()
+                continue
+            heapq.heappop(due)
+            config = self.clusters[name]
+            with self._lock:
+                busy = name in self.in_flight
+                if not busy:
+                    self.in_flight.add(name)
+            if busy:
+                self.skipped += 1
+            else:
+                try:
+                    self._pool.submit(self._poll, config)
+                except RuntimeError:
+                    # Пул уже остановлен
+                    return
+            sequence += 1
+            interval = config.interval_seconds * self.states[name].backoff_multiplier
+            heapq.heappush(due, (time.monotonic() + interval, sequence, name))
+
+    def _poll(self, config: ClusterConfig):
+        state = self.states[config.name]
+        started = time.perf_counter()
+        try:
+            view = ClusterView.fetch(self._client(config))
+            digest = cluster_digest(view)
+            state.view, state.digest, state.error = view, digest, None
+            state.failures = 0
+        except Exception as e:
+            if state.failures == 0:
+                logger.warning(f"⚠️ Кластер {config.name} недоступен: {e}")
+            state.error = str(e)
+            state.failures += 1
+        finally:
+            state.duration_ms = round((time.perf_counter() - started) * 1000, 2)
+            state.polled_at = str(datetime.now())
+            state.checked_at = time.monotonic()
+            state.polls += 1
+            with self._lock:
+                self.in_flight.discard(config.name)
+
+    def poll_now(self, name: str) -> ClusterState:
+        """Синхронный опрос вне расписания (например, для проверки после восстановления)"""
+        self._poll(self.clusters[name])
+        return self.states[name]
+
+    def summary(self) -> Dict[str, Any]:
+        by_status: Dict[str, int] = {}
+        no_primary, split_brain, stale = [], [], []
+        total_nodes = healthy_nodes = 0
+        worst_lag = (0.0, None)
+        for name, state in self.states.items():
+            entry = state.to_dict()
+            by_status[entry["status"]] = by_status.get(entry["status"], 0) + 1
+            if entry["stale"]:
+                stale.append(name)
+            if state.error or not state.digest:
+                continue
+            digest = state.digest
+            total_nodes += digest["total_nodes"]
+            healthy_nodes += digest["healthy_nodes"]
+            if digest["primary_nodes"] == 0:
+                no_primary.append(name)
+            elif digest["primary_nodes"] > 1:
+                split_brain.append(name)
+            if digest["max_lag_seconds"] > worst_lag[0]:
+                worst_lag = (digest["max_lag_seconds"], name)
+
+        if by_status.get("CRITICAL") or by_status.get("UNREACHABLE"):
+            fleet_status = "CRITICAL"
+        elif by_status.get("DEGRADED"):
+            fleet_status = "DEGRADED"
+        else:
+            fleet_status = "HEALTHY"
+        return {
+            "timestamp": str(datetime.now()),
+            "fleet_status": fleet_status,
+            "clusters_total": len(self.states),
+            "clusters_by_status": by_status,
+            "total_nodes": total_nodes,
+            "healthy_nodes": healthy_nodes,
+            "clusters_without_primary": no_primary,
+            "clusters_split_brain": split_brain,
+            "max_lag_seconds": worst_lag[0],
+            "max_lag_cluster": worst_lag[1],
+            "stale_clusters": stale,
+            "scheduler": {
+                "workers": self.workers,
+                "in_flight": len(self.in_flight),
+                "skipped_polls": self.skipped
+            }
+        }
+
+
+def fleet_router(fleet: FleetMonitor) -> APIRouter:
+    """Эндпоинты /fleet/* - одинаковые для всех сервисов мониторинга"""
+    router = APIRouter(route_class=FastRoute)
+
+    @router.get("/fleet/summary")
+    async def get_fleet_summary():
+        """Сводка по всем кластерам реестра"""
+        return fleet.summary()
+
+    @router.get("/fleet/clusters")
+    async def get_fleet_clusters(status: Optional[str] = None, tag: Optional[str] = None):
+        """Состояние каждого кластера; фильтр по статусу и тегу вида key=value"""
+        clusters = [state.to_dict() for state in fleet.states.values()]
+        if status:
+            clusters = [c for c in clusters if c["status"] == status.upper()]
+        if tag:
+            key, _, value = tag.partition('=')
+            clusters = [c for c in clusters if c["tags"].get(key) == value]
+        return {"timestamp": str(datetime.now()), "count": len(clusters), "clusters": clusters}
+
+    @router.get("/fleet/clusters/{name}")
+    async def get_fleet_cluster(name: str):
+        """Подробности одного кластера из последнего опроса"""
+        state = fleet.states.get(name)
+        if state is None:
+            raise HTTPException(status_code=404, detail=f"Кластер {name} не найден в реестре")
+        result = state.to_dict()
+        if state.view is not None:
+            result["last_members" if state.error else "members"] = [{
+                "name": m.name,
+                "state": m.state,
+                "health": "healthy" if m.healthy else "unhealthy",
+                "lag_seconds": round(m.lag_seconds, 2) if m.lag_seconds is not None else None,
+                "ping_ms": m.ping_ms
+            } for m in state.view.members]
+        return result
+
+    return router
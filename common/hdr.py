@@ -0,0 +1,87 @@
+from typing import Dict, Optional
+
+
+class HdrHistogram:
+    """
+    Гистограмма задержек с фиксированной относительной точностью (как HdrHistogram)
+
+    Значения хранятся в микросекундах. До 2^bits значения считаются точно,
+    выше - в логарифмических корзинах по 2^(bits-1) линейных подкорзин,
+    что дает погрешность не более 1/2^(bits-1) при любой величине.
+    """
+
+    def __init__(self, significant_bits: int = 7):
+        self.significant_bits = significant_bits
+        self.sub_bucket_count = 1 << significant_bits
+        self.half_count = self.sub_bucket_count >> 1
+        self.counts: Dict[int, int] = {}
+        self.total = 0
+        self.sum_us = 0
+        self.max_us = 0
+        self.min_us: Optional[int] = None
+
+    def _index(self, value_us: int) -> int:
+        if value_us < self.sub_bucket_count:
+            return value_us
+        shift = value_us.bit_length() - self.significant_bits
+        return self.sub_bucket_count + (shift - 1) * self.half_count + ((value_us >> shift) - self.half_count)
+
+    def _value(self, index: int) -> int:
+        """Верхняя граница корзины (как highestEquivalentValue в HdrHistogram)"""
+        if index < self.sub_bucket_count:
+            return index
+        shift = (index - self.sub_bucket_count) // self.half_count + 1
+        sub = (index - self.sub_bucket_count) % self.half_count + self.half_count
+        return ((sub + 1) << shift) - 1
+
+    def record(self, value_us: int):
+        value_us = max(0, int(value_us))
+        index = self._index(value_us)
+        self.counts[index] = self.counts.get(index, 0) + 1
+        self.total += 1
+        self.sum_us += value_us
+        self.max_us = max(self.max_us, value_us)
+        self.min_us = value_us if self.min_us is None else min(self.min_us, value_us)
+
+    def record_ms(self, value_ms: float):
+        self.record(value_ms * 1000)
+
+    def merge(self, other: "HdrHistogram"):
+        for index, count in other.counts.items():
+            self.counts[index] = self.counts.get(index, 0) + count
+        self.total += other.total
+        self.sum_us += other.sum_us
+        self.max_us = max(self.max_us, other.max_us)
+        if other.min_us is not None:
+            self.min_us = other.min_us if self.min_us is None else min(self.min_us, other.min_us)
+
+    def percentile_us(self, p: float) -> Optional[int]:
+        if self.total == 0:
+            return None
+        target = max(1, int(round(p / 100 * self.total)))
+        seen = 0
+        for index in sorted(self.counts):
+            seen += self.counts[index]
+            if seen >= target:
+                return min(self._value(index), self.max_us)
+        return self.max_us
+
+    def percentile_ms(self, p: float) -> Optional[float]:
+        value_us = self.percentile_us(p)
+        return round(value_us / 1000, 3) if value_us is not None else None
+
+    def to_dict(self) -> Dict:
+        if self.total == 0:
+            return {"samples": 0}
+        ms = lambda us: round(us / 1000, 3)
+        return {
+            "samples": self.total,
+            "min_ms": ms(self.min_us),
+            "mean_ms": ms(self.sum_us / self.total),
+            "p50_ms": ms(self.percentile_us(50)),
+            "p90_ms": ms(self.percentile_us(90)),
+            "p95_ms": ms(self.percentile_us(95)),
+            "p99_ms": ms(self.percentile_us(99)),
+            "p999_ms": ms(self.percentile_us(99.9)),
+            "max_ms": ms(self.max_us)
+        }
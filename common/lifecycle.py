@@ -0,0 +1,183 @@
+"""
+Подключение к MongoDB в фоне и пробы /livez, /readyz
+
+startup сервиса не ждет ping: MongoClient создается сразу (pymongo подключается
+лениво), а фоновый поток пингует кластер с экспоненциальной паузой от
+MONGO_CONNECT_BACKOFF_SECONDS до MONGO_CONNECT_BACKOFF_MAX_SECONDS. После первого
+успешного ping выполняются отложенные шаги запуска (on_ready), затем подключение
+перепроверяется раз в MONGO_READY_CHECK_SECONDS. /livez не обращается к MongoDB,
+/readyz отдает закэшированное состояние подключения и breaker-а сервиса.
+"""
+import logging
+import os
+import random
+import threading
+import time
+from typing import Any, Callable, Dict, List, Optional
+
+import pymongo
+from fastapi import APIRouter, HTTPException
+
+from common.mongo_guard import OPEN, MongoGuard
+from common.responses import FastRoute
+
+logger = logging.getLogger(__name__)
+
+
+def _process_age() -> float:
+    """Сколько секунд назад запущен процесс (Linux /proc); иначе 0 - отсчет от импорта модуля"""
+    try:
+        with open("/proc/self/stat") as f:
+            started_ticks = int(f.read().rsplit(")", 1)[1].split()[19])
+        with open("/proc/uptime") as f:
+            uptime = float(f.read().split()[0])
+        return max(0.0, uptime - started_ticks / os.sysconf("SC_CLK_TCK"))
+    except (OSError, ValueError, IndexError):
+        return 0.0
+
+
+# Отсчет холодного старта - момент запуска процесса, включая импорт FastAPI и pymongo
+PROCESS_STARTED = time.monotonic() - _process_age()
+
+MONGO_CONNECT_BACKOFF_SECONDS = float(os.getenv("MONGO_CONNECT_BACKOFF_SECONDS", "0.5"))
+MONGO_CONNECT_BACKOFF_MAX_SECONDS = float(os.getenv("MONGO_CONNECT_BACKOFF_MAX_SECONDS", "30"))
+MONGO_READY_CHECK_SECONDS = float(os.getenv("MONGO_READY_CHECK_SECONDS", "10"))
+MONGO_PING_TIMEOUT_SECONDS = float(os.getenv("MONGO_PING_TIMEOUT_SECONDS", "2"))
+# Цель по времени от запуска процесса до готовности принимать запросы (/livez)
+COLD_START_TARGET_SECONDS = float(os.getenv("COLD_START_TARGET_SECONDS", "2"))
+
+CONNECTING = "connecting"
+READY = "ready"
+UNAVAILABLE = "unavailable"
+
+
+class MongoConnection:
+    """Фоновое подключение к MongoDB с повторами и закэшированное состояние для /readyz"""
+
+    def __init__(self, name: str, guard: Optional[MongoGuard] = None,
+                 backoff_seconds: float = MONGO_CONNECT_BACKOFF_SECONDS,
+                 backoff_max_seconds: float = MONGO_CONNECT_BACKOFF_MAX_SECONDS,
+                 check_seconds: float = MONGO_READY_CHECK_SECONDS,
+                 ping_timeout_seconds: float = MONGO_PING_TIMEOUT_SECONDS):
+        self.name = name
+        self.guard = guard
+        self.backoff_seconds = backoff_seconds
+        self.backoff_max_seconds = backoff_max_seconds
+        self.check_seconds = check_seconds
+        self.ping_timeout_seconds = ping_timeout_seconds
+        self.state = CONNECTING
+        self.attempts = 0
+        self.last_error: Optional[str] = None
+        self.checked_at: Optional[float] = None
+        self.next_attempt_at: Optional[float] = None
+        self.started_seconds: Optional[float] = None
+        self.ready_seconds: Optional[float] = None
+        self._steps: List[Callable[[], Any]] = []
+        self._stop = threading.Event()
+        self._thread: Optional[threading.Thread] = None
+
+    def on_ready(self, step: Callable[[], Any]) -> Callable[[], Any]:
+        """Шаг запуска, которому нужна MongoDB; выполняется один раз после первого успешного ping"""
+        self._steps.append(step)
+        return step
+
+    def start(self, client_fn: Callable[[], Any]):
+        self.started_seconds = time.monotonic() - PROCESS_STARTED
+        if self.started_seconds > COLD_START_TARGET_SECONDS:
+            logger.warning(f"🐢 {self.name}: запуск {self.started_seconds:.2f}s дольше цели "
+                           f"{COLD_START_TARGET_SECONDS:.2f}s")
+        else:
+            logger.info(f"🚀 {self.name}: запуск за {self.started_seconds:.2f}s, подключение к MongoDB в фоне")
+        self._stop.clear()
+        self._thread = threading.Thread(
+            target=self._run, args=(client_fn,), name=f"{self.name}-connect", daemon=True
+        )
+        self._thread.start()
+
+    def stop(self):
+        self._stop.set()
+
+    def _check(self, client):
+        if client is None:
+            raise RuntimeError("клиент MongoDB не создан")
+        with pymongo.timeout(self.ping_timeout_seconds):
+            client.admin.command('ping')
+        while self._steps:
+            self._steps[0]()
+            self._steps.pop(0)
+
+    def _run(self, client_fn: Callable[[], Any]):
+        delay = self.backoff_seconds
+        while not self._stop.is_set():
+            self.attempts += 1
+            try:
+                self._check(client_fn())
+            except Exception as e:
+                self.state = UNAVAILABLE if self.ready_seconds is not None else CONNECTING
+                self.last_error = str(e)
+                # Небольшой разброс, чтобы реплики сервиса не шли в кластер одновременно
+                wait = delay * random.uniform(0.8, 1.2)
+                logger.warning(f"⏳ {self.name}: MongoDB недоступна ({e}), повтор через {wait:.1f}s")
+                delay = min(delay * 2, self.backoff_max_seconds)
+            else:
+                if self.state != READY:
+                    logger.info(f"✅ {self.name}: Подключено к MongoDB (попытка {self.attempts})")
+                if self.ready_seconds is None:
+                    self.ready_seconds = time.monotonic() - PROCESS_STARTED
+                self.state = READY
+                self.last_error = None
+                wait = self.check_seconds
+                delay = self.backoff_seconds
+            self.checked_at = time.monotonic()
+            self.next_attempt_at = self.checked_at + wait
+            self._stop.wait(wait)
+
+    @property
+    def ready(self) -> bool:
+        if self.state != READY or self.checked_at is None:
+            return False
+        # Проверка не обновлялась три интервала - поток подключения завис
+        if time.monotonic() - self.checked_at > 3 * self.check_seconds + self.ping_timeout_seconds:
+            return False
+        return self.guard is None or self.guard.breaker.state != OPEN
+
+    def to_dict(self) -> Dict[str, Any]:
+        now = time.monotonic()
+        return {
+            "status": "ready" if self.ready else "not_ready",
+            "connection": self.state,
+            "breaker": self.guard.breaker.state if self.guard else None,
+            "attempts": self.attempts,
+            "last_error": self.last_error,
+            "checked_seconds_ago": round(now - self.checked_at, 1) if self.checked_at is not None else None,
+            "next_attempt_in_seconds": round(max(0.0, self.next_attempt_at - now), 1)
+            if self.next_attempt_at is not None else None,
+            "pending_startup_steps": [getattr(step, "__name__", repr(step)) for step in self._steps],
+            "startup_seconds": round(self.started_seconds, 3) if self.started_seconds is not None else None,
+            "ready_seconds": round(self.ready_seconds, 3) if self.ready_seconds is not None else None,
+            "cold_start_target_seconds": COLD_START_TARGET_SECONDS
+        }
+
+
+def lifecycle_router(connection: MongoConnection) -> APIRouter:
+    """Пробы для оркестратора: /livez без MongoDB, /readyz по закэшированному состоянию"""
+    router = APIRouter(route_class=FastRoute)
+
+    @router.get("/livez")
+    async def livez():
+        """Процесс жив и обслуживает запросы; MongoDB не проверяется"""
+        return {
+            "status": "alive",
+            "service": connection.name,
+            "uptime_seconds": round(time.monotonic() - PROCESS_STARTED, 1)
+        }
+
+    @router.get("/readyz")
+    async def readyz():
+        """Готовность принимать трафик: MongoDB отвечала на последний ping и breaker не разомкнут"""
+        status = connection.to_dict()
+        if not connection.ready:
+            raise HTTPException(status_code=503, detail=status)
+        return status
+
+    return router
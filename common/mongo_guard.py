@@ -0,0 +1,182 @@
+"""
+Защита вызовов MongoDB на пути запроса: дедлайн операций и circuit breaker
+
+Операции обработчика выполняются внутри pymongo.timeout (client-side timeoutMS):
+выбор сервера, ожидание соединения и сама команда укладываются в дедлайн эндпоинта
+вместо 30 секунд serverSelectionTimeoutMS по умолчанию. После MONGO_BREAKER_FAILURES
+подряд отказов из-за недоступности кластера breaker размыкается: запросы сразу
+получают последний успешный ответ с пометкой stale или 503, а раз в
+MONGO_BREAKER_RESET_SECONDS один пробный запрос проверяет, вернулся ли кластер.
+"""
+import logging
+import os
+import threading
+import time
+from collections import OrderedDict
+from contextlib import contextmanager
+from typing import Any, Dict, Optional, Tuple
+
+import pymongo
+from pymongo.errors import ConnectionFailure, ExecutionTimeout
+
+logger = logging.getLogger(__name__)
+
+MONGO_DEADLINE_SECONDS = float(os.getenv("MONGO_DEADLINE_SECONDS", "5"))
+MONGO_BREAKER_FAILURES = int(os.getenv("MONGO_BREAKER_FAILURES", "3"))
+MONGO_BREAKER_RESET_SECONDS = float(os.getenv("MONGO_BREAKER_RESET_SECONDS", "10"))
+# Последние успешные ответы старше этого не отдаются даже с пометкой stale
+MONGO_STALE_MAX_SECONDS = float(os.getenv("MONGO_STALE_MAX_SECONDS", "600"))
+MONGO_STALE_MAX_ENTRIES = int(os.getenv("MONGO_STALE_MAX_ENTRIES", "256"))
+
+CLOSED = "closed"
+OPEN = "open"
+HALF_OPEN = "half_open"
+
+
+class CircuitOpenError(Exception):
+    """Breaker разомкнут: вызов MongoDB не выполнялся"""
+
+    def __init__(self, name: str, retry_after: float, last_error: Optional[str]):
+        self.retry_after = retry_after
+        super().__init__(f"MongoDB недоступна ({name}: {last_error}), повтор через {retry_after:.0f}s")
+
+
+def is_unavailable(error: BaseException) -> bool:
+    """
+    Отказ из-за недоступности кластера: нет сервера, сеть, истек дедлайн
+
+    Обработчики оборачивают ошибки в HTTPException, поэтому просматривается
+    вся цепочка __cause__/__context__. Ошибки самой команды (OperationFailure,
+    write concern timeout) говорят о том, что кластер отвечает, и не считаются.
+    """
+    seen = set()
+    while error is not None and id(error) not in seen:
+        if isinstance(error, (ConnectionFailure, ExecutionTimeout)):
+            return True
+        seen.add(id(error))
+        error = error.__cause__ or error.__context__
+    return False
+
+
+class CircuitBreaker:
+    """closed -> open после failures отказов подряд -> half_open через reset_seconds -> closed или open"""
+
+    def __init__(self, name: str, failures: int = MONGO_BREAKER_FAILURES,
+                 reset_seconds: float = MONGO_BREAKER_RESET_SECONDS):
+        self.name = name
+        self.failures = failures
+        self.reset_seconds = reset_seconds
+        self.state = CLOSED
+        self.consecutive_failures = 0
+        self.opened_at = float('-inf')
+        self.last_error: Optional[str] = None
+        self.rejected = 0
+        self.trips = 0
+        self._probe_in_flight = False
+        self._lock = threading.Lock()
+
+    def retry_after(self) -> float:
+        return max(0.0, self.opened_at + self.reset_seconds - time.monotonic())
+
+    def allow(self) -> bool:
+        """Можно ли идти в MongoDB; в half_open пропускается один пробный вызов"""
+        with self._lock:
+            if self.state == CLOSED:
+                return True
+            if self.state == OPEN and self.retry_after() <= 0:
+                self.state = HALF_OPEN
+            if self.state == HALF_OPEN and not self._probe_in_flight:
+                self._probe_in_flight = True
+                return True
+            self.rejected += 1
+            return False
+
+    def record_success(self):
+        with self._lock:
+            if self.state != CLOSED:
+                logger.info(f"🟢 MongoDB снова доступна ({self.name}), breaker замкнут")
+            self.state = CLOSED
+            self.consecutive_failures = 0
+            self._probe_in_flight = False
+
+    def record_failure(self, error: BaseException):
+        with self._lock:
+            self.consecutive_failures += 1
+            self.last_error = str(error)
+            self._probe_in_flight = False
+            if self.state == HALF_OPEN or (self.state == CLOSED and self.consecutive_failures >= self.failures):
+                self.state = OPEN
+                self.opened_at = time.monotonic()
+                self.trips += 1
+                logger.error(f"🔴 Breaker MongoDB разомкнут ({self.name}) после {self.consecutive_failures} "
+                             f"отказов: {self.last_error}")
+
+    def to_dict(self) -> Dict[str, Any]:
+        return {
+            "state": self.state,
+            "consecutive_failures": self.consecutive_failures,
+            "failure_threshold": self.failures,
+            "retry_after_seconds": round(self.retry_after(), 1) if self.state == OPEN else None,
+            "last_error": self.last_error,
+            "rejected_calls": self.rejected,
+            "trips": self.trips
+        }
+
+
+class MongoGuard:
+    """Дедлайн, breaker и последние успешные ответы эндпоинтов одного сервиса"""
+
+    def __init__(self, name: str, deadline_seconds: float = MONGO_DEADLINE_SECONDS,
+                 breaker: Optional[CircuitBreaker] = None, stale_max_seconds: float = MONGO_STALE_MAX_SECONDS,
+                 stale_max_entries: int = MONGO_STALE_MAX_ENTRIES):
+        self.name = name
+        self.deadline_seconds = deadline_seconds
+        self.breaker = breaker or CircuitBreaker(name)
+        self.stale_max_seconds = stale_max_seconds
+        self.stale_max_entries = stale_max_entries
+        self._last_good: "OrderedDict[str, Tuple[Any, float]]" = OrderedDict()
+        self._lock = threading.Lock()
+        self.stale_served = 0
+
+    @contextmanager
+    def deadline(self, seconds: Optional[float] = None):
+        """Операции MongoDB внутри блока - не дольше seconds; при разомкнутом breaker - CircuitOpenError"""
+        if not self.breaker.allow():
+            raise CircuitOpenError(self.name, self.breaker.retry_after(), self.breaker.last_error)
+        try:
+            with pymongo.timeout(seconds or self.deadline_seconds):
+                yield
+        except BaseException as e:
+            if is_unavailable(e):
+                self.breaker.record_failure(e)
+            else:
+                self.breaker.record_success()
+            raise
+        self.breaker.record_success()
+
+    def remember(self, key: str, content: Any):
+        with self._lock:
+            self._last_good[key] = (content, time.monotonic())
+            self._last_good.move_to_end(key)
+            while len(self._last_good) > self.stale_max_entries:
+                self._last_good.popitem(last=False)
+
+    def last_good(self, key: str) -> Optional[Tuple[Any, float]]:
+        """(последний успешный ответ, его возраст в секундах) или None"""
+        with self._lock:
+            entry = self._last_good.get(key)
+        if entry is None:
+            return None
+        age = time.monotonic() - entry[1]
+        if age > self.stale_max_seconds:
+            return None
+        self.stale_served += 1
+        return entry[0], age
+
+    def to_dict(self) -> Dict[str, Any]:
+        return {
+            "deadline_seconds": self.deadline_seconds,
+            "breaker": self.breaker.to_dict(),
+            "stale_entries": len(self._last_good),
+            "stale_served": self.stale_served
+        }
@@ -0,0 +1,360 @@
+"""
+Общие ответы HTTP API сервисов
+
+FastRoute отдает результат обработчика через FastResponse, минуя jsonable_encoder:
+тело сериализуется orjson (datetime, ObjectId и Timestamp - без предварительного
+обхода словаря), по заголовку Accept - в msgpack, а тела от RESPONSE_COMPRESS_MIN_BYTES
+сжимаются brotli или gzip по Accept-Encoding. Обработчики, помеченные versioned(),
+получают ETag по версии данных, 304 на If-None-Match и ожидание ?wait_for_change,
+а помеченные guarded() - дедлайн операций MongoDB и circuit breaker (common/mongo_guard.py).
+"""
+import asyncio
+import functools
+import gzip
+import inspect
+import logging
+import math
+import os
+import re
+import time
+from datetime import date, datetime
+from typing import Any, Callable, Dict, Optional
+
+import orjson
+from bson import ObjectId
+from bson.decimal128 import Decimal128
+from bson.timestamp import Timestamp
+from fastapi import HTTPException, Request
+from fastapi.encoders import jsonable_encoder
+from fastapi.routing import APIRoute
+from starlette.concurrency import run_in_threadpool
+from starlette.responses import Response
+
+from common.mongo_guard import CLOSED, CircuitOpenError, MongoGuard, is_unavailable
+
+try:
+    import brotli
+except ImportError:
+    brotli = None
+
+try:
+    import msgpack
+except ImportError:
+    msgpack = None
+
+# Тела меньше порога не сжимаются: выигрыш в байтах меньше затрат на сжатие
+RESPONSE_COMPRESS_MIN_BYTES = int(os.getenv("RESPONSE_COMPRESS_MIN_BYTES", "1024"))
+RESPONSE_GZIP_LEVEL = int(os.getenv("RESPONSE_GZIP_LEVEL", "6"))
+RESPONSE_BROTLI_QUALITY = int(os.getenv("RESPONSE_BROTLI_QUALITY", "4"))
+# Предел ожидания ?wait_for_change и шаг, с которым во время ожидания перечитывается версия
+RESPONSE_LONG_POLL_MAX_SECONDS = float(os.getenv("RESPONSE_LONG_POLL_MAX_SECONDS", "60"))
+RESPONSE_LONG_POLL_INTERVAL_SECONDS = float(os.getenv("RESPONSE_LONG_POLL_INTERVAL_SECONDS", "1"))
+
+logger = logging.getLogger(__name__)
+
+JSON_MEDIA_TYPE = "application/json"
+MSGPACK_MEDIA_TYPES = ("application/msgpack", "application/x-msgpack")
+
+
+def _default(value: Any) -> Any:
+    if isinstance(value, (ObjectId, Decimal128)):
+        return str(value)
+    if isinstance(value, Timestamp):
+        return {"t": value.time, "i": value.inc}
+    # Остальное (pydantic, Enum, set, Decimal, ...) - как у FastAPI по умолчанию
+    return jsonable_encoder(value)
+
+
+def _msgpack_default(value: Any) -> Any:
+    if isinstance(value, (datetime, date)):
+        return value.isoformat()
+    return _default(value)
+
+
+def dumps_json(content: Any) -> bytes:
+    return orjson.dumps(content, default=_default, option=orjson.OPT_NON_STR_KEYS)
+
+
+def dumps_msgpack(content: Any) -> bytes:
+    return msgpack.packb(content, default=_msgpack_default, use_bin_type=True)
+
+
+def _qualities(header: str) -> Dict[str, float]:
+    """Значения заголовка Accept/Accept-Encoding с весами q"""
+    result = {}
+    for item in header.split(","):
+        token, _, params = item.strip().partition(";")
+        if not token:
+            continue
+        q = 1.0
+        for param in params.split(";"):
+            key, _, value = param.strip().partition("=")
+            if key == "q":
+                try:
+                    q = float(value)
+                except ValueError:
+                    q = 0.0
+        result[token.strip().lower()] = q
+    return result
+
+
+def choose_encoding(accept_encoding: str) -> Optional[str]:
+    """br или gzip, которые клиент принимает (q > 0) и которые доступны; None - без сжатия"""
+    accepted = _qualities(accept_encoding)
+    wildcard = accepted.get("*", 0.0)
+    for encoding in ("br", "gzip"):
+        if encoding == "br" and brotli is None:
+            continue
+        if accepted.get(encoding, wildcard) > 0:
+            return encoding
+    return None
+
+
+def wants_msgpack(accept: str) -> bool:
+    if msgpack is None:
+        return False
+    accepted = _qualities(accept)
+    return any(accepted.get(media_type, 0.0) > 0 for media_type in MSGPACK_MEDIA_TYPES)
+
+
+def compress(body: bytes, encoding: str) -> bytes:
+    if encoding == "br":
+        return brotli.compress(body, quality=RESPONSE_BROTLI_QUALITY)
+    return gzip.compress(body, compresslevel=RESPONSE_GZIP_LEVEL, mtime=0)
+
+
+class FastResponse(Response):
+    """
+    JSON ответ через orjson; формат и сжатие выбираются по заголовкам запроса при отправке
+
+    content хранится до отправки: msgpack строится из него, а не из готового JSON.
+    """
+
+    media_type = JSON_MEDIA_TYPE
+
+    def __init__(self, content: Any, status_code: int = 200, headers: Optional[Dict[str, str]] = None,
+                 media_type: Optional[str] = None, background=None):
+        self.content = content
+        super().__init__(content, status_code, headers, media_type, background)
+
+    def render(self, content: Any) -> bytes:
+        return dumps_json(content)
+
+    async def __call__(self, scope, receive, send):
+        request_headers = {key.decode("latin-1"): value.decode("latin-1") for key, value in scope.get("headers", [])}
+        body = self.body
+        if wants_msgpack(request_headers.get("accept", "")):
+            body = dumps_msgpack(self.content)
+            self.headers["content-type"] = MSGPACK_MEDIA_TYPES[0]
+        if len(body) >= RESPONSE_COMPRESS_MIN_BYTES and "content-encoding" not in self.headers:
+            encoding = choose_encoding(request_headers.get("accept-encoding", ""))
+            if encoding is not None:
+                body = compress(body, encoding)
+                self.headers["content-encoding"] = encoding
+        if body is not self.body:
+            self.body = body
+            self.headers["content-length"] = str(len(body))
+        self.headers["vary"] = "Accept, Accept-Encoding"
+        await super().__call__(scope, receive, send)
+
+
+_DURATION = re.compile(r"^\s*(\d+(?:\.\d+)?)\s*(ms|s|m)?\s*$")
+_DURATION_UNITS = {"ms": 0.001, "s": 1.0, "m": 60.0, None: 1.0}
+
+
+def parse_duration(value: str) -> float:
+    """Длительность вида 30s, 500ms, 1m или просто секунды"""
+    match = _DURATION.match(value)
+    if match is None:
+        raise ValueError(f"Некорректная длительность: {value}")
+    return float(match.group(1)) * _DURATION_UNITS[match.group(2)]
+
+
+def _etag(version: str) -> str:
+    # Слабый ETag: тело с тем же состоянием топологии может отличаться меткой времени или uptime
+    return f'W/"{version}"'
+
+
+def _matches(if_none_match: Optional[str], version: str) -> bool:
+    if not if_none_match:
+        return False
+    tags = {tag.strip() for tag in if_none_match.split(",")}
+    return "*" in tags or _etag(version) in tags or f'"{version}"' in tags
+
+
+def _version_headers(version: str) -> Dict[str, str]:
+    return {"etag": _etag(version), "cache-control": "no-cache", "vary": "Accept, Accept-Encoding"}
+
+
+def versioned(version: Callable[[], Optional[str]]):
+    """
+    Условный GET для обработчика: ETag по version(), 304 на If-None-Match и ?wait_for_change=30s
+
+    Ставится под @app.get и только помечает обработчик: FastRoute добавляет маршруту
+    Request и wait_for_change, а сама функция остается прежней для прямых вызовов.
+    version() вызывается до построения ответа, поэтому ETag никогда не новее тела;
+    None или исключение - версии нет, ответ строится как обычно.
+    """
+    def mark(endpoint: Callable) -> Callable:
+        endpoint.__response_version__ = version
+        return endpoint
+    return mark
+
+
+def guarded(guard: MongoGuard, seconds: Optional[float] = None, stale: bool = True):
+    """
+    Дедлайн и circuit breaker для обработчика, который ходит в MongoDB
+
+    seconds - дедлайн операций эндпоинта (None - guard.deadline_seconds). stale=True:
+    последний успешный ответ запоминается и отдается с пометкой stale, пока кластер
+    недоступен; без него разомкнутый breaker дает 503 с Retry-After. Как и versioned(),
+    только помечает обработчик.
+    """
+    def mark(endpoint: Callable) -> Callable:
+        endpoint.__mongo_guard__ = (guard, seconds, stale)
+        return endpoint
+    return mark
+
+
+def _guarded_endpoint(endpoint: Callable, guard: MongoGuard, seconds: Optional[float], stale: bool) -> Callable:
+    name = f"{endpoint.__module__}.{endpoint.__qualname__}"
+
+    def fallback(error: Exception, key: Optional[str]) -> Response:
+        unavailable = isinstance(error, CircuitOpenError) or (is_unavailable(error) and guard.breaker.state != CLOSED)
+        last = guard.last_good(key) if key is not None and unavailable else None
+        if last is not None:
+            content, age = last
+            if isinstance(content, dict):
+                content = {**content, "stale": True, "stale_age_seconds": round(age, 1), "stale_reason": str(error)}
+            return FastResponse(content, headers={"warning": '110 - "Response is Stale"'})
+        if isinstance(error, CircuitOpenError):
+            raise HTTPException(status_code=503, detail=str(error),
+                                headers={"Retry-After": str(math.ceil(error.retry_after))})
+        raise error
+
+    def key_of(kwargs: Dict[str, Any]) -> Optional[str]:
+        return f"{name}:{sorted(kwargs.items())!r}" if stale else None
+
+    if inspect.iscoroutinefunction(endpoint):
+        @functools.wraps(endpoint)
+        async def wrapped(*args, **kwargs):
+            try:
+                with guard.deadline(seconds):
+                    content = await endpoint(*args, **kwargs)
+            except Exception as e:
+                return fallback(e, key_of(kwargs))
+            if stale:
+                guard.remember(key_of(kwargs), content)
+            return content
+    else:
+        @functools.wraps(endpoint)
+        def wrapped(*args, **kwargs):
+            try:
+                with guard.deadline(seconds):
+                    content = endpoint(*args, **kwargs)
+            except Exception as e:
+                return fallback(e, key_of(kwargs))
+            if stale:
+                guard.remember(key_of(kwargs), content)
+            return content
+    return wrapped
+
+
+def _guarded_version(version: Callable[[], Optional[str]], guard: MongoGuard) -> Callable[[], Optional[str]]:
+    def guarded_version() -> Optional[str]:
+        # Разомкнутый breaker - версии нет, ответ решит сам обработчик (stale или 503)
+        with guard.deadline():
+            return version()
+    return guarded_version
+
+
+async def _current_version(version: Callable[[], Optional[str]]) -> Optional[str]:
+    try:
+        return await run_in_threadpool(version)
+    except Exception as e:
+        logger.debug(f"Версия ответа недоступна: {e}")
+        return None
+
+
+def _versioned_endpoint(endpoint: Callable, version: Callable[[], Optional[str]],
+                        respond: Callable[[Any], Response]) -> Callable:
+    @functools.wraps(endpoint)
+    async def wrapped(*args, _request: Request, wait_for_change: Optional[str] = None, **kwargs):
+        if_none_match = _request.headers.get("if-none-match")
+        current = await _current_version(version)
+        if wait_for_change and current is not None and _matches(if_none_match, current):
+            try:
+                wait = min(parse_duration(wait_for_change), RESPONSE_LONG_POLL_MAX_SECONDS)
+            except ValueError as e:
+                raise HTTPException(status_code=422, detail=str(e))
+            # Долгий опрос: держать запрос, пока версия не сменится или не выйдет время
+            deadline = time.monotonic() + wait
+            while current is not None and _matches(if_none_match, current):
+                remaining = deadline - time.monotonic()
+                if remaining <= 0:
+                    break
+                await asyncio.sleep(min(RESPONSE_LONG_POLL_INTERVAL_SECONDS, remaining))
+                current = await _current_version(version)
+        if current is not None and _matches(if_none_match, current):
+            return Response(status_code=304, headers=_version_headers(current))
+
+        if inspect.iscoroutinefunction(endpoint):
+            content = await endpoint(*args, **kwargs)
+        else:
+            content = await run_in_threadpool(endpoint, *args, **kwargs)
+        response = respond(content)
+        if current is not None and response.status_code == 200 and "warning" not in response.headers:
+            response.headers.update(_version_headers(current))
+        return response
+
+    signature = inspect.signature(endpoint)
+    wrapped.__signature__ = signature.replace(parameters=[
+        *signature.parameters.values(),
+        inspect.Parameter("_request", inspect.Parameter.KEYWORD_ONLY, annotation=Request),
+        inspect.Parameter("wait_for_change", inspect.Parameter.KEYWORD_ONLY, default=None,
+                          annotation=Optional[str]),
+    ])
+    return wrapped
+
+
+def _fast_endpoint(endpoint: Callable, status_code: Optional[int]) -> Callable:
+    # Ответ-объект FastAPI отдает как есть, поэтому jsonable_encoder не вызывается
+    if getattr(endpoint, "__fast_response__", False):
+        return endpoint
+
+    def respond(content: Any) -> Any:
+        if isinstance(content, Response):
+            return content
+        return FastResponse(content, status_code or 200)
+
+    call = endpoint
+    guard = getattr(endpoint, "__mongo_guard__", None)
+    if guard is not None:
+        call = _guarded_endpoint(endpoint, *guard)
+    version = getattr(endpoint, "__response_version__", None)
+    if version is not None:
+        if guard is not None:
+            version = _guarded_version(version, guard[0])
+        wrapped = _versioned_endpoint(call, version, respond)
+    elif inspect.iscoroutinefunction(call):
+        @functools.wraps(endpoint)
+        async def wrapped(*args, **kwargs):
+            return respond(await call(*args, **kwargs))
+    else:
+        @functools.wraps(endpoint)
+        def wrapped(*args, **kwargs):
+            return respond(call(*args, **kwargs))
+    wrapped.__fast_response__ = True
+    return wrapped
+
+
+class FastRoute(APIRoute):
+    """
+    Маршрут с FastResponse для результатов обработчиков
+
+    Подключение: app.router.route_class = FastRoute сразу после создания приложения
+    и APIRouter(route_class=FastRoute) для общих роутеров.
+    """
+
+    def __init__(self, path: str, endpoint: Callable[..., Any], **kwargs: Any):
+        super().__init__(path, _fast_endpoint(endpoint, kwargs.get("status_code")), **kwargs)
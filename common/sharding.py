@@ -0,0 +1,167 @@
+import logging
+import os
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+from typing import Any, Callable, Dict, List, Optional, Tuple
+from urllib.parse import parse_qsl, urlencode
+
+from common.backend import create_client
+from common.cluster_view import ClusterView
+
+logger = logging.getLogger(__name__)
+
+SHARD_DISCOVERY_SECONDS = float(os.getenv("SHARD_DISCOVERY_SECONDS", "60"))
+SHARD_FANOUT_WORKERS = int(os.getenv("SHARD_FANOUT_WORKERS", "8"))
+SHARD_TIMEOUT_MS = int(os.getenv("SHARD_TIMEOUT_MS", "5000"))
+CONFIG_SHARD_ID = "config"
+
+
+class ShardInfo:
+    __slots__ = ('shard_id', 'set_name', 'hosts', 'role', 'uri')
+
+    def __init__(self, shard_id: str, set_name: str, hosts: List[str], role: str, uri: str):
+        self.shard_id = shard_id
+        self.set_name = set_name
+        self.hosts = hosts
+        self.role = role
+        self.uri = uri
+
+    def to_dict(self) -> Dict[str, Any]:
+        return {"shard": self.shard_id, "replica_set": self.set_name, "hosts": self.hosts, "role": self.role}
+
+
+def shard_uri(base_uri: str, set_name: str, hosts: List[str]) -> str:
+    """
+    URI Replica Set шарда с учетными данными и опциями исходного URI mongos
+
+    Для mongodb+srv хосты берутся из listShards, поэтому схема меняется на
+    mongodb://, а TLS, который SRV включает неявно, указывается явно.
+    """
+    scheme, _, rest = base_uri.partition('://')
+    authority, _, tail = rest.partition('/')
+    userinfo, _, _ = authority.rpartition('@')
+    path, _, query = tail.partition('?')
+    options = [(k, v) for k, v in parse_qsl(query, keep_blank_values=True) if k.lower() != 'replicaset']
+    if scheme == 'mongodb+srv' and not any(k.lower() in ('tls', 'ssl') for k, _ in options):
+        options.append(('tls', 'true'))
+    options.append(('replicaSet', set_name))
+    credentials = f"{userinfo}@" if userinfo else ""
+    return f"mongodb://{credentials}{','.join(hosts)}/{path}?{urlencode(options)}"
+
+
+def _parse_shard_host(value: str) -> Tuple[Optional[str], List[str]]:
+    # Формат listShards/getShardMap: "rsName/host1:port,host2:port"
+    set_name, _, hosts = value.partition('/')
+    if not hosts:
+        return None, value.split(',')
+    return set_name, hosts.split(',')
+
+
+def is_mongos(client) -> bool:
+    return client.admin.command('hello').get('msg') == 'isdbgrid'
+
+
+def discover_shards(client, base_uri: str) -> List[ShardInfo]:
+    """Шарды из listShards и Replica Set config-серверов из getShardMap"""
+    shards = []
+    for shard in client.admin.command('listShards')['shards']:
+        set_name, hosts = _parse_shard_host(shard['host'])
+        if set_name is None:
+            logger.warning(f"⚠️ Шард {shard['_id']} не является Replica Set - мониторинг репликации невозможен")
+            continue
+        shards.append(ShardInfo(shard['_id'], set_name, hosts, "shard", shard_uri(base_uri, set_name, hosts)))
+    try:
+        config_host = client.admin.command('getShardMap')['map'].get(CONFIG_SHARD_ID)
+    except Exception as e:
+        logger.warning(f"⚠️ Не удалось получить адрес config-серверов: {e}")
+        config_host = None
+    if config_host:
+        set_name, hosts = _parse_shard_host(config_host)
+        if set_name:
+            shards.append(ShardInfo(CONFIG_SHARD_ID, set_name, hosts, "config", shard_uri(base_uri, set_name, hosts)))
+    return shards
+
+
+class ShardFanout:
+    """
+    Параллельный опрос всех шардов и config-серверов за mongos
+
+    Тип топологии определяется один раз командой hello; список шардов
+    обновляется не чаще SHARD_DISCOVERY_SECONDS. У каждого Replica Set шарда
+    свой клиент, опросы идут в пуле из workers потоков.
+    """
+
+    def __init__(self, base_uri: str, workers: int = SHARD_FANOUT_WORKERS, timeout_ms: int = SHARD_TIMEOUT_MS,
+                 discovery_seconds: float = SHARD_DISCOVERY_SECONDS, client_factory: Callable = create_client):
+        self.base_uri = base_uri
+        self.workers = workers
+        self.timeout_ms = timeout_ms
+        self.discovery_seconds = discovery_seconds
+        self.client_factory = client_factory
+        self.sharded: Optional[bool] = None
+        self.shards: List[ShardInfo] = []
+        self.discovered_at = float('-inf')
+        self.clients: Dict[str, Any] = {}
+        self._pool: Optional[ThreadPoolExecutor] = None
+        self._lock = threading.Lock()
+
+    def is_sharded(self, client) -> bool:
+        if self.sharded is None:
+            self.sharded = is_mongos(client)
+            if self.sharded:
+                logger.info("🧩 Подключение к mongos: мониторинг по шардам и config-серверам")
+        return self.sharded
+
+    def _refresh_shards(self, client):
+        if time.monotonic() - self.discovered_at < self.discovery_seconds:
+            return
+        with self._lock:
+            if time.monotonic() - self.discovered_at < self.discovery_seconds:
+                return
+            shards = discover_shards(client, self.base_uri)
+            current = {s.uri for s in shards}
+            for uri in [u for u in self.clients if u not in current]:
+                # Шард удален из кластера
+                self.clients.pop(uri).close()
+            self.shards = shards
+            self.discovered_at = time.monotonic()
+            if self._pool is None:
+                self._pool = ThreadPoolExecutor(max_workers=self.workers, thread_name_prefix="shards")
+
+    def _client(self, shard: ShardInfo):
+        client = self.clients.get(shard.uri)
+        if client is None:
+            with self._lock:
+                client = self.clients.get(shard.uri)
+                if client is None:
+                    client = self.client_factory(
+                        shard.uri, serverSelectionTimeoutMS=self.timeout_ms, connectTimeoutMS=self.timeout_ms
+                    )
+                    self.clients[shard.uri] = client
+        return client
+
+    def roles(self) -> Dict[str, str]:
+        return {s.shard_id: s.role for s in self.shards}
+
+    def fan_out(self, client, fn: Callable[[Any], Any]) -> Tuple[Dict[str, Any], Dict[str, str]]:
+        """Выполнить fn(клиент шарда) на всех шардах параллельно: (результаты, ошибки)"""
+        self._refresh_shards(client)
+        futures = {s.shard_id: self._pool.submit(lambda s=s: fn(self._client(s))) for s in self.shards}
+        results, errors = {}, {}
+        for shard_id, future in futures.items():
+            try:
+                results[shard_id] = future.result()
+            except Exception as e:
+                errors[shard_id] = str(e)
+        return results, errors
+
+    def views(self, client) -> Tuple[Dict[str, ClusterView], Dict[str, str]]:
+        return self.fan_out(client, ClusterView.fetch)
+
+    def close(self):
+        if self._pool:
+            self._pool.shutdown(wait=False, cancel_futures=True)
+        for shard_client in self.clients.values():
+            shard_client.close()
+        self.clients.clear()
@@ -0,0 +1,170 @@
+import hashlib
+import json
+import logging
+import os
+import threading
+import time
+from bisect import bisect_left, bisect_right
+from typing import Any, Dict, Optional
+
+from fastapi import APIRouter
+
+from common.responses import FastRoute
+
+logger = logging.getLogger(__name__)
+
+# Файл правил (JSON или YAML); без него действуют DEFAULT_SCALES
+THRESHOLDS_PATH = os.getenv("THRESHOLDS_PATH")
+# Как часто проверять mtime файла правил
+THRESHOLDS_CHECK_SECONDS = float(os.getenv("THRESHOLDS_CHECK_SECONDS", "2"))
+
+# Шкала: границы по возрастанию и уровни (на один больше границ).
+# below - значение попадает в полосу, если меньше границы; up_to - если не больше.
+# Уровень null означает "порог не превышен".
+DEFAULT_SCALES: Dict[str, Dict[str, Any]] = {
+    # Оценка lag каждого Secondary в /replication/lag
+    "replication_lag": {"below": [5, 10, 30], "levels": ["EXCELLENT", "GOOD", "WARNING", "CRITICAL"]},
+    # Общая оценка по максимальному lag в /replication/lag
+    "replication_overall_lag": {"up_to": [10, 30], "levels": ["GOOD", "WARNING", "CRITICAL"]},
+    # lag_status узлов в /replication/status
+    "replication_status_lag": {"below": [10, 30], "levels": ["OK", "WARNING", "CRITICAL"]},
+    # Алерт HIGH_REPLICATION_LAG и его уровень
+    "alert_replication_lag": {"up_to": [30], "levels": [None, "WARNING"]},
+    # Качество синхронизации в /recovery/sync-status
+    "sync_quality_lag": {"below": [5, 15, 60], "levels": ["EXCELLENT", "GOOD", "ACCEPTABLE", "POOR"]},
+    "sync_attention_lag": {"up_to": [30], "levels": [None, "ATTENTION"]},
+    # Узел требует восстановления (/recovery/status, /recovery/recommendations) - приоритет рекомендации
+    "recovery_lag": {"up_to": [60], "levels": [None, "MEDIUM"]},
+    # Автовосстановление (/recovery/auto-heal) - приоритет действия
+    "auto_heal_lag": {"up_to": [120], "levels": [None, "HIGH"]},
+    # Задержка сети до узла (p95 окна или pingMs) в /health/network
+    "network_latency_ms": {"up_to": [100], "levels": [None, "WARNING"]},
+    # Отстающие Secondary в сводке флота
+    "fleet_lagging": {"up_to": [30], "levels": [None, "LAGGING"]},
+}
+
+
+class Scale:
+    """Скомпилированная шкала: уровень по значению - один bisect по кортежу границ"""
+
+    __slots__ = ('bounds', 'levels', 'inclusive')
+
+    def __init__(self, name: str, spec: Dict[str, Any]):
+        if ("below" in spec) == ("up_to" in spec):
+            raise ValueError(f"Шкала {name}: нужно ровно одно из below / up_to")
+        self.inclusive = "up_to" in spec
+        bounds = [float(b) for b in spec["up_to" if self.inclusive else "below"]]
+        levels = spec.get("levels") or []
+        if any(b >= nxt for b, nxt in zip(bounds, bounds[1:])):
+            raise ValueError(f"Шкала {name}: границы должны строго возрастать")
+        if len(levels) != len(bounds) + 1:
+            raise ValueError(f"Шкала {name}: уровней должно быть на один больше, чем границ")
+        self.bounds = tuple(bounds)
+        self.levels = tuple(levels)
+
+    def classify(self, value: float) -> Optional[str]:
+        if self.inclusive:
+            return self.levels[bisect_left(self.bounds, value)]
+        return self.levels[bisect_right(self.bounds, value)]
+
+    def to_dict(self) -> Dict[str, Any]:
+        return {"up_to" if self.inclusive else "below": list(self.bounds), "levels": list(self.levels)}
+
+
+class ThresholdRules:
+    """Набор скомпилированных шкал; неизменяем, при перезагрузке заменяется целиком"""
+
+    def __init__(self, scales: Dict[str, Dict[str, Any]], source: str = "defaults"):
+        self.source = source
+        self.scales = {name: Scale(name, spec) for name, spec in scales.items()}
+        # Меняется вместе со шкалами: входит в версию ответов, уровни которых зависят от порогов
+        self.version = hashlib.blake2b(json.dumps(self.to_dict()["scales"], sort_keys=True).encode(),
+                                       digest_size=6).hexdigest()
+
+    def classify(self, name: str, value: float) -> Optional[str]:
+        return self.scales[name].classify(value)
+
+    def exceeds(self, name: str, value: float) -> bool:
+        """Порог шкалы превышен: уровень не null"""
+        return self.scales[name].classify(value) is not None
+
+    def to_dict(self) -> Dict[str, Any]:
+        return {"source": self.source, "scales": {name: scale.to_dict() for name, scale in self.scales.items()}}
+
+
+def _read_rules_file(path: str) -> Dict[str, Any]:
+    with open(path, encoding='utf-8') as f:
+        if path.endswith(('.yaml', '.yml')):
+            import yaml
+            data = yaml.safe_load(f) or {}
+        else:
+            data = json.load(f)
+    return data.get("scales", {})
+
+
+class ThresholdsFile:
+    """
+    Правила порогов с перечитыванием файла без перезапуска
+
+    current() не чаще раза в check_seconds сверяет mtime файла; новая версия
+    компилируется и подменяет прежнюю атомарно. Ошибочный файл не применяется -
+    сервисы продолжают работать с последними корректными правилами.
+    """
+
+    def __init__(self, path: Optional[str], check_seconds: float = THRESHOLDS_CHECK_SECONDS):
+        self.path = path
+        self.check_seconds = check_seconds
+        self.rules = ThresholdRules(DEFAULT_SCALES)
+        self.mtime: Optional[float] = None
+        self.checked_at = float('-inf')
+        self.last_error: Optional[str] = None
+        self._lock = threading.Lock()
+
+    def current(self) -> ThresholdRules:
+        if self.path and time.monotonic() - self.checked_at >= self.check_seconds:
+            self._check()
+        return self.rules
+
+    def _check(self):
+        with self._lock:
+            if time.monotonic() - self.checked_at < self.check_seconds:
+                return
+            self.checked_at = time.monotonic()
+            try:
+                mtime = os.stat(self.path).st_mtime
+            except OSError:
+                if self.mtime is not None:
+                    logger.warning(f"⚠️ Файл порогов {self.path} пропал - остаются последние загруженные правила")
+                    self.mtime = None
+                return
+            if mtime == self.mtime:
+                return
+            self.mtime = mtime
+            try:
+                overrides = _read_rules_file(self.path)
+                unknown = set(overrides) - set(DEFAULT_SCALES)
+                if unknown:
+                    logger.warning(f"⚠️ Неизвестные шкалы в {self.path}: {', '.join(sorted(unknown))}")
+                self.rules = ThresholdRules({**DEFAULT_SCALES, **overrides}, source=self.path)
+                self.last_error = None
+                logger.info(f"🎚️ Пороги загружены из {self.path}: переопределено шкал {len(overrides)}")
+            except Exception as e:
+                self.last_error = str(e)
+                logger.error(f"❌ Файл порогов {self.path} не применен: {e}")
+
+    def to_dict(self) -> Dict[str, Any]:
+        return {**self.current().to_dict(), "path": self.path, "last_error": self.last_error}
+
+
+thresholds = ThresholdsFile(THRESHOLDS_PATH)
+
+
+def thresholds_router(rules_file: ThresholdsFile = thresholds) -> APIRouter:
+    router = APIRouter(route_class=FastRoute)
+
+    @router.get("/thresholds")
+    async def get_thresholds():
+        """Действующие шкалы порогов и ошибка последней перезагрузки файла"""
+        return rules_file.to_dict()
+
+    return router
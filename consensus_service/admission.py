@@ -0,0 +1,294 @@
+import json
+import logging
+import threading
+import time
+from collections import OrderedDict, deque
+from typing import Any, Deque, Dict, List, Optional, Tuple
+
+from topology import TopologySnapshot
+
+logger = logging.getLogger(__name__)
+
+PRIORITIES = ("high", "normal", "low")
+
+
+def load_quotas(raw: str) -> Dict[str, float]:
+    """Квоты {"имя": записей в секунду} из JSON переменной окружения; пусто - отдельных квот нет"""
+    if not raw:
+        return {}
+    return {name: float(rate) for name, rate in json.loads(raw).items()}
+
+
+class WriteThrottled(Exception):
+    """Запись не допущена: reason - lag, global, collection или client"""
+
+    def __init__(self, reason: str, retry_after: float, message: str):
+        self.reason = reason
+        self.retry_after = retry_after
+        super().__init__(message)
+
+
+class TokenBucket:
+    __slots__ = ("rate", "burst", "tokens", "updated", "admitted", "rejected")
+
+    def __init__(self, rate: float, burst: float, now: float):
+        self.rate = rate
+        self.burst = burst
+        self.tokens = burst
+        self.updated = now
+        self.admitted = 0
+        self.rejected = 0
+
+    def refill(self, now: float, factor: float):
+        self.tokens = min(self.burst, self.tokens + (now - self.updated) * self.rate * factor)
+        self.updated = now
+
+    def wait_seconds(self, cost: float, factor: float, reserve: float = 0.0) -> float:
+        """Через сколько секунд в корзине наберется cost токенов сверх reserve (cost не больше burst)"""
+        missing = cost + reserve - self.tokens
+        if missing <= 0:
+            return 0.0
+        rate = self.rate * factor
+        return missing / rate if rate > 0 else float('inf')
+
+    def burst_seconds_at(self, factor: float) -> float:
+        """За сколько секунд пустая корзина наполняется целиком"""
+        rate = self.rate * factor
+        return self.burst / rate if rate > 0 else float('inf')
+
+
+class AdmissionController:
+    """
+    Допуск записей по токен-корзинам, скорость которых зависит от отставания кластера
+
+    Давление - большее из majority lag и отставания точки majority-коммита от Primary
+    в кэшированном снимке топологии: именно эти записи откатятся при потере Primary.
+    До lag_soft_seconds корзины наполняются с полной скоростью, к lag_hard_seconds
+    скорость линейно падает до min_factor, выше lag_hard записи priority=low
+    отклоняются. Снижение применяется сразу, а возврат к полной скорости растянут на
+    recovery_seconds, чтобы отставание не вернулось от накопившегося всплеска.
+
+    Приоритеты: high не ограничивается по lag (только квотой клиента), normal ждет
+    токен до max_wait_seconds, low не ждет и не трогает резерв low_reserve_ratio
+    общей корзины, оставляя его для normal и high.
+    """
+
+    def __init__(self, rate: float, burst_seconds: float, lag_soft_seconds: float, lag_hard_seconds: float,
+                 min_factor: float, recovery_seconds: float, max_wait_seconds: float, low_reserve_ratio: float,
+                 client_rate: float = 0, collection_rate: float = 0,
+                 client_quotas: Optional[Dict[str, float]] = None,
+                 collection_quotas: Optional[Dict[str, float]] = None,
+                 max_keys: int = 10000, window_seconds: int = 60):
+        self.rate = rate
+        self.burst_seconds = burst_seconds
+        self.lag_soft_seconds = lag_soft_seconds
+        self.lag_hard_seconds = max(lag_hard_seconds, lag_soft_seconds)
+        self.min_factor = min_factor
+        self.recovery_seconds = recovery_seconds
+        self.max_wait_seconds = max_wait_seconds
+        self.low_reserve_ratio = low_reserve_ratio
+        self.client_rate = client_rate
+        self.collection_rate = collection_rate
+        self.client_quotas = client_quotas or {}
+        self.collection_quotas = collection_quotas or {}
+        self.max_keys = max_keys
+        self.window_seconds = window_seconds
+
+        now = time.monotonic()
+        self.started_at = now
+        self.factor = 1.0
+        self.target_factor = 1.0
+        self._factor_at = now
+        self.majority_lag_seconds = 0.0
+        self.commit_lag_seconds = 0.0
+        self.pressure_seconds = 0.0
+        self.global_bucket = TokenBucket(rate, rate * burst_seconds, now)
+        self.clients: "OrderedDict[str, TokenBucket]" = OrderedDict()
+        self.collections: "OrderedDict[str, TokenBucket]" = OrderedDict()
+        self.stats = {
+            "admitted": {priority: 0 for priority in PRIORITIES},
+            "delayed": 0,
+            "rejected": {"lag": 0, "global": 0, "collection": 0, "client": 0}
+        }
+        # [секунда, допущено, задержано, отклонено] для скоростей за последние window_seconds
+        self.window: Deque[List[int]] = deque()
+        self._lock = threading.Lock()
+
+    def _target(self, pressure: float) -> float:
+        if pressure <= self.lag_soft_seconds:
+            return 1.0
+        if pressure >= self.lag_hard_seconds:
+            return self.min_factor
+        share = (pressure - self.lag_soft_seconds) / (self.lag_hard_seconds - self.lag_soft_seconds)
+        return 1.0 - (1.0 - self.min_factor) * share
+
+    def _advance(self, now: float):
+        """Плавный подъем скорости к целевой: от min_factor до 1 за recovery_seconds"""
+        if self.factor < self.target_factor:
+            if self.recovery_seconds <= 0:
+                self.factor = self.target_factor
+            else:
+                step = (1.0 - self.min_factor) / self.recovery_seconds * (now - self._factor_at)
+                self.factor = min(self.target_factor, self.factor + step)
+        self._factor_at = now
+
+    def observe(self, snapshot: TopologySnapshot):
+        """Слушатель кэша топологии: пересчитать скорость допуска по новому снимку"""
+        # Без единственного Primary lag не определен - скорость сохраняется до следующего снимка
+        if snapshot.error or snapshot.primary_count != 1:
+            return
+        pressure = max(snapshot.majority_lag_seconds, snapshot.commit_lag_seconds)
+        with self._lock:
+            self._advance(time.monotonic())
+            previous = self.target_factor
+            self.majority_lag_seconds = snapshot.majority_lag_seconds
+            self.commit_lag_seconds = snapshot.commit_lag_seconds
+            self.pressure_seconds = pressure
+            self.target_factor = self._target(pressure)
+            self.factor = min(self.factor, self.target_factor)
+        if self.target_factor < 1.0 <= previous:
+            logger.warning(f"🚦 Lag {pressure:.1f}s: скорость записей снижена до {self.target_factor:.0%}")
+        elif previous < 1.0 <= self.target_factor:
+            logger.info(f"🟢 Lag {pressure:.1f}s: скорость записей восстанавливается за {self.recovery_seconds}s")
+
+    def _bucket(self, buckets: "OrderedDict[str, TokenBucket]", key: str, rate: float, now: float) -> TokenBucket:
+        bucket = buckets.get(key)
+        if bucket is None:
+            bucket = buckets[key] = TokenBucket(rate, rate * self.burst_seconds, now)
+            while len(buckets) > self.max_keys:
+                buckets.popitem(last=False)
+        else:
+            buckets.move_to_end(key)
+        return bucket
+
+    def _count(self, now: float, field: int):
+        second = int(now)
+        if not self.window or self.window[-1][0] != second:
+            self.window.append([second, 0, 0, 0])
+            while self.window[0][0] <= second - self.window_seconds:
+                self.window.popleft()
+        self.window[-1][field] += 1
+
+    def admit(self, client: str, collection: str, priority: str = "normal", cost: int = 1) -> float:
+        """
+        Допустить запись cost документов: секунды, которые нужно подождать перед записью
+        (токены уже зарезервированы), или WriteThrottled
+        """
+        now = time.monotonic()
+        with self._lock:
+            self._advance(now)
+            factor = self.factor
+            if priority == "low" and self.pressure_seconds >= self.lag_hard_seconds:
+                self.stats["rejected"]["lag"] += 1
+                self._count(now, 3)
+                raise WriteThrottled(
+                    "lag", min(self.recovery_seconds, max(1.0, self.pressure_seconds - self.lag_hard_seconds)),
+                    f"Lag {self.pressure_seconds:.1f}s выше {self.lag_hard_seconds}s: записи priority=low отклоняются"
+                )
+
+            # (причина, корзина, множитель скорости, резерв)
+            limits: List[Tuple[str, TokenBucket, float, float]] = []
+            client_rate = self.client_quotas.get(client, self.client_rate)
+            if client_rate > 0:
+                limits.append(("client", self._bucket(self.clients, client, client_rate, now), 1.0, 0.0))
+            if priority != "high":
+                collection_rate = self.collection_quotas.get(collection, self.collection_rate)
+                if collection_rate > 0:
+                    limits.append(("collection", self._bucket(self.collections, collection, collection_rate, now),
+                                   factor, 0.0))
+                reserve = self.global_bucket.burst * self.low_reserve_ratio if priority == "low" else 0.0
+                limits.append(("global", self.global_bucket, factor, reserve))
+
+            for reason, bucket, bucket_factor, _ in limits:
+                if cost > bucket.burst:
+                    # Такой пакет не допустить никогда: корзина не вмещает столько токенов
+                    bucket.rejected += 1
+                    self.stats["rejected"][reason] += 1
+                    self._count(now, 3)
+                    raise WriteThrottled(
+                        reason, min(bucket.burst_seconds_at(bucket_factor), self.recovery_seconds),
+                        f"Пакет из {cost} документов больше допустимого всплеска {self._limit_name(reason, client, collection)} "
+                        f"({bucket.burst:.0f}), разделите пакет"
+                    )
+
+            wait, limiting = 0.0, None
+            for reason, bucket, bucket_factor, reserve in limits:
+                bucket.refill(now, bucket_factor)
+                bucket_wait = bucket.wait_seconds(cost, bucket_factor, reserve)
+                if bucket_wait > wait:
+                    wait, limiting = bucket_wait, (reason, bucket)
+
+            max_wait = 0.0 if priority == "low" else self.max_wait_seconds
+            if wait > max_wait:
+                reason, bucket = limiting
+                bucket.rejected += 1
+                self.stats["rejected"][reason] += 1
+                self._count(now, 3)
+                raise WriteThrottled(
+                    reason, wait if wait != float('inf') else self.recovery_seconds,
+                    f"Превышена скорость записей {self._limit_name(reason, client, collection)} ({bucket.rate * (1.0 if reason == 'client' else factor):.1f}/s "
+                    f"при lag {self.pressure_seconds:.1f}s)"
+                )
+            # Пакет оплачивается целиком: долг корзины удлиняет ожидание следующих записей
+            for _, bucket, _, _ in limits:
+                bucket.tokens -= cost
+                bucket.admitted += 1
+            self.stats["admitted"][priority] += 1
+            self._count(now, 1)
+            if wait > 0:
+                self.stats["delayed"] += 1
+                self._count(now, 2)
+            return wait
+
+    @staticmethod
+    def _limit_name(reason: str, client: str, collection: str) -> str:
+        return {"client": f"клиента {client}", "collection": f"коллекции {collection}", "global": "сервиса"}[reason]
+
+    def _rates(self, now: float) -> Dict[str, float]:
+        cutoff = int(now) - self.window_seconds
+        totals = [0, 0, 0]
+        for entry in self.window:
+            if entry[0] > cutoff:
+                for i in range(3):
+                    totals[i] += entry[i + 1]
+        span = max(1.0, min(self.window_seconds, now - self.started_at))
+        return {
+            "admitted_per_second": round(totals[0] / span, 2),
+            "delayed_per_second": round(totals[1] / span, 2),
+            "rejected_per_second": round(totals[2] / span, 2),
+            "window_seconds": self.window_seconds
+        }
+
+    @staticmethod
+    def _top(buckets: "OrderedDict[str, TokenBucket]", limit: int = 10) -> List[Dict[str, Any]]:
+        ranked = sorted(buckets.items(), key=lambda item: item[1].rejected, reverse=True)[:limit]
+        return [{"name": name, "rate": bucket.rate, "admitted": bucket.admitted, "rejected": bucket.rejected}
+                for name, bucket in ranked]
+
+    def snapshot(self) -> Dict[str, Any]:
+        now = time.monotonic()
+        with self._lock:
+            self._advance(now)
+            self.global_bucket.refill(now, self.factor)
+            return {
+                "factor": round(self.factor, 3),
+                "target_factor": round(self.target_factor, 3),
+                "effective_rate": round(self.rate * self.factor, 1),
+                "rate": self.rate,
+                "available_tokens": round(self.global_bucket.tokens, 1),
+                "pressure_seconds": None if self.pressure_seconds == float('inf') else round(self.pressure_seconds, 2),
+                "majority_lag_seconds": None if self.majority_lag_seconds == float('inf')
+                else round(self.majority_lag_seconds, 2),
+                "commit_lag_seconds": None if self.commit_lag_seconds == float('inf')
+                else round(self.commit_lag_seconds, 2),
+                "lag_soft_seconds": self.lag_soft_seconds,
+                "lag_hard_seconds": self.lag_hard_seconds,
+                "stats": {
+                    "admitted": dict(self.stats["admitted"]),
+                    "delayed": self.stats["delayed"],
+                    "rejected": dict(self.stats["rejected"])
+                },
+                "rates": self._rates(now),
+                "clients": self._top(self.clients),
+                "collections": self._top(self.collections)
+            }
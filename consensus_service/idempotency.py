@@ -0,0 +1,87 @@
+import hashlib
+import json
+import logging
+from datetime import datetime
+from typing import Any, Dict, Optional, Tuple
+
+from bson import ObjectId
+from pymongo import WriteConcern
+from pymongo.errors import DuplicateKeyError
+
+logger = logging.getLogger(__name__)
+
+
+class IdempotencyConflict(Exception):
+    """Ключ идемпотентности уже использован для другого запроса"""
+
+
+class IdempotencyStore:
+    """
+    Дедупликация повторных записей по ключу клиента
+
+    Запись ключа {_id: key, document_id} делается ДО вставки документа, поэтому
+    повтор после wtimeout вставляет документ с тем же _id: либо он уже есть
+    (DuplicateKeyError = запись прошла), либо вставляется впервые. Дубликатов нет,
+    а завершенный повтор стоит одного find_one по _id. Старые ключи удаляет TTL индекс.
+    """
+
+    def __init__(self, collection, ttl_seconds: int):
+        self.collection = collection.with_options(write_concern=WriteConcern(w="majority", wtimeout=5000))
+        self.ttl_seconds = ttl_seconds
+        self._index_ready = False
+
+    def ensure_index(self):
+        if not self._index_ready:
+            self.collection.create_index("created_at", expireAfterSeconds=self.ttl_seconds)
+            self._index_ready = True
+
+    @staticmethod
+    def request_hash(collection: str, document: Dict[str, Any]) -> str:
+        payload = json.dumps([collection, document], sort_keys=True, default=str)
+        return hashlib.sha256(payload.encode('utf-8')).hexdigest()
+
+    def begin(self, key: str, collection: str, document: Dict[str, Any]) -> Tuple[Dict[str, Any], bool]:
+        """Зарезервировать ключ; вернуть (запись ключа, True если запрос новый)"""
+        return self.reserve(key, collection, self.request_hash(collection, document), document.get('_id', ObjectId()))
+
+    def reserve(self, key: str, collection: str, request_hash: str, document_id) -> Tuple[Dict[str, Any], bool]:
+        """begin по готовому хешу запроса: так ключ резервирует и слив буфера записей"""
+        self.ensure_index()
+        record = {
+            "_id": key,
+            "collection": collection,
+            "document_id": document_id,
+            "request_hash": request_hash,
+            "status": "pending",
+            "created_at": datetime.utcnow()
+        }
+        try:
+            self.collection.insert_one(record)
+            return record, True
+        except DuplicateKeyError:
+            existing = self.collection.find_one({"_id": key})
+            if existing is None:
+                # Ключ успел истечь по TTL между вставкой и чтением
+                return self.reserve(key, collection, request_hash, document_id)
+            if existing['collection'] != collection or existing['request_hash'] != request_hash:
+                raise IdempotencyConflict(f"Ключ {key} уже использован для другого запроса")
+            return existing, False
+
+    def complete(self, key: str, operation_time: Optional[str]):
+        self.collection.update_one(
+            {"_id": key},
+            {"$set": {"status": "committed", "operation_time": operation_time, "committed_at": datetime.utcnow()}}
+        )
+
+
+def insert_once(collection, document: Dict[str, Any], document_id, session=None) -> bool:
+    """Вставить документ с заданным _id; False если он уже был записан прошлой попыткой"""
+    try:
+        collection.insert_one({**document, "_id": document_id}, session=session)
+        return True
+    except DuplicateKeyError as e:
+        key_pattern = (e.details or {}).get('keyPattern')
+        if key_pattern and list(key_pattern) != ['_id']:
+            raise
+        logger.info(f"♻️ Документ {document_id} уже записан предыдущей попыткой")
+        return False
@@ -1,11 +1,30 @@
-from fastapi import FastAPI, HTTPException
+from fastapi import FastAPI, HTTPException, Header, Request
 from fastapi.middleware.cors import CORSMiddleware
 from pydantic import BaseModel
-from pymongo import MongoClient
-from pymongo.errors import ConnectionFailure, OperationFailure
+from pymongo import WriteConcern
+from pymongo.errors import OperationFailure
+from common.alerts import AlertEngine, alerts_router
+from common.backend import create_client
+from common.lifecycle import MongoConnection, lifecycle_router
+from common.mongo_guard import MongoGuard
+from common.responses import FastRoute, guarded, versioned
+from common.cluster_view import ClusterView, sharded_response
+from pymongo.read_concern import ReadConcern
+from pymongo.read_preferences import Primary, PrimaryPreferred, Secondary, SecondaryPreferred, Nearest
+from bson.timestamp import Timestamp
+from collections import OrderedDict
+from read_cache import ReadResultCache, watch_invalidations
+from topology import TopologyCache
+from validation import WriteValidator, load_schemas
+from idempotency import IdempotencyStore, IdempotencyConflict, insert_once
+from write_buffer import FailoverWriteBuffer
+from admission import PRIORITIES, AdmissionController, WriteThrottled, load_quotas
+from bson import ObjectId
+import asyncio
+import math
 import os
 import logging
-from typing import Optional, Dict, Any
+from typing import Optional, Dict, Any, List
 import subprocess
 import json
 import threading
@@ -15,6 +34,7 @@ logging.basicConfig(level=logging.INFO)
 logger = logging.getLogger(__name__)
 
 app = FastAPI(title="Consensus Service")
+app.router.route_class = FastRoute
 
 app.add_middleware(
     CORSMiddleware,
@@ -25,12 +45,122 @@ app.add_middleware(
 )
 
 MONGO_URI = os.getenv("MONGO_URI", "mongodb://localhost:27017/?replicaSet=rs0")
+MAX_CAUSAL_SESSIONS = int(os.getenv("MAX_CAUSAL_SESSIONS", "10000"))
+READ_CACHE_MAX_ENTRIES = int(os.getenv("READ_CACHE_MAX_ENTRIES", "1024"))
+READ_CACHE_TTL_SECONDS = float(os.getenv("READ_CACHE_TTL_SECONDS", "30"))
+TOPOLOGY_REFRESH_SECONDS = float(os.getenv("TOPOLOGY_REFRESH_SECONDS", "1"))
+TOPOLOGY_MAX_AGE_SECONDS = float(os.getenv("TOPOLOGY_MAX_AGE_SECONDS", "5"))
+VALIDATION_SCHEMAS_PATH = os.getenv("VALIDATION_SCHEMAS_PATH", "schemas.json")
+MAX_DOCUMENT_BYTES = int(os.getenv("MAX_DOCUMENT_BYTES", str(16 * 1024 * 1024)))
+WRITE_LAG_BUDGET_SECONDS = float(os.getenv("WRITE_LAG_BUDGET_SECONDS", "30"))
+MAX_BATCH_SIZE = int(os.getenv("MAX_BATCH_SIZE", "1000"))
+IDEMPOTENCY_TTL_SECONDS = int(os.getenv("IDEMPOTENCY_TTL_SECONDS", "86400"))
+WRITE_BUFFER_ENABLED = os.getenv("WRITE_BUFFER_ENABLED", "false").lower() == "true"
+WRITE_BUFFER_MAX_ENTRIES = int(os.getenv("WRITE_BUFFER_MAX_ENTRIES", "100000"))
+WRITE_BUFFER_MEMORY_ENTRIES = int(os.getenv("WRITE_BUFFER_MEMORY_ENTRIES", "1000"))
+WRITE_BUFFER_SPILL_DIR = os.getenv("WRITE_BUFFER_SPILL_DIR", "/tmp/consensus_write_buffer")
+WRITE_BUFFER_BATCH_SIZE = int(os.getenv("WRITE_BUFFER_BATCH_SIZE", "500"))
+WRITE_BUFFER_DEADLINE_SECONDS = float(os.getenv("WRITE_BUFFER_DEADLINE_SECONDS", "10"))
+WRITE_BUFFER_MAX_DEADLINE_SECONDS = float(os.getenv("WRITE_BUFFER_MAX_DEADLINE_SECONDS", "30"))
+# Отказ в записи при нескольких Primary: и при проверке снимка, и вместо буферизации
+SPLIT_BRAIN_DETAIL = "Обнаружено более одного Primary (Split-Brain), запись отклонена"
+ADMISSION_ENABLED = os.getenv("ADMISSION_ENABLED", "true").lower() == "true"
+# Записей в секунду на сервис при lag ниже ADMISSION_LAG_SOFT_SECONDS; корзина вмещает ADMISSION_BURST_SECONDS
+ADMISSION_RATE = float(os.getenv("ADMISSION_RATE", "2000"))
+ADMISSION_BURST_SECONDS = float(os.getenv("ADMISSION_BURST_SECONDS", "2"))
+ADMISSION_LAG_SOFT_SECONDS = float(os.getenv("ADMISSION_LAG_SOFT_SECONDS", "5"))
+ADMISSION_LAG_HARD_SECONDS = float(os.getenv("ADMISSION_LAG_HARD_SECONDS", str(WRITE_LAG_BUDGET_SECONDS)))
+ADMISSION_MIN_FACTOR = float(os.getenv("ADMISSION_MIN_FACTOR", "0.05"))
+ADMISSION_RECOVERY_SECONDS = float(os.getenv("ADMISSION_RECOVERY_SECONDS", "30"))
+ADMISSION_MAX_WAIT_SECONDS = float(os.getenv("ADMISSION_MAX_WAIT_SECONDS", "0.5"))
+ADMISSION_LOW_PRIORITY_RESERVE = float(os.getenv("ADMISSION_LOW_PRIORITY_RESERVE", "0.5"))
+# Квоты по умолчанию на клиента и коллекцию (0 - без квоты) и отдельные квоты JSON {"имя": записей/с}
+ADMISSION_CLIENT_RATE = float(os.getenv("ADMISSION_CLIENT_RATE", "0"))
+ADMISSION_COLLECTION_RATE = float(os.getenv("ADMISSION_COLLECTION_RATE", "0"))
+ADMISSION_CLIENT_QUOTAS = os.getenv("ADMISSION_CLIENT_QUOTAS", "")
+ADMISSION_COLLECTION_QUOTAS = os.getenv("ADMISSION_COLLECTION_QUOTAS", "")
 client = None
+# Дедлайн операций MongoDB на пути запроса и circuit breaker (MONGO_DEADLINE_SECONDS, MONGO_BREAKER_*)
+mongo_guard = MongoGuard("consensus_service")
+# Подключение к MongoDB в фоне с повторами; /livez и /readyz для оркестратора
+mongo_connection = MongoConnection("consensus_service", mongo_guard)
+app.include_router(lifecycle_router(mongo_connection))
+idempotency_store = None
+write_buffer = FailoverWriteBuffer(
+    max_entries=WRITE_BUFFER_MAX_ENTRIES,
+    memory_entries=WRITE_BUFFER_MEMORY_ENTRIES,
+    spill_dir=WRITE_BUFFER_SPILL_DIR,
+    batch_size=WRITE_BUFFER_BATCH_SIZE
+) if WRITE_BUFFER_ENABLED else None
+
+read_cache = ReadResultCache(max_entries=READ_CACHE_MAX_ENTRIES, ttl_seconds=READ_CACHE_TTL_SECONDS)
+topology_cache = TopologyCache(
+    refresh_seconds=TOPOLOGY_REFRESH_SECONDS,
+    max_age_seconds=TOPOLOGY_MAX_AGE_SECONDS,
+    uri=MONGO_URI
+)
+write_validator = WriteValidator(
+    schemas=load_schemas(VALIDATION_SCHEMAS_PATH),
+    max_document_bytes=MAX_DOCUMENT_BYTES,
+    lag_budget_seconds=WRITE_LAG_BUDGET_SECONDS
+)
+# Скорость допуска записей следует за lag из снимка топологии (слушатель topology_cache)
+admission = AdmissionController(
+    rate=ADMISSION_RATE,
+    burst_seconds=ADMISSION_BURST_SECONDS,
+    lag_soft_seconds=ADMISSION_LAG_SOFT_SECONDS,
+    lag_hard_seconds=ADMISSION_LAG_HARD_SECONDS,
+    min_factor=ADMISSION_MIN_FACTOR,
+    recovery_seconds=ADMISSION_RECOVERY_SECONDS,
+    max_wait_seconds=ADMISSION_MAX_WAIT_SECONDS,
+    low_reserve_ratio=ADMISSION_LOW_PRIORITY_RESERVE,
+    client_rate=ADMISSION_CLIENT_RATE,
+    collection_rate=ADMISSION_COLLECTION_RATE,
+    client_quotas=load_quotas(ADMISSION_CLIENT_QUOTAS),
+    collection_quotas=load_quotas(ADMISSION_COLLECTION_QUOTAS)
+) if ADMISSION_ENABLED else None
+if admission:
+    topology_cache.listeners.append(admission.observe)
+background_stop = threading.Event()
+# Алерты оцениваются на каждом обновлении снимка топологии
+alert_engine = AlertEngine.from_env("consensus_service")
+app.include_router(alerts_router(alert_engine, "/alerts"))
+
+READ_CONCERNS = ("local", "majority", "linearizable")
+READ_PREFERENCES = {
+    "primary": Primary,
+    "primaryPreferred": PrimaryPreferred,
+    "secondary": Secondary,
+    "secondaryPreferred": SecondaryPreferred,
+    "nearest": Nearest
+}
+# Минимум, который допускает MongoDB: heartbeatFrequency (10s) + idleWritePeriod (10s), но не меньше 90s
+MIN_MAX_STALENESS_SECONDS = 90
+
+# session_id клиента -> последнее известное operationTime (для afterClusterTime)
+causal_sessions: "OrderedDict[str, Timestamp]" = OrderedDict()
+causal_sessions_lock = threading.Lock()
 
 class WriteRequest(BaseModel):
     collection: str
     document: Dict[str, Any]
     write_concern: Optional[str] = "majority"
+    session_id: Optional[str] = None
+    idempotency_key: Optional[str] = None
+    # Сколько ждать выбора нового Primary, если включен буфер записей
+    deadline_seconds: Optional[float] = None
+    # Допуск при росте lag: high, normal или low; клиент для квот (иначе X-Client-Id или адрес)
+    priority: Optional[str] = "normal"
+    client_id: Optional[str] = None
+
+class BatchWriteRequest(BaseModel):
+    collection: str
+    documents: List[Dict[str, Any]]
+    write_concern: Optional[str] = "majority"
+    session_id: Optional[str] = None
+    ordered: Optional[bool] = True
+    priority: Optional[str] = "normal"
+    client_id: Optional[str] = None
 
 class DockerRequest(BaseModel):
     node: str
@@ -38,107 +168,531 @@ class DockerRequest(BaseModel):
 
 @app.on_event("startup")
 async def startup_db_client():
-    global client
-    try:
-        client = MongoClient(MONGO_URI)
-        client.admin.command('ping')
-        logger.info("✅ Подключено к MongoDB Replica Set")
-    except ConnectionFailure as e:
-        logger.error(f"❌ Ошибка подключения к MongoDB: {e}")
+    global client, idempotency_store
+    # MongoClient подключается лениво; ping и повторы - в фоне (mongo_connection)
+    client = create_client(MONGO_URI, event_listeners=[write_buffer.watcher] if write_buffer is not None else [])
+    idempotency_store = IdempotencyStore(client['protected_db']['write_idempotency'], IDEMPOTENCY_TTL_SECONDS)
+    mongo_connection.start(lambda: client)
+
+    alert_engine.start()
+    background_stop.clear()
+    threading.Thread(
+        target=topology_cache.run,
+        args=(lambda: client, background_stop),
+        daemon=True
+    ).start()
+    threading.Thread(
+        target=watch_invalidations,
+        args=(lambda: client, 'protected_db', read_cache, background_stop),
+        daemon=True
+    ).start()
+    if write_buffer is not None:
+        threading.Thread(
+            target=write_buffer.run,
+            args=(lambda: client, 'protected_db', background_stop, idempotency_store),
+            daemon=True
+        ).start()
+        logger.info("🧺 Буфер записей на время выборов Primary включен")
 
 @app.on_event("shutdown")
 async def shutdown_db_client():
+    background_stop.set()
+    mongo_connection.stop()
+    topology_cache.close()
+    alert_engine.stop()
     if client:
         client.close()
 
+def _format_cluster_time(ts: Optional[Timestamp]) -> Optional[str]:
+    """Timestamp -> токен 'time:inc', который клиент передает обратно в after_cluster_time"""
+    return f"{ts.time}:{ts.inc}" if ts else None
+
+def _parse_cluster_time(token: str) -> Timestamp:
+    try:
+        seconds, increment = token.split(':')
+        return Timestamp(int(seconds), int(increment))
+    except ValueError:
+        raise HTTPException(status_code=400, detail=f"Некорректный after_cluster_time: {token} (ожидается 'time:inc')")
+
+def _remember_operation_time(session_id: Optional[str], operation_time: Optional[Timestamp]):
+    """Сохранить operationTime клиентской сессии, чтобы следующее чтение видело её запись"""
+    if not session_id or operation_time is None:
+        return
+    with causal_sessions_lock:
+        known = causal_sessions.get(session_id)
+        causal_sessions[session_id] = max(known, operation_time) if known else operation_time
+        causal_sessions.move_to_end(session_id)
+        while len(causal_sessions) > MAX_CAUSAL_SESSIONS:
+            causal_sessions.popitem(last=False)
+
+def _build_read_preference(mode: str, max_staleness_seconds: Optional[int]):
+    if mode not in READ_PREFERENCES:
+        raise HTTPException(status_code=400, detail=f"Неизвестный read_preference: {mode}")
+    if max_staleness_seconds is None:
+        return READ_PREFERENCES[mode]()
+    if mode == "primary":
+        raise HTTPException(status_code=400, detail="max_staleness_seconds несовместим с read_preference=primary")
+    if max_staleness_seconds < MIN_MAX_STALENESS_SECONDS:
+        raise HTTPException(
+            status_code=400,
+            detail=f"max_staleness_seconds должен быть не меньше {MIN_MAX_STALENESS_SECONDS}"
+        )
+    return READ_PREFERENCES[mode](max_staleness=max_staleness_seconds)
+
 @app.get("/")
 async def root():
     return {
         "service": "Consensus Service",
-        "status": "running"
+        "status": "running",
+        "mongo": mongo_guard.to_dict()
+    }
+
+def _replica_set_report(view: ClusterView) -> Dict[str, Any]:
+    return {
+        "name": view.set_name,
+        "primary_nodes": view.primary_count,
+        "secondary_nodes": view.secondary_count,
+        "total_members": view.total
     }
 
 @app.get("/health")
+@guarded(mongo_guard, stale=False)
 async def health_check():
     try:
         client.admin.command('ping')
-        rs_status = client.admin.command('replSetGetStatus')
-        primary_count = sum(1 for member in rs_status['members'] if member['stateStr'] == 'PRIMARY')
-        secondary_count = sum(1 for member in rs_status['members'] if member['stateStr'] == 'SECONDARY')
         
         return {
             "status": "healthy",
             "database": "connected",
-            "replica_set": {
-                "name": rs_status.get('set'),
-                "primary_nodes": primary_count,
-                "secondary_nodes": secondary_count,
-                "total_members": len(rs_status['members'])
-            }
+            "replica_set": _dispatch(_replica_set_report)
         }
     except Exception as e:
         logger.error(f"Health check failed: {e}")
         raise HTTPException(status_code=503, detail=str(e))
 
+def _cluster_status_report(view: ClusterView) -> Dict[str, Any]:
+    members_info = []
+    for member in view.members:
+        members_info.append({
+            "name": member.name,
+            "state": member.state,
+            "health": "healthy" if member.healthy else "unhealthy",
+            "uptime": member.uptime,
+            "lag": member.optime
+        })
+    
+    return {
+        "replica_set": view.set_name,
+        "members": members_info,
+        "date": str(view.date),
+        "health_percentage": 100 * view.healthy_count / view.total,
+        "total_nodes": view.total,
+        "healthy_nodes": view.healthy_count
+    }
+
 @app.get("/cluster/status")
+@guarded(mongo_guard)
+@versioned(lambda: _topology_version())
 async def get_cluster_status():
     try:
-        rs_status = client.admin.command('replSetGetStatus')
-        members_info = []
-        for member in rs_status['members']:
-            members_info.append({
-                "name": member['name'],
-                "state": member['stateStr'],
-                "health": "healthy" if member['health'] == 1 else "unhealthy",
-                "uptime": member.get('uptime', 0),
-                "lag": member.get('optimeDate', None)
-            })
-        
+        return _dispatch(_cluster_status_report)
+    except Exception as e:
+        logger.error(f"Ошибка получения статуса кластера: {e}")
+        raise HTTPException(status_code=500, detail=str(e))
+
+def _topology_version() -> Optional[str]:
+    """Версия снимка топологии; отказ обновления снимка пробрасывается, чтобы его учел breaker"""
+    snapshot = topology_cache.current(client)
+    if snapshot.failure is not None:
+        raise RuntimeError(snapshot.error) from snapshot.failure
+    return snapshot.version
+
+def _cluster_view() -> ClusterView:
+    """Разобранный replSetGetStatus из кэша топологии (не старше TOPOLOGY_MAX_AGE_SECONDS)"""
+    snapshot = topology_cache.current(client)
+    if snapshot.view is None:
+        raise RuntimeError(snapshot.error) from snapshot.failure
+    return snapshot.view
+
+def _dispatch(report):
+    """report(view) для Replica Set или для каждого шарда, если сервис подключен к mongos"""
+    snapshot = topology_cache.current(client)
+    if not snapshot.shard_views and not snapshot.shard_errors:
+        return report(_cluster_view())
+    return sharded_response(
+        {shard: report(view) for shard, view in snapshot.shard_views.items()},
+        snapshot.shard_errors,
+        topology_cache.shards.roles()
+    )
+
+def _collection_with_concern(name: str, write_concern: str):
+    collection = client['protected_db'][name]
+    if write_concern == "all":
+        # w - число подтверждающих узлов из снимка; без него не слабее majority
+        voting_members = topology_cache.snapshot.voting_members
+        return collection.with_options(
+            write_concern=WriteConcern(w=voting_members or "majority", wtimeout=5000)
+        )
+    if write_concern == "majority":
+        return collection.with_options(
+            write_concern=WriteConcern(w="majority", wtimeout=5000)
+        )
+    return collection
+
+def _driver_primary() -> Optional[bool]:
+    """Primary по событиям топологии драйвера; None - буфер выключен и слушателя топологии нет"""
+    return write_buffer.watcher.primary_available.is_set() if write_buffer is not None else None
+
+def _enforce_validation(collection: str, documents: List[Dict[str, Any]], write_concern: str) -> Dict[str, Any]:
+    """Этап валидации перед записью: 503 без Primary, 422 при нарушении остальных проверок"""
+    return _raise_if_rejected(
+        write_validator.validate(collection, documents, write_concern, topology_cache.current(client),
+                                 _driver_primary())
+    )
+
+def _raise_if_rejected(validation: Dict[str, Any]) -> Dict[str, Any]:
+    if validation['split_brain']:
+        raise HTTPException(status_code=503, detail=SPLIT_BRAIN_DETAIL)
+    if not validation['primary_available']:
+        raise HTTPException(status_code=503, detail="Нет доступного Primary узла")
+    if not validation['can_execute']:
+        raise HTTPException(status_code=422, detail={
+            "message": validation['recommendation'],
+            "checks": [c for c in validation['checks'] if not c['passed']],
+            "document_errors": validation['document_errors']
+        })
+    return validation
+
+@app.post("/validate/operation")
+@guarded(mongo_guard, stale=False)
+async def validate_operation(request: WriteRequest):
+    """
+    Проверить допустимость записи без её выполнения
+    """
+    try:
+        validation = write_validator.validate(
+            request.collection, [request.document], request.write_concern, topology_cache.current(client),
+            _driver_primary()
+        )
         return {
-            "replica_set": rs_status.get('set'),
-            "members": members_info,
-            "date": str(rs_status.get('date')),
-            "health_percentage": 100 * sum(1 for m in rs_status['members'] if m['health'] == 1) / len(rs_status['members']),
-            "total_nodes": len(rs_status['members']),
-            "healthy_nodes": sum(1 for m in rs_status['members'] if m['health'] == 1)
+            "timestamp": time.strftime("%Y-%m-%d %H:%M:%S"),
+            **validation
         }
     except Exception as e:
-        logger.error(f"Ошибка получения статуса кластера: {e}")
+        logger.error(f"❌ Ошибка валидации: {e}")
         raise HTTPException(status_code=500, detail=str(e))
 
+async def _admit_write(http_request: Request, collection: str, priority: Optional[str], client_id: Optional[str],
+                       cost: int = 1):
+    """Допуск записи по скорости, зависящей от lag; при нехватке токенов - ожидание или 429"""
+    if not admission:
+        return
+    priority = priority or "normal"
+    if priority not in PRIORITIES:
+        raise HTTPException(status_code=400, detail=f"Неизвестный priority: {priority}")
+    client_key = client_id or http_request.headers.get("x-client-id") or (
+        http_request.client.host if http_request.client else "unknown"
+    )
+    try:
+        delay = admission.admit(client_key, collection, priority, cost)
+    except WriteThrottled as e:
+        logger.warning(f"🚦 Запись в {collection} от {client_key} ({priority}) отклонена: {e}")
+        raise HTTPException(
+            status_code=429,
+            detail={"message": str(e), "reason": e.reason, "retry_after_seconds": round(e.retry_after, 2)},
+            headers={"Retry-After": str(max(1, math.ceil(e.retry_after)))}
+        )
+    if delay > 0:
+        await asyncio.sleep(delay)
+
 @app.post("/write/safe")
-async def safe_write(request: WriteRequest):
+async def safe_write(request: WriteRequest, http_request: Request,
+                     idempotency_key_header: Optional[str] = Header(None, alias="Idempotency-Key")):
     try:
-        db = client['protected_db']
-        collection = db[request.collection]
-        from pymongo import WriteConcern
+        await _admit_write(http_request, request.collection, request.priority, request.client_id)
+        idempotency_key = request.idempotency_key or idempotency_key_header
+        
+        # Решение о буфере - по событиям драйвера: replSetGetStatus без Primary ждет выбора
+        # сервера, а снимок топологии еще несколько секунд показывает прежний Primary.
+        # Ключ идемпотентности в буфере резервируется при сливе - это тоже запись на Primary
+        if write_buffer is not None and not write_buffer.watcher.primary_available.is_set():
+            # Split-Brain - не выборы: буфер слил бы записи в один из Primary, снимок не обновляем
+            if topology_cache.snapshot.primary_count > 1:
+                raise HTTPException(status_code=503, detail=SPLIT_BRAIN_DETAIL)
+            document_errors = write_validator.check_documents(request.collection, [request.document])
+            if document_errors:
+                raise HTTPException(status_code=422, detail={
+                    "message": "❌ Операция будет отклонена: " + "; ".join(
+                        f"документ #{d['index']}: {', '.join(d['errors'])}" for d in document_errors
+                    ),
+                    "checks": [],
+                    "document_errors": document_errors
+                })
+            inserted_id = await _buffered_write(request, idempotency_key)
+            return _safe_write_response(request, inserted_id, None, False, buffered=True)
+        
+        collection_with_concern = _collection_with_concern(request.collection, request.write_concern)
+        validation = write_validator.validate(
+            request.collection, [request.document], request.write_concern, topology_cache.current(client),
+            _driver_primary()
+        )
+        # Отклоненный документ не резервирует ключ: исправленный повтор с тем же ключом не получит 409
+        if validation['document_errors']:
+            _raise_if_rejected(validation)
         
-        if request.write_concern == "majority":
-            collection_with_concern = collection.with_options(
-                write_concern=WriteConcern(w="majority", wtimeout=5000)
+        record = None
+        if idempotency_key:
+            try:
+                record, is_new = idempotency_store.begin(idempotency_key, request.collection, request.document)
+            except IdempotencyConflict as e:
+                raise HTTPException(status_code=409, detail=str(e))
+            if not is_new and record['status'] == "committed":
+                logger.info(f"♻️ Повтор запроса {idempotency_key}: возвращен исходный результат")
+                return _safe_write_response(request, record['document_id'], record.get('operation_time'), True)
+        
+        _raise_if_rejected(validation)
+        
+        with client.start_session(causal_consistency=True) as session:
+            if record is not None:
+                insert_once(collection_with_concern, request.document, record['document_id'], session=session)
+                inserted_id = record['document_id']
+            else:
+                inserted_id = collection_with_concern.insert_one(request.document, session=session).inserted_id
+            operation_time = session.operation_time
+        _remember_operation_time(request.session_id, operation_time)
+        if record is not None:
+            idempotency_store.complete(idempotency_key, _format_cluster_time(operation_time))
+        logger.info(f"✅ Безопасная запись выполнена: {inserted_id}")
+        
+        return _safe_write_response(request, inserted_id, _format_cluster_time(operation_time), False)
+    except HTTPException:
+        raise
+    except Exception as e:
+        logger.error(f"❌ Ошибка записи: {e}")
+        raise HTTPException(status_code=500, detail=str(e))
+
+def _safe_write_response(request: WriteRequest, inserted_id, operation_time: Optional[str], replayed: bool,
+                         buffered: bool = False):
+    return {
+        "status": "success",
+        "message": "Документ записан с гарантией согласованности",
+        "inserted_id": str(inserted_id),
+        "write_concern": request.write_concern,
+        "session_id": request.session_id,
+        "operation_time": operation_time,
+        "idempotent_replay": replayed,
+        "buffered_during_election": buffered
+    }
+
+async def _buffered_write(request: WriteRequest, idempotency_key: Optional[str]):
+    """Придержать запись до выбора нового Primary, но не дольше дедлайна запроса"""
+    deadline_seconds = min(request.deadline_seconds or WRITE_BUFFER_DEADLINE_SECONDS, WRITE_BUFFER_MAX_DEADLINE_SECONDS)
+    document_id = request.document.get('_id', ObjectId())
+    idempotency = None
+    if idempotency_key:
+        idempotency = (idempotency_key, IdempotencyStore.request_hash(request.collection, request.document))
+    pending = write_buffer.submit(
+        request.collection,
+        {**request.document, "_id": document_id},
+        time.monotonic() + deadline_seconds,
+        idempotency
+    )
+    if pending is None:
+        raise HTTPException(status_code=503, detail="Нет доступного Primary узла, буфер записей заполнен")
+    
+    logger.info(f"🧺 Запись {document_id} в буфере до выбора Primary (дедлайн {deadline_seconds}s)")
+    if not await asyncio.to_thread(pending.done.wait, deadline_seconds):
+        if write_buffer.abandon(pending):
+            raise HTTPException(
+                status_code=503,
+                detail=f"Primary не выбран за {deadline_seconds}s, запись не выполнена"
             )
-        else:
-            collection_with_concern = collection
+        # Запись уже отправлена - дождаться подтверждения majority
+        if not await asyncio.to_thread(pending.done.wait, 10):
+            raise HTTPException(status_code=504, detail="Результат буферизованной записи неизвестен, повторите с тем же ключом")
+    if pending.error:
+        raise HTTPException(status_code=409 if pending.conflict else 500, detail=pending.error)
+    return pending.document_id
+
+@app.post("/write/batch")
+async def safe_batch_write(request: BatchWriteRequest, http_request: Request):
+    """
+    Пакетная запись: валидация всего пакета за один проход, затем один insert_many
+    """
+    try:
+        if not request.documents:
+            raise HTTPException(status_code=400, detail="Пустой пакет документов")
+        if len(request.documents) > MAX_BATCH_SIZE:
+            raise HTTPException(status_code=400, detail=f"Пакет больше {MAX_BATCH_SIZE} документов")
+        await _admit_write(http_request, request.collection, request.priority, request.client_id,
+                           len(request.documents))
         
-        rs_status = client.admin.command('replSetGetStatus')
-        primary_count = sum(1 for member in rs_status['members'] if member['stateStr'] == 'PRIMARY')
+        collection_with_concern = _collection_with_concern(request.collection, request.write_concern)
         
-        if primary_count == 0:
-            raise HTTPException(status_code=503, detail="Нет доступного Primary узла")
+        _enforce_validation(request.collection, request.documents, request.write_concern)
         
-        result = collection_with_concern.insert_one(request.document)
-        logger.info(f"✅ Безопасная запись выполнена: {result.inserted_id}")
+        with client.start_session(causal_consistency=True) as session:
+            result = collection_with_concern.insert_many(request.documents, ordered=request.ordered, session=session)
+            operation_time = session.operation_time
+        _remember_operation_time(request.session_id, operation_time)
+        logger.info(f"✅ Пакетная запись выполнена: {len(result.inserted_ids)} документов")
         
         return {
             "status": "success",
-            "message": "Документ записан с гарантией согласованности",
-            "inserted_id": str(result.inserted_id),
-            "write_concern": request.write_concern
+            "message": "Пакет записан с гарантией согласованности",
+            "inserted_count": len(result.inserted_ids),
+            "inserted_ids": [str(i) for i in result.inserted_ids],
+            "write_concern": request.write_concern,
+            "session_id": request.session_id,
+            "operation_time": _format_cluster_time(operation_time)
         }
+    except HTTPException:
+        raise
     except Exception as e:
-        logger.error(f"❌ Ошибка записи: {e}")
+        logger.error(f"❌ Ошибка пакетной записи: {e}")
         raise HTTPException(status_code=500, detail=str(e))
 
+@app.get("/read/safe")
+@guarded(mongo_guard, stale=False)
+async def safe_read(
+    collection: str,
+    filter: str = "{}",
+    projection: Optional[str] = None,
+    limit: int = 20,
+    read_concern: str = "majority",
+    read_preference: str = "primary",
+    max_staleness_seconds: Optional[int] = None,
+    session_id: Optional[str] = None,
+    after_cluster_time: Optional[str] = None
+):
+    """
+    Согласованное чтение с выбором readConcern и readPreference
+    
+    Причинная согласованность: чтение внутри causal-сессии с afterClusterTime,
+    взятым из operation_time записи (явно или по session_id клиента),
+    поэтому чтение с Secondary гарантированно видит собственные записи клиента.
+    """
+    try:
+        if read_concern not in READ_CONCERNS:
+            raise HTTPException(status_code=400, detail=f"Неизвестный read_concern: {read_concern}")
+        if read_concern == "linearizable" and read_preference != "primary":
+            raise HTTPException(status_code=400, detail="linearizable чтение возможно только с read_preference=primary")
+        
+        try:
+            query = json.loads(filter)
+            fields = json.loads(projection) if projection else None
+        except json.JSONDecodeError as e:
+            raise HTTPException(status_code=400, detail=f"Некорректный JSON в filter/projection: {e}")
+        
+        limit = max(1, min(limit, 1000))
+        pref = _build_read_preference(read_preference, max_staleness_seconds)
+        
+        after_time = _parse_cluster_time(after_cluster_time) if after_cluster_time else None
+        if session_id:
+            with causal_sessions_lock:
+                known = causal_sessions.get(session_id)
+            if known and (after_time is None or known > after_time):
+                after_time = known
+        
+        # Кэшируются только majority-чтения с Primary: их снимок инвалидируется change stream,
+        # который сам видит только majority-подтвержденные изменения. Отстающий Secondary
+        # мог бы заполнить запись уже после события и отдать старый снимок чтению с Primary
+        cache_key = None
+        if read_concern == "majority" and read_preference == "primary":
+            cache_key = ReadResultCache.make_key(collection, query, fields, limit)
+            cached = read_cache.get(cache_key, after_time)
+            if cached is not None:
+                return _safe_read_response(collection, cached, read_concern, read_preference,
+                                           max_staleness_seconds, session_id, after_time, None, "hit")
+            generation = read_cache.generation(collection)
+        else:
+            read_cache.bypass()
+        
+        coll = client['protected_db'][collection].with_options(
+            read_preference=pref,
+            read_concern=ReadConcern(read_concern)
+        )
+        
+        if read_concern == "linearizable":
+            # linearizable сильнее причинной согласованности и не допускает afterClusterTime
+            documents = list(coll.find(query, fields).limit(limit))
+            operation_time = None
+        else:
+            with client.start_session(causal_consistency=True) as session:
+                if after_time:
+                    session.advance_operation_time(after_time)
+                documents = list(coll.find(query, fields, session=session).limit(limit))
+                operation_time = session.operation_time
+            _remember_operation_time(session_id, operation_time)
+        
+        for doc in documents:
+            if '_id' in doc:
+                doc['_id'] = str(doc['_id'])
+        
+        if cache_key is not None:
+            read_cache.put(cache_key, documents, operation_time, generation)
+        
+        return _safe_read_response(collection, documents, read_concern, read_preference,
+                                   max_staleness_seconds, session_id, after_time, operation_time,
+                                   "miss" if cache_key is not None else "bypass")
+    except HTTPException:
+        raise
+    except Exception as e:
+        logger.error(f"❌ Ошибка чтения: {e}")
+        raise HTTPException(status_code=500, detail=str(e))
+
+def _safe_read_response(collection, documents, read_concern, read_preference, max_staleness_seconds,
+                        session_id, after_time, operation_time, cache_status):
+    return {
+        "status": "success",
+        "collection": collection,
+        "count": len(documents),
+        "documents": documents,
+        "read_concern": read_concern,
+        "read_preference": read_preference,
+        "max_staleness_seconds": max_staleness_seconds,
+        "cache": cache_status,
+        "causal_consistency": {
+            "session_id": session_id,
+            "after_cluster_time": _format_cluster_time(after_time),
+            "operation_time": _format_cluster_time(operation_time)
+        }
+    }
+
+@app.get("/read/cache/stats")
+async def get_read_cache_stats():
+    """Счетчики кэша majority-чтений: попадания, промахи, инвалидации"""
+    return {
+        "success": True,
+        "data": read_cache.snapshot()
+    }
+
+@app.get("/write/buffer/stats")
+async def get_write_buffer_stats():
+    """Состояние буфера записей и итоги последнего окна выборов"""
+    if write_buffer is None:
+        return {
+            "success": True,
+            "data": {"enabled": False}
+        }
+    return {
+        "success": True,
+        "data": {"enabled": True, **write_buffer.snapshot()}
+    }
+
+@app.get("/write/admission/stats")
+async def get_write_admission_stats():
+    """Скорость допуска записей, lag, по которому она выбрана, и счетчики допущенных и отклоненных"""
+    if not admission:
+        return {
+            "success": True,
+            "data": {"enabled": False}
+        }
+    return {
+        "success": True,
+        "data": {"enabled": True, **admission.snapshot()}
+    }
+
 @app.get("/docker/status")
 async def get_docker_status():
     """Получить статус Docker контейнеров"""
@@ -325,48 +879,78 @@ async def start_container(request: DockerRequest):
             "error": str(e)
         }
 
+def _collect_alerts(view: ClusterView) -> List[Dict[str, Any]]:
+    alerts = []
+    
+    if view.primary_count == 0:
+        alerts.append({
+            "level": "CRITICAL",
+            "type": "NO_PRIMARY",
+            "message": "Primary узел не найден"
+        })
+    elif view.primary_count > 1:
+        alerts.append({
+            "level": "CRITICAL",
+            "type": "SPLIT_BRAIN",
+            "message": "Обнаружено более одного Primary"
+        })
+    
+    for member in view.unhealthy:
+        alerts.append({
+            "level": "WARNING",
+            "type": "UNHEALTHY_NODE",
+            "node": member.name,
+            "message": f"{member.name} недоступен"
+        })
+    
+    return alerts
+
+def _snapshot_alerts(snapshot) -> List[Dict[str, Any]]:
+    if snapshot.shard_views or snapshot.shard_errors:
+        # За mongos алерты каждого шарда помечаются его id
+        alerts = [
+            {**alert, "shard": shard}
+            for shard, view in snapshot.shard_views.items()
+            for alert in _collect_alerts(view)
+        ]
+        alerts.extend({
+            "level": "CRITICAL",
+            "type": "SHARD_UNREACHABLE",
+            "shard": shard,
+            "message": f"Шард {shard} недоступен: {reason}"
+        } for shard, reason in snapshot.shard_errors.items())
+        return alerts
+    if snapshot.view is None:
+        # Недоступность кластера - сама по себе алерт, а не пустой список
+        return [{
+            "level": "CRITICAL",
+            "type": "CLUSTER_UNAVAILABLE",
+            "message": f"Статус кластера недоступен: {snapshot.error}"
+        }]
+    return _collect_alerts(snapshot.view)
+
+def _evaluate_alerts(snapshot):
+    alert_engine.evaluate(_snapshot_alerts(snapshot))
+
+topology_cache.listeners.append(_evaluate_alerts)
+
 @app.get("/alerts")
+@guarded(mongo_guard)
 async def get_alerts():
     try:
-        rs_status = client.admin.command('replSetGetStatus')
-        alerts = []
-        
-        primary_count = sum(1 for m in rs_status['members'] if m['stateStr'] == 'PRIMARY')
-        if primary_count == 0:
-            alerts.append({
-                "level": "CRITICAL",
-                "type": "NO_PRIMARY",
-                "message": "Primary узел не найден"
-            })
-        elif primary_count > 1:
-            alerts.append({
-                "level": "CRITICAL",
-                "type": "SPLIT_BRAIN",
-                "message": "Обнаружено более одного Primary"
-            })
-        
-        unhealthy = [m for m in rs_status['members'] if m['health'] != 1]
-        for member in unhealthy:
-            alerts.append({
-                "level": "WARNING",
-                "type": "UNHEALTHY_NODE",
-                "message": f"{member['name']} недоступен"
-            })
+        # Если фоновое обновление отстало, current() обновит снимок и алерты синхронно
+        topology_cache.current(client)
         
         return {
             "success": True,
             "data": {
-                "alerts": alerts
+                "alerts": alert_engine.current(),
+                "evaluated_at": alert_engine.evaluated_at
             }
         }
     except Exception as e:
-        logger.error(f"Error getting alerts: {e}")
-        return {
-            "success": True,
-            "data": {
-                "alerts": []
-            }
-        }
+        logger.error(f"❌ Ошибка получения алертов: {e}")
+        raise HTTPException(status_code=500, detail=str(e))
 
 if __name__ == "__main__":
     import uvicorn
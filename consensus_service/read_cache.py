@@ -0,0 +1,180 @@
+import json
+import threading
+import time
+import logging
+from collections import OrderedDict
+from typing import Any, Dict, List, Optional, Tuple
+
+from bson.timestamp import Timestamp
+
+logger = logging.getLogger(__name__)
+
+
+class CacheEntry:
+    __slots__ = ("documents", "as_of", "stored_at")
+
+    def __init__(self, documents: List[Dict[str, Any]], as_of: Optional[Timestamp], stored_at: float):
+        self.documents = documents
+        self.as_of = as_of
+        self.stored_at = stored_at
+
+
+class ReadResultCache:
+    """
+    Ограниченный LRU/TTL кэш результатов majority-чтений с Primary
+
+    Ключ - (коллекция, запрос, проекция, limit). Записи коллекции сбрасываются
+    по событиям change stream на её namespace; пока change stream не работает,
+    кэш не отдает ничего, так как инвалидация не гарантирована. Каждое открытие
+    change stream начинает новую эпоху: результат чтения, начатого раньше, мог
+    пропустить изменение до открытия потока и в кэш не попадает.
+    """
+
+    def __init__(self, max_entries: int = 1024, ttl_seconds: float = 30):
+        self.max_entries = max_entries
+        self.ttl_seconds = ttl_seconds
+        self.entries: "OrderedDict[Tuple, CacheEntry]" = OrderedDict()
+        self.keys_by_collection: Dict[str, set] = {}
+        self.generations: Dict[str, int] = {}
+        self.epoch = 0
+        self.watching = False
+        self.stats = {
+            "hits": 0,
+            "misses": 0,
+            "bypassed": 0,
+            "stores": 0,
+            "stale_rejections": 0,
+            "expired": 0,
+            "evictions": 0,
+            "invalidations": 0,
+            "invalidated_entries": 0,
+            "full_flushes": 0
+        }
+        self._lock = threading.Lock()
+
+    @staticmethod
+    def make_key(collection: str, query: Dict, projection: Optional[Dict], limit: int) -> Tuple:
+        return (
+            collection,
+            json.dumps(query, sort_keys=True, default=str),
+            json.dumps(projection, sort_keys=True, default=str) if projection else None,
+            limit
+        )
+
+    def generation(self, collection: str) -> Tuple[int, int]:
+        with self._lock:
+            return self.epoch, self.generations.get(collection, 0)
+
+    def bypass(self):
+        with self._lock:
+            self.stats["bypassed"] += 1
+
+    def get(self, key: Tuple, after_time: Optional[Timestamp] = None) -> Optional[List[Dict[str, Any]]]:
+        with self._lock:
+            entry = self.entries.get(key)
+            if entry is None or not self.watching:
+                self.stats["misses"] += 1
+                return None
+            if time.monotonic() - entry.stored_at > self.ttl_seconds:
+                self._remove(key)
+                self.stats["expired"] += 1
+                self.stats["misses"] += 1
+                return None
+            # Клиент уже видел более позднее состояние кластера - снимок из кэша слишком старый
+            if after_time is not None and (entry.as_of is None or entry.as_of < after_time):
+                self.stats["stale_rejections"] += 1
+                self.stats["misses"] += 1
+                return None
+            self.entries.move_to_end(key)
+            self.stats["hits"] += 1
+            return entry.documents
+
+    def put(self, key: Tuple, documents: List[Dict[str, Any]], as_of: Optional[Timestamp],
+            generation: Tuple[int, int]):
+        collection = key[0]
+        with self._lock:
+            # Пока шло чтение, пришло событие изменения или открылся новый change stream - результат мог устареть
+            if not self.watching or (self.epoch, self.generations.get(collection, 0)) != generation:
+                return
+            self.entries[key] = CacheEntry(documents, as_of, time.monotonic())
+            self.entries.move_to_end(key)
+            self.keys_by_collection.setdefault(collection, set()).add(key)
+            self.stats["stores"] += 1
+            while len(self.entries) > self.max_entries:
+                oldest = next(iter(self.entries))
+                self._remove(oldest)
+                self.stats["evictions"] += 1
+
+    def invalidate_collection(self, collection: str):
+        with self._lock:
+            self.generations[collection] = self.generations.get(collection, 0) + 1
+            keys = self.keys_by_collection.pop(collection, set())
+            for key in keys:
+                self.entries.pop(key, None)
+            self.stats["invalidations"] += 1
+            self.stats["invalidated_entries"] += len(keys)
+
+    def flush(self):
+        with self._lock:
+            for collection in list(self.generations) + list(self.keys_by_collection):
+                self.generations[collection] = self.generations.get(collection, 0) + 1
+            self.stats["invalidated_entries"] += len(self.entries)
+            self.entries.clear()
+            self.keys_by_collection.clear()
+            self.stats["full_flushes"] += 1
+
+    def set_watching(self, watching: bool):
+        if not watching:
+            self.flush()
+        with self._lock:
+            if watching:
+                self.epoch += 1
+            self.watching = watching
+
+    def _remove(self, key: Tuple):
+        self.entries.pop(key, None)
+        keys = self.keys_by_collection.get(key[0])
+        if keys is not None:
+            keys.discard(key)
+            if not keys:
+                del self.keys_by_collection[key[0]]
+
+    def snapshot(self) -> Dict:
+        with self._lock:
+            lookups = self.stats["hits"] + self.stats["misses"]
+            return {
+                "enabled": self.watching,
+                "entries": len(self.entries),
+                "max_entries": self.max_entries,
+                "ttl_seconds": self.ttl_seconds,
+                "hit_ratio": round(self.stats["hits"] / lookups, 3) if lookups else None,
+                **self.stats
+            }
+
+
+def watch_invalidations(get_client, database: str, cache: ReadResultCache, stop: threading.Event):
+    """Слушать change stream базы и сбрасывать кэш по namespace изменившейся коллекции"""
+    while not stop.is_set():
+        try:
+            client = get_client()
+            if client is None:
+                stop.wait(5)
+                continue
+            with client[database].watch(max_await_time_ms=1000) as stream:
+                cache.set_watching(True)
+                logger.info(f"👁️ Change stream для инвалидации кэша чтений запущен ({database})")
+                while not stop.is_set() and stream.alive:
+                    event = stream.try_next()
+                    if event is None:
+                        continue
+                    operation = event.get('operationType')
+                    if operation in ('dropDatabase', 'invalidate'):
+                        cache.flush()
+                    elif 'ns' in event and event['ns'].get('coll'):
+                        cache.invalidate_collection(event['ns']['coll'])
+                        if operation == 'rename' and event.get('to', {}).get('coll'):
+                            cache.invalidate_collection(event['to']['coll'])
+        except Exception as e:
+            logger.warning(f"⚠️ Change stream недоступен, кэш чтений отключен: {e}")
+        cache.set_watching(False)
+        stop.wait(5)
@@ -0,0 +1,161 @@
+import threading
+import time
+import logging
+from typing import Callable, Dict, List, Optional
+
+from common.cluster_view import ClusterView, topology_version
+from common.sharding import ShardFanout
+
+logger = logging.getLogger(__name__)
+
+
+class TopologySnapshot:
+    """Сжатая сводка replSetGetStatus, достаточная для решений о записи"""
+
+    def __init__(self, rs_status: Optional[Dict] = None, error: Optional[str] = None):
+        self.refreshed_at = time.monotonic()
+        self.error = error
+        # Исключение, из-за которого снимок не получен: по нему видно, что кластер недоступен
+        self.failure: Optional[BaseException] = None
+        self.view: Optional[ClusterView] = ClusterView(rs_status) if rs_status is not None else None
+        view = self.view
+        self.set_name = view.set_name if view else None
+        self.term = view.term if view else None
+        self.primary: Optional[str] = view.primary.name if view and view.primary else None
+        self.primary_count = view.primary_count if view else 0
+        self.secondary_count = view.secondary_count if view else 0
+        self.healthy_count = view.healthy_count if view else 0
+        self.total = view.total if view else 0
+        self.majority = view.majority if view else 1
+        self.voting_members: Optional[int] = view.voting_members if view else None
+        self.secondary_lags: Dict[str, float] = view.secondary_lags if view else {}
+        self.majority_lag_seconds = view.majority_lag_seconds if view else 0.0
+        self.max_lag_seconds = view.max_lag_seconds if view else 0.0
+        self.commit_lag_seconds = view.commit_lag_seconds if view else 0.0
+        # За mongos: снимки шардов и config-серверов, из которых собрана сводка
+        self.shard_views: Dict[str, ClusterView] = {}
+        self.shard_errors: Dict[str, str] = {}
+
+    @classmethod
+    def from_shards(cls, views: Dict[str, ClusterView], errors: Dict[str, str]) -> "TopologySnapshot":
+        """
+        Сводка шардированного кластера для решений о записи
+
+        Запись может попасть в любой шард, поэтому кворум берется по худшему
+        шарду, lag - максимальный среди шардов, а Primary считается единственным,
+        только если он ровно один в каждом шарде. Недоступный шард - ошибка снимка.
+        """
+        error = None
+        if errors:
+            error = "Недоступны шарды: " + ", ".join(f"{shard} ({reason})" for shard, reason in sorted(errors.items()))
+        elif not views:
+            error = "mongos не вернул ни одного шарда"
+        snapshot = cls(error=error)
+        snapshot.shard_views = views
+        snapshot.shard_errors = errors
+        if not views:
+            return snapshot
+        primary_counts = [view.primary_count for view in views.values()]
+        snapshot.primary_count = 0 if 0 in primary_counts else max(primary_counts)
+        snapshot.primary = ", ".join(
+            f"{shard}/{member.name}" for shard, view in views.items() for member in view.primaries
+        ) or None
+        snapshot.secondary_count = sum(view.secondary_count for view in views.values())
+        worst = min(views.values(), key=lambda view: view.healthy_count - view.majority)
+        snapshot.healthy_count = worst.healthy_count
+        snapshot.total = worst.total
+        snapshot.majority = worst.majority
+        # w:N уходит в каждый шард: одно N для всех есть, только если шарды одного размера
+        voting = {view.voting_members for view in views.values()}
+        snapshot.voting_members = voting.pop() if len(voting) == 1 else None
+        snapshot.secondary_lags = {
+            name: lag for view in views.values() for name, lag in view.secondary_lags.items()
+        }
+        snapshot.majority_lag_seconds = max(view.majority_lag_seconds for view in views.values())
+        snapshot.max_lag_seconds = max(view.max_lag_seconds for view in views.values())
+        snapshot.commit_lag_seconds = max(view.commit_lag_seconds for view in views.values())
+        return snapshot
+
+    @property
+    def version(self) -> Optional[str]:
+        """Версия топологии снимка; None - снимок с ошибкой"""
+        if self.view is not None:
+            return self.view.version
+        if self.shard_views and not self.shard_errors:
+            return topology_version(self.shard_views, self.shard_errors)
+        return None
+
+    @property
+    def age_seconds(self) -> float:
+        return time.monotonic() - self.refreshed_at
+
+    def to_dict(self) -> Dict:
+        return {
+            "replica_set": self.set_name,
+            "term": self.term,
+            "primary": self.primary,
+            "primary_nodes": self.primary_count,
+            "secondary_nodes": self.secondary_count,
+            "healthy_nodes": self.healthy_count,
+            "total_nodes": self.total,
+            "majority": self.majority,
+            "voting_members": self.voting_members,
+            "majority_lag_seconds": None if self.majority_lag_seconds == float('inf') else round(self.majority_lag_seconds, 2),
+            "max_lag_seconds": round(self.max_lag_seconds, 2),
+            "commit_lag_seconds": None if self.commit_lag_seconds == float('inf') else round(self.commit_lag_seconds, 2),
+            "age_seconds": round(self.age_seconds, 2),
+            "error": self.error,
+            **({"shards": sorted(self.shard_views), "unreachable_shards": self.shard_errors}
+               if self.shard_views or self.shard_errors else {})
+        }
+
+
+class TopologyCache:
+    """Фоновое обновление снимка топологии, чтобы запись не платила за replSetGetStatus"""
+
+    def __init__(self, refresh_seconds: float = 1.0, max_age_seconds: float = 5.0, uri: Optional[str] = None):
+        self.refresh_seconds = refresh_seconds
+        self.max_age_seconds = max_age_seconds
+        self.snapshot = TopologySnapshot(error="not refreshed yet")
+        self.snapshot.refreshed_at = float('-inf')
+        self._lock = threading.Lock()
+        # Если uri указывает на mongos, снимок собирается со всех шардов
+        self.shards = ShardFanout(uri) if uri is not None else None
+        # Вызываются с каждым новым снимком (например, оценка правил алертов)
+        self.listeners: List[Callable[[TopologySnapshot], None]] = []
+
+    def refresh(self, client) -> TopologySnapshot:
+        try:
+            if self.shards is not None and self.shards.is_sharded(client):
+                snapshot = TopologySnapshot.from_shards(*self.shards.views(client))
+            else:
+                snapshot = TopologySnapshot(client.admin.command('replSetGetStatus'))
+        except Exception as e:
+            snapshot = TopologySnapshot(error=str(e))
+            snapshot.failure = e
+        with self._lock:
+            self.snapshot = snapshot
+        for listener in self.listeners:
+            try:
+                listener(snapshot)
+            except Exception as e:
+                logger.error(f"❌ Ошибка обработчика снимка топологии: {e}")
+        return snapshot
+
+    def current(self, client) -> TopologySnapshot:
+        """Кэшированный снимок; если фон отстал дольше max_age - обновить синхронно"""
+        snapshot = self.snapshot
+        if snapshot.age_seconds > self.max_age_seconds:
+            snapshot = self.refresh(client)
+        return snapshot
+
+    def run(self, get_client, stop: threading.Event):
+        while not stop.is_set():
+            client = get_client()
+            if client is not None:
+                self.refresh(client)
+            stop.wait(self.refresh_seconds)
+
+    def close(self):
+        if self.shards is not None:
+            self.shards.close()
@@ -0,0 +1,138 @@
+import json
+import os
+import logging
+from typing import Any, Callable, Dict, List, Optional
+
+import bson
+import fastjsonschema
+
+from topology import TopologySnapshot
+
+logger = logging.getLogger(__name__)
+
+SAFE_WRITE_CONCERNS = ("majority", "all")
+
+
+def load_schemas(path: str) -> Dict[str, Callable]:
+    """
+    Загрузить JSON-схемы коллекций {"collection": {...schema...}} и скомпилировать их один раз
+    """
+    if not path or not os.path.exists(path):
+        logger.info(f"📐 Файл схем {path} не найден - проверка схем отключена")
+        return {}
+    with open(path, encoding='utf-8') as f:
+        raw = json.load(f)
+    compiled = {name: fastjsonschema.compile(schema) for name, schema in raw.items()}
+    logger.info(f"📐 Скомпилировано JSON-схем: {len(compiled)}")
+    return compiled
+
+
+class WriteValidator:
+    """
+    Проверки перед записью: схема, размер документа, кворум и бюджет lag
+
+    Проверки кластера выполняются один раз на операцию по кэшированному снимку топологии,
+    проверки документов - в одном проходе по пакету без обращений к MongoDB. Наличие
+    Primary можно передать по событиям драйвера (primary_available): во время выборов
+    снимок еще несколько секунд показывает прежний Primary.
+    """
+
+    def __init__(self, schemas: Dict[str, Callable], max_document_bytes: int, lag_budget_seconds: float):
+        self.schemas = schemas
+        self.max_document_bytes = max_document_bytes
+        self.lag_budget_seconds = lag_budget_seconds
+
+    def check_cluster(self, snapshot: TopologySnapshot, write_concern: str,
+                      primary_available: Optional[bool] = None) -> List[Dict[str, Any]]:
+        checks = []
+        if snapshot.error:
+            checks.append({"check": "topology", "passed": False, "blocking": True,
+                           "message": f"Статус кластера недоступен: {snapshot.error}"})
+            return checks
+
+        if primary_available is None:
+            primary_available = snapshot.primary_count > 0
+        if not primary_available:
+            checks.append({"check": "primary", "passed": False, "blocking": True,
+                           "message": "Нет доступного Primary узла"})
+        elif snapshot.primary_count > 1:
+            checks.append({"check": "primary", "passed": False, "blocking": True,
+                           "message": "Обнаружено более одного Primary (Split-Brain)"})
+        else:
+            checks.append({"check": "primary", "passed": True, "blocking": True,
+                           "message": f"Primary: {snapshot.primary or 'найден драйвером, снимок обновляется'}"})
+
+        has_quorum = snapshot.healthy_count >= snapshot.majority
+        checks.append({"check": "quorum", "passed": has_quorum, "blocking": write_concern in SAFE_WRITE_CONCERNS,
+                       "message": f"Доступно {snapshot.healthy_count} из {snapshot.total}, нужно {snapshot.majority}"})
+
+        if write_concern == "all":
+            all_up = snapshot.voting_members is not None and snapshot.healthy_count >= snapshot.voting_members
+            checks.append({"check": "all_members", "passed": all_up, "blocking": True,
+                           "message": f"Доступно {snapshot.healthy_count} из "
+                                      f"{snapshot.voting_members or 'разного числа в шардах'} подтверждающих узлов"})
+
+        lag = snapshot.max_lag_seconds if write_concern == "all" else snapshot.majority_lag_seconds
+        within_budget = lag <= self.lag_budget_seconds
+        checks.append({"check": "lag_budget", "passed": within_budget, "blocking": write_concern in SAFE_WRITE_CONCERNS,
+                       "message": f"Lag подтверждающих узлов {lag if lag != float('inf') else 'N/A'}s "
+                                  f"(бюджет {self.lag_budget_seconds}s)"})
+
+        checks.append({"check": "write_concern", "passed": write_concern in SAFE_WRITE_CONCERNS, "blocking": False,
+                       "message": f"writeConcern {write_concern}"
+                                  + ("" if write_concern in SAFE_WRITE_CONCERNS else " не гарантирует защиту от UBI.136")})
+        return checks
+
+    def check_documents(self, collection: str, documents: List[Dict[str, Any]]) -> List[Dict[str, Any]]:
+        """Ошибки по документам пакета: [{"index": i, "errors": [...]}] только для невалидных"""
+        schema = self.schemas.get(collection)
+        failures = []
+        for index, document in enumerate(documents):
+            errors = []
+            size = len(bson.encode(document))
+            if size > self.max_document_bytes:
+                errors.append(f"Размер документа {size} байт превышает {self.max_document_bytes}")
+            if schema is not None:
+                try:
+                    schema(document)
+                except fastjsonschema.JsonSchemaException as e:
+                    errors.append(f"Нарушение схемы: {e.message}")
+            if errors:
+                failures.append({"index": index, "errors": errors})
+        return failures
+
+    def validate(self, collection: str, documents: List[Dict[str, Any]], write_concern: str,
+                 snapshot: TopologySnapshot, primary_available: Optional[bool] = None) -> Dict[str, Any]:
+        checks = self.check_cluster(snapshot, write_concern, primary_available)
+        has_primary = snapshot.primary_count > 0 if primary_available is None else primary_available
+        document_errors = self.check_documents(collection, documents)
+
+        blocking_failures = [c for c in checks if c['blocking'] and not c['passed']]
+        warnings = [c['message'] for c in checks if not c['blocking'] and not c['passed']]
+        can_execute = not blocking_failures and not document_errors
+        is_safe = can_execute and all(c['passed'] for c in checks)
+
+        if not can_execute:
+            recommendation = "❌ Операция будет отклонена: " + "; ".join(
+                [c['message'] for c in blocking_failures] + [f"документ #{d['index']}: {', '.join(d['errors'])}" for d in document_errors]
+            )
+        elif not is_safe:
+            recommendation = "⚠️ Операция возможна, но используйте writeConcern majority"
+        else:
+            recommendation = "✅ Операция безопасна"
+
+        return {
+            "is_safe": is_safe,
+            "can_execute": can_execute,
+            "primary_available": has_primary,
+            "split_brain": snapshot.primary_count > 1,
+            "collection": collection,
+            "write_concern": write_concern,
+            "documents_checked": len(documents),
+            "schema_enforced": collection in self.schemas,
+            "checks": checks,
+            "document_errors": document_errors,
+            "warnings": warnings,
+            "recommendation": recommendation,
+            "cluster_health": snapshot.to_dict()
+        }
@@ -0,0 +1,332 @@
+import os
+import threading
+import time
+import logging
+from collections import deque
+from typing import Any, Deque, Dict, List, Optional, Tuple
+
+import bson
+from pymongo import WriteConcern, monitoring
+from pymongo.errors import BulkWriteError
+
+from idempotency import IdempotencyConflict
+
+logger = logging.getLogger(__name__)
+
+DUPLICATE_KEY = 11000
+
+
+class PrimaryWatcher(monitoring.TopologyListener):
+    """Отслеживает появление/исчезновение Primary по событиям топологии драйвера"""
+
+    def __init__(self, on_change):
+        self.primary_available = threading.Event()
+        self._on_change = on_change
+
+    def opened(self, event):
+        pass
+
+    def description_changed(self, event):
+        writable = event.new_description.has_writable_server()
+        was_writable = event.previous_description.has_writable_server()
+        if writable:
+            self.primary_available.set()
+        else:
+            self.primary_available.clear()
+        if writable != was_writable:
+            self._on_change(writable)
+
+    def closed(self, event):
+        self.primary_available.clear()
+
+
+class PendingWrite:
+    __slots__ = ("seq", "collection", "document", "document_id", "idempotency", "deadline", "state", "error",
+                 "conflict", "done")
+
+    def __init__(self, seq: int, collection: str, document: Optional[Dict[str, Any]], deadline: float,
+                 idempotency: Optional[Tuple[str, str]] = None):
+        self.seq = seq
+        self.collection = collection
+        self.document = document
+        self.document_id = document["_id"]
+        # (ключ, хеш запроса): ключ резервируется при сливе, когда Primary уже есть
+        self.idempotency = idempotency
+        self.deadline = deadline
+        self.state = "queued"
+        self.error: Optional[str] = None
+        # Ключ идемпотентности уже занят другим запросом (409, а не 500)
+        self.conflict = False
+        self.done = threading.Event()
+
+
+class FailoverWriteBuffer:
+    """
+    Буфер записей на время выборов Primary
+
+    Порядок сохраняется: пока в файле есть вытесненные записи, новые тоже пишутся
+    в файл, а сливается сначала память, затем файл. После появления Primary буфер
+    сливается пакетами insert_many(ordered=True) с writeConcern majority. Записи,
+    чей дедлайн истек до отправки, не пишутся - вызывающий уже получил отказ.
+    Ключи идемпотентности записей резервируются перед вставкой пакета: повтор
+    уже выполненного запроса получает его _id и становится already_committed.
+    """
+
+    def __init__(self, max_entries: int, memory_entries: int, spill_dir: str, batch_size: int):
+        self.max_entries = max_entries
+        self.memory_entries = memory_entries
+        self.batch_size = batch_size
+        self.spill_path = os.path.join(spill_dir, "write_buffer.bson")
+        os.makedirs(spill_dir, exist_ok=True)
+        # Файл с прошлого запуска не сливаем: его ожидающие уже получили отказ
+        open(self.spill_path, 'wb').close()
+        self.memory: Deque[PendingWrite] = deque()
+        self.pending: Dict[int, PendingWrite] = {}
+        self.spilled = 0
+        self.spill_read_pos = 0
+        self.next_seq = 0
+        self.watcher = PrimaryWatcher(self._on_primary_change)
+        self.drain_wakeup = threading.Event()
+        self.stats = {
+            "buffered": 0,
+            "spilled_to_disk": 0,
+            "drained": 0,
+            "already_committed": 0,
+            "failed": 0,
+            "expired": 0,
+            "rejected_full": 0,
+            "elections": 0
+        }
+        self.current_window: Optional[Dict[str, Any]] = None
+        self.last_window: Optional[Dict[str, Any]] = None
+        self._lock = threading.Lock()
+
+    def __len__(self):
+        return len(self.memory) + self.spilled
+
+    def _on_primary_change(self, writable: bool):
+        with self._lock:
+            if not writable:
+                self.stats["elections"] += 1
+                self.current_window = {
+                    "started_at": time.time(),
+                    "ended_at": None,
+                    "buffered": 0,
+                    "drained": 0,
+                    "expired": 0,
+                    "rejected_full": 0,
+                    "drain_seconds": None
+                }
+                logger.warning("⚠️ Primary недоступен - записи буферизуются")
+            elif self.current_window is not None:
+                self.current_window["ended_at"] = time.time()
+                logger.info(f"✅ Новый Primary обнаружен, в буфере {len(self)} записей")
+        if writable:
+            self.drain_wakeup.set()
+
+    def _count(self, key: str, amount: int = 1):
+        self.stats[key] += amount
+        if self.current_window is not None and key in self.current_window:
+            self.current_window[key] += amount
+
+    def submit(self, collection: str, document: Dict[str, Any], deadline: float,
+               idempotency: Optional[Tuple[str, str]] = None) -> Optional[PendingWrite]:
+        """Поставить запись в буфер; None если буфер заполнен"""
+        with self._lock:
+            if len(self) >= self.max_entries:
+                self._count("rejected_full")
+                return None
+            self.next_seq += 1
+            pending = PendingWrite(self.next_seq, collection, document, deadline, idempotency)
+            self.pending[pending.seq] = pending
+            if self.spilled or len(self.memory) >= self.memory_entries:
+                with open(self.spill_path, 'ab') as f:
+                    f.write(bson.encode({"seq": pending.seq, "collection": collection, "document": document}))
+                pending.document = None
+                self.spilled += 1
+                self._count("spilled_to_disk")
+            else:
+                self.memory.append(pending)
+            self._count("buffered")
+        if self.watcher.primary_available.is_set():
+            self.drain_wakeup.set()
+        return pending
+
+    def abandon(self, pending: PendingWrite) -> bool:
+        """Дедлайн вызывающего истек; True если запись гарантированно не будет выполнена"""
+        with self._lock:
+            if pending.state == "queued":
+                pending.state = "expired"
+                self._count("expired")
+                return True
+            return False
+
+    def _take_batch(self) -> List[PendingWrite]:
+        batch: List[PendingWrite] = []
+        with self._lock:
+            while len(batch) < self.batch_size and (self.memory or self.spilled):
+                if self.memory:
+                    candidate = self.memory.popleft()
+                else:
+                    candidate = self._read_spilled()
+                    if candidate is None:
+                        break
+                if candidate.state == "expired":
+                    self.pending.pop(candidate.seq, None)
+                    continue
+                if batch and candidate.collection != batch[0].collection:
+                    # Пакет - только подряд идущие записи одной коллекции
+                    self.memory.appendleft(candidate)
+                    break
+                candidate.state = "in_flight"
+                batch.append(candidate)
+        return batch
+
+    def _read_spilled(self) -> Optional[PendingWrite]:
+        with open(self.spill_path, 'rb') as f:
+            f.seek(self.spill_read_pos)
+            head = f.read(4)
+            if len(head) < 4:
+                return None
+            record = bson.decode(head + f.read(int.from_bytes(head, 'little') - 4))
+            self.spill_read_pos = f.tell()
+        self.spilled -= 1
+        if self.spilled == 0:
+            open(self.spill_path, 'wb').close()
+            self.spill_read_pos = 0
+        pending = self.pending.get(record["seq"])
+        if pending is None:
+            return self._read_spilled() if self.spilled else None
+        pending.document = record["document"]
+        return pending
+
+    def _finish(self, pending: PendingWrite, error: Optional[str] = None, committed_before: bool = False):
+        with self._lock:
+            pending.state = "done"
+            pending.error = error
+            self.pending.pop(pending.seq, None)
+            if error:
+                self._count("failed")
+            elif committed_before:
+                self._count("already_committed")
+            else:
+                self._count("drained")
+        pending.done.set()
+
+    def _reserve_keys(self, store, batch: List[PendingWrite]) -> List[PendingWrite]:
+        """Зарезервировать ключи идемпотентности пакета; вернуть записи, которые нужно вставить"""
+        ready = []
+        for pending in batch:
+            if pending.idempotency is None or store is None:
+                ready.append(pending)
+                continue
+            key, request_hash = pending.idempotency
+            try:
+                record, _ = store.reserve(key, pending.collection, request_hash, pending.document_id)
+            except IdempotencyConflict as e:
+                pending.conflict = True
+                self._finish(pending, error=str(e))
+                continue
+            # Повтор уже зарезервированного запроса пишется с тем же _id и дубликата не создаст
+            pending.document_id = record['document_id']
+            pending.document["_id"] = record['document_id']
+            ready.append(pending)
+        return ready
+
+    def _complete_keys(self, store, batch: List[PendingWrite]):
+        for pending in batch:
+            if pending.idempotency is None or store is None or pending.state != "done" or pending.error:
+                continue
+            try:
+                store.complete(pending.idempotency[0], None)
+            except Exception as e:
+                # Ключ остается pending: повтор допишет документ с тем же _id и завершит ключ
+                logger.warning(f"⚠️ Ключ {pending.idempotency[0]} не отмечен выполненным: {e}")
+
+    def _write_batch(self, db, batch: List[PendingWrite], store=None):
+        self._insert_batch(db, self._reserve_keys(store, batch))
+        self._complete_keys(store, batch)
+
+    def _insert_batch(self, db, remaining: List[PendingWrite]):
+        if not remaining:
+            return
+        collection = db[remaining[0].collection].with_options(write_concern=WriteConcern(w="majority", wtimeout=5000))
+        while remaining:
+            try:
+                collection.insert_many([p.document for p in remaining], ordered=True)
+                for pending in remaining:
+                    self._finish(pending)
+                return
+            except BulkWriteError as e:
+                if not e.details.get('writeErrors'):
+                    # Документы вставлены, но majority не подтвердилось за wtimeout
+                    for pending in remaining:
+                        self._finish(pending, error="writeConcern majority не подтвержден")
+                    return
+                error = e.details['writeErrors'][0]
+                index = error['index']
+                for pending in remaining[:index]:
+                    self._finish(pending)
+                failed = remaining[index]
+                # Тот же _id уже записан (повтор идемпотентного запроса) - это успех
+                if error['code'] == DUPLICATE_KEY and list(error.get('keyPattern', {'_id': 1})) == ['_id']:
+                    self._finish(failed, committed_before=True)
+                else:
+                    self._finish(failed, error=error.get('errmsg'))
+                remaining = remaining[index + 1:]
+
+    def run(self, get_client, database: str, stop: threading.Event, idempotency_store=None):
+        """Фоновый слив буфера при наличии Primary"""
+        while not stop.is_set():
+            self.drain_wakeup.wait(1)
+            self.drain_wakeup.clear()
+            client = get_client()
+            if client is None or not self.watcher.primary_available.is_set() or not len(self):
+                continue
+            started = time.monotonic()
+            drained_before = self.stats["drained"]
+            while len(self) and self.watcher.primary_available.is_set() and not stop.is_set():
+                batch = self._take_batch()
+                if not batch:
+                    break
+                try:
+                    self._write_batch(client[database], batch, idempotency_store)
+                except Exception as e:
+                    # Primary снова пропал посреди слива - вернуть пакет в начало очереди
+                    logger.error(f"❌ Ошибка слива буфера: {e}")
+                    with self._lock:
+                        for pending in reversed(batch):
+                            if pending.state == "in_flight":
+                                pending.state = "queued"
+                                self.memory.appendleft(pending)
+                    break
+            with self._lock:
+                if self.current_window is not None and self.current_window["ended_at"] and not len(self):
+                    self.current_window["drain_seconds"] = round(time.monotonic() - started, 3)
+                    self.last_window = self.current_window
+                    self.current_window = None
+            logger.info(f"📤 Буфер слит: {self.stats['drained'] - drained_before} записей за {time.monotonic() - started:.2f}s")
+
+    def snapshot(self) -> Dict[str, Any]:
+        with self._lock:
+            last = self.last_window
+            window_report = None
+            if last:
+                election_seconds = last["ended_at"] - last["started_at"]
+                window_report = {
+                    **last,
+                    "election_seconds": round(election_seconds, 3),
+                    "lost": last["expired"] + last["rejected_full"],
+                    "drain_throughput_per_second": round(last["drained"] / last["drain_seconds"], 1)
+                    if last["drain_seconds"] else None
+                }
+            return {
+                "primary_available": self.watcher.primary_available.is_set(),
+                "buffered_now": len(self),
+                "in_memory": len(self.memory),
+                "on_disk": self.spilled,
+                "max_entries": self.max_entries,
+                "totals": dict(self.stats),
+                "current_election_window": dict(self.current_window) if self.current_window else None,
+                "last_election_window": window_report
+            }
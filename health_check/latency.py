@@ -0,0 +1,127 @@
+import threading
+import time
+from datetime import datetime
+from typing import Dict, Optional
+
+from common.hdr import HdrHistogram
+
+
+class MemberLatency:
+    """Статистика задержек для одной пары узлов (опрашиваемый узел -> участник)"""
+
+    def __init__(self):
+        self.ping = HdrHistogram()
+        self.heartbeat_age = HdrHistogram()
+        self.heartbeat_recv_age = HdrHistogram()
+        self.window_ping = HdrHistogram()
+        self.previous_window_ping: Optional[HdrHistogram] = None
+        self.last_ping_ms: Optional[float] = None
+        self.jitter_ms = 0.0
+        self.last_heartbeat = None
+        self.last_sample_at: Optional[datetime] = None
+        # Узел, который отдал replSetGetStatus (за mongos у каждого шарда свой)
+        self.source: Optional[str] = None
+
+    def rotate_window(self):
+        self.previous_window_ping = self.window_ping
+        self.window_ping = HdrHistogram()
+
+    def trend(self) -> str:
+        previous = self.previous_window_ping
+        if previous is None or previous.total == 0 or self.window_ping.total == 0:
+            return "UNKNOWN"
+        before = previous.percentile_ms(95)
+        now = self.window_ping.percentile_ms(95)
+        if now > before * 1.5 and now - before >= 1:
+            return "DEGRADING"
+        if now < before / 1.5 and before - now >= 1:
+            return "IMPROVING"
+        return "STABLE"
+
+
+class NetworkLatencyTracker:
+    """
+    Непрерывный сбор pingMs / lastHeartbeat / lastHeartbeatRecv из replSetGetStatus
+    и накопление гистограмм задержек по каждому участнику
+    """
+
+    def __init__(self, window_seconds: float = 300):
+        self.window_seconds = window_seconds
+        self.members: Dict[str, MemberLatency] = {}
+        self.source: Optional[str] = None
+        self.window_started = time.monotonic()
+        self.samples_taken = 0
+        self.last_error: Optional[str] = None
+        self._lock = threading.Lock()
+
+    def observe(self, rs_status: Dict):
+        """Учесть один снимок replSetGetStatus"""
+        status_date = rs_status.get('date')
+        with self._lock:
+            if time.monotonic() - self.window_started >= self.window_seconds:
+                for stats in self.members.values():
+                    stats.rotate_window()
+                self.window_started = time.monotonic()
+
+            source = next((m['name'] for m in rs_status['members'] if m.get('self')), None)
+            if self.source is None:
+                self.source = source
+            for member in rs_status['members']:
+                if member.get('self'):
+                    continue
+
+                stats = self.members.setdefault(member['name'], MemberLatency())
+                stats.source = source
+                stats.last_sample_at = datetime.now()
+                last_heartbeat = member.get('lastHeartbeat')
+                ping_ms = member.get('pingMs')
+
+                # pingMs обновляется только с новым heartbeat - повторный снимок не считаем
+                if ping_ms is not None and last_heartbeat != stats.last_heartbeat:
+                    stats.ping.record_ms(ping_ms)
+                    stats.window_ping.record_ms(ping_ms)
+                    if stats.last_ping_ms is not None:
+                        # Сглаженный jitter как в RFC 3550
+                        stats.jitter_ms += (abs(ping_ms - stats.last_ping_ms) - stats.jitter_ms) / 16
+                    stats.last_ping_ms = ping_ms
+                stats.last_heartbeat = last_heartbeat
+
+                if status_date and last_heartbeat:
+                    stats.heartbeat_age.record_ms((status_date - last_heartbeat).total_seconds() * 1000)
+                last_heartbeat_recv = member.get('lastHeartbeatRecv')
+                if status_date and last_heartbeat_recv:
+                    stats.heartbeat_recv_age.record_ms((status_date - last_heartbeat_recv).total_seconds() * 1000)
+
+            self.samples_taken += 1
+            self.last_error = None
+
+    def window_p95(self, member_name: str) -> Optional[float]:
+        with self._lock:
+            stats = self.members.get(member_name)
+            if stats is None or stats.window_ping.total < 5:
+                return None
+            return stats.window_ping.percentile_ms(95)
+
+    def snapshot(self) -> Dict:
+        with self._lock:
+            pairs = []
+            for name, stats in self.members.items():
+                pairs.append({
+                    "pair": f"{stats.source}->{name}",
+                    "source": stats.source,
+                    "target": name,
+                    "ping": stats.ping.to_dict(),
+                    "current_window_ping": stats.window_ping.to_dict(),
+                    "jitter_ms": round(stats.jitter_ms, 3),
+                    "heartbeat_age": stats.heartbeat_age.to_dict(),
+                    "heartbeat_recv_age": stats.heartbeat_recv_age.to_dict(),
+                    "trend": stats.trend(),
+                    "last_sample": str(stats.last_sample_at) if stats.last_sample_at else None
+                })
+            return {
+                "source_node": self.source,
+                "samples_taken": self.samples_taken,
+                "window_seconds": self.window_seconds,
+                "last_error": self.last_error,
+                "pairs": pairs
+            }
@@ -1,16 +1,26 @@
 from fastapi import FastAPI, HTTPException
-from pymongo import MongoClient
-from pymongo.errors import ConnectionFailure, ServerSelectionTimeoutError
+from pymongo.errors import ServerSelectionTimeoutError
+from common.backend import create_client
+from common.lifecycle import MongoConnection, lifecycle_router
+from common.mongo_guard import MongoGuard
+from common.responses import FastRoute, guarded, versioned
+from common.cluster_view import ClusterView, ClusterViewCache
+from common.fleet import FleetMonitor, fleet_router
+from common.thresholds import thresholds, thresholds_router
 import os
 import logging
+import threading
+import time
 from datetime import datetime
 from typing import List, Dict
 from fastapi.middleware.cors import CORSMiddleware
+from latency import NetworkLatencyTracker
 
 logging.basicConfig(level=logging.INFO)
 logger = logging.getLogger(__name__)
 
 app = FastAPI(title="Health Check Service", description="Проверка здоровья узлов кластера")
+app.router.route_class = FastRoute
 # CORS Middleware
 app.add_middleware(
     CORSMiddleware,
@@ -20,20 +30,64 @@ app.add_middleware(
     allow_headers=["*"],
 )
 MONGO_URI = os.getenv("MONGO_URI", "mongodb://localhost:27017/?replicaSet=rs0")
+CLUSTER_VIEW_MAX_AGE_SECONDS = float(os.getenv("CLUSTER_VIEW_MAX_AGE_SECONDS", "1"))
+LATENCY_SAMPLE_INTERVAL = float(os.getenv("LATENCY_SAMPLE_INTERVAL", "2"))
+LATENCY_WINDOW_SECONDS = float(os.getenv("LATENCY_WINDOW_SECONDS", "300"))
 client = None
+# Дедлайн операций MongoDB на пути запроса и circuit breaker (MONGO_DEADLINE_SECONDS, MONGO_BREAKER_*)
+mongo_guard = MongoGuard("health_check")
+# Подключение к MongoDB в фоне с повторами; /livez и /readyz для оркестратора
+mongo_connection = MongoConnection("health_check", mongo_guard)
+app.include_router(lifecycle_router(mongo_connection))
+# Разобранный replSetGetStatus общий для всех эндпоинтов в пределах CLUSTER_VIEW_MAX_AGE_SECONDS
+cluster_views = ClusterViewCache(max_age_seconds=CLUSTER_VIEW_MAX_AGE_SECONDS, uri=MONGO_URI)
+
+def _status_version() -> str:
+    """Версия ответов о состоянии: топология кластера и действующие пороги"""
+    return f"{cluster_views.version(client)}-{thresholds.current().version}"
+
+# Реестр кластеров (FLEET_CONFIG) с опросом по расписанию для /fleet/*
+fleet = FleetMonitor.from_env(MONGO_URI)
+app.include_router(fleet_router(fleet))
+app.include_router(thresholds_router())
+
+latency_tracker = NetworkLatencyTracker(window_seconds=LATENCY_WINDOW_SECONDS)
+latency_sampler_stop = threading.Event()
+
+def _sample_network_latency():
+    """Фоновый сбор задержек heartbeat между узлами"""
+    while not latency_sampler_stop.is_set():
+        try:
+            if client is not None and cluster_views.is_sharded(client):
+                # За mongos heartbeat видны только внутри каждого шарда
+                views, _ = cluster_views.current_shards(client)
+                for view in views.values():
+                    latency_tracker.observe(view.status)
+            elif client is not None:
+                latency_tracker.observe(client.admin.command('replSetGetStatus'))
+        except Exception as e:
+            latency_tracker.last_error = str(e)
+            logger.warning(f"⚠️ Не удалось получить замер задержек: {e}")
+        latency_sampler_stop.wait(LATENCY_SAMPLE_INTERVAL)
 
 @app.on_event("startup")
 async def startup_db_client():
     global client
-    try:
-        client = MongoClient(MONGO_URI, serverSelectionTimeoutMS=5000)
-        client.admin.command('ping')
-        logger.info("✅ Health Check: Подключено к MongoDB")
-    except ConnectionFailure as e:
-        logger.error(f"❌ Ошибка подключения: {e}")
+    client = create_client(MONGO_URI, serverSelectionTimeoutMS=5000)
+    mongo_connection.start(lambda: client)
+
+    fleet.start(client, MONGO_URI)
+
+    latency_sampler_stop.clear()
+    threading.Thread(target=_sample_network_latency, daemon=True).start()
+    logger.info(f"📈 Сбор задержек сети запущен (интервал {LATENCY_SAMPLE_INTERVAL}s)")
 
 @app.on_event("shutdown")
 async def shutdown_db_client():
+    mongo_connection.stop()
+    fleet.stop()
+    latency_sampler_stop.set()
+    cluster_views.close()
     if client:
         client.close()
 
@@ -42,62 +96,59 @@ async def root():
     return {
         "service": "Health Check Service",
         "status": "running",
-        "description": "Проверка доступности и здоровья узлов кластера"
+        "description": "Проверка доступности и здоровья узлов кластера",
+        "mongo": mongo_guard.to_dict()
+    }
+
+def _all_nodes_report(view: ClusterView) -> Dict:
+    nodes_health = []
+    healthy_count = view.healthy_count
+    unhealthy_count = len(view.unhealthy)
+    
+    for member in view.members:
+        # Определяем время недоступности
+        uptime = member.uptime
+        
+        nodes_health.append({
+            "name": member.name,
+            "state": member.state,
+            "health": "healthy" if member.healthy else "unhealthy",
+            "uptime_seconds": uptime,
+            "uptime_formatted": f"{uptime // 3600}h {(uptime % 3600) // 60}m",
+            "ping_ms": member.get('pingMs', 'N/A'),
+            "last_heartbeat": str(member.get('lastHeartbeat', 'N/A')),
+            "sync_source": member.get('syncSourceHost', 'N/A')
+        })
+    
+    # Общая оценка здоровья кластера
+    total_nodes = view.total
+    health_percentage = (healthy_count / total_nodes * 100) if total_nodes > 0 else 0
+    
+    cluster_status = "HEALTHY" if healthy_count == total_nodes else "DEGRADED" if healthy_count > total_nodes // 2 else "CRITICAL"
+    
+    return {
+        "timestamp": str(datetime.now()),
+        "cluster_status": cluster_status,
+        "health_percentage": round(health_percentage, 1),
+        "total_nodes": total_nodes,
+        "healthy_nodes": healthy_count,
+        "unhealthy_nodes": unhealthy_count,
+        "nodes": nodes_health,
+        "threat_assessment": {
+            "UBI.136_risk": "LOW" if cluster_status == "HEALTHY" else "MEDIUM" if cluster_status == "DEGRADED" else "HIGH",
+            "description": _get_threat_description(cluster_status)
+        }
     }
 
 @app.get("/health/all")
+@guarded(mongo_guard)
+@versioned(_status_version)
 async def check_all_nodes():
     """
     Проверить здоровье всех узлов в Replica Set
     """
     try:
-        rs_status = client.admin.command('replSetGetStatus')
-        
-        nodes_health = []
-        healthy_count = 0
-        unhealthy_count = 0
-        
-        for member in rs_status['members']:
-            is_healthy = member['health'] == 1
-            
-            if is_healthy:
-                healthy_count += 1
-            else:
-                unhealthy_count += 1
-            
-            # Определяем время недоступности
-            uptime = member.get('uptime', 0)
-            
-            nodes_health.append({
-                "name": member['name'],
-                "state": member['stateStr'],
-                "health": "healthy" if is_healthy else "unhealthy",
-                "uptime_seconds": uptime,
-                "uptime_formatted": f"{uptime // 3600}h {(uptime % 3600) // 60}m",
-                "ping_ms": member.get('pingMs', 'N/A'),
-                "last_heartbeat": str(member.get('lastHeartbeat', 'N/A')),
-                "sync_source": member.get('syncSourceHost', 'N/A')
-            })
-        
-        # Общая оценка здоровья кластера
-        total_nodes = len(rs_status['members'])
-        health_percentage = (healthy_count / total_nodes * 100) if total_nodes > 0 else 0
-        
-        cluster_status = "HEALTHY" if healthy_count == total_nodes else "DEGRADED" if healthy_count > total_nodes // 2 else "CRITICAL"
-        
-        return {
-            "timestamp": str(datetime.now()),
-            "cluster_status": cluster_status,
-            "health_percentage": round(health_percentage, 1),
-            "total_nodes": total_nodes,
-            "healthy_nodes": healthy_count,
-            "unhealthy_nodes": unhealthy_count,
-            "nodes": nodes_health,
-            "threat_assessment": {
-                "UBI.136_risk": "LOW" if cluster_status == "HEALTHY" else "MEDIUM" if cluster_status == "DEGRADED" else "HIGH",
-                "description": self._get_threat_description(cluster_status)
-            }
-        }
+        return cluster_views.dispatch(client, _all_nodes_report)
         
     except Exception as e:
         logger.error(f"❌ Ошибка проверки здоровья: {e}")
@@ -114,208 +165,240 @@ def _get_threat_description(status: str) -> str:
 
 app._get_threat_description = _get_threat_description
 
+def _primary_report(view: ClusterView) -> Dict:
+    primary_nodes = view.primaries
+    
+    if len(primary_nodes) == 0:
+        return {
+            "status": "CRITICAL",
+            "message": "🔴 Primary узел не найден!",
+            "threat": "Записи в базу невозможны",
+            "impact": "UBI.136: Полная блокировка операций записи",
+            "action_required": "Немедленно проверить конфигурацию кластера"
+        }
+    
+    if len(primary_nodes) > 1:
+        return {
+            "status": "CRITICAL",
+            "message": "🔴 Обнаружено более одного Primary узла (Split-Brain)!",
+            "primary_nodes": [p.name for p in primary_nodes],
+            "threat": "Критический риск расхождения данных",
+            "impact": "UBI.136: Данные могут быть записаны в разные узлы несогласованно",
+            "action_required": "НЕМЕДЛЕННО изолировать сегменты и провести восстановление"
+        }
+    
+    primary = primary_nodes[0]
+    
+    return {
+        "status": "HEALTHY",
+        "message": "✅ Primary узел работает нормально",
+        "primary_node": {
+            "name": primary.name,
+            "health": "healthy" if primary.healthy else "unhealthy",
+            "uptime_seconds": primary.uptime,
+            "optime": str(primary.get('optimeDate', 'N/A')),
+            "election_date": str(primary.get('electionDate', 'N/A'))
+        },
+        "threat": "Нет угрозы",
+        "protection_level": "Полная защита от UBI.136"
+    }
+
 @app.get("/health/primary")
+@guarded(mongo_guard)
+@versioned(_status_version)
 async def check_primary():
     """
     Проверить статус Primary узла
     """
     try:
-        rs_status = client.admin.command('replSetGetStatus')
-        
-        primary_nodes = [m for m in rs_status['members'] if m['stateStr'] == 'PRIMARY']
-        
-        if len(primary_nodes) == 0:
-            return {
-                "status": "CRITICAL",
-                "message": "🔴 Primary узел не найден!",
-                "threat": "Записи в базу невозможны",
-                "impact": "UBI.136: Полная блокировка операций записи",
-                "action_required": "Немедленно проверить конфигурацию кластера"
-            }
-        
-        if len(primary_nodes) > 1:
-            return {
-                "status": "CRITICAL",
-                "message": "🔴 Обнаружено более одного Primary узла (Split-Brain)!",
-                "primary_nodes": [p['name'] for p in primary_nodes],
-                "threat": "Критический риск расхождения данных",
-                "impact": "UBI.136: Данные могут быть записаны в разные узлы несогласованно",
-                "action_required": "НЕМЕДЛЕННО изолировать сегменты и провести восстановление"
-            }
-        
-        primary = primary_nodes[0]
-        
-        return {
-            "status": "HEALTHY",
-            "message": "✅ Primary узел работает нормально",
-            "primary_node": {
-                "name": primary['name'],
-                "health": "healthy" if primary['health'] == 1 else "unhealthy",
-                "uptime_seconds": primary.get('uptime', 0),
-                "optime": str(primary.get('optimeDate', 'N/A')),
-                "election_date": str(primary.get('electionDate', 'N/A'))
-            },
-            "threat": "Нет угрозы",
-            "protection_level": "Полная защита от UBI.136"
-        }
+        return cluster_views.dispatch(client, _primary_report)
         
     except Exception as e:
         logger.error(f"❌ Ошибка проверки Primary: {e}")
         raise HTTPException(status_code=500, detail=str(e))
 
+def _secondaries_report(view: ClusterView) -> Dict:
+    secondary_nodes = view.secondaries
+    
+    if len(secondary_nodes) == 0:
+        return {
+            "status": "CRITICAL",
+            "message": "🔴 Secondary узлы не найдены!",
+            "threat": "Отсутствует избыточность данных",
+            "impact": "UBI.136: Критический риск потери данных при отказе Primary",
+            "action_required": "Восстановить Secondary узлы как можно скорее"
+        }
+    
+    secondaries_info = []
+    healthy_secondaries = 0
+    
+    for secondary in secondary_nodes:
+        if secondary.healthy:
+            healthy_secondaries += 1
+        
+        secondaries_info.append({
+            "name": secondary.name,
+            "health": "healthy" if secondary.healthy else "unhealthy",
+            "state": secondary.state,
+            "uptime_seconds": secondary.uptime,
+            "sync_source": secondary.get('syncSourceHost', 'N/A'),
+            "ping_ms": secondary.get('pingMs', 'N/A')
+        })
+    
+    redundancy_level = "FULL" if healthy_secondaries == len(secondary_nodes) else "PARTIAL" if healthy_secondaries > 0 else "NONE"
+    
+    return {
+        "status": "HEALTHY" if redundancy_level == "FULL" else "DEGRADED",
+        "total_secondaries": len(secondary_nodes),
+        "healthy_secondaries": healthy_secondaries,
+        "redundancy_level": redundancy_level,
+        "secondaries": secondaries_info,
+        "protection_assessment": {
+            "data_redundancy": f"{healthy_secondaries + 1} копии данных" if healthy_secondaries > 0 else "Только 1 копия (Primary)",
+            "UBI.136_protection": "Активна" if healthy_secondaries > 0 else "Отсутствует"
+        }
+    }
+
 @app.get("/health/secondaries")
+@guarded(mongo_guard)
+@versioned(_status_version)
 async def check_secondaries():
     """
     Проверить статус Secondary узлов
     """
     try:
-        rs_status = client.admin.command('replSetGetStatus')
-        
-        secondary_nodes = [m for m in rs_status['members'] if m['stateStr'] == 'SECONDARY']
-        
-        if len(secondary_nodes) == 0:
-            return {
-                "status": "CRITICAL",
-                "message": "🔴 Secondary узлы не найдены!",
-                "threat": "Отсутствует избыточность данных",
-                "impact": "UBI.136: Критический риск потери данных при отказе Primary",
-                "action_required": "Восстановить Secondary узлы как можно скорее"
-            }
-        
-        secondaries_info = []
-        healthy_secondaries = 0
-        
-        for secondary in secondary_nodes:
-            is_healthy = secondary['health'] == 1
-            if is_healthy:
-                healthy_secondaries += 1
-            
-            secondaries_info.append({
-                "name": secondary['name'],
-                "health": "healthy" if is_healthy else "unhealthy",
-                "state": secondary['stateStr'],
-                "uptime_seconds": secondary.get('uptime', 0),
-                "sync_source": secondary.get('syncSourceHost', 'N/A'),
-                "ping_ms": secondary.get('pingMs', 'N/A')
-            })
-        
-        redundancy_level = "FULL" if healthy_secondaries == len(secondary_nodes) else "PARTIAL" if healthy_secondaries > 0 else "NONE"
-        
-        return {
-            "status": "HEALTHY" if redundancy_level == "FULL" else "DEGRADED",
-            "total_secondaries": len(secondary_nodes),
-            "healthy_secondaries": healthy_secondaries,
-            "redundancy_level": redundancy_level,
-            "secondaries": secondaries_info,
-            "protection_assessment": {
-                "data_redundancy": f"{healthy_secondaries + 1} копии данных" if healthy_secondaries > 0 else "Только 1 копия (Primary)",
-                "UBI.136_protection": "Активна" if healthy_secondaries > 0 else "Отсутствует"
-            }
-        }
+        return cluster_views.dispatch(client, _secondaries_report)
         
     except Exception as e:
         logger.error(f"❌ Ошибка проверки Secondary: {e}")
         raise HTTPException(status_code=500, detail=str(e))
 
+def _network_report(view: ClusterView) -> Dict:
+    rules = thresholds.current()
+    connectivity_issues = []
+    
+    for member in view.members:
+        ping_ms = member.ping_ms
+        # p95 за текущее окно устойчивее единичного замера
+        ping_p95_ms = latency_tracker.window_p95(member.name)
+        
+        # Проверяем задержку ping
+        if ping_ms is not None:
+            effective_ping = ping_p95_ms if ping_p95_ms is not None else ping_ms
+            severity = rules.classify("network_latency_ms", effective_ping)
+            if severity:
+                connectivity_issues.append({
+                    "node": member.name,
+                    "issue": "HIGH_LATENCY",
+                    "ping_ms": ping_ms,
+                    "ping_p95_ms": ping_p95_ms,
+                    "severity": severity,
+                    "description": f"⚠️ Высокая задержка сети: {effective_ping}ms"
+                })
+        else:
+            if not member.healthy:
+                connectivity_issues.append({
+                    "node": member.name,
+                    "issue": "NO_CONNECTION",
+                    "severity": "CRITICAL",
+                    "description": "🔴 Узел недоступен по сети"
+                })
+    
+    network_status = "CRITICAL" if any(i['severity'] == 'CRITICAL' for i in connectivity_issues) else "WARNING" if connectivity_issues else "HEALTHY"
+    
+    return {
+        "timestamp": str(datetime.now()),
+        "network_status": network_status,
+        "issues_count": len(connectivity_issues),
+        "issues": connectivity_issues if connectivity_issues else [{"message": "✅ Сетевая связность в норме"}],
+        "split_brain_risk": "HIGH" if network_status == "CRITICAL" else "LOW",
+        "recommendations": [
+            "Проверьте сетевое оборудование" if network_status != "HEALTHY" else "Сеть работает нормально",
+            "Риск Split-Brain сценария" if network_status == "CRITICAL" else "Топология кластера стабильна"
+        ]
+    }
+
 @app.get("/health/network")
+@guarded(mongo_guard)
 async def check_network_connectivity():
     """
     Проверить сетевую связность между узлами
     """
     try:
-        rs_status = client.admin.command('replSetGetStatus')
-        
-        connectivity_issues = []
-        
-        for member in rs_status['members']:
-            ping_ms = member.get('pingMs')
-            
-            # Проверяем задержку ping
-            if ping_ms is not None:
-                if ping_ms > 100:
-                    connectivity_issues.append({
-                        "node": member['name'],
-                        "issue": "HIGH_LATENCY",
-                        "ping_ms": ping_ms,
-                        "severity": "WARNING",
-                        "description": f"⚠️ Высокая задержка сети: {ping_ms}ms"
-                    })
-            else:
-                if member['health'] != 1:
-                    connectivity_issues.append({
-                        "node": member['name'],
-                        "issue": "NO_CONNECTION",
-                        "severity": "CRITICAL",
-                        "description": "🔴 Узел недоступен по сети"
-                    })
-        
-        network_status = "CRITICAL" if any(i['severity'] == 'CRITICAL' for i in connectivity_issues) else "WARNING" if connectivity_issues else "HEALTHY"
-        
-        return {
-            "timestamp": str(datetime.now()),
-            "network_status": network_status,
-            "issues_count": len(connectivity_issues),
-            "issues": connectivity_issues if connectivity_issues else [{"message": "✅ Сетевая связность в норме"}],
-            "split_brain_risk": "HIGH" if network_status == "CRITICAL" else "LOW",
-            "recommendations": [
-                "Проверьте сетевое оборудование" if network_status != "HEALTHY" else "Сеть работает нормально",
-                "Риск Split-Brain сценария" if network_status == "CRITICAL" else "Топология кластера стабильна"
-            ]
-        }
+        return cluster_views.dispatch(client, _network_report)
         
     except Exception as e:
         logger.error(f"❌ Ошибка проверки сети: {e}")
         raise HTTPException(status_code=500, detail=str(e))
 
+@app.get("/health/network/latency")
+async def get_network_latency():
+    """
+    Гистограммы задержек heartbeat по каждой паре узлов: p50/p95/p99, jitter и тренд
+    """
+    snapshot = latency_tracker.snapshot()
+    degrading = [p['target'] for p in snapshot['pairs'] if p['trend'] == 'DEGRADING']
+    
+    return {
+        "timestamp": str(datetime.now()),
+        "sample_interval_seconds": LATENCY_SAMPLE_INTERVAL,
+        **snapshot,
+        "degrading_links": degrading,
+        "network_trend": "DEGRADING" if degrading else "STABLE"
+    }
+
+def _health_summary_report(view: ClusterView) -> Dict:
+    # Счетчики по статусам посчитаны при разборе снимка
+    primary_count = view.primary_count
+    secondary_count = view.secondary_count
+    healthy_count = view.healthy_count
+    total_count = view.total
+    
+    # Определяем общий статус
+    if primary_count == 1 and secondary_count >= 1 and healthy_count == total_count:
+        overall_status = "EXCELLENT"
+        status_icon = "✅"
+        threat_level = "NONE"
+    elif primary_count == 1 and healthy_count >= (total_count // 2 + 1):
+        overall_status = "GOOD"
+        status_icon = "✅"
+        threat_level = "LOW"
+    elif primary_count == 1:
+        overall_status = "DEGRADED"
+        status_icon = "⚠️"
+        threat_level = "MEDIUM"
+    else:
+        overall_status = "CRITICAL"
+        status_icon = "🔴"
+        threat_level = "HIGH"
+    
+    return {
+        "timestamp": str(datetime.now()),
+        "overall_status": f"{status_icon} {overall_status}",
+        "replica_set": view.set_name,
+        "cluster_health": {
+            "total_nodes": total_count,
+            "healthy_nodes": healthy_count,
+            "primary_nodes": primary_count,
+            "secondary_nodes": secondary_count
+        },
+        "threat_assessment": {
+            "UBI.136_threat_level": threat_level,
+            "description": _get_summary_description(overall_status),
+            "data_safety": "PROTECTED" if threat_level in ["NONE", "LOW"] else "AT_RISK"
+        },
+        "recommendations": _get_recommendations(overall_status, primary_count, secondary_count)
+    }
+
 @app.get("/health/summary")
+@guarded(mongo_guard)
+@versioned(_status_version)
 async def get_health_summary():
     """
     Общая сводка по здоровью кластера
     """
     try:
-        rs_status = client.admin.command('replSetGetStatus')
-        
-        # Считаем узлы по статусам
-        primary_count = sum(1 for m in rs_status['members'] if m['stateStr'] == 'PRIMARY')
-        secondary_count = sum(1 for m in rs_status['members'] if m['stateStr'] == 'SECONDARY')
-        healthy_count = sum(1 for m in rs_status['members'] if m['health'] == 1)
-        total_count = len(rs_status['members'])
-        
-        # Определяем общий статус
-        if primary_count == 1 and secondary_count >= 1 and healthy_count == total_count:
-            overall_status = "EXCELLENT"
-            status_icon = "✅"
-            threat_level = "NONE"
-        elif primary_count == 1 and healthy_count >= (total_count // 2 + 1):
-            overall_status = "GOOD"
-            status_icon = "✅"
-            threat_level = "LOW"
-        elif primary_count == 1:
-            overall_status = "DEGRADED"
-            status_icon = "⚠️"
-            threat_level = "MEDIUM"
-        else:
-            overall_status = "CRITICAL"
-            status_icon = "🔴"
-            threat_level = "HIGH"
-        
-        return {
-            "timestamp": str(datetime.now()),
-            "overall_status": f"{status_icon} {overall_status}",
-            "replica_set": rs_status.get('set'),
-            "cluster_health": {
-                "total_nodes": total_count,
-                "healthy_nodes": healthy_count,
-                "primary_nodes": primary_count,
-                "secondary_nodes": secondary_count
-            },
-            "threat_assessment": {
-                "UBI.136_threat_level": threat_level,
-                "description": self._get_summary_description(overall_status),
-                "data_safety": "PROTECTED" if threat_level in ["NONE", "LOW"] else "AT_RISK"
-            },
-            "recommendations": self._get_recommendations(overall_status, primary_count, secondary_count)
-        }
+        return cluster_views.dispatch(client, _health_summary_report)
         
     except Exception as e:
         logger.error(f"❌ Ошибка получения сводки: {e}")
@@ -1,16 +1,24 @@
 from fastapi import FastAPI, HTTPException
-from pymongo import MongoClient
-from pymongo.errors import ConnectionFailure, OperationFailure
+from pymongo.errors import OperationFailure
+from common.backend import create_client
+from common.lifecycle import MongoConnection, lifecycle_router
+from common.mongo_guard import MongoGuard
+from common.responses import FastRoute, guarded, versioned
+from common.cluster_view import ClusterView, ClusterViewCache, RECOVERY_STATES
+from common.fleet import FleetMonitor, fleet_router
+from common.thresholds import thresholds, thresholds_router
+from oplog_archive import OplogArchiver
 import os
 import logging
 from datetime import datetime
-from typing import Optional
+from typing import Dict, Optional
 from fastapi.middleware.cors import CORSMiddleware
 
 logging.basicConfig(level=logging.INFO)
 logger = logging.getLogger(__name__)
 
 app = FastAPI(title="Recovery Service", description="Восстановление узлов и синхронизация данных")
+app.router.route_class = FastRoute
 # CORS Middleware
 app.add_middleware(
     CORSMiddleware,
@@ -20,20 +28,63 @@ app.add_middleware(
     allow_headers=["*"],
 )
 MONGO_URI = os.getenv("MONGO_URI", "mongodb://localhost:27017/?replicaSet=rs0")
+CLUSTER_VIEW_MAX_AGE_SECONDS = float(os.getenv("CLUSTER_VIEW_MAX_AGE_SECONDS", "1"))
+# Каталог архива oplog для PITR; пусто - архив выключен
+OPLOG_ARCHIVE_DIR = os.getenv("OPLOG_ARCHIVE_DIR", "")
+OPLOG_ARCHIVE_SEGMENT_MB = int(os.getenv("OPLOG_ARCHIVE_SEGMENT_MB", "64"))
+OPLOG_ARCHIVE_SEGMENT_SECONDS = float(os.getenv("OPLOG_ARCHIVE_SEGMENT_SECONDS", "300"))
+# 0 - хранить сегменты бессрочно
+OPLOG_ARCHIVE_RETENTION_DAYS = float(os.getenv("OPLOG_ARCHIVE_RETENTION_DAYS", "0"))
+# oldest - начать с самой старой записи oplog, latest - только с новых
+OPLOG_ARCHIVE_START = os.getenv("OPLOG_ARCHIVE_START", "oldest")
 client = None
+# Дедлайн операций MongoDB на пути запроса и circuit breaker (MONGO_DEADLINE_SECONDS, MONGO_BREAKER_*)
+mongo_guard = MongoGuard("recovery_service")
+# Подключение к MongoDB в фоне с повторами; /livez и /readyz для оркестратора
+mongo_connection = MongoConnection("recovery_service", mongo_guard)
+app.include_router(lifecycle_router(mongo_connection))
+# Разобранный replSetGetStatus общий для всех эндпоинтов в пределах CLUSTER_VIEW_MAX_AGE_SECONDS
+cluster_views = ClusterViewCache(max_age_seconds=CLUSTER_VIEW_MAX_AGE_SECONDS, uri=MONGO_URI)
+
+def _status_version() -> str:
+    """Версия ответов о состоянии: топология кластера и действующие пороги"""
+    return f"{cluster_views.version(client)}-{thresholds.current().version}"
+
+# Реестр кластеров (FLEET_CONFIG) с опросом по расписанию для /fleet/*
+fleet = FleetMonitor.from_env(MONGO_URI)
+oplog_archiver = OplogArchiver(
+    OPLOG_ARCHIVE_DIR, OPLOG_ARCHIVE_SEGMENT_MB * 1024 * 1024, OPLOG_ARCHIVE_SEGMENT_SECONDS,
+    OPLOG_ARCHIVE_RETENTION_DAYS, OPLOG_ARCHIVE_START
+) if OPLOG_ARCHIVE_DIR else None
+app.include_router(fleet_router(fleet))
+app.include_router(thresholds_router())
+
+@mongo_connection.on_ready
+def _start_oplog_archiver():
+    """Архив oplog запускается после первого успешного ping: нужно знать, не mongos ли это"""
+    if oplog_archiver is None:
+        return
+    if cluster_views.is_sharded(client):
+        # У mongos нет oplog; архив ведется на каждом Replica Set шарда отдельно
+        logger.warning("⚠️ Архив oplog не запущен: MONGO_URI указывает на mongos")
+    else:
+        oplog_archiver.start(client)
 
 @app.on_event("startup")
 async def startup_db_client():
     global client
-    try:
-        client = MongoClient(MONGO_URI)
-        client.admin.command('ping')
-        logger.info("✅ Recovery Service: Подключено к MongoDB")
-    except ConnectionFailure as e:
-        logger.error(f"❌ Ошибка подключения: {e}")
+    client = create_client(MONGO_URI)
+    mongo_connection.start(lambda: client)
+
+    fleet.start(client, MONGO_URI)
 
 @app.on_event("shutdown")
 async def shutdown_db_client():
+    mongo_connection.stop()
+    fleet.stop()
+    if oplog_archiver is not None:
+        oplog_archiver.stop()
+    cluster_views.close()
     if client:
         client.close()
 
@@ -42,72 +93,80 @@ async def root():
     return {
         "service": "Recovery Service",
         "status": "running",
-        "description": "Автоматическое восстановление узлов и синхронизация данных"
+        "description": "Автоматическое восстановление узлов и синхронизация данных",
+        "mongo": mongo_guard.to_dict()
+    }
+
+def _recovery_status_report(view: ClusterView) -> Dict:
+    rules = thresholds.current()
+    nodes_needing_recovery = []
+    healthy_nodes = []
+    
+    for member in view.members:
+        node_info = {
+            "name": member.name,
+            "state": member.state,
+            "health": member.get('health')
+        }
+        
+        # Узлы, требующие восстановления
+        if not member.healthy:
+            node_info['issue'] = "Node is down or unreachable"
+            node_info['recovery_needed'] = True
+            nodes_needing_recovery.append(node_info)
+        elif member.state in RECOVERY_STATES:
+            node_info['issue'] = f"Node in {member.state} state"
+            node_info['recovery_needed'] = True
+            nodes_needing_recovery.append(node_info)
+        elif member.state == 'SECONDARY':
+            # Проверяем отставание репликации
+            lag = member.lag_seconds
+            if lag is not None and rules.exceeds("recovery_lag", lag):
+                node_info['issue'] = f"High replication lag: {round(lag, 2)}s"
+                node_info['recovery_needed'] = True
+                node_info['lag_seconds'] = lag
+                nodes_needing_recovery.append(node_info)
+            else:
+                healthy_nodes.append(node_info)
+        else:
+            healthy_nodes.append(node_info)
+    
+    return {
+        "timestamp": str(datetime.now()),
+        "total_nodes": view.total,
+        "nodes_needing_recovery": len(nodes_needing_recovery),
+        "healthy_nodes": len(healthy_nodes),
+        "recovery_required": len(nodes_needing_recovery) > 0,
+        "problematic_nodes": nodes_needing_recovery,
+        "status": "RECOVERY_NEEDED" if nodes_needing_recovery else "ALL_HEALTHY"
     }
 
 @app.get("/recovery/status")
+@guarded(mongo_guard)
+@versioned(_status_version)
 async def get_recovery_status():
     """
     Проверить, требуется ли восстановление для каких-либо узлов
     """
     try:
-        rs_status = client.admin.command('replSetGetStatus')
-        
-        nodes_needing_recovery = []
-        healthy_nodes = []
-        
-        for member in rs_status['members']:
-            node_info = {
-                "name": member['name'],
-                "state": member['stateStr'],
-                "health": member['health']
-            }
-            
-            # Узлы, требующие восстановления
-            if member['health'] != 1:
-                node_info['issue'] = "Node is down or unreachable"
-                node_info['recovery_needed'] = True
-                nodes_needing_recovery.append(node_info)
-            elif member['stateStr'] in ['RECOVERING', 'STARTUP', 'STARTUP2', 'ROLLBACK']:
-                node_info['issue'] = f"Node in {member['stateStr']} state"
-                node_info['recovery_needed'] = True
-                nodes_needing_recovery.append(node_info)
-            elif member['stateStr'] == 'SECONDARY':
-                # Проверяем отставание репликации
-                primary_member = next((m for m in rs_status['members'] if m['stateStr'] == 'PRIMARY'), None)
-                if primary_member:
-                    primary_optime = primary_member.get('optimeDate')
-                    member_optime = member.get('optimeDate')
-                    
-                    if primary_optime and member_optime:
-                        lag = (primary_optime - member_optime).total_seconds()
-                        if lag > 60:  # Более 60 секунд отставания
-                            node_info['issue'] = f"High replication lag: {round(lag, 2)}s"
-                            node_info['recovery_needed'] = True
-                            node_info['lag_seconds'] = lag
-                            nodes_needing_recovery.append(node_info)
-                        else:
-                            healthy_nodes.append(node_info)
-                    else:
-                        healthy_nodes.append(node_info)
-            else:
-                healthy_nodes.append(node_info)
-        
-        return {
-            "timestamp": str(datetime.now()),
-            "total_nodes": len(rs_status['members']),
-            "nodes_needing_recovery": len(nodes_needing_recovery),
-            "healthy_nodes": len(healthy_nodes),
-            "recovery_required": len(nodes_needing_recovery) > 0,
-            "problematic_nodes": nodes_needing_recovery,
-            "status": "RECOVERY_NEEDED" if nodes_needing_recovery else "ALL_HEALTHY"
-        }
+        return cluster_views.dispatch(client, _recovery_status_report)
         
     except Exception as e:
         logger.error(f"❌ Ошибка проверки статуса восстановления: {e}")
         raise HTTPException(status_code=500, detail=str(e))
 
+def _view_of_node(node_name: str) -> ClusterView:
+    """Снимок Replica Set узла; за mongos - снимок шарда, в который входит узел"""
+    if not cluster_views.is_sharded(client):
+        return cluster_views.current(client)
+    views, _ = cluster_views.current_shards(client)
+    for view in views.values():
+        if view.member(node_name):
+            return view
+    raise HTTPException(status_code=404, detail=f"Узел {node_name} не найден ни в одном шарде")
+
 @app.post("/recovery/resync")
+@guarded(mongo_guard, stale=False)
 async def trigger_resync(node_name: str):
     """
     Запустить ресинхронизацию данных для указанного узла
@@ -118,16 +177,16 @@ async def trigger_resync(node_name: str):
     3. Мониторинг процесса восстановления
     """
     try:
-        rs_status = client.admin.command('replSetGetStatus')
+        view = _view_of_node(node_name)
         
         # Находим узел
-        target_node = next((m for m in rs_status['members'] if m['name'] == node_name), None)
+        target_node = view.member(node_name)
         
         if not target_node:
             raise HTTPException(status_code=404, detail=f"Узел {node_name} не найден")
         
         # Проверяем текущее состояние
-        current_state = target_node['stateStr']
+        current_state = target_node.state
         
         logger.info(f"🔄 Инициирована ресинхронизация для узла {node_name}")
         
@@ -154,34 +213,35 @@ async def trigger_resync(node_name: str):
         raise HTTPException(status_code=500, detail=str(e))
 
 @app.post("/recovery/force-sync")
+@guarded(mongo_guard, stale=False)
 async def force_sync_secondary(node_name: str):
     """
     Принудительная синхронизация Secondary узла с Primary
     """
     try:
-        rs_status = client.admin.command('replSetGetStatus')
+        view = _view_of_node(node_name)
         
         # Находим Primary узел
-        primary = next((m for m in rs_status['members'] if m['stateStr'] == 'PRIMARY'), None)
+        primary = view.primary
         if not primary:
             raise HTTPException(status_code=503, detail="Primary узел не найден")
         
         # Находим целевой узел
-        target_node = next((m for m in rs_status['members'] if m['name'] == node_name), None)
+        target_node = view.member(node_name)
         if not target_node:
             raise HTTPException(status_code=404, detail=f"Узел {node_name} не найден")
         
-        if target_node['stateStr'] != 'SECONDARY':
+        if target_node.state != 'SECONDARY':
             raise HTTPException(
                 status_code=400, 
-                detail=f"Узел {node_name} не является Secondary (текущий статус: {target_node['stateStr']})"
+                detail=f"Узел {node_name} не является Secondary (текущий статус: {target_node.state})"
             )
         
-        logger.info(f"🔄 Принудительная синхронизация {node_name} с Primary {primary['name']}")
+        logger.info(f"🔄 Принудительная синхронизация {node_name} с Primary {primary.name}")
         
         return {
             "status": "sync_initiated",
-            "source": primary['name'],
+            "source": primary.name,
             "target": node_name,
             "message": f"Принудительная синхронизация {node_name} запущена",
             "note": "Узел будет синхронизирован с текущим Primary"
@@ -194,6 +254,7 @@ async def force_sync_secondary(node_name: str):
         raise HTTPException(status_code=500, detail=str(e))
 
 @app.post("/recovery/rollback")
+@guarded(mongo_guard, stale=False)
 async def handle_rollback(node_name: str):
     """
     Обработать ситуацию rollback на узле
@@ -202,9 +263,9 @@ async def handle_rollback(node_name: str):
     а после переподключения оказалось, что другой узел стал Primary
     """
     try:
-        rs_status = client.admin.command('replSetGetStatus')
+        view = _view_of_node(node_name)
         
-        target_node = next((m for m in rs_status['members'] if m['name'] == node_name), None)
+        target_node = view.member(node_name)
         
         if not target_node:
             raise HTTPException(status_code=404, detail=f"Узел {node_name} не найден")
@@ -235,187 +296,190 @@ async def handle_rollback(node_name: str):
         logger.error(f"❌ Ошибка обработки rollback: {e}")
         raise HTTPException(status_code=500, detail=str(e))
 
+def _sync_status_report(view: ClusterView) -> Dict:
+    primary = view.primary
+    
+    if not primary:
+        return {
+            "status": "error",
+            "message": "Primary узел не найден"
+        }
+    
+    rules = thresholds.current()
+    sync_statuses = []
+    
+    for member in view.secondaries:
+        lag = member.lag_seconds
+        
+        if lag is not None:
+            sync_quality = rules.classify("sync_quality_lag", lag)
+            
+            sync_statuses.append({
+                "node": member.name,
+                "lag_seconds": round(lag, 2),
+                "sync_quality": sync_quality,
+                "sync_source": member.get('syncSourceHost', 'unknown'),
+                "needs_attention": rules.exceeds("sync_attention_lag", lag)
+            })
+    
+    overall_sync = "GOOD" if all(s['sync_quality'] in ['EXCELLENT', 'GOOD'] for s in sync_statuses) else "DEGRADED"
+    
+    return {
+        "timestamp": str(datetime.now()),
+        "primary_node": primary.name,
+        "overall_sync_status": overall_sync,
+        "secondary_nodes": sync_statuses,
+        "nodes_needing_attention": sum(1 for s in sync_statuses if s['needs_attention'])
+    }
+
 @app.get("/recovery/sync-status")
+@guarded(mongo_guard)
+@versioned(_status_version)
 async def check_sync_status():
     """
     Проверить статус синхронизации всех Secondary узлов
     """
     try:
-        rs_status = client.admin.command('replSetGetStatus')
-        
-        primary = next((m for m in rs_status['members'] if m['stateStr'] == 'PRIMARY'), None)
-        
-        if not primary:
-            return {
-                "status": "error",
-                "message": "Primary узел не найден"
-            }
-        
-        primary_optime = primary.get('optimeDate')
-        
-        sync_statuses = []
-        
-        for member in rs_status['members']:
-            if member['stateStr'] == 'SECONDARY':
-                member_optime = member.get('optimeDate')
-                
-                if primary_optime and member_optime:
-                    lag = (primary_optime - member_optime).total_seconds()
-                    
-                    if lag < 5:
-                        sync_quality = "EXCELLENT"
-                    elif lag < 15:
-                        sync_quality = "GOOD"
-                    elif lag < 60:
-                        sync_quality = "ACCEPTABLE"
-                    else:
-                        sync_quality = "POOR"
-                    
-                    sync_statuses.append({
-                        "node": member['name'],
-                        "lag_seconds": round(lag, 2),
-                        "sync_quality": sync_quality,
-                        "sync_source": member.get('syncSourceHost', 'unknown'),
-                        "needs_attention": lag > 30
-                    })
-        
-        overall_sync = "GOOD" if all(s['sync_quality'] in ['EXCELLENT', 'GOOD'] for s in sync_statuses) else "DEGRADED"
-        
-        return {
-            "timestamp": str(datetime.now()),
-            "primary_node": primary['name'],
-            "overall_sync_status": overall_sync,
-            "secondary_nodes": sync_statuses,
-            "nodes_needing_attention": sum(1 for s in sync_statuses if s['needs_attention'])
-        }
+        return cluster_views.dispatch(client, _sync_status_report)
         
     except Exception as e:
         logger.error(f"❌ Ошибка проверки статуса синхронизации: {e}")
         raise HTTPException(status_code=500, detail=str(e))
 
+def _auto_heal_report(view: ClusterView) -> Dict:
+    rules = thresholds.current()
+    actions_taken = []
+    
+    for member in view.members:
+        # Проверяем Secondary узлы с большим lag
+        if member.state == 'SECONDARY':
+            lag = member.lag_seconds
+            priority = rules.classify("auto_heal_lag", lag) if lag is not None else None
+            
+            if priority:
+                actions_taken.append({
+                    "node": member.name,
+                    "issue": f"High lag: {round(lag, 2)}s",
+                    "action": "Triggered resync",
+                    "priority": priority
+                })
+                logger.warning(f"⚠️ Автовосстановление: {member.name} имеет lag {lag}s")
+        
+        # Проверяем узлы в состоянии RECOVERING
+        elif member.state == 'RECOVERING':
+            actions_taken.append({
+                "node": member.name,
+                "issue": "Node in RECOVERING state",
+                "action": "Monitoring recovery progress",
+                "priority": "MEDIUM"
+            })
+    
+    return {
+        "timestamp": str(datetime.now()),
+        "auto_heal_status": "completed",
+        "actions_count": len(actions_taken),
+        "actions": actions_taken if actions_taken else [{"message": "✅ Все узлы в нормальном состоянии"}],
+        "next_check": "Рекомендуется через 5 минут"
+    }
+
 @app.post("/recovery/auto-heal")
+@guarded(mongo_guard, stale=False)
 async def auto_heal():
     """
     Автоматическое восстановление проблемных узлов
     """
     try:
-        rs_status = client.admin.command('replSetGetStatus')
-        
-        actions_taken = []
-        
-        for member in rs_status['members']:
-            # Проверяем Secondary узлы с большим lag
-            if member['stateStr'] == 'SECONDARY':
-                primary = next((m for m in rs_status['members'] if m['stateStr'] == 'PRIMARY'), None)
-                
-                if primary:
-                    primary_optime = primary.get('optimeDate')
-                    member_optime = member.get('optimeDate')
-                    
-                    if primary_optime and member_optime:
-                        lag = (primary_optime - member_optime).total_seconds()
-                        
-                        if lag > 120:  # Более 2 минут отставания
-                            actions_taken.append({
-                                "node": member['name'],
-                                "issue": f"High lag: {round(lag, 2)}s",
-                                "action": "Triggered resync",
-                                "priority": "HIGH"
-                            })
-                            logger.warning(f"⚠️ Автовосстановление: {member['name']} имеет lag {lag}s")
-            
-            # Проверяем узлы в состоянии RECOVERING
-            elif member['stateStr'] == 'RECOVERING':
-                actions_taken.append({
-                    "node": member['name'],
-                    "issue": "Node in RECOVERING state",
-                    "action": "Monitoring recovery progress",
-                    "priority": "MEDIUM"
-                })
-        
-        return {
-            "timestamp": str(datetime.now()),
-            "auto_heal_status": "completed",
-            "actions_count": len(actions_taken),
-            "actions": actions_taken if actions_taken else [{"message": "✅ Все узлы в нормальном состоянии"}],
-            "next_check": "Рекомендуется через 5 минут"
-        }
+        return cluster_views.dispatch(client, _auto_heal_report)
         
     except Exception as e:
         logger.error(f"❌ Ошибка автовосстановления: {e}")
         raise HTTPException(status_code=500, detail=str(e))
 
+def _recommendations_report(view: ClusterView) -> Dict:
+    rules = thresholds.current()
+    recommendations = []
+    
+    # Счетчики посчитаны при разборе снимка
+    primary_count = view.primary_count
+    secondary_count = view.secondary_count
+    unhealthy_count = len(view.unhealthy)
+    
+    # Генерация рекомендаций
+    if primary_count == 0:
+        recommendations.append({
+            "priority": "CRITICAL",
+            "issue": "Нет Primary узла",
+            "recommendation": "Немедленно проверьте конфигурацию кластера и восстановите Primary",
+            "commands": ["rs.status()", "rs.stepDown() на старом Primary если есть"]
+        })
+    
+    if secondary_count == 0 and primary_count > 0:
+        recommendations.append({
+            "priority": "HIGH",
+            "issue": "Нет Secondary узлов",
+            "recommendation": "Восстановите Secondary узлы для обеспечения репликации",
+            "impact": "Нет защиты от UBI.136 - данные не реплицируются"
+        })
+    
+    if unhealthy_count > 0:
+        recommendations.append({
+            "priority": "MEDIUM",
+            "issue": f"{unhealthy_count} узлов недоступны",
+            "recommendation": "Проверьте сетевое подключение и состояние серверов",
+            "next_steps": ["Проверить логи узлов", "Проверить доступность по сети", "Перезапустить при необходимости"]
+        })
+    
+    # Проверка lag
+    for member in view.secondaries:
+        lag = member.lag_seconds
+        priority = rules.classify("recovery_lag", lag) if lag is not None else None
+        if priority:
+            recommendations.append({
+                "priority": priority,
+                "issue": f"Узел {member.name} имеет высокий lag: {round(lag, 2)}s",
+                "recommendation": "Проверьте производительность узла и сетевое соединение",
+                "action": "Возможно потребуется resync"
+            })
+    
+    if not recommendations:
+        recommendations.append({
+            "priority": "INFO",
+            "status": "✅ Кластер в отличном состоянии",
+            "recommendation": "Продолжайте регулярный мониторинг"
+        })
+    
+    return {
+        "timestamp": str(datetime.now()),
+        "recommendations_count": len(recommendations),
+        "recommendations": recommendations,
+        "cluster_health": "CRITICAL" if any(r['priority'] == 'CRITICAL' for r in recommendations) else "DEGRADED" if any(r['priority'] == 'HIGH' for r in recommendations) else "GOOD"
+    }
+
+@app.get("/recovery/archive")
+async def get_oplog_archive_status():
+    """
+    Состояние архива oplog: покрытый интервал, сегменты и разрывы
+
+    Восстановление на момент времени возможно внутри [covered_from, covered_to]
+    без разрывов командой python oplog_archive.py restore.
+    """
+    if oplog_archiver is None:
+        return {"enabled": False, "note": "Архив oplog выключен: задайте OPLOG_ARCHIVE_DIR"}
+    try:
+        return oplog_archiver.status()
+    except Exception as e:
+        logger.error(f"❌ Ошибка получения состояния архива oplog: {e}")
+        raise HTTPException(status_code=500, detail=str(e))
+
 @app.get("/recovery/recommendations")
+@guarded(mongo_guard)
+@versioned(_status_version)
 async def get_recovery_recommendations():
     """
     Получить рекомендации по восстановлению на основе текущего состояния
     """
     try:
-        rs_status = client.admin.command('replSetGetStatus')
-        
-        recommendations = []
-        
-        # Подсчет узлов
-        primary_count = sum(1 for m in rs_status['members'] if m['stateStr'] == 'PRIMARY')
-        secondary_count = sum(1 for m in rs_status['members'] if m['stateStr'] == 'SECONDARY')
-        unhealthy_count = sum(1 for m in rs_status['members'] if m['health'] != 1)
-        
-        # Генерация рекомендаций
-        if primary_count == 0:
-            recommendations.append({
-                "priority": "CRITICAL",
-                "issue": "Нет Primary узла",
-                "recommendation": "Немедленно проверьте конфигурацию кластера и восстановите Primary",
-                "commands": ["rs.status()", "rs.stepDown() на старом Primary если есть"]
-            })
-        
-        if secondary_count == 0 and primary_count > 0:
-            recommendations.append({
-                "priority": "HIGH",
-                "issue": "Нет Secondary узлов",
-                "recommendation": "Восстановите Secondary узлы для обеспечения репликации",
-                "impact": "Нет защиты от UBI.136 - данные не реплицируются"
-            })
-        
-        if unhealthy_count > 0:
-            recommendations.append({
-                "priority": "MEDIUM",
-                "issue": f"{unhealthy_count} узлов недоступны",
-                "recommendation": "Проверьте сетевое подключение и состояние серверов",
-                "next_steps": ["Проверить логи узлов", "Проверить доступность по сети", "Перезапустить при необходимости"]
-            })
-        
-        # Проверка lag
-        primary = next((m for m in rs_status['members'] if m['stateStr'] == 'PRIMARY'), None)
-        if primary:
-            for member in rs_status['members']:
-                if member['stateStr'] == 'SECONDARY':
-                    primary_optime = primary.get('optimeDate')
-                    member_optime = member.get('optimeDate')
-                    
-                    if primary_optime and member_optime:
-                        lag = (primary_optime - member_optime).total_seconds()
-                        if lag > 60:
-                            recommendations.append({
-                                "priority": "MEDIUM",
-                                "issue": f"Узел {member['name']} имеет высокий lag: {round(lag, 2)}s",
-                                "recommendation": "Проверьте производительность узла и сетевое соединение",
-                                "action": "Возможно потребуется resync"
-                            })
-        
-        if not recommendations:
-            recommendations.append({
-                "priority": "INFO",
-                "status": "✅ Кластер в отличном состоянии",
-                "recommendation": "Продолжайте регулярный мониторинг"
-            })
-        
-        return {
-            "timestamp": str(datetime.now()),
-            "recommendations_count": len(recommendations),
-            "recommendations": recommendations,
-            "cluster_health": "CRITICAL" if any(r['priority'] == 'CRITICAL' for r in recommendations) else "DEGRADED" if any(r['priority'] == 'HIGH' for r in recommendations) else "GOOD"
-        }
+        return cluster_views.dispatch(client, _recommendations_report)
         
     except Exception as e:
         logger.error(f"❌ Ошибка получения рекомендаций: {e}")
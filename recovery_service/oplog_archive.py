@@ -0,0 +1,487 @@
+"""
+Непрерывный архив oplog и восстановление на момент времени (PITR)
+
+Архив пишет сам Recovery Service (OPLOG_ARCHIVE_DIR). Восстановление - команда:
+    python oplog_archive.py segments --archive /archive
+    python oplog_archive.py restore --archive /archive --target-uri "mongodb://restore:27017/?replicaSet=rs1" \\
+        --from 2026-10-19T03:00:00 --until 2026-10-19T06:15:00 --ns protected_db
+Целевой кластер должен быть восстановлен из резервной копии, снятой не позже --from:
+записи oplog идемпотентны, поэтому повторное применение хвоста копии безопасно.
+"""
+import argparse
+import gzip
+import json
+import logging
+import os
+import re
+import sys
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+from datetime import datetime, timedelta
+from typing import Any, Dict, Iterator, List, Optional, Tuple
+
+import bson
+from bson import json_util
+from bson.codec_options import CodecOptions
+from bson.raw_bson import RawBSONDocument
+from bson.timestamp import Timestamp
+from pymongo import CursorType
+
+from common.backend import create_client
+
+logger = logging.getLogger(__name__)
+
+STATE_FILE = "state.json"
+CURRENT_SEGMENT = "current.bson.gz.tmp"
+SEGMENT_PATTERN = re.compile(r"^oplog-(\d{10})-(\d{10})-(\d{10})-(\d{10})\.bson\.gz$")
+# Базы, которые не восстанавливаются: служебные данные узла и кластера
+SKIP_DATABASES = ("local", "config", "admin")
+# Предел одной команды applyOps с запасом до 16 МБ
+APPLY_OPS_MAX_BYTES = 8 * 1024 * 1024
+
+
+def segment_name(first: Timestamp, last: Timestamp) -> str:
+    return f"oplog-{first.time:010d}-{first.inc:010d}-{last.time:010d}-{last.inc:010d}.bson.gz"
+
+
+def list_segments(archive_dir: str) -> List[Tuple[Timestamp, Timestamp, str]]:
+    """Закрытые сегменты архива по возрастанию: (первый ts, последний ts, путь)"""
+    segments = []
+    for name in os.listdir(archive_dir):
+        match = SEGMENT_PATTERN.match(name)
+        if match:
+            t1, i1, t2, i2 = (int(g) for g in match.groups())
+            segments.append((Timestamp(t1, i1), Timestamp(t2, i2), os.path.join(archive_dir, name)))
+    return sorted(segments)
+
+
+def load_state(archive_dir: str) -> Dict[str, Any]:
+    path = os.path.join(archive_dir, STATE_FILE)
+    if not os.path.exists(path):
+        return {"last_ts": None, "gaps": []}
+    with open(path, encoding="utf-8") as f:
+        return json_util.loads(f.read())
+
+
+def parse_timestamp(value: str, upper: bool = False) -> Timestamp:
+    """ISO время (локальное) или секунды:инкремент; upper - последний ts внутри секунды"""
+    if re.fullmatch(r"\d+:\d+", value):
+        seconds, inc = value.split(":")
+        return Timestamp(int(seconds), int(inc))
+    seconds = int(datetime.fromisoformat(value).timestamp())
+    return Timestamp(seconds, 0xFFFFFFFF if upper else 0)
+
+
+class _Segment:
+    """Открытый сегмент: сырые BSON записи oplog подряд в gzip"""
+
+    def __init__(self, path: str):
+        self.path = path
+        self.file = gzip.open(path, "wb", compresslevel=6)
+        self.first: Optional[Timestamp] = None
+        self.last: Optional[Timestamp] = None
+        self.bytes = 0
+        self.count = 0
+        self.opened_at = time.monotonic()
+
+    def write(self, entry: RawBSONDocument):
+        ts = entry["ts"]
+        if self.first is None:
+            self.first = ts
+        self.last = ts
+        self.file.write(entry.raw)
+        self.bytes += len(entry.raw)
+        self.count += 1
+
+
+class OplogArchiver:
+    """
+    Хвост local.oplog.rs в сжатые сегменты на диске
+
+    Записи читаются tailable-await курсором без разбора в dict (RawBSONDocument)
+    и пишутся байтами как есть. Сегмент закрывается по размеру несжатых данных или
+    по возрасту и переименовывается в oplog-<первый ts>-<последний ts>.bson.gz; только
+    после этого в state.json сохраняется ts продолжения. После перезапуска незакрытый
+    сегмент перечитывается с этого ts. Если oplog успел перезаписать записи после
+    ts продолжения, разрыв фиксируется в state.json - через него PITR невозможен.
+
+    В архив попадают только записи не новее lastCommittedOpTime: запись, которую еще
+    не подтвердило большинство, ждет подтверждения и может быть откачена (rollback).
+    Непрерывность при продолжении проверяется по самой записи с ts продолжения:
+    если ее нет в oplog, записи после нее перезаписаны или откачены.
+    """
+
+    def __init__(self, archive_dir: str, segment_max_bytes: int = 64 * 1024 * 1024,
+                 segment_max_seconds: float = 300, retention_days: float = 0, start_from: str = "oldest",
+                 commit_poll_seconds: float = 0.2):
+        self.archive_dir = archive_dir
+        self.segment_max_bytes = segment_max_bytes
+        self.segment_max_seconds = segment_max_seconds
+        self.retention_days = retention_days
+        self.start_from = start_from
+        self.commit_poll_seconds = commit_poll_seconds
+        self.committed_ts: Optional[Timestamp] = None
+        self.state: Dict[str, Any] = {"last_ts": None, "gaps": []}
+        self.segment: Optional[_Segment] = None
+        self.last_error: Optional[str] = None
+        self.archived_at: Optional[datetime] = None
+        self._stop = threading.Event()
+        self._thread: Optional[threading.Thread] = None
+
+    def start(self, client):
+        os.makedirs(self.archive_dir, exist_ok=True)
+        self.state = load_state(self.archive_dir)
+        stale = os.path.join(self.archive_dir, CURRENT_SEGMENT)
+        if os.path.exists(stale):
+            # Сегмент, не закрытый до остановки процесса, перечитывается из oplog
+            os.remove(stale)
+        self._stop.clear()
+        self._thread = threading.Thread(target=self._run, args=(client,), daemon=True, name="oplog-archiver")
+        self._thread.start()
+        logger.info(f"🗄️ Архив oplog в {self.archive_dir}, продолжение с {self.state['last_ts']}")
+
+    def stop(self):
+        self._stop.set()
+        if self._thread:
+            self._thread.join(timeout=5)
+
+    def _save_state(self):
+        path = os.path.join(self.archive_dir, STATE_FILE)
+        with open(path + ".tmp", "w", encoding="utf-8") as f:
+            f.write(json_util.dumps(self.state, indent=2))
+        os.replace(path + ".tmp", path)
+
+    def _run(self, client):
+        backoff = 1.0
+        while not self._stop.is_set():
+            try:
+                self._tail(client)
+                backoff = 1.0
+            except Exception as e:
+                self.last_error = str(e)
+                logger.warning(f"⚠️ Архив oplog прерван: {e}; повтор через {backoff:.0f}s")
+                self._stop.wait(backoff)
+                backoff = min(backoff * 2, 60)
+        self._close_segment()
+
+    def _add_gap(self, start: Timestamp, end: Timestamp, reason: str):
+        self.state["gaps"].append({"from": start, "to": end, "reason": reason, "detected_at": datetime.now()})
+        self._save_state()
+
+    def _committed(self, client) -> Timestamp:
+        status = client.admin.command("replSetGetStatus")
+        self.committed_ts = status["optimes"]["lastCommittedOpTime"]["ts"]
+        return self.committed_ts
+
+    def _wait_committed(self, client, oplog, entry: RawBSONDocument) -> bool:
+        """
+        Дождаться, пока большинство подтвердит запись; False - запись откачена или остановка
+
+        Oplog линеен: если запись на месте после подтверждения, на месте и все записи до нее.
+        """
+        ts = entry["ts"]
+        while self._committed(client) < ts:
+            if self.segment and time.monotonic() - self.segment.opened_at >= self.segment_max_seconds:
+                self._close_segment()
+            if self._stop.wait(self.commit_poll_seconds):
+                return False
+        if oplog.find_one({"ts": ts, "t": entry.get("t")}, {"ts": 1}) is None:
+            logger.warning(f"↩️ Запись oplog {ts.as_datetime()} откачена до подтверждения, "
+                           f"архив продолжится с последней подтвержденной")
+            return False
+        return True
+
+    def _tail(self, client):
+        # Записи прошлой попытки целые: сегмент закрывается, и продолжение идет с его последнего ts
+        self._close_segment()
+        oplog = client['local'].get_collection('oplog.rs', codec_options=CodecOptions(document_class=RawBSONDocument))
+        oldest = oplog.find_one({}, {"ts": 1}, sort=[("$natural", 1)])
+        if oldest is None:
+            self._stop.wait(1)
+            return
+        last_ts = self.state["last_ts"]
+        if last_ts is None:
+            if self.start_from == "latest":
+                newest = oplog.find_one({}, {"ts": 1}, sort=[("$natural", -1)])
+                query = {"ts": {"$gt": newest["ts"]}}
+            else:
+                query = {"ts": {"$gte": oldest["ts"]}}
+        else:
+            # Продолжение непрерывно, только если запись с ts продолжения еще в oplog
+            if oplog.find_one({"ts": last_ts}, {"ts": 1}) is None:
+                if oldest["ts"] > last_ts:
+                    self._add_gap(last_ts, oldest["ts"], "overwritten")
+                    logger.error(f"🚨 Разрыв архива oplog: записи с {last_ts.as_datetime()} по "
+                                 f"{oldest['ts'].as_datetime()} перезаписаны до архивации")
+                else:
+                    # Архив писался без ожидания подтверждения, и его хвост откатил rollback
+                    common = oplog.find_one({"ts": {"$lt": last_ts}}, {"ts": 1}, sort=[("ts", -1)])
+                    self._add_gap(common["ts"] if common else oldest["ts"], last_ts, "rollback")
+                    logger.error(f"🚨 Разрыв архива oplog: записи по {last_ts.as_datetime()} откачены кластером")
+            query = {"ts": {"$gt": last_ts}}
+
+        cursor = oplog.find(query, cursor_type=CursorType.TAILABLE_AWAIT).max_await_time_ms(1000)
+        self.last_error = None
+        while cursor.alive and not self._stop.is_set():
+            for entry in cursor:
+                pending = self.committed_ts is None or entry["ts"] > self.committed_ts
+                if pending and not self._wait_committed(client, oplog, entry):
+                    cursor.close()
+                    return
+                if self.segment is None:
+                    self.segment = _Segment(os.path.join(self.archive_dir, CURRENT_SEGMENT))
+                self.segment.write(entry)
+                if self.segment.bytes >= self.segment_max_bytes:
+                    self._close_segment()
+                if self._stop.is_set():
+                    break
+            if self.segment and time.monotonic() - self.segment.opened_at >= self.segment_max_seconds:
+                self._close_segment()
+                self._prune()
+
+    def _close_segment(self):
+        segment, self.segment = self.segment, None
+        if segment is None:
+            return
+        segment.file.close()
+        if segment.count == 0:
+            os.remove(segment.path)
+            return
+        name = segment_name(segment.first, segment.last)
+        os.replace(segment.path, os.path.join(self.archive_dir, name))
+        self.state["last_ts"] = segment.last
+        self._save_state()
+        self.archived_at = datetime.now()
+        logger.info(f"🗄️ Сегмент oplog {name}: {segment.count} записей, {segment.bytes / 1024 / 1024:.1f} MiB")
+
+    def _prune(self):
+        if not self.retention_days:
+            return
+        cutoff = (datetime.now() - timedelta(days=self.retention_days)).timestamp()
+        for _, last, path in list_segments(self.archive_dir):
+            if last.time < cutoff:
+                os.remove(path)
+
+    def status(self) -> Dict[str, Any]:
+        segments = list_segments(self.archive_dir) if os.path.isdir(self.archive_dir) else []
+        last_ts = self.state["last_ts"]
+        return {
+            "enabled": True,
+            "archive_dir": self.archive_dir,
+            "running": bool(self._thread and self._thread.is_alive()),
+            "segments": len(segments),
+            "archive_bytes": sum(os.path.getsize(path) for _, _, path in segments),
+            "covered_from": str(segments[0][0].as_datetime()) if segments else None,
+            "covered_to": str(last_ts.as_datetime()) if last_ts else None,
+            "open_segment_entries": self.segment.count if self.segment else 0,
+            "committed_to": str(self.committed_ts.as_datetime()) if self.committed_ts else None,
+            "gaps": [{"from": str(g["from"].as_datetime()), "to": str(g["to"].as_datetime()),
+                      "reason": g.get("reason", "overwritten")} for g in self.state["gaps"]],
+            "last_segment_at": str(self.archived_at) if self.archived_at else None,
+            "last_error": self.last_error
+        }
+
+
+def read_entries(archive_dir: str, start: Timestamp, until: Timestamp) -> Iterator[Dict[str, Any]]:
+    """Записи архива с ts в [start, until] по порядку, сегмент за сегментом"""
+    for first, last, path in list_segments(archive_dir):
+        if last < start or first > until:
+            continue
+        with gzip.open(path, "rb") as f:
+            for entry in bson.decode_file_iter(f):
+                if entry["ts"] < start:
+                    continue
+                if entry["ts"] > until:
+                    return
+                yield entry
+
+
+def _strip(entry: Dict[str, Any]) -> Dict[str, Any]:
+    # UUID коллекций (ui) в целевом кластере другие; служебные поля сессий applyOps не нужны
+    op = {"op": entry["op"], "ns": entry["ns"], "o": entry["o"]}
+    if "o2" in entry:
+        op["o2"] = entry["o2"]
+    return op
+
+
+def _wanted(ns: str, namespaces: Optional[List[str]]) -> bool:
+    database = ns.split(".", 1)[0]
+    if database in SKIP_DATABASES:
+        return False
+    return not namespaces or any(ns == n or ns.startswith(n + ".") for n in namespaces)
+
+
+class OplogRestore:
+    """
+    Применение архива oplog к целевому кластеру до заданного ts
+
+    CRUD записи копятся окном по namespace и применяются пакетами applyOps
+    параллельно по namespace, внутри namespace - строго по порядку. Команды
+    (create, drop, createIndexes) и транзакции - барьер: окно применяется целиком,
+    затем команда отдельно. Порядок между разными коллекциями внутри окна не
+    сохраняется, поэтому окно ограничено window_size записями.
+    """
+
+    def __init__(self, target_client, workers: int = 8, window_size: int = 10000,
+                 namespaces: Optional[List[str]] = None, dry_run: bool = False):
+        self.client = target_client
+        self.workers = workers
+        self.window_size = window_size
+        self.namespaces = namespaces
+        self.dry_run = dry_run
+        self.applied: Dict[str, int] = {}
+        self.commands = 0
+        self.transactions = 0
+        self.skipped = 0
+        self.last_ts: Optional[Timestamp] = None
+        self._transactions: Dict[Tuple[str, Any], List[Dict[str, Any]]] = {}
+
+    @staticmethod
+    def _is_transaction(command: Dict[str, Any]) -> bool:
+        return "applyOps" in command or "commitTransaction" in command or "abortTransaction" in command
+
+    def _transaction_ops(self, entry: Dict[str, Any]) -> List[Dict[str, Any]]:
+        """
+        CRUD операции транзакции к применению, когда она зафиксирована
+
+        Большие и подготовленные транзакции записываются в oplog несколькими
+        записями (partialTxn / prepare) и фиксируются последней записью или
+        commitTransaction; до фиксации операции накапливаются по сессии.
+        """
+        command = entry["o"]
+        key = (json_util.dumps(entry.get("lsid")), entry.get("txnNumber"))
+        if "abortTransaction" in command:
+            self._transactions.pop(key, None)
+            return []
+        ops = self._transactions.pop(key, []) + [
+            _strip(inner) for inner in command.get("applyOps", []) if _wanted(inner["ns"], self.namespaces)
+        ]
+        if command.get("partialTxn") or command.get("prepare"):
+            self._transactions[key] = ops
+            return []
+        return ops
+
+    def _apply(self, ops: List[Dict[str, Any]]):
+        if self.dry_run:
+            return
+        batch, size = [], 0
+        for op in ops:
+            op_size = len(bson.encode(op))
+            if batch and size + op_size > APPLY_OPS_MAX_BYTES:
+                self.client.admin.command("applyOps", batch)
+                batch, size = [], 0
+            batch.append(op)
+            size += op_size
+        if batch:
+            self.client.admin.command("applyOps", batch)
+
+    def _flush(self, pool: ThreadPoolExecutor, window: Dict[str, List[Dict[str, Any]]]):
+        futures = [pool.submit(self._apply, ops) for ops in window.values()]
+        for future in futures:
+            future.result()
+        for ns, ops in window.items():
+            self.applied[ns] = self.applied.get(ns, 0) + len(ops)
+        window.clear()
+
+    def run(self, entries: Iterator[Dict[str, Any]]) -> Dict[str, Any]:
+        started = time.perf_counter()
+        window: Dict[str, List[Dict[str, Any]]] = {}
+        pending = 0
+        with ThreadPoolExecutor(max_workers=self.workers, thread_name_prefix="pitr") as pool:
+            for entry in entries:
+                op, ns = entry["op"], entry["ns"]
+                if op == "c" and self._is_transaction(entry["o"]):
+                    ops = self._transaction_ops(entry)
+                    if ops:
+                        # Транзакция - барьер и одна атомарная команда applyOps
+                        self._flush(pool, window)
+                        pending = 0
+                        self._apply(ops)
+                        self.transactions += 1
+                        for tx_op in ops:
+                            self.applied[tx_op["ns"]] = self.applied.get(tx_op["ns"], 0) + 1
+                elif op == "n" or not _wanted(ns, self.namespaces):
+                    self.skipped += 1
+                    continue
+                elif op == "c":
+                    self._flush(pool, window)
+                    pending = 0
+                    self._apply([_strip(entry)])
+                    self.commands += 1
+                else:
+                    window.setdefault(ns, []).append(_strip(entry))
+                    pending += 1
+                    if pending >= self.window_size:
+                        self._flush(pool, window)
+                        pending = 0
+                self.last_ts = entry["ts"]
+            self._flush(pool, window)
+        return {
+            "dry_run": self.dry_run,
+            "applied": sum(self.applied.values()),
+            "applied_by_namespace": self.applied,
+            "commands": self.commands,
+            "transactions": self.transactions,
+            "skipped": self.skipped,
+            "restored_to": str(self.last_ts.as_datetime()) if self.last_ts else None,
+            "restored_to_ts": f"{self.last_ts.time}:{self.last_ts.inc}" if self.last_ts else None,
+            "duration_seconds": round(time.perf_counter() - started, 3)
+        }
+
+
+def restore(archive_dir: str, target_client, start: Timestamp, until: Timestamp, **options) -> Dict[str, Any]:
+    """Проверить непрерывность архива на [start, until] и применить его к целевому кластеру"""
+    segments = [s for s in list_segments(archive_dir) if s[1] >= start and s[0] <= until]
+    if not segments:
+        raise ValueError("В архиве нет сегментов для запрошенного интервала")
+    if segments[0][0] > start:
+        raise ValueError(f"Архив начинается с {segments[0][0].as_datetime()}, позже начала восстановления")
+    for gap in load_state(archive_dir)["gaps"]:
+        if gap["from"] < until and gap["to"] > start:
+            raise ValueError(f"Разрыв архива с {gap['from'].as_datetime()} по {gap['to'].as_datetime()}: "
+                             f"восстановление через него невозможно")
+    return OplogRestore(target_client, **options).run(read_entries(archive_dir, start, until))
+
+
+def main(argv=None) -> int:
+    logging.basicConfig(level=logging.INFO)
+    parser = argparse.ArgumentParser(prog="oplog_archive.py", description="Архив oplog и восстановление на момент времени")
+    sub = parser.add_subparsers(dest="command", required=True)
+
+    segments = sub.add_parser("segments", help="Сегменты архива и покрытый интервал")
+    segments.add_argument("--archive", default=os.getenv("OPLOG_ARCHIVE_DIR", "/archive"))
+
+    rst = sub.add_parser("restore", help="Применить архив к целевому кластеру до момента времени")
+    rst.add_argument("--archive", default=os.getenv("OPLOG_ARCHIVE_DIR", "/archive"))
+    rst.add_argument("--target-uri", required=True)
+    rst.add_argument("--from", dest="start", required=True,
+                     help="Начало: время резервной копии целевого кластера (ISO или секунды:инкремент)")
+    rst.add_argument("--until", required=True, help="Момент восстановления включительно (ISO или секунды:инкремент)")
+    rst.add_argument("--ns", action="append", help="База или база.коллекция; можно несколько раз")
+    rst.add_argument("--workers", type=int, default=8)
+    rst.add_argument("--window", type=int, default=10000, help="Записей в окне параллельного применения")
+    rst.add_argument("--dry-run", action="store_true", help="Только подсчитать записи")
+    args = parser.parse_args(argv)
+
+    if args.command == "segments":
+        state = load_state(args.archive)
+        for first, last, path in list_segments(args.archive):
+            print(f"{first.as_datetime()} .. {last.as_datetime()}  {os.path.getsize(path) / 1024 / 1024:8.1f} MiB  "
+                  f"{os.path.basename(path)}")
+        for gap in state["gaps"]:
+            print(f"🚨 разрыв {gap['from'].as_datetime()} .. {gap['to'].as_datetime()} ({gap.get('reason', 'overwritten')})")
+        return 0
+
+    target = create_client(args.target_uri)
+    try:
+        result = restore(args.archive, target, parse_timestamp(args.start), parse_timestamp(args.until, upper=True),
+                         workers=args.workers, window_size=args.window, namespaces=args.ns, dry_run=args.dry_run)
+    finally:
+        target.close()
+    print(json.dumps(result, ensure_ascii=False, indent=2))
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
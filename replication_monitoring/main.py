@@ -1,8 +1,15 @@
 from fastapi import FastAPI, HTTPException
-from pymongo import MongoClient
-from pymongo.errors import ConnectionFailure
+from common.alerts import AlertEngine, alerts_router
+from common.backend import create_client
+from common.lifecycle import MongoConnection, lifecycle_router
+from common.mongo_guard import MongoGuard
+from common.responses import FastRoute, guarded, versioned
+from common.cluster_view import ClusterView, ClusterViewCache
+from common.fleet import FleetMonitor, fleet_router
+from common.thresholds import thresholds, thresholds_router
 import os
 import logging
+import threading
 from datetime import datetime, timedelta
 from typing import List, Dict
 from fastapi.middleware.cors import CORSMiddleware
@@ -10,6 +17,7 @@ logging.basicConfig(level=logging.INFO)
 logger = logging.getLogger(__name__)
 
 app = FastAPI(title="Replication Monitoring Service", description="Мониторинг репликации и oplog lag")
+app.router.route_class = FastRoute
 # CORS Middleware
 app.add_middleware(
     CORSMiddleware,
@@ -19,20 +27,57 @@ app.add_middleware(
     allow_headers=["*"],
 )
 MONGO_URI = os.getenv("MONGO_URI", "mongodb://localhost:27017/?replicaSet=rs0")
+CLUSTER_VIEW_MAX_AGE_SECONDS = float(os.getenv("CLUSTER_VIEW_MAX_AGE_SECONDS", "1"))
+ALERT_EVALUATION_SECONDS = float(os.getenv("ALERT_EVALUATION_SECONDS", "5"))
 client = None
+# Дедлайн операций MongoDB на пути запроса и circuit breaker (MONGO_DEADLINE_SECONDS, MONGO_BREAKER_*)
+mongo_guard = MongoGuard("replication_monitoring")
+# Подключение к MongoDB в фоне с повторами; /livez и /readyz для оркестратора
+mongo_connection = MongoConnection("replication_monitoring", mongo_guard)
+app.include_router(lifecycle_router(mongo_connection))
+# Разобранный replSetGetStatus общий для всех эндпоинтов в пределах CLUSTER_VIEW_MAX_AGE_SECONDS
+cluster_views = ClusterViewCache(max_age_seconds=CLUSTER_VIEW_MAX_AGE_SECONDS, uri=MONGO_URI)
+
+def _status_version() -> str:
+    """Версия ответов о состоянии: топология кластера и действующие пороги"""
+    return f"{cluster_views.version(client)}-{thresholds.current().version}"
+
+# Реестр кластеров (FLEET_CONFIG) с опросом по расписанию для /fleet/*
+fleet = FleetMonitor.from_env(MONGO_URI)
+app.include_router(fleet_router(fleet))
+app.include_router(thresholds_router())
+# Алерты с fingerprint, состоянием и историей; правила оцениваются в фоне каждые ALERT_EVALUATION_SECONDS
+alert_engine = AlertEngine.from_env("replication_monitoring")
+app.include_router(alerts_router(alert_engine, "/monitoring/alerts"))
+alert_evaluation_stop = threading.Event()
+
+def _evaluate_alerts_loop():
+    """Фоновая оценка правил алертов, чтобы переходы фиксировались и без запросов"""
+    while not alert_evaluation_stop.is_set():
+        if client is not None:
+            evaluate_alerts()
+        alert_evaluation_stop.wait(ALERT_EVALUATION_SECONDS)
 
 @app.on_event("startup")
 async def startup_db_client():
     global client
-    try:
-        client = MongoClient(MONGO_URI)
-        client.admin.command('ping')
-        logger.info("✅ Replication Monitoring: Подключено к MongoDB")
-    except ConnectionFailure as e:
-        logger.error(f"❌ Ошибка подключения: {e}")
+    client = create_client(MONGO_URI)
+    mongo_connection.start(lambda: client)
+
+    fleet.start(client, MONGO_URI)
+
+    alert_engine.start()
+    alert_evaluation_stop.clear()
+    threading.Thread(target=_evaluate_alerts_loop, daemon=True).start()
+    logger.info(f"🔔 Оценка алертов запущена (интервал {ALERT_EVALUATION_SECONDS}s)")
 
 @app.on_event("shutdown")
 async def shutdown_db_client():
+    mongo_connection.stop()
+    alert_evaluation_stop.set()
+    alert_engine.stop()
+    fleet.stop()
+    cluster_views.close()
     if client:
         client.close()
 
@@ -41,244 +86,282 @@ async def root():
     return {
         "service": "Replication Monitoring Service",
         "status": "running",
-        "description": "Мониторинг статуса репликации и oplog lag"
+        "description": "Мониторинг статуса репликации и oplog lag",
+        "mongo": mongo_guard.to_dict()
+    }
+
+def _replication_status_report(view: ClusterView) -> Dict:
+    rules = thresholds.current()
+    replication_info = []
+    
+    # Lag относительно Primary уже посчитан при разборе снимка
+    for member in view.members:
+        lag_seconds = member.lag_seconds or 0
+        
+        replication_info.append({
+            "name": member.name,
+            "state": member.state,
+            "health": "healthy" if member.healthy else "unhealthy",
+            "optime": str(member.optime) if member.optime else None,
+            "lag_seconds": lag_seconds,
+            "lag_status": rules.classify("replication_status_lag", lag_seconds)
+        })
+    
+    return {
+        "replica_set": view.set_name,
+        "members": replication_info,
+        "timestamp": str(datetime.now())
     }
 
 @app.get("/replication/status")
+@guarded(mongo_guard)
+@versioned(_status_version)
 async def get_replication_status():
     """Получить общий статус репликации"""
     try:
-        rs_status = client.admin.command('replSetGetStatus')
-        
-        replication_info = []
-        primary_optime = None
+        return cluster_views.dispatch(client, _replication_status_report)
         
-        # Находим Primary узел и его optime
-        for member in rs_status['members']:
-            if member['stateStr'] == 'PRIMARY':
-                primary_optime = member.get('optimeDate')
-                break
+    except Exception as e:
+        logger.error(f"❌ Ошибка получения статуса репликации: {e}")
+        raise HTTPException(status_code=500, detail=str(e))
+
+# Оценка угрозы для уровней шкалы replication_lag
+LAG_THREATS = {
+    "EXCELLENT": "Нет угрозы",
+    "GOOD": "Минимальная задержка",
+    "WARNING": "⚠️ Повышенная задержка репликации",
+    "CRITICAL": "🔴 КРИТИЧЕСКАЯ задержка - риск потери данных!"
+}
+
+def _replication_lag_report(view: ClusterView) -> Dict:
+    rules = thresholds.current()
+    primary_member = view.primary
+    secondary_members = view.secondaries
+    
+    if not primary_member:
+        return {
+            "status": "error",
+            "message": "Primary узел не найден",
+            "threat_level": "CRITICAL"
+        }
+    
+    primary_optime = primary_member.optime
+    
+    lag_analysis = []
+    max_lag = 0
+    
+    for secondary in secondary_members:
+        lag_seconds = secondary.lag_seconds
         
-        # Собираем информацию о репликации для каждого узла
-        for member in rs_status['members']:
-            member_optime = member.get('optimeDate')
+        if lag_seconds is not None:
+            max_lag = max(max_lag, lag_seconds)
             
-            # Вычисляем задержку репликации (lag)
-            lag_seconds = 0
-            if primary_optime and member_optime and member['stateStr'] != 'PRIMARY':
-                lag = primary_optime - member_optime
-                lag_seconds = lag.total_seconds()
+            # Оценка критичности задержки по шкале replication_lag
+            status = rules.classify("replication_lag", lag_seconds)
+            threat = LAG_THREATS.get(status, status)
             
-            replication_info.append({
-                "name": member['name'],
-                "state": member['stateStr'],
-                "health": "healthy" if member['health'] == 1 else "unhealthy",
-                "optime": str(member_optime) if member_optime else None,
-                "lag_seconds": lag_seconds,
-                "lag_status": "OK" if lag_seconds < 10 else "WARNING" if lag_seconds < 30 else "CRITICAL"
+            lag_analysis.append({
+                "node": secondary.name,
+                "lag_seconds": round(lag_seconds, 2),
+                "lag_formatted": str(timedelta(seconds=int(lag_seconds))),
+                "status": status,
+                "threat_assessment": threat,
+                "last_optime": str(secondary.optime)
             })
-        
-        return {
-            "replica_set": rs_status.get('set'),
-            "members": replication_info,
-            "timestamp": str(datetime.now())
-        }
-        
-    except Exception as e:
-        logger.error(f"❌ Ошибка получения статуса репликации: {e}")
-        raise HTTPException(status_code=500, detail=str(e))
+    
+    # Общая оценка
+    overall_status = rules.classify("replication_overall_lag", max_lag)
+    
+    return {
+        "primary_node": primary_member.name,
+        "primary_optime": str(primary_optime),
+        "secondary_nodes_count": len(secondary_members),
+        "max_lag_seconds": round(max_lag, 2),
+        "overall_status": overall_status,
+        "lag_details": lag_analysis,
+        "recommendations": [
+            "✅ Репликация в норме" if overall_status == "GOOD" else "⚠️ Проверьте сетевое соединение",
+            "✅ Консистентность данных обеспечена" if overall_status == "GOOD" else "🔴 Риск несогласованности данных"
+        ]
+    }
 
 @app.get("/replication/lag")
+@guarded(mongo_guard)
+@versioned(_status_version)
 async def get_replication_lag():
     """
     Детальный анализ oplog lag - задержки репликации между узлами
     КРИТИЧНО для обнаружения угрозы UBI.136
     """
     try:
-        rs_status = client.admin.command('replSetGetStatus')
-        
-        primary_member = None
-        secondary_members = []
-        
-        # Разделяем узлы
-        for member in rs_status['members']:
-            if member['stateStr'] == 'PRIMARY':
-                primary_member = member
-            elif member['stateStr'] == 'SECONDARY':
-                secondary_members.append(member)
-        
-        if not primary_member:
-            return {
-                "status": "error",
-                "message": "Primary узел не найден",
-                "threat_level": "CRITICAL"
-            }
-        
-        primary_optime = primary_member.get('optimeDate')
-        
-        lag_analysis = []
-        max_lag = 0
-        
-        for secondary in secondary_members:
-            secondary_optime = secondary.get('optimeDate')
-            
-            if primary_optime and secondary_optime:
-                lag = primary_optime - secondary_optime
-                lag_seconds = lag.total_seconds()
-                max_lag = max(max_lag, lag_seconds)
-                
-                # Оценка критичности задержки
-                if lag_seconds < 5:
-                    status = "EXCELLENT"
-                    threat = "Нет угрозы"
-                elif lag_seconds < 10:
-                    status = "GOOD"
-                    threat = "Минимальная задержка"
-                elif lag_seconds < 30:
-                    status = "WARNING"
-                    threat = "⚠️ Повышенная задержка репликации"
-                else:
-                    status = "CRITICAL"
-                    threat = "🔴 КРИТИЧЕСКАЯ задержка - риск потери данных!"
-                
-                lag_analysis.append({
-                    "node": secondary['name'],
-                    "lag_seconds": round(lag_seconds, 2),
-                    "lag_formatted": str(timedelta(seconds=int(lag_seconds))),
-                    "status": status,
-                    "threat_assessment": threat,
-                    "last_optime": str(secondary_optime)
-                })
-        
-        # Общая оценка
-        overall_status = "CRITICAL" if max_lag > 30 else "WARNING" if max_lag > 10 else "GOOD"
-        
-        return {
-            "primary_node": primary_member['name'],
-            "primary_optime": str(primary_optime),
-            "secondary_nodes_count": len(secondary_members),
-            "max_lag_seconds": round(max_lag, 2),
-            "overall_status": overall_status,
-            "lag_details": lag_analysis,
-            "recommendations": [
-                "✅ Репликация в норме" if overall_status == "GOOD" else "⚠️ Проверьте сетевое соединение",
-                "✅ Консистентность данных обеспечена" if max_lag < 10 else "🔴 Риск несогласованности данных"
-            ]
-        }
+        return cluster_views.dispatch(client, _replication_lag_report)
         
     except Exception as e:
         logger.error(f"❌ Ошибка анализа lag: {e}")
         raise HTTPException(status_code=500, detail=str(e))
 
+def _oplog_report(db_client) -> Dict:
+    # Подключаемся к local БД где хранится oplog
+    local_db = db_client['local']
+    oplog = local_db['oplog.rs']
+    
+    # Получаем размер oplog
+    stats = local_db.command('collStats', 'oplog.rs')
+    
+    # Первая и последняя записи
+    first_entry = oplog.find().sort('$natural', 1).limit(1)
+    last_entry = oplog.find().sort('$natural', -1).limit(1)
+    
+    first_ts = None
+    last_ts = None
+    
+    for entry in first_entry:
+        first_ts = entry['ts'].as_datetime()
+    
+    for entry in last_entry:
+        last_ts = entry['ts'].as_datetime()
+    
+    # Вычисляем временное окно oplog
+    oplog_window = None
+    if first_ts and last_ts:
+        oplog_window = last_ts - first_ts
+    
+    return {
+        "oplog_size_mb": round(stats['size'] / (1024 * 1024), 2),
+        "oplog_max_size_mb": round(stats.get('maxSize', 0) / (1024 * 1024), 2),
+        "document_count": stats['count'],
+        "first_timestamp": str(first_ts) if first_ts else None,
+        "last_timestamp": str(last_ts) if last_ts else None,
+        "oplog_window": str(oplog_window) if oplog_window else None,
+        "oplog_window_hours": round(oplog_window.total_seconds() / 3600, 2) if oplog_window else None,
+        "description": "Oplog содержит историю операций для репликации"
+    }
+
 @app.get("/replication/oplog/info")
+@guarded(mongo_guard)
 async def get_oplog_info():
-    """Получить информацию об oplog (журнал операций)"""
+    """Получить информацию об oplog (журнал операций); за mongos - по каждому шарду"""
     try:
-        # Подключаемся к local БД где хранится oplog
-        local_db = client['local']
-        oplog = local_db['oplog.rs']
-        
-        # Получаем размер oplog
-        stats = local_db.command('collStats', 'oplog.rs')
-        
-        # Первая и последняя записи
-        first_entry = oplog.find().sort('$natural', 1).limit(1)
-        last_entry = oplog.find().sort('$natural', -1).limit(1)
-        
-        first_ts = None
-        last_ts = None
-        
-        for entry in first_entry:
-            first_ts = entry['ts'].as_datetime()
-        
-        for entry in last_entry:
-            last_ts = entry['ts'].as_datetime()
-        
-        # Вычисляем временное окно oplog
-        oplog_window = None
-        if first_ts and last_ts:
-            oplog_window = last_ts - first_ts
-        
-        return {
-            "oplog_size_mb": round(stats['size'] / (1024 * 1024), 2),
-            "oplog_max_size_mb": round(stats.get('maxSize', 0) / (1024 * 1024), 2),
-            "document_count": stats['count'],
-            "first_timestamp": str(first_ts) if first_ts else None,
-            "last_timestamp": str(last_ts) if last_ts else None,
-            "oplog_window": str(oplog_window) if oplog_window else None,
-            "oplog_window_hours": round(oplog_window.total_seconds() / 3600, 2) if oplog_window else None,
-            "description": "Oplog содержит историю операций для репликации"
-        }
+        return cluster_views.dispatch_clients(client, _oplog_report)
         
     except Exception as e:
         logger.error(f"❌ Ошибка получения oplog info: {e}")
         raise HTTPException(status_code=500, detail=str(e))
 
+def _collect_alerts(view: ClusterView) -> List[Dict]:
+    rules = thresholds.current()
+    alerts = []
+    
+    # Проверяем наличие Primary
+    primary_count = view.primary_count
+    if primary_count == 0:
+        alerts.append({
+            "level": "CRITICAL",
+            "type": "NO_PRIMARY",
+            "message": "🔴 Отсутствует Primary узел - записи невозможны!",
+            "threat": "UBI.136: Полная блокировка записей",
+            "action": "Требуется немедленное восстановление кластера"
+        })
+    elif primary_count > 1:
+        alerts.append({
+            "level": "CRITICAL",
+            "type": "SPLIT_BRAIN",
+            "message": "🔴 Обнаружено более одного Primary узла!",
+            "threat": "UBI.136: Критический риск расхождения данных",
+            "action": "Немедленно изолировать сегменты сети"
+        })
+    
+    # Проверяем здоровье узлов
+    for member in view.unhealthy:
+        alerts.append({
+            "level": "WARNING",
+            "type": "UNHEALTHY_NODE",
+            "node": member.name,
+            "message": f"⚠️ Узел {member.name} недоступен",
+            "threat": "Потеря избыточности данных",
+            "action": "Проверить доступность узла"
+        })
+    
+    # Проверяем lag Secondary относительно Primary
+    for member in view.secondaries:
+        lag = member.lag_seconds
+        level = rules.classify("alert_replication_lag", lag) if lag is not None else None
+        if level:
+            alerts.append({
+                "level": level,
+                "type": "HIGH_REPLICATION_LAG",
+                "node": member.name,
+                "message": f"⚠️ Высокая задержка репликации на {member.name}: {round(lag, 2)}s",
+                "threat": "Риск устаревших данных при чтении с Secondary",
+                "action": "Проверить сетевую производительность"
+            })
+    
+    return alerts
+
+def _current_alerts() -> List[Dict]:
+    """Алерты по текущему снимку; за mongos - со всех шардов и config-серверов, у каждого указан shard"""
+    if not cluster_views.is_sharded(client):
+        return _collect_alerts(cluster_views.current(client))
+    views, errors = cluster_views.current_shards(client)
+    alerts = []
+    for shard, view in views.items():
+        alerts.extend({"shard": shard, **alert} for alert in _collect_alerts(view))
+    for shard, error in errors.items():
+        alerts.append({
+            "shard": shard,
+            "level": "CRITICAL",
+            "type": "SHARD_UNREACHABLE",
+            "message": f"🔴 Шард {shard} недоступен: {error}",
+            "threat": "UBI.136: Состояние репликации шарда неизвестно",
+            "action": "Проверить доступность Replica Set шарда"
+        })
+    return alerts
+
+def evaluate_alerts() -> List[Dict]:
+    """Оценить правила по текущему снимку и передать результат движку алертов"""
+    try:
+        alerts = _current_alerts()
+    except Exception as e:
+        logger.warning(f"⚠️ Снимок кластера для алертов недоступен: {e}")
+        alerts = [{
+            "level": "CRITICAL",
+            "type": "CLUSTER_UNAVAILABLE",
+            "message": f"🔴 Статус кластера недоступен: {e}",
+            "threat": "UBI.136: Состояние репликации неизвестно",
+            "action": "Проверить доступность узлов и сети"
+        }]
+    return alert_engine.evaluate(alerts)
+
 @app.get("/monitoring/alerts")
+@guarded(mongo_guard)
 async def get_monitoring_alerts():
     """
     Получить активные алерты о проблемах репликации
+    Алерты из последней оценки правил: у каждого fingerprint, состояние и время начала
     """
     try:
-        rs_status = client.admin.command('replSetGetStatus')
-        
-        alerts = []
+        if alert_engine.evaluated_at is None:
+            evaluate_alerts()
+        alerts = alert_engine.current()
+        alerts_by_shard = None
+        # Тип топологии уже определен при оценке; недоступный кластер здесь не дает 500
+        if cluster_views.shards is not None and cluster_views.shards.sharded:
+            alerts_by_shard = {}
+            for alert in alerts:
+                shard = alert.get("shard")
+                alerts_by_shard[shard] = alerts_by_shard.get(shard, 0) + 1
         
-        # Проверяем наличие Primary
-        primary_count = sum(1 for m in rs_status['members'] if m['stateStr'] == 'PRIMARY')
-        if primary_count == 0:
-            alerts.append({
-                "level": "CRITICAL",
-                "type": "NO_PRIMARY",
-                "message": "🔴 Отсутствует Primary узел - записи невозможны!",
-                "threat": "UBI.136: Полная блокировка записей",
-                "action": "Требуется немедленное восстановление кластера"
-            })
-        elif primary_count > 1:
-            alerts.append({
-                "level": "CRITICAL",
-                "type": "SPLIT_BRAIN",
-                "message": "🔴 Обнаружено более одного Primary узла!",
-                "threat": "UBI.136: Критический риск расхождения данных",
-                "action": "Немедленно изолировать сегменты сети"
-            })
-        
-        # Проверяем здоровье узлов
-        unhealthy = [m for m in rs_status['members'] if m['health'] != 1]
-        if unhealthy:
-            for member in unhealthy:
-                alerts.append({
-                    "level": "WARNING",
-                    "type": "UNHEALTHY_NODE",
-                    "message": f"⚠️ Узел {member['name']} недоступен",
-                    "threat": "Потеря избыточности данных",
-                    "action": "Проверить доступность узла"
-                })
-        
-        # Проверяем lag (используем предыдущую логику)
-        primary_member = next((m for m in rs_status['members'] if m['stateStr'] == 'PRIMARY'), None)
-        if primary_member:
-            primary_optime = primary_member.get('optimeDate')
-            for member in rs_status['members']:
-                if member['stateStr'] == 'SECONDARY':
-                    member_optime = member.get('optimeDate')
-                    if primary_optime and member_optime:
-                        lag = (primary_optime - member_optime).total_seconds()
-                        if lag > 30:
-                            alerts.append({
-                                "level": "WARNING",
-                                "type": "HIGH_REPLICATION_LAG",
-                                "message": f"⚠️ Высокая задержка репликации на {member['name']}: {round(lag, 2)}s",
-                                "threat": "Риск устаревших данных при чтении с Secondary",
-                                "action": "Проверить сетевую производительность"
-                            })
-        
-        return {
+        response = {
             "timestamp": str(datetime.now()),
+            "evaluated_at": alert_engine.evaluated_at,
             "alerts_count": len(alerts),
             "status": "CRITICAL" if any(a['level'] == 'CRITICAL' for a in alerts) else "WARNING" if alerts else "OK",
             "alerts": alerts if alerts else [{"level": "INFO", "message": "✅ Все системы работают нормально"}]
         }
+        if alerts_by_shard is not None:
+            response["topology"] = "sharded"
+            response["alerts_by_shard"] = alerts_by_shard
+        return response
         
     except Exception as e:
         logger.error(f"❌ Ошибка получения алертов: {e}")
@@ -0,0 +1,34 @@
+#!/bin/bash
+# Запуск всех микросервисов без Docker и MongoDB на встроенной замене (MONGO_BACKEND=fake)
+# Каждый сервис получает свой экземпляр эмулируемого Replica Set.
+#
+#   ./run_offline.sh                         # топология без сбоев
+#   FAKE_MONGO_SCENARIO=scenario.json ./run_offline.sh
+#
+# Пример сценария: [{"at": 10, "action": "stop", "member": "mongo-primary"},
+#                   {"at": 20, "action": "lag", "member": "mongo-secondary2", "seconds": 45},
+#                   {"at": 40, "action": "heal"}]
+# Действия: stop, start, elect, step_down, split_brain, heal, lag, ping, state
+
+ROOT="$(cd "$(dirname "$0")" && pwd)"
+export MONGO_BACKEND=fake
+export PYTHONPATH="$ROOT${PYTHONPATH:+:$PYTHONPATH}"
+
+services=(
+    "consensus_service:8001"
+    "replication_monitoring:8002"
+    "health_check:8003"
+    "transaction_log:8004"
+    "recovery_service:8005"
+)
+
+pids=()
+for service in "${services[@]}"; do
+    IFS=':' read -r dir port <<< "$service"
+    (cd "$ROOT/$dir" && exec python -m uvicorn main:app --host 127.0.0.1 --port "$port" --log-level warning) &
+    pids+=($!)
+    echo "🧪 $dir запущен на порту $port (pid ${pids[-1]})"
+done
+
+trap 'kill "${pids[@]}" 2>/dev/null' INT TERM EXIT
+wait
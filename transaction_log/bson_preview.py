@@ -0,0 +1,97 @@
+import struct
+from typing import List, Tuple
+
+import bson
+
+# Размер значения фиксированной длины по типу элемента BSON
+_FIXED_SIZES = {0x01: 8, 0x06: 0, 0x07: 12, 0x08: 1, 0x09: 8, 0x0A: 0, 0x10: 4, 0x11: 8, 0x12: 8,
+                0x13: 16, 0xFF: 0, 0x7F: 0}
+_STRING_TYPES = (0x02, 0x0D, 0x0E)
+_DOCUMENT_TYPES = (0x03, 0x04)
+ELLIPSIS = "…"
+
+
+def _cstring_end(data: bytes, position: int) -> int:
+    end = data.find(b"\x00", position)
+    if end < 0:
+        raise IndexError
+    return end
+
+
+def _value_size(data: bytes, kind: int, position: int) -> int:
+    if kind in _FIXED_SIZES:
+        return _FIXED_SIZES[kind]
+    if kind in _STRING_TYPES:
+        return 4 + struct.unpack_from("<i", data, position)[0]
+    if kind in _DOCUMENT_TYPES or kind == 0x0F:
+        return struct.unpack_from("<i", data, position)[0]
+    if kind == 0x05:
+        return 5 + struct.unpack_from("<i", data, position)[0]
+    if kind == 0x0B:
+        return _cstring_end(data, _cstring_end(data, position) + 1) + 1 - position
+    if kind == 0x0C:
+        return 4 + struct.unpack_from("<i", data, position)[0] + 12
+    raise ValueError(f"Неизвестный тип BSON 0x{kind:02x}")
+
+
+def _decode_value(element: bytes):
+    # Один элемент в собственном документе: значение и repr как у полного разбора
+    document = struct.pack("<i", len(element) + 5) + element + b"\x00"
+    return next(iter(bson.decode(document).values()))
+
+
+def _preview(data: bytes, position: int, limit: int, array: bool) -> Tuple[str, bool]:
+    """Текст документа с position длиной не больше limit; (текст, обрезан ли)"""
+    parts: List[str] = []
+    used = 2
+    truncated = False
+    marked = False
+    try:
+        end = position + struct.unpack_from("<i", data, position)[0] - 1
+        position += 4
+        while position < end:
+            kind = data[position]
+            name_end = _cstring_end(data, position + 1)
+            key = data[position + 1:name_end].decode("utf-8", "replace")
+            value_at = name_end + 1
+            prefix = "" if array else f"{key!r}: "
+            room = limit - used - len(prefix) - (2 if parts else 0)
+            if room <= 0:
+                truncated = True
+                break
+            if kind in _DOCUMENT_TYPES:
+                text, cut = _preview(data, value_at, room, kind == 0x04)
+            elif kind == 0x02 and struct.unpack_from("<i", data, value_at)[0] - 1 > room:
+                # Длинная строка: декодируется только префикс, который поместится в текст
+                raw = data[value_at + 4:value_at + 4 + room]
+                text, cut = repr(raw.decode("utf-8", "ignore"))[:-1], True
+            else:
+                size = _value_size(data, kind, value_at)
+                if value_at + size > len(data):
+                    raise IndexError
+                text = repr(_decode_value(data[position:value_at + size]))
+                cut = len(text) > room
+            parts.append(prefix + text)
+            used += len(prefix) + len(text) + (2 if len(parts) > 1 else 0)
+            if cut:
+                # Обрезанный вложенный документ уже закончился многоточием
+                truncated, marked = True, kind in _DOCUMENT_TYPES
+                break
+            position = value_at + _value_size(data, kind, value_at)
+    except (IndexError, struct.error):
+        # Буфер обрезан до конца документа (например, частично распакованная копия)
+        truncated = True
+    open_, close = ("[", "]") if array else ("{", "}")
+    tail = ("" if marked else ELLIPSIS) if truncated else close
+    return open_ + ", ".join(parts) + tail, truncated
+
+
+def bson_preview(data: bytes, limit: int) -> str:
+    """
+    Начало str(документ) не длиннее limit символов прямо из байтов BSON
+
+    Разбираются только элементы, попадающие в текст: длинные строки декодируются
+    префиксом, вложенные документы - рекурсивно, остальное пропускается по длине.
+    Стоимость не зависит от размера документа.
+    """
+    return _preview(data, 0, limit, False)[0][:limit]
@@ -0,0 +1,326 @@
+"""
+Потоковая выгрузка журнала аудита и oplog в файлы NDJSON (gzip / zstd) или Parquet
+
+Запуск (в контейнере transaction-log или из папки transaction_log с корнем репозитория в PYTHONPATH):
+    python export.py audit --out /exports/audit --start 2026-10-01 --end 2026-10-19 --compression zstd
+    python export.py oplog --out /exports/oplog --format parquet --max-rows-per-second 20000
+
+Выгрузка пишется частями по --rows-per-part строк; после каждой завершенной части
+в checkpoint.json сохраняется позиция. Повторный запуск с тем же --out продолжает
+с последней завершенной части, незавершенная часть пишется заново.
+"""
+import argparse
+import glob
+import gzip
+import logging
+import os
+import sys
+import time
+from datetime import datetime
+from typing import Any, Dict, Iterator, Optional
+
+from bson import json_util
+from bson.json_util import JSONMode, JSONOptions
+from bson.timestamp import Timestamp
+
+from common.backend import create_client
+from partitions import AuditPartitions
+
+logging.basicConfig(level=logging.INFO)
+logger = logging.getLogger(__name__)
+
+MONGO_URI = os.getenv("MONGO_URI", "mongodb://localhost:27017/?replicaSet=rs0")
+# Документов за один getMore: меньше обращений к серверу при постоянной памяти
+EXPORT_BATCH_SIZE = int(os.getenv("EXPORT_BATCH_SIZE", "5000"))
+EXPORT_ROWS_PER_PART = int(os.getenv("EXPORT_ROWS_PER_PART", "500000"))
+# Строк в row group Parquet - столько строк держится в памяти перед записью
+EXPORT_ROW_GROUP = int(os.getenv("EXPORT_ROW_GROUP", "50000"))
+CHECKPOINT_FILE = "checkpoint.json"
+JSON_OPTIONS = JSONOptions(json_mode=JSONMode.RELAXED)
+EXTENSIONS = {"gzip": ".gz", "zstd": ".zst", "none": ""}
+
+
+def _json(value: Any) -> Optional[str]:
+    return None if value is None else json_util.dumps(value, json_options=JSON_OPTIONS)
+
+
+def _open_stream(path: str, compression: str):
+    if compression == "gzip":
+        return gzip.open(path, "wb", compresslevel=6)
+    if compression == "zstd":
+        try:
+            import zstandard
+        except ImportError as e:
+            raise RuntimeError(f"Сжатие zstd требует пакет zstandard: {e}")
+        return zstandard.ZstdCompressor(level=3).stream_writer(open(path, "wb"), closefd=True)
+    return open(path, "wb")
+
+
+class NdjsonPart:
+    """Часть выгрузки: по строке Relaxed Extended JSON на документ"""
+
+    def __init__(self, path: str, compression: str, source):
+        self.stream = _open_stream(path, compression)
+
+    def write(self, row: Dict[str, Any]):
+        self.stream.write(json_util.dumps(row, json_options=JSON_OPTIONS).encode() + b"\n")
+
+    def close(self):
+        self.stream.close()
+
+
+class ParquetPart:
+    """Часть выгрузки в Parquet: плоские колонки источника, вложенные документы - JSON строки"""
+
+    def __init__(self, path: str, compression: str, source):
+        try:
+            import pyarrow
+            import pyarrow.parquet
+        except ImportError as e:
+            raise RuntimeError(f"Формат parquet требует пакет pyarrow: {e}")
+        self.pa = pyarrow
+        self.schema = source.parquet_schema(pyarrow)
+        self.flatten = source.flatten
+        self.writer = pyarrow.parquet.ParquetWriter(path, self.schema, compression=compression)
+        self.rows = []
+
+    def write(self, row: Dict[str, Any]):
+        self.rows.append(self.flatten(row))
+        if len(self.rows) >= EXPORT_ROW_GROUP:
+            self._flush()
+
+    def _flush(self):
+        if self.rows:
+            self.writer.write_table(self.pa.Table.from_pylist(self.rows, schema=self.schema))
+            self.rows = []
+
+    def close(self):
+        self._flush()
+        self.writer.close()
+
+
+FORMATS = {"ndjson": NdjsonPart, "parquet": ParquetPart}
+
+
+class AuditSource:
+    """Записи журнала аудита по всем партициям в порядке времени"""
+
+    name = "audit"
+
+    def __init__(self, client, start: datetime, end: Optional[datetime], batch_size: int):
+        self.partitions = AuditPartitions(client['protected_db'])
+        self.start = start
+        self.end = end
+        self.batch_size = batch_size
+
+    def rows(self, position: Optional[Dict[str, Any]]) -> Iterator[Dict[str, Any]]:
+        after = (position["timestamp"], position["ids"]) if position else None
+        for row in self.partitions.iter_range(self.start, self.end, after, self.batch_size):
+            yield row
+
+    @staticmethod
+    def advance(position: Optional[Dict[str, Any]], row: Dict[str, Any]) -> Dict[str, Any]:
+        # Одинаковый timestamp у нескольких записей: запоминаются все выданные _id
+        if position and position["timestamp"] == row["timestamp"]:
+            return {"timestamp": row["timestamp"], "ids": position["ids"] + [row["_id"]]}
+        return {"timestamp": row["timestamp"], "ids": [row["_id"]]}
+
+    @staticmethod
+    def parquet_schema(pa):
+        return pa.schema([
+            ("_id", pa.string()), ("seq", pa.int64()), ("timestamp", pa.timestamp("ms")),
+            ("operation_type", pa.string()), ("target_collection", pa.string()),
+            ("write_concern", pa.string()), ("result", pa.string()),
+            ("document", pa.string()), ("metadata", pa.string()), ("replica_set_status", pa.string()),
+            ("payload_sha256", pa.string()), ("payload_size", pa.int64()),
+        ])
+
+    @staticmethod
+    def flatten(row: Dict[str, Any]) -> Dict[str, Any]:
+        payload = row.get("payload") or {}
+        return {
+            "_id": str(row["_id"]),
+            "seq": row.get("seq"),
+            "timestamp": row["timestamp"],
+            "operation_type": row.get("operation_type"),
+            "target_collection": row.get("target_collection"),
+            "write_concern": row.get("write_concern"),
+            "result": row.get("result"),
+            "document": _json(row.get("document")),
+            "metadata": _json(row.get("metadata")),
+            "replica_set_status": _json(row.get("replica_set_status")),
+            "payload_sha256": payload.get("sha256"),
+            "payload_size": payload.get("size"),
+        }
+
+
+class OplogSource:
+    """Записи local.oplog.rs в порядке ts"""
+
+    name = "oplog"
+
+    def __init__(self, client, start: datetime, end: Optional[datetime], batch_size: int):
+        self.oplog = client['local']['oplog.rs']
+        self.start = start
+        self.end = end
+        self.batch_size = batch_size
+
+    def rows(self, position: Optional[Dict[str, Any]]) -> Iterator[Dict[str, Any]]:
+        ts_filter: Dict[str, Any] = (
+            {"$gt": position["ts"]} if position else {"$gte": Timestamp(int(self.start.timestamp()), 0)}
+        )
+        if self.end is not None:
+            ts_filter["$lt"] = Timestamp(int(self.end.timestamp()), 0)
+        oldest = self.oplog.find_one({}, {"ts": 1}, sort=[("$natural", 1)])
+        if position and oldest and oldest["ts"] > position["ts"]:
+            logger.warning(f"⚠️ oplog перезаписан после точки продолжения {position['ts'].as_datetime()} - "
+                           f"записи до {oldest['ts'].as_datetime()} потеряны для выгрузки")
+        # Фильтр по ts на oplog обрабатывается без полного сканирования (поиск начала по ts)
+        cursor = self.oplog.find({"ts": ts_filter}).sort("$natural", 1).batch_size(self.batch_size)
+        for row in cursor:
+            yield row
+
+    @staticmethod
+    def advance(position: Optional[Dict[str, Any]], row: Dict[str, Any]) -> Dict[str, Any]:
+        return {"ts": row["ts"]}
+
+    @staticmethod
+    def parquet_schema(pa):
+        return pa.schema([
+            ("ts_seconds", pa.int64()), ("ts_inc", pa.int64()), ("wall", pa.timestamp("ms")),
+            ("op", pa.string()), ("ns", pa.string()), ("o", pa.string()), ("o2", pa.string()),
+            ("txn_number", pa.int64()),
+        ])
+
+    @staticmethod
+    def flatten(row: Dict[str, Any]) -> Dict[str, Any]:
+        return {
+            "ts_seconds": row["ts"].time,
+            "ts_inc": row["ts"].inc,
+            "wall": row.get("wall"),
+            "op": row.get("op"),
+            "ns": row.get("ns"),
+            "o": _json(row.get("o")),
+            "o2": _json(row.get("o2")),
+            "txn_number": row.get("txnNumber"),
+        }
+
+
+SOURCES = {"audit": AuditSource, "oplog": OplogSource}
+
+
+class Exporter:
+    """
+    Выгрузка источника частями с контрольной точкой после каждой части
+
+    Часть пишется во временный файл и переименовывается после закрытия, только
+    затем сохраняется позиция. Поэтому после сбоя в каталоге нет неполных
+    частей, а каждая строка попадает ровно в одну часть.
+    """
+
+    def __init__(self, source, out_dir: str, fmt: str, compression: str,
+                 rows_per_part: int = EXPORT_ROWS_PER_PART, max_rows_per_second: float = 0):
+        self.source = source
+        self.out_dir = out_dir
+        self.fmt = fmt
+        self.compression = compression
+        self.rows_per_part = rows_per_part
+        self.max_rows_per_second = max_rows_per_second
+        self.settings = {"source": source.name, "format": fmt, "compression": compression,
+                         "start": source.start, "end": source.end}
+
+    def _part_path(self, number: int) -> str:
+        suffix = ".parquet" if self.fmt == "parquet" else f".ndjson{EXTENSIONS[self.compression]}"
+        return os.path.join(self.out_dir, f"{self.source.name}-{number:05d}{suffix}")
+
+    def _load_state(self) -> Dict[str, Any]:
+        path = os.path.join(self.out_dir, CHECKPOINT_FILE)
+        if not os.path.exists(path):
+            return {**self.settings, "position": None, "parts": 0, "rows": 0, "completed": False}
+        with open(path, encoding="utf-8") as f:
+            state = json_util.loads(f.read())
+        if any(state.get(key) != value for key, value in self.settings.items()):
+            raise ValueError(f"{self.out_dir} содержит выгрузку с другими параметрами: "
+                             f"{ {key: state.get(key) for key in self.settings} }")
+        return state
+
+    def _save_state(self, state: Dict[str, Any]):
+        path = os.path.join(self.out_dir, CHECKPOINT_FILE)
+        with open(path + ".tmp", "w", encoding="utf-8") as f:
+            f.write(json_util.dumps(state, json_options=JSON_OPTIONS, indent=2))
+        os.replace(path + ".tmp", path)
+
+    def run(self) -> Dict[str, Any]:
+        os.makedirs(self.out_dir, exist_ok=True)
+        state = self._load_state()
+        if state["completed"]:
+            logger.info(f"✅ Выгрузка в {self.out_dir} уже завершена: {state['rows']} строк")
+            return state
+        for stale in glob.glob(os.path.join(self.out_dir, "*.tmp")):
+            os.remove(stale)
+        if state["position"] is not None:
+            logger.info(f"↩️ Продолжение выгрузки с части {state['parts'] + 1}, выгружено {state['rows']} строк")
+
+        part, part_rows, position = None, 0, state["position"]
+        started, exported = time.monotonic(), 0
+        for row in self.source.rows(position):
+            if part is None:
+                part_path = self._part_path(state["parts"] + 1)
+                part = FORMATS[self.fmt](part_path + ".tmp", self.compression, self.source)
+            part.write(row)
+            part_rows += 1
+            exported += 1
+            position = self.source.advance(position, row)
+            if part_rows >= self.rows_per_part:
+                self._finish_part(state, part, part_path, part_rows, position)
+                part, part_rows = None, 0
+            if self.max_rows_per_second and exported % 1000 == 0:
+                # Ограничение скорости, чтобы выгрузка не забирала ресурсы узла у рабочей нагрузки
+                ahead = exported / self.max_rows_per_second - (time.monotonic() - started)
+                if ahead > 0:
+                    time.sleep(ahead)
+        if part is not None:
+            self._finish_part(state, part, part_path, part_rows, position)
+        state["completed"] = True
+        self._save_state(state)
+        logger.info(f"✅ Выгрузка {self.source.name} завершена: {state['rows']} строк в {state['parts']} частях, "
+                    f"{exported / max(time.monotonic() - started, 1e-9):.0f} строк/с")
+        return state
+
+    def _finish_part(self, state: Dict[str, Any], part, part_path: str, rows: int, position: Dict[str, Any]):
+        part.close()
+        os.replace(part_path + ".tmp", part_path)
+        state.update(parts=state["parts"] + 1, rows=state["rows"] + rows, position=position)
+        self._save_state(state)
+        logger.info(f"📦 {os.path.basename(part_path)}: {rows} строк, "
+                    f"{os.path.getsize(part_path) / 1024 / 1024:.1f} MiB")
+
+
+def main(argv=None) -> int:
+    parser = argparse.ArgumentParser(prog="export.py", description="Выгрузка журнала аудита и oplog в файлы")
+    parser.add_argument("source", choices=list(SOURCES))
+    parser.add_argument("--out", required=True, help="Каталог выгрузки; повторный запуск продолжает выгрузку")
+    parser.add_argument("--start", type=datetime.fromisoformat, default=datetime(1970, 1, 2),
+                        help="Начало интервала (ISO, локальное время)")
+    parser.add_argument("--end", type=datetime.fromisoformat, help="Конец интервала, не включая")
+    parser.add_argument("--format", choices=list(FORMATS), default="ndjson")
+    parser.add_argument("--compression", choices=list(EXTENSIONS), default="gzip")
+    parser.add_argument("--rows-per-part", type=int, default=EXPORT_ROWS_PER_PART)
+    parser.add_argument("--batch-size", type=int, default=EXPORT_BATCH_SIZE)
+    parser.add_argument("--max-rows-per-second", type=float, default=0, help="0 - без ограничения")
+    parser.add_argument("--mongo-uri", default=MONGO_URI)
+    args = parser.parse_args(argv)
+
+    # Чтение с Secondary, чтобы выгрузка не нагружала Primary
+    client = create_client(args.mongo_uri, readPreference="secondaryPreferred")
+    try:
+        source = SOURCES[args.source](client, args.start, args.end, args.batch_size)
+        Exporter(source, args.out, args.format, args.compression,
+                 args.rows_per_part, args.max_rows_per_second).run()
+    finally:
+        client.close()
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
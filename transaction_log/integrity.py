@@ -0,0 +1,296 @@
+import hashlib
+import heapq
+import logging
+import threading
+import time
+from collections import deque
+from concurrent.futures import ThreadPoolExecutor
+from datetime import datetime, timedelta
+from typing import Any, Dict, Iterator, List, Tuple
+
+import bson
+from bson.binary import Binary
+from pymongo import ASCENDING, DESCENDING, ReturnDocument, WriteConcern
+from pymongo.errors import DuplicateKeyError
+
+logger = logging.getLogger(__name__)
+
+AUDIT_CHECKPOINTS = "audit_checkpoints"
+AUDIT_COUNTERS = "audit_counters"
+AUDIT_VERIFICATION = "audit_verification"
+# Предыдущая цепочка для первого пакета
+GENESIS = "0" * 64
+HASH_SIZE = 32
+
+
+def _canonical(value: Any) -> Any:
+    # MongoDB сохраняет порядок полей, но time-series собирает документ из столбцов заново
+    if isinstance(value, dict):
+        return {key: _canonical(value[key]) for key in sorted(value)}
+    if isinstance(value, list):
+        return [_canonical(item) for item in value]
+    return value
+
+
+def entry_hash(document: Dict[str, Any]) -> bytes:
+    """SHA-256 записи журнала в том виде, в каком она сохранена (с _id и seq)"""
+    return hashlib.sha256(bson.encode(_canonical(document))).digest()
+
+
+def merkle_root(leaves: List[bytes]) -> bytes:
+    """Корень дерева Меркла; непарный узел уровня поднимается без изменений"""
+    if not leaves:
+        return hashlib.sha256(b"").digest()
+    level = leaves
+    while len(level) > 1:
+        paired = [hashlib.sha256(level[i] + level[i + 1]).digest() for i in range(0, len(level) - 1, 2)]
+        if len(level) % 2:
+            paired.append(level[-1])
+        level = paired
+    return level[0]
+
+
+def chain_hash(prev_chain: str, checkpoint: Dict[str, Any]) -> str:
+    """Звено цепочки: предыдущее звено и заголовок пакета, включая корень и пропуски"""
+    header = (f"{checkpoint['_id']}:{checkpoint['first_seq']}:{checkpoint['last_seq']}:"
+              f"{checkpoint['partition']}:{checkpoint['missing']}:{checkpoint['merkle_root']}")
+    return hashlib.sha256(bytes.fromhex(prev_chain) + header.encode()).hexdigest()
+
+
+class AuditChain:
+    """
+    Цепочка хешей по пакетам записей журнала
+
+    Каждая запись при вставке получает сквозной номер seq. Фоновая задача
+    закрывает пакеты до batch_size записей одной партиции: хеши записей
+    сворачиваются в корень Меркла, а корень сцепляется с предыдущим пакетом.
+    Пакеты хранятся в audit_checkpoints вместе с хешами записей, поэтому
+    проверка указывает конкретные измененные, удаленные и лишние записи.
+
+    Номер, выданный под запись, которая так и не вставилась, становится
+    пропуском пакета, если следующие записи старше seal_grace_seconds.
+    """
+
+    def __init__(self, db, partitions, batch_size: int = 256, seal_grace_seconds: float = 30,
+                 verify_workers: int = 4):
+        self.db = db
+        self.partitions = partitions
+        self.batch_size = batch_size
+        self.seal_grace = timedelta(seconds=seal_grace_seconds)
+        self.verify_workers = verify_workers
+        self.checkpoints = db[AUDIT_CHECKPOINTS].with_options(write_concern=WriteConcern(w="majority"))
+        self._seal_lock = threading.Lock()
+        self._verify_lock = threading.Lock()
+
+    def next_seq(self) -> int:
+        counter = self.db[AUDIT_COUNTERS].with_options(write_concern=WriteConcern(w="majority")).find_one_and_update(
+            {"_id": "transaction_logs"}, {"$inc": {"seq": 1}}, upsert=True, return_document=ReturnDocument.AFTER
+        )
+        return counter["seq"]
+
+    def _last_seq(self) -> int:
+        counter = self.db[AUDIT_COUNTERS].find_one({"_id": "transaction_logs"})
+        return counter["seq"] if counter else 0
+
+    def _pending(self, names: List[str], first_seq: int, last_seq: int) -> Iterator[Tuple[int, str, Dict[str, Any]]]:
+        # Номера растут во времени, но партиция записи определяется ее timestamp:
+        # курсоры партиций сливаются в один поток по seq
+        def stream(name: str):
+            cursor = self.db[name].find({"seq": {"$gte": first_seq, "$lte": last_seq}}).sort("seq", ASCENDING)
+            for doc in cursor.batch_size(1000):
+                yield doc["seq"], name, doc
+
+        return heapq.merge(*(stream(name) for name in names), key=lambda item: item[0])
+
+    def seal(self) -> int:
+        """Закрыть готовые пакеты; возвращает число записей в новых пакетах"""
+        with self._seal_lock:
+            last = self.checkpoints.find_one({}, {"leaf_hashes": 0}, sort=[("_id", DESCENDING)])
+            number = last["_id"] + 1 if last else 1
+            expected = last["last_seq"] + 1 if last else 1
+            prev_chain = last["chain"] if last else GENESIS
+            high = self._last_seq()
+            if high < expected:
+                return 0
+            names = self.partitions.partitions()
+            if last and last["partition"] in names:
+                names = names[names.index(last["partition"]):]
+
+            now = datetime.now()
+            sealed = 0
+            batch: List[Tuple[int, str, Dict[str, Any]]] = []
+            missing: List[int] = []
+            first = expected
+            for seq, name, doc in self._pending(names, expected, high):
+                if seq < expected:
+                    logger.warning(f"⚠️ Повторный номер записи журнала {seq} в {name} - не включен в пакет")
+                    continue
+                if seq > expected and now - doc["timestamp"] < self.seal_grace:
+                    # Пропущенные номера еще могут быть в полете
+                    break
+                if batch and (name != batch[0][1] or len(batch) >= self.batch_size):
+                    prev_chain = self._store(number, first, batch, missing, prev_chain)
+                    number, sealed, first, batch, missing = number + 1, sealed + len(batch), expected, [], []
+                missing.extend(range(expected, seq))
+                batch.append((seq, name, doc))
+                expected = seq + 1
+            # Неполный пакет закрывается, когда новых записей нет дольше seal_grace
+            if batch and (len(batch) >= self.batch_size or now - batch[-1][2]["timestamp"] >= self.seal_grace):
+                self._store(number, first, batch, missing, prev_chain)
+                sealed += len(batch)
+            if sealed:
+                logger.info(f"🔗 Запечатано записей журнала: {sealed}, последний номер {expected - 1}")
+            return sealed
+
+    def _store(self, number: int, first_seq: int, batch: List[Tuple[int, str, Dict[str, Any]]],
+               missing: List[int], prev_chain: str) -> str:
+        leaves = [entry_hash(doc) for _, _, doc in batch]
+        checkpoint = {
+            "_id": number,
+            "first_seq": first_seq,
+            "last_seq": batch[-1][0],
+            "missing": missing,
+            "count": len(batch),
+            "partition": batch[0][1],
+            "start_ts": min(doc["timestamp"] for _, _, doc in batch),
+            "end_ts": max(doc["timestamp"] for _, _, doc in batch),
+            "merkle_root": merkle_root(leaves).hex(),
+            "leaf_hashes": Binary(b"".join(leaves)),
+            "prev_chain": prev_chain,
+            "sealed_at": datetime.now()
+        }
+        checkpoint["chain"] = chain_hash(prev_chain, checkpoint)
+        try:
+            self.checkpoints.insert_one(checkpoint)
+        except DuplicateKeyError:
+            # Пакет с этим номером уже закрыл другой экземпляр сервиса
+            raise RuntimeError(f"Пакет журнала {number} уже запечатан другим экземпляром")
+        return checkpoint["chain"]
+
+    def prune(self) -> int:
+        """Удалить пакеты, записи которых вышли за срок хранения журнала"""
+        cutoff = datetime.now() - timedelta(days=self.partitions.retention_days)
+        last = self.checkpoints.find_one({}, {"_id": 1}, sort=[("_id", DESCENDING)])
+        if last is None:
+            return 0
+        # Последний пакет остается всегда: от него продолжается нумерация и цепочка
+        return self.checkpoints.delete_many({"_id": {"$lt": last["_id"]}, "end_ts": {"$lt": cutoff}}).deleted_count
+
+    def run_sealer(self, stop: threading.Event, interval_seconds: float):
+        """Фоновое закрытие пакетов и удаление устаревших"""
+        while not stop.is_set():
+            try:
+                self.seal()
+                self.prune()
+            except Exception as e:
+                logger.warning(f"⚠️ Не удалось запечатать пакет журнала: {e}")
+            stop.wait(interval_seconds)
+
+    def _verify_checkpoint(self, checkpoint: Dict[str, Any], cutoff: datetime,
+                           dropped: Dict[str, datetime]) -> Dict[str, Any]:
+        result = {"checkpoint": checkpoint["_id"], "first_seq": checkpoint["first_seq"],
+                  "last_seq": checkpoint["last_seq"], "partition": checkpoint["partition"]}
+        # Часть записей могла законно удалиться сроком хранения или через /logs/clear с меньшим сроком
+        if checkpoint["start_ts"] < max(cutoff, dropped.get(checkpoint["partition"], cutoff)):
+            return {**result, "status": "expired"}
+        stored = bytes(checkpoint["leaf_hashes"])
+        leaves = [stored[i:i + HASH_SIZE] for i in range(0, len(stored), HASH_SIZE)]
+        if len(leaves) != checkpoint["count"] or merkle_root(leaves).hex() != checkpoint["merkle_root"]:
+            return {**result, "status": "checkpoint_altered"}
+
+        skipped = set(checkpoint["missing"])
+        expected = iter([seq for seq in range(checkpoint["first_seq"], checkpoint["last_seq"] + 1)
+                         if seq not in skipped])
+        leaf_by_seq = dict(zip(expected, leaves))
+        modified, unexpected, seen = [], [], set()
+        time_range = {"$gte": checkpoint["start_ts"], "$lte": checkpoint["end_ts"]}
+        collection = self.db[checkpoint["partition"]]
+        cursor = collection.find(
+            {"timestamp": time_range, "seq": {"$gte": checkpoint["first_seq"], "$lte": checkpoint["last_seq"]}}
+        )
+        for doc in cursor.batch_size(1000):
+            seq = doc["seq"]
+            leaf = leaf_by_seq.get(seq)
+            if leaf is None or seq in seen:
+                unexpected.append(seq)
+            elif entry_hash(doc) != leaf:
+                modified.append(seq)
+            seen.add(seq)
+        deleted = sorted(set(leaf_by_seq) - seen)
+        # Записи без номера в закрытом интервале не проходили через журнал
+        unsequenced = collection.count_documents({"timestamp": time_range, "seq": {"$exists": False}})
+        ok = not (modified or deleted or unexpected or unsequenced)
+        return {**result, "status": "ok" if ok else "tampered", "entries": len(seen),
+                "modified": sorted(modified), "deleted": deleted, "unexpected": sorted(unexpected),
+                "unsequenced": unsequenced}
+
+    def verify(self, full: bool = False) -> Dict[str, Any]:
+        """
+        Проверить журнал от последнего проверенного пакета (full - с первого сохраненного)
+
+        Пакеты читаются потоком и проверяются параллельно в verify_workers потоках,
+        в памяти не больше двух пакетов на поток. Сцепление пакетов проверяется по
+        порядку. Отметка проверки сдвигается только по непрерывному префиксу
+        успешных пакетов, поэтому повторная проверка стоит столько, сколько новых записей.
+        """
+        with self._verify_lock:
+            started = time.perf_counter()
+            verification = self.db[AUDIT_VERIFICATION]
+            state = verification.find_one({"_id": "state"}) or {}
+            from_checkpoint = 0 if full else state.get("checkpoint", 0)
+            expected_chain = None if full else state.get("chain")
+            cutoff = datetime.now() - timedelta(days=self.partitions.retention_days)
+            dropped = self.partitions.retention_cutoffs()
+
+            results: List[Dict[str, Any]] = []
+            failures: List[Dict[str, Any]] = []
+            verified_through, verified_chain = None, None
+            prefix_ok = True
+            entries = 0
+            in_flight: deque = deque()
+
+            def collect(checkpoint, future):
+                nonlocal expected_chain, verified_through, verified_chain, prefix_ok, entries
+                result = future.result()
+                if expected_chain is not None and checkpoint["prev_chain"] != expected_chain:
+                    result = {**result, "status": "chain_broken"}
+                elif chain_hash(checkpoint["prev_chain"], checkpoint) != checkpoint["chain"]:
+                    result = {**result, "status": "checkpoint_altered"}
+                expected_chain = checkpoint["chain"]
+                entries += result.get("entries", 0)
+                results.append(result)
+                if result["status"] in ("ok", "expired"):
+                    if prefix_ok:
+                        verified_through, verified_chain = checkpoint["_id"], checkpoint["chain"]
+                else:
+                    prefix_ok = False
+                    failures.append(result)
+
+            cursor = self.checkpoints.find({"_id": {"$gt": from_checkpoint}}).sort("_id", ASCENDING)
+            with ThreadPoolExecutor(max_workers=self.verify_workers, thread_name_prefix="audit-verify") as pool:
+                for checkpoint in cursor.batch_size(self.verify_workers * 2):
+                    in_flight.append((checkpoint, pool.submit(self._verify_checkpoint, checkpoint, cutoff, dropped)))
+                    if len(in_flight) >= self.verify_workers * 2:
+                        collect(*in_flight.popleft())
+                while in_flight:
+                    collect(*in_flight.popleft())
+
+            if verified_through is not None and verified_through > state.get("checkpoint", 0):
+                verification.update_one(
+                    {"_id": "state"},
+                    {"$set": {"checkpoint": verified_through, "chain": verified_chain, "verified_at": datetime.now()}},
+                    upsert=True
+                )
+            last = self.checkpoints.find_one({}, {"last_seq": 1}, sort=[("_id", DESCENDING)])
+            return {
+                "mode": "full" if full else "incremental",
+                "status": "TAMPERED" if failures else "OK",
+                "from_checkpoint": from_checkpoint,
+                "checkpoints_verified": len(results),
+                "entries_verified": entries,
+                "expired_checkpoints": sum(1 for r in results if r["status"] == "expired"),
+                "verified_through": max(verified_through or 0, state.get("checkpoint", 0)),
+                "unsealed_entries": self._last_seq() - (last["last_seq"] if last else 0),
+                "failures": failures,
+                "duration_seconds": round(time.perf_counter() - started, 3)
+            }
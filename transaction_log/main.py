@@ -1,16 +1,24 @@
 from fastapi import FastAPI, HTTPException
-from pymongo import MongoClient
-from pymongo.errors import ConnectionFailure
+from common.backend import create_client
+from common.lifecycle import MongoConnection, lifecycle_router
+from common.mongo_guard import MongoGuard
+from common.responses import FastRoute, guarded
+from common.cluster_view import ClusterView, ClusterViewCache
 import os
 import logging
+import threading
 from datetime import datetime
 from typing import Optional, Dict, Any
 from fastapi.middleware.cors import CORSMiddleware
+from partitions import AuditPartitions, RAW_OPTIONS, SUMMARY_FIELDS
+from bson_preview import bson_preview
+from integrity import AuditChain
 
 logging.basicConfig(level=logging.INFO)
 logger = logging.getLogger(__name__)
 
 app = FastAPI(title="Transaction Log Service", description="Логирование операций и аудит транзакций")
+app.router.route_class = FastRoute
 app.add_middleware(
     CORSMiddleware,
     allow_origins=["*"],
@@ -19,27 +27,78 @@ app.add_middleware(
     allow_headers=["*"],
 )
 MONGO_URI = os.getenv("MONGO_URI", "mongodb://localhost:27017/?replicaSet=rs0")
+CLUSTER_VIEW_MAX_AGE_SECONDS = float(os.getenv("CLUSTER_VIEW_MAX_AGE_SECONDS", "1"))
+# day / month - журнал по коллекциям периода; none - одна коллекция с TTL индексом
+AUDIT_PARTITIONING = os.getenv("AUDIT_PARTITIONING", "day")
+AUDIT_RETENTION_DAYS = int(os.getenv("AUDIT_RETENTION_DAYS", "30"))
+AUDIT_RETENTION_CHECK_SECONDS = float(os.getenv("AUDIT_RETENTION_CHECK_SECONDS", "3600"))
+# collection - полная копия документа в записи; timeseries - time-series коллекции (MongoDB 5.0+) с хешем документа
+AUDIT_STORAGE = os.getenv("AUDIT_STORAGE", "collection")
+# В режиме timeseries сжатая копия хранится для документов от этого размера BSON; none - только хеш и размер
+AUDIT_PAYLOAD_BLOB_BYTES = os.getenv("AUDIT_PAYLOAD_BLOB_BYTES", "0")
+# Цепочка хешей журнала: записей в пакете, период закрытия пакетов и ожидание пропущенных номеров
+AUDIT_CHAIN_BATCH = int(os.getenv("AUDIT_CHAIN_BATCH", "256"))
+AUDIT_SEAL_SECONDS = float(os.getenv("AUDIT_SEAL_SECONDS", "10"))
+AUDIT_SEAL_GRACE_SECONDS = float(os.getenv("AUDIT_SEAL_GRACE_SECONDS", "30"))
+AUDIT_VERIFY_WORKERS = int(os.getenv("AUDIT_VERIFY_WORKERS", "4"))
+# Копии документов больше этого размера (байт) в списках журнала отдаются началом текста без полного разбора
+AUDIT_DOCUMENT_PREVIEW_BYTES = int(os.getenv("AUDIT_DOCUMENT_PREVIEW_BYTES", "4096"))
+# Дедлайны эндпоинтов, которые читают все партиции журнала или проверяют цепочку целиком
+AUDIT_QUERY_DEADLINE_SECONDS = float(os.getenv("AUDIT_QUERY_DEADLINE_SECONDS", "15"))
+AUDIT_VERIFY_DEADLINE_SECONDS = float(os.getenv("AUDIT_VERIFY_DEADLINE_SECONDS", "300"))
 client = None
+# Дедлайн операций MongoDB на пути запроса и circuit breaker (MONGO_DEADLINE_SECONDS, MONGO_BREAKER_*)
+mongo_guard = MongoGuard("transaction_log")
+# Подключение к MongoDB в фоне с повторами; /livez и /readyz для оркестратора
+mongo_connection = MongoConnection("transaction_log", mongo_guard)
+app.include_router(lifecycle_router(mongo_connection))
+audit_log = None
+audit_chain = None
+background_stop = threading.Event()
+# Разобранный replSetGetStatus общий для всех эндпоинтов в пределах CLUSTER_VIEW_MAX_AGE_SECONDS
+cluster_views = ClusterViewCache(max_age_seconds=CLUSTER_VIEW_MAX_AGE_SECONDS, uri=MONGO_URI)
+
+@mongo_connection.on_ready
+def _prepare_audit_log():
+    """Срок хранения коллекции журнала (создает ее при необходимости) - после первого успешного ping"""
+    if audit_log.partitioned:
+        logger.info(f"📝 Журнал по партициям ({AUDIT_PARTITIONING}, {AUDIT_STORAGE}), хранение {AUDIT_RETENTION_DAYS} дн.")
+    else:
+        audit_log.apply_ttl(AUDIT_RETENTION_DAYS)
+        logger.info(f"📝 Журнал в {audit_log.partition_name(datetime.now())} с TTL {AUDIT_RETENTION_DAYS} дн.")
 
 @app.on_event("startup")
 async def startup_db_client():
-    global client
-    try:
-        client = MongoClient(MONGO_URI)
-        client.admin.command('ping')
-        logger.info("✅ Transaction Log: Подключено к MongoDB")
-        
-        # Создаем коллекцию для логов, если её нет
-        db = client['protected_db']
-        if 'transaction_logs' not in db.list_collection_names():
-            db.create_collection('transaction_logs')
-            logger.info("📝 Создана коллекция transaction_logs")
-            
-    except ConnectionFailure as e:
-        logger.error(f"❌ Ошибка подключения: {e}")
+    global client, audit_log, audit_chain
+    # Конструкторы не обращаются к MongoDB; ping, TTL и создание коллекций - в фоне (mongo_connection)
+    client = create_client(MONGO_URI)
+    audit_log = AuditPartitions(
+        client['protected_db'], AUDIT_PARTITIONING, AUDIT_RETENTION_DAYS, AUDIT_STORAGE,
+        None if AUDIT_PAYLOAD_BLOB_BYTES == "none" else int(AUDIT_PAYLOAD_BLOB_BYTES)
+    )
+    audit_chain = AuditChain(
+        client['protected_db'], audit_log, AUDIT_CHAIN_BATCH, AUDIT_SEAL_GRACE_SECONDS, AUDIT_VERIFY_WORKERS
+    )
+    mongo_connection.start(lambda: client)
+
+    background_stop.clear()
+    if audit_log.partitioned:
+        threading.Thread(
+            target=audit_log.run_retention,
+            args=(background_stop, AUDIT_RETENTION_CHECK_SECONDS),
+            daemon=True
+        ).start()
+    threading.Thread(
+        target=audit_chain.run_sealer,
+        args=(background_stop, AUDIT_SEAL_SECONDS),
+        daemon=True
+    ).start()
 
 @app.on_event("shutdown")
 async def shutdown_db_client():
+    background_stop.set()
+    mongo_connection.stop()
+    cluster_views.close()
     if client:
         client.close()
 
@@ -48,10 +107,12 @@ async def root():
     return {
         "service": "Transaction Log Service",
         "status": "running",
-        "description": "Логирование всех операций записи и аудит транзакций"
+        "description": "Логирование всех операций записи и аудит транзакций",
+        "mongo": mongo_guard.to_dict()
     }
 
 @app.post("/log/write")
+@guarded(mongo_guard, stale=False)
 async def log_write_operation(
     operation_type: str,
     collection: str,
@@ -64,10 +125,8 @@ async def log_write_operation(
     Залогировать операцию записи
     """
     try:
-        db = client['protected_db']
-        logs_collection = db['transaction_logs']
-        
         log_entry = {
+            "seq": audit_chain.next_seq(),
             "timestamp": datetime.now(),
             "operation_type": operation_type,
             "target_collection": collection,
@@ -75,16 +134,11 @@ async def log_write_operation(
             "write_concern": write_concern,
             "result": result,
             "metadata": metadata or {},
-            "replica_set_status": self._get_replica_status()
+            "replica_set_status": _get_replica_status()
         }
         
-        # Записываем лог с гарантией согласованности
-        from pymongo import WriteConcern
-        logs_with_concern = logs_collection.with_options(
-            write_concern=WriteConcern(w="majority")
-        )
-        
-        log_result = logs_with_concern.insert_one(log_entry)
+        # Записываем лог с гарантией согласованности (w:majority) в партицию периода
+        log_result = audit_log.insert(log_entry)
         
         logger.info(f"📝 Операция залогирована: {operation_type} на {collection}")
         
@@ -98,30 +152,30 @@ async def log_write_operation(
         logger.error(f"❌ Ошибка логирования: {e}")
         raise HTTPException(status_code=500, detail=str(e))
 
+def _replica_status_report(view: ClusterView) -> Dict[str, Any]:
+    return {
+        "primary": view.primary.name if view.primary else None,
+        "healthy_nodes": view.healthy_count,
+        "total_nodes": view.total
+    }
+
 def _get_replica_status():
-    """Получить текущий статус реплика-сета для лога"""
+    """Получить текущий статус реплика-сета для лога (за mongos - по каждому шарду)"""
     try:
-        rs_status = client.admin.command('replSetGetStatus')
-        return {
-            "primary": next((m['name'] for m in rs_status['members'] if m['stateStr'] == 'PRIMARY'), None),
-            "healthy_nodes": sum(1 for m in rs_status['members'] if m['health'] == 1),
-            "total_nodes": len(rs_status['members'])
-        }
+        return cluster_views.dispatch(client, _replica_status_report)
     except:
         return {"status": "unknown"}
 
 app._get_replica_status = _get_replica_status
 
 @app.get("/logs/recent")
+@guarded(mongo_guard)
 async def get_recent_logs(limit: int = 20):
     """
     Получить последние логи операций
     """
     try:
-        db = client['protected_db']
-        logs_collection = db['transaction_logs']
-        
-        logs = list(logs_collection.find().sort('timestamp', -1).limit(limit))
+        logs = audit_log.find_newest({}, limit, document_limit=AUDIT_DOCUMENT_PREVIEW_BYTES)
         
         # Конвертируем ObjectId в строки
         for log in logs:
@@ -138,19 +192,14 @@ async def get_recent_logs(limit: int = 20):
         raise HTTPException(status_code=500, detail=str(e))
 
 @app.get("/logs/by-collection")
+@guarded(mongo_guard)
 async def get_logs_by_collection(collection: str, limit: int = 20):
     """
     Получить логи для конкретной коллекции
     """
     try:
-        db = client['protected_db']
-        logs_collection = db['transaction_logs']
-        
-        logs = list(
-            logs_collection.find({"target_collection": collection})
-            .sort('timestamp', -1)
-            .limit(limit)
-        )
+        logs = audit_log.find_newest({"target_collection": collection}, limit,
+                                     document_limit=AUDIT_DOCUMENT_PREVIEW_BYTES)
         
         for log in logs:
             log['_id'] = str(log['_id'])
@@ -167,49 +216,29 @@ async def get_logs_by_collection(collection: str, limit: int = 20):
         raise HTTPException(status_code=500, detail=str(e))
 
 @app.get("/logs/stats")
+@guarded(mongo_guard, AUDIT_QUERY_DEADLINE_SECONDS)
 async def get_log_statistics():
     """
     Получить статистику по логам операций
     """
     try:
-        db = client['protected_db']
-        logs_collection = db['transaction_logs']
+        total_logs = audit_log.count()
         
-        total_logs = logs_collection.count_documents({})
-        
-        # Статистика по типам операций
-        pipeline = [
-            {"$group": {
-                "_id": "$operation_type",
-                "count": {"$sum": 1}
-            }}
-        ]
-        operation_stats = list(logs_collection.aggregate(pipeline))
-        
-        # Статистика по write_concern
-        pipeline_wc = [
-            {"$group": {
-                "_id": "$write_concern",
-                "count": {"$sum": 1}
-            }}
-        ]
-        write_concern_stats = list(logs_collection.aggregate(pipeline_wc))
-        
-        # Статистика успешности
-        pipeline_result = [
-            {"$group": {
-                "_id": "$result",
-                "count": {"$sum": 1}
-            }}
-        ]
-        result_stats = list(logs_collection.aggregate(pipeline_result))
+        # Статистика по типам операций, write_concern и успешности - по всем партициям
+        operation_stats = audit_log.count_by("operation_type")
+        write_concern_stats = audit_log.count_by("write_concern")
+        result_stats = audit_log.count_by("result")
         
         return {
             "total_operations": total_logs,
             "operations_by_type": operation_stats,
             "operations_by_write_concern": write_concern_stats,
             "operations_by_result": result_stats,
-            "collection_name": "transaction_logs"
+            "collection_name": "transaction_logs",
+            "partitioning": AUDIT_PARTITIONING,
+            "storage": AUDIT_STORAGE,
+            "partitions": audit_log.partitions(),
+            "retention_days": audit_log.retention_days
         }
         
     except Exception as e:
@@ -217,6 +246,7 @@ async def get_log_statistics():
         raise HTTPException(status_code=500, detail=str(e))
 
 @app.get("/audit/timeline")
+@guarded(mongo_guard, AUDIT_QUERY_DEADLINE_SECONDS)
 async def get_audit_timeline(hours: int = 24):
     """
     Получить временную линию операций за последние N часов
@@ -224,15 +254,10 @@ async def get_audit_timeline(hours: int = 24):
     try:
         from datetime import timedelta
         
-        db = client['protected_db']
-        logs_collection = db['transaction_logs']
-        
         cutoff_time = datetime.now() - timedelta(hours=hours)
         
-        logs = list(
-            logs_collection.find({"timestamp": {"$gte": cutoff_time}})
-            .sort('timestamp', 1)
-        )
+        # Читаются только партиции, пересекающие интервал; копии документов timeline не нужны
+        logs = audit_log.find_range({}, cutoff_time, fields=SUMMARY_FIELDS)
         
         timeline = []
         for log in logs:
@@ -256,19 +281,14 @@ async def get_audit_timeline(hours: int = 24):
         raise HTTPException(status_code=500, detail=str(e))
 
 @app.get("/audit/failed-operations")
+@guarded(mongo_guard)
 async def get_failed_operations(limit: int = 20):
     """
     Получить список неудачных операций
     """
     try:
-        db = client['protected_db']
-        logs_collection = db['transaction_logs']
-        
-        failed_logs = list(
-            logs_collection.find({"result": {"$ne": "success"}})
-            .sort('timestamp', -1)
-            .limit(limit)
-        )
+        failed_logs = audit_log.find_newest({"result": {"$ne": "success"}}, limit,
+                                            document_limit=AUDIT_DOCUMENT_PREVIEW_BYTES)
         
         for log in failed_logs:
             log['_id'] = str(log['_id'])
@@ -284,27 +304,47 @@ async def get_failed_operations(limit: int = 20):
         logger.error(f"❌ Ошибка получения неудачных операций: {e}")
         raise HTTPException(status_code=500, detail=str(e))
 
+@app.get("/audit/verify")
+@guarded(mongo_guard, AUDIT_VERIFY_DEADLINE_SECONDS, stale=False)
+def verify_audit_log(full: bool = False):
+    """
+    Проверить целостность журнала по цепочке хешей
+
+    По умолчанию проверяются только пакеты после последнего успешно проверенного;
+    full=true - все сохраненные пакеты. Обработчик синхронный: FastAPI выполняет
+    его в пуле потоков, и долгая проверка не блокирует остальные запросы.
+    """
+    try:
+        result = audit_chain.verify(full)
+        if result["failures"]:
+            logger.error(f"🚨 Журнал изменен: {len(result['failures'])} пакетов не прошли проверку")
+        result["threat_assessment"] = (
+            "🚨 Записи журнала изменены или удалены в обход сервиса" if result["failures"]
+            else "✅ Журнал не изменялся"
+        )
+        return result
+        
+    except Exception as e:
+        logger.error(f"❌ Ошибка проверки журнала: {e}")
+        raise HTTPException(status_code=500, detail=str(e))
+
 @app.delete("/logs/clear")
+@guarded(mongo_guard, AUDIT_QUERY_DEADLINE_SECONDS, stale=False)
 async def clear_old_logs(days: int = 30):
     """
     Очистить старые логи (старше N дней)
+    
+    Партиции удаляются целиком (без delete_many по документам), поэтому граница
+    округляется до партиции: days=0 не трогает партицию текущего периода и
+    возвращает deleted_count: 0. В режиме без партиций записи старше N дней
+    удаляются один раз, а срок TTL индекса (AUDIT_RETENTION_DAYS) не меняется.
     """
     try:
-        from datetime import timedelta
-        
-        db = client['protected_db']
-        logs_collection = db['transaction_logs']
-        
-        cutoff_time = datetime.now() - timedelta(days=days)
-        
-        result = logs_collection.delete_many({"timestamp": {"$lt": cutoff_time}})
-        
-        logger.info(f"🗑️ Удалено старых логов: {result.deleted_count}")
+        result = audit_log.drop_expired(days)
         
         return {
             "status": "cleaned",
-            "deleted_count": result.deleted_count,
-            "cutoff_date": str(cutoff_time)
+            **result
         }
         
     except Exception as e:
@@ -312,15 +352,16 @@ async def clear_old_logs(days: int = 30):
         raise HTTPException(status_code=500, detail=str(e))
 
 @app.get("/oplog/tail")
+@guarded(mongo_guard)
 async def tail_oplog(limit: int = 10):
     """
     Показать последние записи из oplog (журнал операций MongoDB)
     """
     try:
-        local_db = client['local']
-        oplog = local_db['oplog.rs']
-        
-        entries = list(oplog.find().sort('$natural', -1).limit(limit))
+        # Записи приходят байтами BSON: из o разбирается только то, что попадет в details
+        oplog = client['local'].get_collection('oplog.rs', codec_options=RAW_OPTIONS)
+        projection = {"ts": 1, "op": 1, "ns": 1, "o": 1}
+        entries = list(oplog.find({}, projection).sort('$natural', -1).limit(limit))
         
         oplog_entries = []
         for entry in entries:
@@ -328,7 +369,7 @@ async def tail_oplog(limit: int = 10):
                 "timestamp": str(entry['ts'].as_datetime()),
                 "operation": entry['op'],
                 "namespace": entry['ns'],
-                "details": str(entry.get('o', {}))[:100]  # Первые 100 символов
+                "details": bson_preview(entry['o'].raw, 100) if 'o' in entry else "{}"  # Первые 100 символов
             })
         
         return {
@@ -0,0 +1,397 @@
+import hashlib
+import logging
+import threading
+import zlib
+from collections import Counter
+from datetime import datetime, timedelta
+from typing import Any, Dict, List, Optional, Tuple
+
+import bson
+from bson.binary import Binary
+from bson.codec_options import CodecOptions
+from bson.raw_bson import RawBSONDocument
+from pymongo import ASCENDING, DESCENDING, WriteConcern
+from pymongo.errors import CollectionInvalid
+
+from bson_preview import bson_preview
+
+logger = logging.getLogger(__name__)
+
+AUDIT_COLLECTION = "transaction_logs"
+# Границы удаления записей по коллекциям журнала: проверка цепочки (integrity.py) считает удаленное истекшим
+AUDIT_RETENTION = "audit_retention"
+GRANULARITIES = {"day": "%Y%m%d", "month": "%Y%m", "none": None}
+# collection - обычные коллекции с полной копией документа; timeseries - time-series коллекции с компактной записью
+STORAGES = ("collection", "timeseries")
+# Коллекции time-series отличаются именем, чтобы тип партиции был известен без listCollections
+TIMESERIES_MARK = "ts"
+# Поля записи, которые в time-series лежат в metaField и группируют записи в buckets
+META_FIELDS = ("target_collection", "operation_type")
+# Поля записи без копии документа - для сводок, которым копия не нужна
+SUMMARY_FIELDS = ("timestamp", "operation_type", "target_collection", "write_concern", "result", "replica_set_status")
+# Чтение без разбора: документы приходят байтами BSON, поля разбираются по обращению
+RAW_OPTIONS = CodecOptions(document_class=RawBSONDocument)
+
+
+def compact_payload(document: Dict[str, Any], blob_min_bytes: Optional[int]) -> Dict[str, Any]:
+    """
+    Компактная замена копии документа: SHA-256 и размер его BSON, а для документов
+    не меньше blob_min_bytes - сжатый zlib BSON. blob_min_bytes=None - без копий.
+    """
+    raw = bson.encode(document)
+    payload: Dict[str, Any] = {"sha256": hashlib.sha256(raw).hexdigest(), "size": len(raw)}
+    if blob_min_bytes is not None and len(raw) >= blob_min_bytes:
+        payload["blob"] = Binary(zlib.compress(raw))
+    return payload
+
+
+def parse_audit_name(name: str) -> Optional[Tuple[bool, str]]:
+    """(time-series, суффикс периода) для коллекций журнала, None для остальных"""
+    if name == AUDIT_COLLECTION:
+        return False, ""
+    if not name.startswith(AUDIT_COLLECTION + "_"):
+        return None
+    suffix = name[len(AUDIT_COLLECTION) + 1:]
+    timeseries = suffix == TIMESERIES_MARK or suffix.startswith(TIMESERIES_MARK + "_")
+    if timeseries:
+        suffix = suffix[len(TIMESERIES_MARK) + 1:]
+    if suffix and not suffix.isdigit():
+        return None
+    return timeseries, suffix
+
+
+class AuditPartitions:
+    """
+    Журнал аудита в коллекциях по дням или месяцам
+
+    Запись идет в коллекцию периода своей метки времени (transaction_logs_20261019),
+    чтение - только по коллекциям, пересекающим запрошенный интервал. Срок хранения
+    соблюдается удалением целых коллекций: drop - одна запись в oplog вместо
+    удаления каждого документа на Primary и всех Secondary.
+
+    При granularity="none" журнал - одна коллекция transaction_logs с TTL индексом.
+    В режиме партиций прежняя коллекция transaction_logs читается как самая старая
+    партиция и удаляется целиком, когда все ее записи старше срока хранения.
+
+    При storage="timeseries" новые партиции - time-series коллекции (transaction_logs_ts_20261019)
+    с metaField {target_collection, operation_type}, а копия документа заменяется
+    compact_payload. Чтение приводит записи обоих видов к одной форме, поэтому
+    партиции, записанные до смены режима, остаются доступны до своего удаления.
+    """
+
+    def __init__(self, db, granularity: str = "day", retention_days: int = 30,
+                 storage: str = "collection", blob_min_bytes: Optional[int] = 0):
+        if granularity not in GRANULARITIES:
+            raise ValueError(f"Неизвестная гранулярность партиций: {granularity}")
+        if storage not in STORAGES:
+            raise ValueError(f"Неизвестный режим хранения журнала: {storage}")
+        self.db = db
+        self.granularity = granularity
+        self.retention_days = retention_days
+        self.storage = storage
+        self.blob_min_bytes = blob_min_bytes
+        self._prepared: set = set()
+        self._lock = threading.Lock()
+
+    @property
+    def partitioned(self) -> bool:
+        return self.granularity != "none"
+
+    @property
+    def timeseries(self) -> bool:
+        return self.storage == "timeseries"
+
+    def partition_name(self, timestamp: datetime) -> str:
+        base = f"{AUDIT_COLLECTION}_{TIMESERIES_MARK}" if self.timeseries else AUDIT_COLLECTION
+        if not self.partitioned:
+            return base
+        return f"{base}_{timestamp.strftime(GRANULARITIES[self.granularity])}"
+
+    @staticmethod
+    def is_timeseries(name: str) -> bool:
+        parsed = parse_audit_name(name)
+        return parsed is not None and parsed[0]
+
+    @staticmethod
+    def bounds(name: str) -> Tuple[Optional[datetime], Optional[datetime]]:
+        """[начало, конец) периода партиции; у коллекций без партиций границ нет"""
+        parsed = parse_audit_name(name)
+        suffix = parsed[1] if parsed else ""
+        if len(suffix) == 8:
+            start = datetime.strptime(suffix, "%Y%m%d")
+            return start, start + timedelta(days=1)
+        if len(suffix) == 6:
+            start = datetime.strptime(suffix, "%Y%m")
+            return start, (start + timedelta(days=32)).replace(day=1)
+        return None, None
+
+    def partitions(self) -> List[str]:
+        """Все коллекции журнала от старых к новым"""
+        names = [name for name in self.db.list_collection_names() if parse_audit_name(name) is not None]
+        # Коллекции без границ (журнал до партиций) считаются самыми старыми
+        return sorted(names, key=lambda n: (self.bounds(n)[0] or datetime.min, n))
+
+    def between(self, start: Optional[datetime] = None, end: Optional[datetime] = None) -> List[str]:
+        """Партиции, пересекающие [start, end), от старых к новым"""
+        selected = []
+        for name in self.partitions():
+            p_start, p_end = self.bounds(name)
+            if p_start is not None and ((end is not None and p_start >= end) or (start is not None and p_end <= start)):
+                continue
+            selected.append(name)
+        return selected
+
+    def _ensure_collection(self, name: str):
+        if name in self._prepared:
+            return
+        with self._lock:
+            if name in self._prepared:
+                return
+            if self.is_timeseries(name):
+                self._create_timeseries(name)
+                collection = self.db[name]
+                collection.create_index([("meta.target_collection", ASCENDING), ("timestamp", DESCENDING)])
+            else:
+                collection = self.db[name]
+                collection.create_index([("timestamp", ASCENDING)])
+                collection.create_index([("target_collection", ASCENDING), ("timestamp", DESCENDING)])
+                # Номер записи в цепочке хешей (integrity.py); time-series 5.0 не индексирует поля измерений
+                collection.create_index([("seq", ASCENDING)])
+                if not self.partitioned:
+                    self._apply_ttl_index(self.retention_days)
+            self._prepared.add(name)
+
+    def _create_timeseries(self, name: str):
+        # Коллекцию нужно создать явно: первая вставка создала бы обычную
+        options: Dict[str, Any] = {
+            "timeseries": {"timeField": "timestamp", "metaField": "meta", "granularity": "minutes"}
+        }
+        if not self.partitioned:
+            # Срок хранения без партиций - встроенное удаление buckets по timeField
+            options["expireAfterSeconds"] = self.retention_days * 86400
+        try:
+            self.db.create_collection(name, **options)
+            logger.info(f"🕒 Создана time-series коллекция журнала {name}")
+        except CollectionInvalid:
+            # Уже создана другим экземпляром сервиса
+            pass
+
+    def apply_ttl(self, retention_days: int):
+        """Срок хранения для режима без партиций; меняет срок у существующей коллекции"""
+        self.retention_days = retention_days
+        name = self.partition_name(datetime.now())
+        if self.is_timeseries(name):
+            self._ensure_collection(name)
+            self.db.command("collMod", name, expireAfterSeconds=retention_days * 86400)
+        else:
+            self._apply_ttl_index(retention_days)
+
+    def _apply_ttl_index(self, retention_days: int):
+        expire_after = retention_days * 86400
+        collection = self.db[AUDIT_COLLECTION]
+        for index in collection.list_indexes():
+            if index.get("key") == {"ttl_timestamp": 1}:
+                if index.get("expireAfterSeconds") != expire_after:
+                    self.db.command("collMod", AUDIT_COLLECTION,
+                                    index={"name": index["name"], "expireAfterSeconds": expire_after})
+                break
+        else:
+            collection.create_index([("ttl_timestamp", ASCENDING)], expireAfterSeconds=expire_after)
+
+    def collection_for_write(self, timestamp: datetime):
+        name = self.partition_name(timestamp)
+        self._ensure_collection(name)
+        return self.db[name].with_options(write_concern=WriteConcern(w="majority"))
+
+    def insert(self, entry: Dict[str, Any]):
+        if self.timeseries:
+            record = {key: value for key, value in entry.items() if key not in META_FIELDS and key != "document"}
+            record["meta"] = {field: entry[field] for field in META_FIELDS}
+            record["payload"] = compact_payload(entry["document"], self.blob_min_bytes)
+            entry = record
+        elif not self.partitioned:
+            # TTL монитор сравнивает с UTC, а timestamp журнала - локальное время
+            entry = {**entry, "ttl_timestamp": datetime.utcnow()}
+        return self.collection_for_write(entry["timestamp"]).insert_one(entry)
+
+    @staticmethod
+    def _field(name: str, field: str) -> str:
+        return f"meta.{field}" if field in META_FIELDS and AuditPartitions.is_timeseries(name) else field
+
+    def _query(self, name: str, query: Dict[str, Any]) -> Dict[str, Any]:
+        if not self.is_timeseries(name):
+            return query
+        return {self._field(name, key): value for key, value in query.items()}
+
+    def _projection(self, name: str, fields: Optional[Tuple[str, ...]]) -> Optional[Dict[str, int]]:
+        if fields is None:
+            return None
+        return {("meta" if self.is_timeseries(name) and field in META_FIELDS else field): 1 for field in fields}
+
+    @staticmethod
+    def _from_raw(raw: RawBSONDocument) -> Dict[str, Any]:
+        """Верхний уровень сырой записи; копия документа остается байтами до _normalize"""
+        return {key: bson.decode(value.raw) if isinstance(value, RawBSONDocument) and key not in ("document", "payload")
+                else value for key, value in raw.items()}
+
+    @staticmethod
+    def _normalize(document: Dict[str, Any], document_limit: Optional[int] = None) -> Dict[str, Any]:
+        """
+        Запись time-series в форме обычной: поля meta наверху, документ из сжатой копии
+
+        document_limit - копии больше этого числа байт не разбираются целиком:
+        вместо документа отдается начало его текста, document_truncated и document_size.
+        """
+        meta = document.pop("meta", None)
+        if meta is not None:
+            document.update(meta)
+        if "payload" in document:
+            payload = dict(document.pop("payload"))
+            blob = payload.pop("blob", None)
+            document["payload"] = {**payload, "stored": blob is not None}
+            if blob is None:
+                document["document"] = None
+            elif document_limit is None or payload["size"] <= document_limit:
+                document["document"] = bson.decode(zlib.decompress(blob))
+            else:
+                # Распаковывается только начало копии - текст не длиннее document_limit символов
+                head = zlib.decompressobj().decompress(blob, document_limit * 4)
+                document.update(document=bson_preview(head, document_limit), document_truncated=True,
+                                document_size=payload["size"])
+        elif isinstance(document.get("document"), RawBSONDocument):
+            raw = document["document"].raw
+            if len(raw) <= document_limit:
+                document["document"] = bson.decode(raw)
+            else:
+                document.update(document=bson_preview(raw, document_limit), document_truncated=True,
+                                document_size=len(raw))
+        return document
+
+    def _find(self, name: str, query: Dict[str, Any], fields: Optional[Tuple[str, ...]], raw: bool):
+        collection = self.db.get_collection(name, codec_options=RAW_OPTIONS) if raw else self.db[name]
+        return collection.find(query, self._projection(name, fields))
+
+    def _read(self, cursor, raw: bool, document_limit: Optional[int]):
+        for doc in cursor:
+            yield self._normalize(self._from_raw(doc) if raw else doc, document_limit)
+
+    def find_newest(self, query: Dict[str, Any], limit: int, fields: Optional[Tuple[str, ...]] = None,
+                    document_limit: Optional[int] = None) -> List[Dict[str, Any]]:
+        """
+        Последние записи: партиции от новых к старым, пока не набран limit
+
+        fields - проекция (None - все поля); document_limit - см. _normalize.
+        """
+        raw = document_limit is not None
+        documents: List[Dict[str, Any]] = []
+        for name in reversed(self.partitions()):
+            if len(documents) >= limit:
+                break
+            cursor = self._find(name, self._query(name, query), fields, raw).sort("timestamp", DESCENDING)
+            documents.extend(self._read(cursor.limit(limit - len(documents)), raw, document_limit))
+        return documents
+
+    def find_range(self, query: Dict[str, Any], start: datetime, end: Optional[datetime] = None,
+                   fields: Optional[Tuple[str, ...]] = None) -> List[Dict[str, Any]]:
+        """Записи за [start, end) по возрастанию времени; fields - проекция (None - все поля)"""
+        time_filter: Dict[str, Any] = {"$gte": start}
+        if end is not None:
+            time_filter["$lt"] = end
+        documents: List[Dict[str, Any]] = []
+        for name in self.between(start, end):
+            cursor = self._find(name, {**self._query(name, query), "timestamp": time_filter}, fields, False)
+            documents.extend(self._read(cursor.sort("timestamp", ASCENDING), False, None))
+        return documents
+
+    def iter_range(self, start: datetime, end: Optional[datetime] = None,
+                   after: Optional[Tuple[datetime, List[Any]]] = None, batch_size: int = 5000):
+        """
+        Поток записей за [start, end) по возрастанию времени с постоянной памятью
+
+        after - (timestamp последней выданной записи, _id выданных записей с этим
+        timestamp): продолжение прерванного чтения без пропусков и повторов.
+        """
+        time_filter: Dict[str, Any] = {"$gte": after[0] if after else start}
+        if end is not None:
+            time_filter["$lt"] = end
+        seen = set(after[1]) if after else set()
+        for name in self.between(time_filter["$gte"], end):
+            cursor = self.db[name].find({"timestamp": time_filter}).sort("timestamp", ASCENDING).batch_size(batch_size)
+            for doc in cursor:
+                if seen and doc["timestamp"] == after[0] and doc["_id"] in seen:
+                    continue
+                yield self._normalize(doc)
+
+    def count_by(self, field: str) -> List[Dict[str, Any]]:
+        """$group по полю во всех партициях, сведенный в один ответ"""
+        totals: Counter = Counter()
+        for name in self.partitions():
+            group = {"$group": {"_id": f"${self._field(name, field)}", "count": {"$sum": 1}}}
+            for row in self.db[name].aggregate([group]):
+                totals[row["_id"]] += row["count"]
+        return [{"_id": key, "count": count} for key, count in totals.items()]
+
+    def count(self) -> int:
+        return sum(self.db[name].count_documents({}) for name in self.partitions())
+
+    def drop_expired(self, older_than_days: Optional[int] = None) -> Dict[str, Any]:
+        """
+        Удалить партиции, целиком старше срока хранения
+
+        Граница округляется до партиции: записи из периода, который еще не
+        закончился до cutoff, доживают до удаления всей партиции. Без партиций
+        записи старше cutoff удаляются по документам (см. _delete_expired).
+        """
+        days = self.retention_days if older_than_days is None else older_than_days
+        cutoff = datetime.now() - timedelta(days=days)
+        if not self.partitioned:
+            return self._delete_expired(cutoff)
+        dropped, dropped_count = [], 0
+        for name in self.partitions():
+            _, end = self.bounds(name)
+            if end is None:
+                # Прежняя коллекция: удаляется, только когда ее самая новая запись старше cutoff
+                newest = next(self.db[name].find({}, {"timestamp": 1}).sort("timestamp", DESCENDING).limit(1), None)
+                if newest is not None and newest["timestamp"] >= cutoff:
+                    continue
+            elif end > cutoff:
+                continue
+            dropped_count += self.db[name].estimated_document_count()
+            self.db.drop_collection(name)
+            self._prepared.discard(name)
+            self.record_retention(name, cutoff)
+            dropped.append(name)
+        if dropped:
+            logger.info(f"🗑️ Удалены партиции журнала: {', '.join(dropped)} ({dropped_count} записей)")
+        return {"cutoff_date": str(cutoff), "dropped_partitions": dropped, "deleted_count": dropped_count}
+
+    def _delete_expired(self, cutoff: datetime) -> Dict[str, Any]:
+        """Разовое удаление записей старше cutoff без партиций; срок TTL индекса не меняется"""
+        deleted_count = 0
+        for name in self.partitions():
+            deleted = self.db[name].delete_many({"timestamp": {"$lt": cutoff}}).deleted_count
+            if deleted:
+                self.record_retention(name, cutoff)
+                deleted_count += deleted
+        if deleted_count:
+            logger.info(f"🗑️ Удалено записей журнала старше {cutoff}: {deleted_count}")
+        return {"cutoff_date": str(cutoff), "dropped_partitions": [], "deleted_count": deleted_count}
+
+    def record_retention(self, name: str, cutoff: datetime):
+        """Запомнить, что записи коллекции старше cutoff удалены сроком хранения"""
+        self.db[AUDIT_RETENTION].update_one(
+            {"_id": name}, {"$max": {"cutoff": cutoff}, "$set": {"applied_at": datetime.now()}}, upsert=True
+        )
+
+    def retention_cutoffs(self) -> Dict[str, datetime]:
+        """Граница удаления по сроку хранения для каждой коллекции журнала, где оно было"""
+        return {doc["_id"]: doc["cutoff"] for doc in self.db[AUDIT_RETENTION].find()}
+
+    def run_retention(self, stop: threading.Event, interval_seconds: float):
+        """Фоновое удаление устаревших партиций"""
+        while not stop.is_set():
+            try:
+                self.drop_expired()
+            except Exception as e:
+                logger.warning(f"⚠️ Не удалось применить срок хранения журнала: {e}")
+            stop.wait(interval_seconds)